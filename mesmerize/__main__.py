@@ -53,6 +53,12 @@ def main():
     elif sys.argv[1] == 'lighten':
         create_lite_project.main(*sys.argv[2:])
 
+    elif sys.argv[1] == 'dfof':
+        project_dfof.main(*sys.argv[2:])
+
+    elif sys.argv[1] == 'import':
+        bulk_import.main(*sys.argv[2:])
+
     else:
         raise ValueError('Invalid argument')
 
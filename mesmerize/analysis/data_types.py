@@ -16,15 +16,17 @@ import pandas as pd
 import numpy as np
 import pickle
 import json
+import hashlib
 from copy import deepcopy
 from uuid import uuid4, UUID
-from typing import Tuple, List, Dict, Union, Optional
+from typing import Tuple, List, Dict, Union, Optional, Any
 from itertools import chain
 import os
 import traceback
 from warnings import warn
 from configparser import RawConfigParser
 from ..common.utils import HdfTools, draw_graph
+from ..common.columnar_hdf import ColumnarHdf
 from ..common import get_proj_config
 from tqdm import tqdm
 
@@ -50,6 +52,36 @@ class OperationNotFound(_HistoryTraceExceptions):
     """Requested operation not found in data block."""
 
 
+#: Parameter values with more elements than this are stored out-of-line in a HistoryTrace, such as RFFT frequencies
+BLOB_MIN_LENGTH = 64
+
+
+def _content_hash(obj: Any) -> str:
+    return hashlib.sha1(pickle.dumps(obj, protocol=4)).hexdigest()
+
+
+def _is_large_param(v: Any) -> bool:
+    if isinstance(v, np.ndarray):
+        return v.size > BLOB_MIN_LENGTH
+    if isinstance(v, (list, tuple)):
+        return len(v) > BLOB_MIN_LENGTH
+    return False
+
+
+class _BlobRef:
+    """Placeholder for a parameter value that is stored out-of-line"""
+    __slots__ = ('key',)
+
+    def __init__(self, key: str):
+        self.key = key
+
+    def __getstate__(self):
+        return self.key
+
+    def __setstate__(self, key):
+        self.key = key
+
+
 class HistoryTrace:
     """
     Structure of a history trace:
@@ -87,47 +119,106 @@ class HistoryTrace:
     **The main dict illustrated above should never be worked with directly.**\n
     **You must use the helper methods of this class to query or add information**
 
+    Internally every distinct operation is stored once in an operation table, and each data block only keeps a tuple
+    of operation IDs. Operations that are added to many data blocks and merging of HistoryTraces therefore do not
+    duplicate the parameters. Large parameter values, such as RFFT frequencies, are stored out-of-line by content hash.
+
     """
-    def __init__(self, history: Dict[Union[UUID, str], List[Dict]] = None, data_blocks: List[Union[UUID, str]] = None):
+    def __init__(self, history: Dict[Union[UUID, str], List[Dict]] = None, data_blocks: List[Union[UUID, str]] = None,
+                 operations: Dict[str, list] = None, blobs: Dict[str, Any] = None,
+                 blocks: Dict[Union[UUID, str], List[str]] = None):
         """
         :param history:     Dict containing a data block UUIDs as keys. The values are a list of dicts containing operation parameters.
         :param data_blocks: List of data block UUIDs
+        :param operations:  Operation table, from ``to_dict(compact=True)``. Used instead of ``history``
+        :param blobs:       Large parameter values, from ``to_dict(compact=True)``
+        :param blocks:      Operation IDs of each data block, from ``to_dict(compact=True)``
 
-        :ivar _history:     The dict of the actual data, as illustrated above. Should not be accessed directly. Use the :py:attr:`~history` property or call `get_all_data_blocks_history()`.
-        :ivar _data_blocks: List of all data blocks. Should not be accessed directly, use the :py:attr:`~data_blocks` property instead.
+        :ivar _operations:  Operation table, each distinct (operation, parameters) pair is stored once and is keyed by its content hash
+        :ivar _blobs:       Large parameter values, stored out-of-line and keyed by their content hash
+        :ivar _blocks:      Dict of data block UUIDs and the tuple of operation IDs performed on the data block. Should not be accessed directly, use the :py:attr:`~history` property or call `get_all_data_blocks_history()`.
+        :ivar _data_blocks: Tuple of all data blocks. Should not be accessed directly, use the :py:attr:`~data_blocks` property instead.
         """
-        self._history = None
-        self._data_blocks = None
+        self._operations = dict()
+        self._blobs = dict()
 
-        if None in [history, data_blocks]:
-            self.data_blocks = []
-            self.history = dict()
-        else:
-            for i in range(len(data_blocks)):
-                data_blocks[i] = self._to_uuid(data_blocks[i])
-            self.data_blocks = data_blocks
-            for k in list(history.keys()):
-                history[self._to_uuid(k)] = history.pop(k)
-            self.history = history
+        # these are always replaced, never modified in place, so that copies can share them
+        self._blocks = dict()
+        self._data_blocks = tuple()
+
+        if None not in [operations, blocks, data_blocks]:
+            self.data_blocks = [self._to_uuid(db) for db in data_blocks]
+            self._blobs = dict(blobs) if blobs is not None else dict()
+
+            for op_id, (operation, params) in operations.items():
+                stored = {k: _BlobRef(v['__blob__']) if isinstance(v, dict) and list(v.keys()) == ['__blob__'] else v
+                          for k, v in params.items()}
+                self._operations[op_id] = (operation, stored)
+
+            self._blocks = {self._to_uuid(k): tuple(v) for k, v in blocks.items()}
+
+        elif None not in [history, data_blocks]:
+            self.data_blocks = [self._to_uuid(db) for db in data_blocks]
+            self.history = {self._to_uuid(k): v for k, v in history.items()}
 
     @property
     def data_blocks(self) -> list:
         """List of UUIDs that allow you to pin down the history of specific rows of the dataframe to their history
         as stored in the history trace data structure (self.history)"""
-        return self._data_blocks
+        return list(self._data_blocks)
 
     @data_blocks.setter
     def data_blocks(self, dbl: list):
-        self._data_blocks = dbl
+        self._data_blocks = tuple(dbl)
 
     @property
     def history(self) -> dict:
-        """The analysis log that is stored in the structure outlined in the doc string"""
-        return self._history
+        """The analysis log that is stored in the structure outlined in the doc string, with copies of the parameters"""
+        return {db: self._expand_block(db, copy=True) for db in self._blocks.keys()}
 
     @history.setter
-    def history(self, h):
-        self._history = h
+    def history(self, h: dict):
+        self._blocks = {db: tuple(self._intern(next(iter(d)), next(iter(d.values()))) for d in l)
+                        for db, l in h.items()}
+
+    def _intern(self, operation: str, parameters: dict) -> str:
+        """Add an operation to the operation table if it isn't already in it, returns the operation ID"""
+        stored = dict()
+        for k, v in parameters.items():
+            if _is_large_param(v):
+                try:
+                    key = _content_hash(v)
+                except (pickle.PicklingError, TypeError, AttributeError):
+                    key = uuid4().hex
+                self._blobs.setdefault(key, v)
+                stored[k] = _BlobRef(key)
+            else:
+                stored[k] = v
+
+        try:
+            op_id = _content_hash((operation, stored))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # cannot be hashed, just don't share it with identical operations
+            op_id = uuid4().hex
+
+        self._operations.setdefault(op_id, (operation, stored))
+        return op_id
+
+    def _expand(self, op_id: str, copy: bool = False) -> Tuple[str, dict]:
+        """
+        Get the operation name and full parameters dict of an operation ID
+
+        :param copy: deep copy the parameter values, otherwise they are the values in the operation table which are
+                     shared by all data blocks with this operation and must not be modified
+        """
+        operation, stored = self._operations[op_id]
+        params = {k: self._blobs[v.key] if isinstance(v, _BlobRef) else v for k, v in stored.items()}
+        if copy:
+            params = deepcopy(params)
+        return operation, params
+
+    def _expand_block(self, data_block_id: UUID, copy: bool = False) -> List[dict]:
+        return [dict((self._expand(op_id, copy=copy),)) for op_id in self._blocks[data_block_id]]
 
     def create_data_block(self, dataframe: pd.DataFrame) -> Tuple[pd.DataFrame, UUID]:
         """
@@ -146,12 +237,12 @@ class HistoryTrace:
         Throws exception if UUID already exists.
         """
         assert isinstance(data_block_id, UUID)
-        if data_block_id in self.data_blocks:
+        if data_block_id in self._data_blocks:
             raise DataBlockAlreadyExists(str(data_block_id))
         else:
-            self.data_blocks.append(data_block_id)
+            self._data_blocks = self._data_blocks + (data_block_id,)
 
-        self.history.update({data_block_id: []})
+        self._blocks = {**self._blocks, data_block_id: tuple()}
 
     def add_operation(self, data_block_id: Union[UUID, str], operation: str, parameters: dict):
         """
@@ -167,7 +258,7 @@ class HistoryTrace:
 
         if isinstance(data_block_id, str):
             if data_block_id == 'all':
-                _ids = self.data_blocks
+                _ids = self._data_blocks
             else:
                 try:
                     _ids = [self._to_uuid(data_block_id)]
@@ -177,21 +268,28 @@ class HistoryTrace:
         else:
             _ids = [data_block_id]
 
-        if not all(u in self.data_blocks for u in _ids):
+        if not all(u in self._data_blocks for u in _ids):
             raise DataBlockNotFound()
+
+        # the operation is stored once, each data block only gets its ID
+        op_id = self._intern(operation, parameters)
+
+        blocks = dict(self._blocks)
         for _id in _ids:
-            self.history[_id].append({operation: parameters})
+            blocks[_id] = blocks[_id] + (op_id,)
+        self._blocks = blocks
 
     def get_data_block_history(self, data_block_id: Union[str, UUID], copy: bool = False) -> List[dict]:
         """
         Get the full history trace of a single data block.
 
-        Use copy=False if you want to modify the history trace of the data block.
+        The parameters are shared with other data blocks through the operation table, so they are always deep copied.
+        Modifying the returned history does not change the history trace.
 
         :param data_block_id: data block ID
         :type data_block_id: Union[str, UUID]
 
-        :param copy: If true, returns a deepcopy
+        :param copy: Not used, kept for compatibility. The parameters are always copied.
         :type copy: bool
 
         :return: data block history
@@ -200,14 +298,10 @@ class HistoryTrace:
 
         data_block_id = self._to_uuid(data_block_id)
 
-        if data_block_id not in self.data_blocks:
+        if data_block_id not in self._data_blocks:
             raise DataBlockNotFound(str(data_block_id))
 
-        if copy:
-            return deepcopy(self.history[data_block_id])
-
-        else:
-            return self.history[data_block_id]
+        return self._expand_block(data_block_id, copy=True)
 
     def get_all_data_blocks_history(self) -> dict:
         """Returns history trace of all datablocks"""
@@ -225,32 +319,33 @@ class HistoryTrace:
         """
         data_block_id = self._to_uuid(data_block_id)
 
-        l = [next(iter(d)) for d in self.get_data_block_history(data_block_id)]
+        if data_block_id not in self._data_blocks:
+            raise DataBlockNotFound(str(data_block_id))
+
+        l = [self._operations[op_id][0] for op_id in self._blocks[data_block_id]]
         return l
 
     def get_operation_params(self, data_block_id: Union[UUID, str], operation: str) -> dict:
-        """Get the parameters dict for a specific operation that was performed on a specific data block"""
+        """
+        Get the parameters dict for a specific operation that was performed on a specific data block.
+        The parameters are a deep copy, modifying them does not change the history trace.
+        """
         # if isinstance(data_block_id, str):
         #     data_block_id = UUID(data_block_id)
         data_block_id = self._to_uuid(data_block_id)
 
-        try:
-            l = self.get_data_block_history(data_block_id)
-            params = next(d for ix, d in enumerate(reversed(l)) if operation in d)[operation]
-        except StopIteration:
-            raise OperationNotFound('Data block: ' + str(data_block_id) + ', Operation: ' + operation)
+        if data_block_id not in self._data_blocks:
+            raise DataBlockNotFound(str(data_block_id))
 
-        return params.copy()
+        for op_id in reversed(self._blocks[data_block_id]):
+            if self._operations[op_id][0] == operation:
+                return self._expand(op_id, copy=True)[1]
+
+        raise OperationNotFound('Data block: ' + str(data_block_id) + ', Operation: ' + operation)
 
     def check_operation_exists(self, data_block_id: UUID, operation: str) -> bool:
         """Check if a specific operation was performed on a specific datablock"""
-        data_block_id = self._to_uuid(data_block_id)
-        try:
-            self.get_operation_params(data_block_id, operation)
-        except OperationNotFound:
-            return False
-        else:
-            return True
+        return operation in self.get_operations_list(data_block_id)
 
     @staticmethod
     def _to_uuid(u: Union[str, UUID]) -> UUID:
@@ -265,15 +360,39 @@ class HistoryTrace:
         else:
             raise TypeError('Must pass str or UUID')
 
-    def to_dict(self) -> dict:
+    def to_dict(self, compact: bool = False) -> dict:
         """
         Package the HistoryTrace instance as a dict. Converts all UUIDs to <str> representation for JSON compatibility.
+
+        :param compact: Package the operation table and the operation IDs of each data block instead of the full
+                        history of each data block. Compact dicts cannot be read by Mesmerize versions < 0.3
         """
 
         dbs_str = [str(db) for db in self.data_blocks]
-        hist_str = self.get_all_data_blocks_history()
 
-        return {'history': hist_str, 'data_blocks': dbs_str}
+        if not compact:
+            hist_str = self.get_all_data_blocks_history()
+            return {'history': hist_str, 'data_blocks': dbs_str}
+
+        blocks = {str(db): list(self._blocks[db]) for db in self._data_blocks}
+        op_ids = set(chain.from_iterable(blocks.values()))
+
+        operations = dict()
+        blob_keys = set()
+        for op_id in op_ids:
+            operation, stored = self._operations[op_id]
+            params = dict()
+            for k, v in stored.items():
+                if isinstance(v, _BlobRef):
+                    blob_keys.add(v.key)
+                    params[k] = {'__blob__': v.key}
+                else:
+                    params[k] = v
+            operations[op_id] = [operation, params]
+
+        blobs = {k: self._blobs[k] for k in blob_keys}
+
+        return {'operations': operations, 'blobs': blobs, 'blocks': blocks, 'data_blocks': dbs_str}
 
     @staticmethod
     def from_dict(d: dict) -> dict:
@@ -285,9 +404,14 @@ class HistoryTrace:
         :return: dict formatted so that it can be used to instantiate a HistoryTrace instance recapitulating the HistoryTrace it was packaged from.
         """
 
-        hist = {HistoryTrace._to_uuid(k): v for k, v in d['history'].items()}
         dbs = [HistoryTrace._to_uuid(u) for u in d['data_blocks']]
 
+        if 'operations' in d.keys():
+            blocks = {HistoryTrace._to_uuid(k): v for k, v in d['blocks'].items()}
+            return {'operations': d['operations'], 'blobs': d['blobs'], 'blocks': blocks, 'data_blocks': dbs}
+
+        hist = {HistoryTrace._to_uuid(k): v for k, v in d['history'].items()}
+
         return {'history': hist, 'data_blocks': dbs}
 
     def to_json(self, path: str):
@@ -344,12 +468,31 @@ class HistoryTrace:
         data_blocks_l2_list = [h.data_blocks for h in history_traces]
         data_blocks = list(chain.from_iterable(data_blocks_l2_list))
 
-        history = dict()
+        merged = cls()
+
+        # operation IDs are content hashes, so the tables can just be combined
         for h in history_traces:
-            d = h.history
-            history.update(d)
+            merged._operations.update(h._operations)
+            merged._blobs.update(h._blobs)
+            merged._blocks.update(h._blocks)
+
+        merged.data_blocks = data_blocks
+
+        return merged
+
+    def copy(self):
+        """
+        Copy of this HistoryTrace. The operation table & blobs are shallow copied, the operations and parameters
+        themselves are never modified in place so they are shared with the copy.
+        """
+        c = self.__class__.__new__(self.__class__)
+        c.__dict__.update(self.__dict__)
+        c._operations = dict(self._operations)
+        c._blobs = dict(self._blobs)
+        return c
 
-        return cls(history=history, data_blocks=data_blocks)
+    def __deepcopy__(self, memo):
+        return self.copy()
 
     def draw_graph(self, data_block_id: Union[str, UUID], **kwargs) -> str:
         """
@@ -470,25 +613,46 @@ class BaseTransmission:
 
         return d
 
-    def to_hdf5(self, path: str):
+    def to_hdf5(self, path: str, version: int = 2):
         """
-        Save as an hdf5 file. Uses pytables to save the DataFrame, serielizes the HistoryTrace using JSON.
-        See :class:`HdfTools <mesmerize.common.utils.HdfTools>`
+        Save as an hdf5 file. Serielizes the HistoryTrace using JSON.
 
-        :param path: file path, usually ends in .trn
+        Version 2 files store each column of the DataFrame separately, arrays are stored as hdf5 datasets instead of
+        being pickled. See :class:`ColumnarHdf <mesmerize.common.columnar_hdf.ColumnarHdf>`
+
+        Version 1 files use pytables to save the DataFrame, see :class:`HdfTools <mesmerize.common.utils.HdfTools>`.
+        Use version 1 to share files with older versions of Mesmerize.
+
+        :param path:    file path, usually ends in .trn
+        :param version: file layout version, 1 or 2
         """
         d = self.to_dict()
         df = d.pop('df')
-        HdfTools.save_dataframe(path=path, dataframe=df, metadata=d, metadata_method='json')
+
+        if version == 2:
+            d['history_trace'] = self.history_trace.to_dict(compact=True)
+            ColumnarHdf.save_dataframe(path=path, dataframe=df, metadata=d, metadata_method='json')
+        elif version == 1:
+            HdfTools.save_dataframe(path=path, dataframe=df, metadata=d, metadata_method='json')
+        else:
+            raise ValueError(f'Invalid Transmission file version: {version}')
 
     @classmethod
-    def from_hdf5(cls, path: str):
+    def from_hdf5(cls, path: str, columns: Optional[List[str]] = None):
         """
         Create Transmission from an hdf5 file. See :class:`HdfTools <mesmerize.common.utils.HdfTools>` for information on the file structure.
 
-        :param path: file path, usually ends in .trn (.ptrn for plots)
+        :param path:    file path, usually ends in .trn (.ptrn for plots)
+        :param columns: only load these DataFrame columns, loads all columns if None.
+                        Only the requested columns are read from version 2 files.
         """
-        df, meta = HdfTools.load_dataframe(path)
+        if ColumnarHdf.is_columnar(path):
+            df, meta = ColumnarHdf.load_dataframe(path, columns=columns)
+        else:
+            df, meta = HdfTools.load_dataframe(path)
+            if columns is not None:
+                df = df[columns]
+
         return cls(df, **meta)
 
     @classmethod
@@ -2,6 +2,8 @@ import numpy as np
 from . import cross_correlation
 from . import tvregdiff
 from . import sosd
+from . import running_percentile
+from . import dfof
 
 
 def modln(x): return np.sign(x) * np.log(np.abs(x))
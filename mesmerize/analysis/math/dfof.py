@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+ΔF/F with a running percentile baseline, computed for a 2D block of curves at once.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from .running_percentile import running_percentile
+
+
+#: Max size in bytes of the windows that are copied at once when computing the percentiles
+CHUNK_BYTES = 2 ** 28
+
+
+def percentile_baseline(curves: np.ndarray, quantile: float = 8, frames_window: int = 500,
+                        step: int = None) -> np.ndarray:
+    """
+    Running percentile of each curve, computed over a sliding window that is centered on each frame.
+
+    By default the exact running percentile is computed with ``running_percentile()``. If ``step`` is given the
+    percentile is only computed at every ``step`` frames and linearly interpolated in between, which is what
+    caiman's ``detrend_df_f`` does when ``use_fast`` is set. The windows of all curves are then computed together, a
+    chunk of curves at a time.
+
+    :param curves:          2D array of curves, shape is [n_curves, n_frames]
+    :param quantile:        percentile of each window that is used as the baseline, 0 - 100
+    :param frames_window:   number of frames in each window
+    :param step:            number of frames between the windows whose percentile is computed, None for every frame
+    :return:                baselines, same shape as ``curves``
+    """
+    curves = np.atleast_2d(np.asarray(curves, dtype=np.float64))
+    n_curves, n_frames = curves.shape
+
+    w = max(min(int(frames_window), n_frames), 1)
+
+    if step is None or step <= 1:
+        return running_percentile(curves, quantile, w)
+
+    centers = np.arange(0, n_frames, step)
+    if centers[-1] != n_frames - 1:
+        centers = np.append(centers, n_frames - 1)
+
+    # window of frame i is padded[:, i:i + w], same padding as running_percentile()
+    half = w // 2
+    padded = np.pad(curves, ((0, 0), (half, w - half - 1)), mode='symmetric')
+
+    windows = as_strided(
+        padded,
+        shape=(n_curves, n_frames, w),
+        strides=(padded.strides[0], padded.strides[1], padded.strides[1]),
+        writeable=False
+    )
+
+    q = np.empty((n_curves, centers.size), dtype=np.float64)
+
+    chunk = max(CHUNK_BYTES // (centers.size * w * 8), 1)
+    for i in range(0, n_curves, chunk):
+        q[i:i + chunk] = np.percentile(windows[i:i + chunk, centers], quantile, axis=2)
+
+    if centers.size == 1:
+        return np.repeat(q, n_frames, axis=1)
+
+    # same linear interpolation for all curves
+    frames = np.arange(n_frames)
+    j = np.clip(np.searchsorted(centers, frames, side='right') - 1, 0, centers.size - 2)
+    frac = (frames - centers[j]) / (centers[j + 1] - centers[j])
+
+    return q[:, j] * (1 - frac) + q[:, j + 1] * frac
+
+
+def dfof(curves: np.ndarray, quantile: float = 8, frames_window: int = 500, detrend_only: bool = False,
+         step: int = None) -> np.ndarray:
+    """
+    (F - Fo) / Fo of each curve, where Fo is the running percentile baseline from ``percentile_baseline()``
+
+    :param curves:          2D array of curves, shape is [n_curves, n_frames]
+    :param quantile:        percentile of each window that is used as the baseline, 0 - 100
+    :param frames_window:   number of frames in each window
+    :param detrend_only:    only subtract the baseline, (F - Fo). Use for curves whose baseline is close to zero,
+                            such as CNMF(E) traces since the background is removed.
+    :param step:            see ``percentile_baseline()``
+    :return:                ΔF/F, same shape as ``curves``
+    """
+    curves = np.atleast_2d(np.asarray(curves, dtype=np.float64))
+    baseline = percentile_baseline(curves, quantile, frames_window, step)
+
+    if detrend_only:
+        return curves - baseline
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (curves - baseline) / baseline
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Running percentile and running median filters for a 2D block of curves.
+
+Uses a double-heap kernel with O(log w) updates per frame when numba is available, so long curves with large windows
+are filtered in about the same time as small windows. For windows that are not longer than the curves the output is
+the same as ``scipy.ndimage.percentile_filter(curves, percentile, size=(1, window), mode='reflect')``, which is used
+when numba is not available. The ends of curves that are shorter than the window may be reflected differently.
+"""
+
+import numpy as np
+from scipy.ndimage import percentile_filter
+
+try:
+    from .running_percentile_numba import running_rank
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+
+def running_percentile(curves: np.ndarray, percentile: float, window: int) -> np.ndarray:
+    """
+    Percentile of a sliding window that is centered on each frame, for each curve.
+
+    The value of rank ``int(window * percentile / 100)`` of each window is returned, same as
+    ``scipy.ndimage.percentile_filter``. Curves are reflected at their ends, i.e. scipy's ``mode='reflect'``.
+    The window should not be longer than the curves, see the module docstring. Curves must not contain NaNs.
+
+    :param curves:      1D array of a curve, or 2D array of curves with shape [n_curves, n_frames]
+    :param percentile:  percentile, 0 - 100
+    :param window:      number of frames in the window
+    :return:            array with the same shape as ``curves``
+    """
+    curves = np.asarray(curves, dtype=np.float64)
+    ndim = curves.ndim
+    curves = np.atleast_2d(curves)
+
+    if curves.ndim != 2:
+        raise ValueError('curves must be a 1D or 2D array')
+
+    if not 0 <= percentile <= 100:
+        raise ValueError('percentile must be between 0 and 100')
+
+    if np.isnan(curves).any():
+        raise ValueError('curves must not contain NaNs')
+
+    w = int(window)
+    if w < 1:
+        raise ValueError('window must be at least 1')
+
+    rank = min(int(w * percentile / 100), w - 1)
+
+    if not HAVE_NUMBA:
+        out = percentile_filter(curves, percentile, size=(1, w), mode='reflect')
+        return out if ndim == 2 else out[0]
+
+    # scipy's 'reflect' is numpy's 'symmetric'
+    half = w // 2
+    padded = np.pad(curves, ((0, 0), (half, w - half - 1)), mode='symmetric')
+
+    out = np.empty(curves.shape, dtype=np.float64)
+    if curves.shape[1] > 0:
+        running_rank(np.ascontiguousarray(padded), w, rank, out)
+
+    return out if ndim == 2 else out[0]
+
+
+def running_median(curves: np.ndarray, window: int) -> np.ndarray:
+    """Running median of each curve, see ``running_percentile()``"""
+    return running_percentile(curves, 50, window)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+numba kernel for ``running_percentile``.
+Importing this module raises ImportError if numba is not available, ``running_percentile`` then uses scipy.
+
+The values of the sliding window are kept in two heaps, a max-heap ``lo`` with the ``rank + 1`` smallest values and
+a min-heap ``hi`` with the rest, so the top of ``lo`` is the value of that rank. The heaps hold indices into the
+padded curve. The window always has ``w`` values so the index that enters the window at each step has the same
+``index % w`` slot as the index that leaves it, the slot keeps the position of the index in its heap. The entering
+index takes the place of the leaving one in the same heap, and is then sifted into place, which is O(log w).
+"""
+
+import numpy as np
+import numba
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def _sift(heap, size, p, x, slot_pos, w, sign):
+    """Move the item at position ``p`` of a heap up or down into place. ``sign`` is 1 for a min-heap, -1 for max"""
+    j = heap[p]
+    key = sign * x[j]
+
+    # up
+    while p > 0:
+        parent = (p - 1) // 2
+        if sign * x[heap[parent]] <= key:
+            break
+        heap[p] = heap[parent]
+        slot_pos[heap[p] % w] = p
+        p = parent
+
+    # down
+    while True:
+        child = 2 * p + 1
+        if child >= size:
+            break
+        if child + 1 < size and sign * x[heap[child + 1]] < sign * x[heap[child]]:
+            child += 1
+        if sign * x[heap[child]] >= key:
+            break
+        heap[p] = heap[child]
+        slot_pos[heap[p] % w] = p
+        p = child
+
+    heap[p] = j
+    slot_pos[j % w] = p
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def _running_rank_1d(x, w, rank, out):
+    """
+    :param x:       padded curve, ``out.size + w - 1`` values
+    :param w:       window size
+    :param rank:    rank of the value in each window that is returned, 0 is the minimum
+    :param out:     value of ``rank`` in the window starting at each index of ``x``
+    """
+    n_lo = rank + 1
+    n_hi = w - n_lo
+
+    lo = np.empty(n_lo, dtype=np.int64)
+    hi = np.empty(max(n_hi, 1), dtype=np.int64)
+
+    slot_pos = np.empty(w, dtype=np.int64)
+    slot_in_lo = np.empty(w, dtype=np.bool_)
+
+    # a sorted array is already a heap
+    order = np.argsort(x[:w], kind='mergesort')
+    for p in range(n_lo):
+        j = order[n_lo - 1 - p]
+        lo[p] = j
+        slot_pos[j] = p
+        slot_in_lo[j] = True
+    for p in range(n_hi):
+        j = order[n_lo + p]
+        hi[p] = j
+        slot_pos[j] = p
+        slot_in_lo[j] = False
+
+    out[0] = x[lo[0]]
+
+    for i in range(1, out.size):
+        j = i + w - 1
+        s = j % w
+        p = slot_pos[s]
+
+        if slot_in_lo[s]:
+            lo[p] = j
+            _sift(lo, n_lo, p, x, slot_pos, w, -1.0)
+
+            if n_hi > 0 and x[lo[0]] > x[hi[0]]:
+                a, b = lo[0], hi[0]
+                lo[0], hi[0] = b, a
+                slot_in_lo[a % w], slot_in_lo[b % w] = False, True
+                _sift(lo, n_lo, 0, x, slot_pos, w, -1.0)
+                _sift(hi, n_hi, 0, x, slot_pos, w, 1.0)
+        else:
+            hi[p] = j
+            _sift(hi, n_hi, p, x, slot_pos, w, 1.0)
+
+            if x[hi[0]] < x[lo[0]]:
+                a, b = lo[0], hi[0]
+                lo[0], hi[0] = b, a
+                slot_in_lo[a % w], slot_in_lo[b % w] = False, True
+                _sift(lo, n_lo, 0, x, slot_pos, w, -1.0)
+                _sift(hi, n_hi, 0, x, slot_pos, w, 1.0)
+
+        out[i] = x[lo[0]]
+
+
+@numba.jit(nopython=True, nogil=True, cache=True, parallel=True)
+def running_rank(padded, w, rank, out):
+    """``_running_rank_1d`` for each row of a 2D array, rows are processed in parallel"""
+    for r in numba.prange(padded.shape[0]):
+        _running_rank_1d(padded[r], w, rank, out[r])
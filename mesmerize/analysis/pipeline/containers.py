@@ -19,7 +19,7 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from fcsugar import Container
 from .. import Transmission
-import os
+from ...common.dataframe_journal import read_project_dataframe
 import pandas as pd
 
 
@@ -30,8 +30,7 @@ class TransmissionContainer(Transmission, Container):
 
     @property
     def dataframe(self):
-        proj_df_path = os.path.join(self.get_proj_path(), 'dataframes', 'root.dfr')
-        proj_df = pd.read_hdf(proj_df_path, key='project_dataframe', mode='r')
+        proj_df = read_project_dataframe(self.get_proj_path())
         return pd.merge(proj_df, self.df, on='uuid_curve')
 
     def append_log(self, node):
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Columnar hdf5 storage of DataFrames, used for the v2 layout of Transmission (.trn) files.
+
+Every column is stored in its own group so that columns can be read independently of each other:
+
+- numeric columns are stored as a 1D dataset
+- columns of numpy arrays that all have the same shape & dtype are stored as one n-dimensional dataset
+- columns of 1D numpy arrays with different lengths are stored as the concatenated values and an offsets dataset
+- columns of str are stored as the concatenated utf-8 bytes and an offsets dataset
+- columns of dicts, such as ``ROI_State``, are stored as a table with one sub-column for each key, each of which is
+  stored in the same way as a column
+- anything else is pickled as a whole column
+
+``None`` cells in array, str and dict columns are recorded in a ``mask`` dataset.
+"""
+
+import os
+import pickle
+import json
+import numpy as np
+import pandas as pd
+import h5py
+from typing import *
+from .utils import HdfTools
+
+
+FORMAT_NAME = 'mesmerize-columnar'
+FORMAT_VERSION = 2
+
+_ARRAY_KINDS = 'biufc'
+_PYTHON_SCALARS = (bool, int, float)
+
+
+def _to_offsets(lengths: Iterable[int], n: int) -> np.ndarray:
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(lengths, dtype=np.int64, count=n), out=offsets[1:])
+    return offsets
+
+
+def _write_blob(group: h5py.Group, obj: Any):
+    group.attrs['kind'] = 'pickle'
+    group.create_dataset('values', data=np.frombuffer(pickle.dumps(obj, protocol=4), dtype=np.uint8))
+
+
+def _array_column_kind(cells: List[np.ndarray]) -> Optional[str]:
+    dtype = cells[0].dtype
+    shape = cells[0].shape
+
+    if dtype.kind not in _ARRAY_KINDS or not dtype.isnative or cells[0].ndim == 0:
+        return None
+
+    if any(a.dtype != dtype for a in cells):
+        return None
+
+    if all(a.shape == shape for a in cells):
+        return 'fixed'
+
+    if all(a.ndim == 1 for a in cells):
+        return 'ragged'
+
+    return None
+
+
+def _write_values(group: h5py.Group, values: np.ndarray):
+    """
+    Write one column to an empty group.
+
+    :param group:   empty hdf5 group for this column
+    :param values:  1D numpy array of the column's values
+    """
+    n = values.size
+    group.attrs['n_rows'] = n
+
+    if values.dtype.kind in _ARRAY_KINDS:
+        group.attrs['kind'] = 'scalar'
+        group.create_dataset('values', data=values)
+        return
+
+    if values.dtype.kind in 'mM':
+        group.attrs['kind'] = 'datetime'
+        group.attrs['dtype'] = values.dtype.str
+        group.create_dataset('values', data=values.view(np.int64))
+        return
+
+    if values.dtype != object:
+        _write_blob(group, values)
+        return
+
+    missing = np.fromiter((v is None for v in values), dtype=bool, count=n)
+    present = [v for v in values if v is not None]
+    types = set(map(type, present))
+
+    if len(present) == 0:
+        _write_blob(group, values)
+        return
+
+    if missing.any():
+        group.create_dataset('mask', data=missing)
+
+    if types == {str}:
+        encoded = [v.encode('utf-8') if v is not None else b'' for v in values]
+        group.attrs['kind'] = 'string'
+        group.create_dataset('values', data=np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        group.create_dataset('offsets', data=_to_offsets(map(len, encoded), n))
+        return
+
+    if types == {np.ndarray}:
+        kind = _array_column_kind(present)
+
+        if kind == 'fixed':
+            stacked = np.zeros((n, *present[0].shape), dtype=present[0].dtype)
+            stacked[~missing] = np.stack(present)
+
+            group.attrs['kind'] = 'fixed'
+            group.create_dataset('values', data=stacked)
+            return
+
+        elif kind == 'ragged':
+            lengths = (v.size if v is not None else 0 for v in values)
+
+            group.attrs['kind'] = 'ragged'
+            group.create_dataset('values', data=np.concatenate(present))
+            group.create_dataset('offsets', data=_to_offsets(lengths, n))
+            return
+
+    if types == {dict} and all(isinstance(k, str) for d in present for k in d.keys()):
+        _write_dicts(group, values)
+        return
+
+    if len(types) == 1 and types.pop() in _PYTHON_SCALARS and not missing.any():
+        scalars = np.array(present)
+        if scalars.dtype.kind in _ARRAY_KINDS:
+            group.attrs['kind'] = 'scalar'
+            group.attrs['python'] = True
+            group.create_dataset('values', data=scalars)
+            return
+
+    if 'mask' in group:
+        del group['mask']
+    _write_blob(group, values)
+
+
+def _write_dicts(group: h5py.Group, values: np.ndarray):
+    """Write a column of dicts as a table of sub-columns, one sub-column for each key"""
+    keys = list(dict.fromkeys(k for d in values if d is not None for k in d.keys()))
+
+    group.attrs['kind'] = 'dicts'
+    group.attrs['keys'] = json.dumps(keys)
+
+    for i, key in enumerate(keys):
+        sub = group.create_group(f'k{i}')
+        has_key = np.fromiter((d is not None and key in d.keys() for d in values), dtype=bool, count=values.size)
+
+        sub.create_dataset('has_key', data=has_key)
+        _write_values(sub.create_group('column'), _object_array([d[key] for d in values[has_key]]))
+
+
+def _object_array(items: list) -> np.ndarray:
+    """1D object array, without numpy trying to broadcast array items into more dimensions"""
+    a = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        a[i] = item
+    return a
+
+
+def _read_values(group: h5py.Group) -> np.ndarray:
+    """Read a column that was written with ``_write_values``"""
+    kind = group.attrs['kind']
+
+    if kind == 'pickle':
+        return pickle.loads(group['values'][()].tobytes())
+
+    elif kind == 'scalar':
+        values = group['values'][()]
+        if group.attrs.get('python', False):
+            return _object_array(values.tolist())
+        return values
+
+    elif kind == 'datetime':
+        return group['values'][()].view(group.attrs['dtype'])
+
+    n = int(group.attrs['n_rows'])
+
+    if kind == 'fixed':
+        stacked = group['values'][()]
+        out = _object_array(list(stacked))
+
+    elif kind == 'ragged':
+        offsets = group['offsets'][()]
+        out = _object_array(np.split(group['values'][()], offsets[1:-1]))
+
+    elif kind == 'string':
+        blob = group['values'][()].tobytes()
+        offsets = group['offsets'][()].tolist()
+        out = _object_array([blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(n)])
+
+    elif kind == 'dicts':
+        out = _object_array([{} for i in range(n)])
+
+        for i, key in enumerate(json.loads(group.attrs['keys'])):
+            sub = group[f'k{i}']
+            rows = np.flatnonzero(sub['has_key'][()])
+            for row, v in zip(rows, _read_values(sub['column'])):
+                out[row][key] = v
+
+    else:
+        raise ValueError(f'Unknown column kind: {kind}')
+
+    if 'mask' in group:
+        out[group['mask'][()]] = None
+
+    return out
+
+
+class ColumnarHdf:
+    """Functions for saving and loading DataFrames in the columnar hdf5 layout"""
+
+    @staticmethod
+    def save_dataframe(path: str, dataframe: pd.DataFrame, metadata: Optional[dict] = None,
+                       metadata_method: str = 'json'):
+        """
+        Save a DataFrame, along with a meta data dict, in the columnar layout.
+        The meta data dict is stored in the same way as ``HdfTools.save_dataframe``.
+
+        :param path:            path to save the file to
+        :param dataframe:       DataFrame to save
+        :param metadata:        Any associated meta data to store along with the DataFrame
+        :param metadata_method: method for storing the metadata dict, either 'json' or 'recursive'
+        """
+        if os.path.isfile(path):
+            raise FileExistsError
+
+        with h5py.File(path, mode='w') as f:
+            f.attrs['format'] = FORMAT_NAME
+            f.attrs['version'] = FORMAT_VERSION
+            f.attrs['n_rows'] = len(dataframe.index)
+
+            cg = f.create_group('COLUMNS')
+            cg.attrs['names'] = json.dumps(list(dataframe.columns))
+
+            for i in range(dataframe.columns.size):
+                series = dataframe.iloc[:, i]
+
+                if isinstance(series.values, np.ndarray):
+                    _write_values(cg.create_group(str(i)), series.values)
+                else:
+                    # pandas extension types such as categoricals
+                    g = cg.create_group(str(i))
+                    g.attrs['n_rows'] = series.size
+                    _write_blob(g, series.values)
+
+            ColumnarHdf._save_index(f.create_group('INDEX'), dataframe.index)
+
+            if metadata is not None:
+                HdfTools.save_metadata(f, metadata, metadata_method)
+
+    @staticmethod
+    def _save_index(group: h5py.Group, index: pd.Index):
+        if isinstance(index, pd.RangeIndex):
+            group.attrs['kind'] = 'range'
+            group.attrs['range'] = [index.start, index.stop, index.step]
+            group.attrs['names'] = json.dumps(index.names)
+            return
+
+        group.attrs['kind'] = 'values'
+        group.attrs['names'] = json.dumps(index.names)
+        group.attrs['multi'] = isinstance(index, pd.MultiIndex)
+
+        values = index.values if isinstance(index.values, np.ndarray) else np.asarray(index, dtype=object)
+        _write_values(group.create_group('column'), values)
+
+    @staticmethod
+    def _load_index(group: h5py.Group) -> pd.Index:
+        names = json.loads(group.attrs['names'])
+
+        if group.attrs['kind'] == 'range':
+            start, stop, step = (int(v) for v in group.attrs['range'])
+            return pd.RangeIndex(start, stop, step, name=names[0])
+
+        values = _read_values(group['column'])
+
+        if group.attrs['multi']:
+            return pd.MultiIndex.from_tuples(values.tolist(), names=names)
+
+        return pd.Index(values, name=names[0])
+
+    @staticmethod
+    def is_columnar(path: str) -> bool:
+        """Whether the hdf5 file was written with ``ColumnarHdf.save_dataframe``"""
+        with h5py.File(path, 'r') as f:
+            return f.attrs.get('format', None) == FORMAT_NAME
+
+    @staticmethod
+    def get_columns(path: str) -> list:
+        """Column names of the DataFrame, without reading any of the data"""
+        with h5py.File(path, 'r') as f:
+            return json.loads(f['COLUMNS'].attrs['names'])
+
+    @staticmethod
+    def load_dataframe(path: str, columns: Optional[List[str]] = None,
+                       metadata: bool = True) -> Tuple[pd.DataFrame, Union[dict, None]]:
+        """
+        Load a DataFrame along with meta data that were saved using ``ColumnarHdf.save_dataframe``.
+        Only the requested columns are read from the file.
+
+        :param path:        file path to the hdf5 file
+        :param columns:     columns to load, loads all columns if None
+        :param metadata:    read the meta data dict, None is returned in its place if False
+
+        :return: tuple, (DataFrame, meta data dict if present else None)
+        """
+        with h5py.File(path, 'r') as f:
+            if f.attrs.get('version', 0) > FORMAT_VERSION:
+                raise ValueError(f'Columnar hdf5 version {f.attrs["version"]} is newer than the supported version '
+                                 f'{FORMAT_VERSION}, you will need a newer version of Mesmerize to open this file')
+
+            names = json.loads(f['COLUMNS'].attrs['names'])
+
+            if columns is None:
+                ixs = list(range(len(names)))
+            else:
+                missing = [c for c in columns if c not in names]
+                if len(missing) > 0:
+                    raise KeyError(f'Columns not found in file: {missing}')
+                ixs = [names.index(c) for c in columns]
+
+            index = ColumnarHdf._load_index(f['INDEX'])
+            data = {i: _read_values(f['COLUMNS'][str(i)]) for i in ixs}
+
+            meta = HdfTools.load_metadata(f) if metadata else None
+
+        # the dtype of numpy columns is kept, newer pandas would infer a string dtype for object columns of str
+        df = pd.DataFrame(
+            {k: pd.Series(v, index=index, dtype=v.dtype if isinstance(v, np.ndarray) else None, copy=False)
+             for k, v in data.items()},
+            index=index
+        )
+        df.columns = [names[i] for i in ixs]
+
+        return df, meta
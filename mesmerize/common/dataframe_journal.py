@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Append-only journal for the project dataframe.
+
+The project dataframe is stored as a snapshot, ``dataframes/root.dfr``, and a journal, ``dataframes/root.dfr.journal``.
+Row additions and deletions are appended to the journal so that their cost is proportional to the number of rows
+that changed, not the size of the whole project. The journal is periodically compacted into a new snapshot.
+"""
+
+import os
+import pickle
+from uuid import uuid4
+from glob import glob
+from shutil import copy2
+from time import time
+from warnings import warn
+from typing import *
+import pandas as pd
+
+
+SNAPSHOT_KEY = 'project_dataframe'
+TOKEN_KEY = 'journal_token'
+
+
+def _concat(dataframe: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    if dataframe.empty and len(dataframe.columns) == 0:
+        return rows.reset_index(drop=True)
+    return pd.concat([dataframe, rows], ignore_index=True, sort=False)
+
+
+class DataFrameJournal:
+    """
+    Manages the snapshot + journal pair of files that make up the project dataframe.
+
+    Journal records are pickled tuples of ``(operation, payload)`` appended one after another:
+
+    - ``('snapshot', str)``: header, token of the snapshot that this journal applies to
+    - ``('append', DataFrame)``: rows added to the end of the dataframe
+    - ``('delete_sample', str)``: all rows with this SampleID are removed
+    - ``('replace_sample', (str, DataFrame))``: rows with this SampleID are removed and the new rows are added
+    - ``('update_roi_states', dict)``: ``{uuid_curve: {key: value}}``, keys that are set in the ROI_State of each row
+
+    A journal whose header token does not match the snapshot's token is stale, i.e. left behind by an interrupted
+    compaction, and is ignored.
+    """
+
+    def __init__(self, dataframes_dir: str, max_records: int = 200, max_ratio: float = 0.5, max_backups: int = 10):
+        """
+        :param dataframes_dir:  the project's ``dataframes`` directory
+        :param max_records:     compact the journal once it has this many records
+        :param max_ratio:       compact the journal once its size exceeds this fraction of the snapshot size
+        :param max_backups:     number of ``root_bak_<time>.dfr`` snapshot backups to keep, older ones are deleted
+        """
+        self.dataframes_dir = dataframes_dir
+        self.snapshot_path = os.path.join(dataframes_dir, 'root.dfr')
+        self.journal_path = self.snapshot_path + '.journal'
+
+        self.max_records = max_records
+        self.max_ratio = max_ratio
+        self.max_backups = max_backups
+
+        self.n_records = 0
+        self.token = None
+
+    def load(self) -> pd.DataFrame:
+        """
+        Read the snapshot and replay the journal on top of it.
+
+        :return: the current project dataframe
+        """
+        dataframe = pd.read_hdf(self.snapshot_path, key=SNAPSHOT_KEY, mode='r')
+        self.token = self._read_token()
+
+        self.n_records = 0
+        records = self._read_records()
+
+        header = next(records, None)
+        if header is None:
+            return dataframe
+
+        if header != ('snapshot', self.token):
+            warn('Ignoring stale project dataframe journal')
+            os.remove(self.journal_path)
+            return dataframe
+
+        for op, payload in records:
+            dataframe = self.apply(dataframe, op, payload)
+            self.n_records += 1
+
+        return dataframe
+
+    def _read_token(self) -> Optional[str]:
+        try:
+            return pd.read_hdf(self.snapshot_path, key=TOKEN_KEY, mode='r').iloc[0]
+        except KeyError:
+            # snapshot written before the journal existed
+            return None
+
+    @staticmethod
+    def apply(dataframe: pd.DataFrame, op: str, payload: Any) -> pd.DataFrame:
+        """Apply one journal record to the dataframe"""
+        if op == 'append':
+            return _concat(dataframe, payload)
+
+        elif op == 'delete_sample':
+            return dataframe[dataframe['SampleID'] != payload]
+
+        elif op == 'replace_sample':
+            sample_id, rows = payload
+            return _concat(dataframe[dataframe['SampleID'] != sample_id], rows)
+
+        elif op == 'update_roi_states':
+            states = [
+                {**state, **payload[u]} if u in payload else state
+                for u, state in zip(dataframe['uuid_curve'], dataframe['ROI_State'])
+            ]
+            return dataframe.assign(ROI_State=pd.Series(states, index=dataframe.index, dtype=object))
+
+        else:
+            raise ValueError(f'Unknown journal operation: {op}')
+
+    def _read_records(self) -> Iterator[Tuple[str, Any]]:
+        if not os.path.isfile(self.journal_path):
+            return
+
+        with open(self.journal_path, 'rb') as f:
+            while True:
+                pos = f.tell()
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+                except (pickle.UnpicklingError, ValueError, TypeError, AttributeError):
+                    # an interrupted write can only leave a partial record at the very end
+                    warn(f'Ignoring incomplete record at byte {pos} of the project dataframe journal')
+                    return
+
+    def append_record(self, op: str, payload: Any):
+        """Append a record to the journal and flush it to disk"""
+        new_journal = not os.path.isfile(self.journal_path)
+
+        with open(self.journal_path, 'ab') as f:
+            if new_journal:
+                pickle.dump(('snapshot', self.token), f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump((op, payload), f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.n_records += 1
+
+    def append_rows(self, rows: pd.DataFrame):
+        self.append_record('append', rows)
+
+    def delete_sample(self, sample_id: str):
+        self.append_record('delete_sample', sample_id)
+
+    def replace_sample(self, sample_id: str, rows: pd.DataFrame):
+        self.append_record('replace_sample', (sample_id, rows))
+
+    def update_roi_states(self, updates: Dict[str, dict]):
+        self.append_record('update_roi_states', updates)
+
+    def needs_compaction(self) -> bool:
+        if self.n_records == 0:
+            return False
+
+        if self.n_records >= self.max_records:
+            return True
+
+        if not os.path.isfile(self.snapshot_path):
+            return True
+
+        return os.path.getsize(self.journal_path) > self.max_ratio * os.path.getsize(self.snapshot_path)
+
+    def write_snapshot(self, dataframe: pd.DataFrame, backup: bool = True):
+        """
+        Write the full dataframe as a new snapshot and clear the journal.
+
+        The new snapshot is written to a temporary file first and then moved into place, so an interrupted write
+        never leaves a broken ``root.dfr``.
+
+        :param dataframe:   the full project dataframe
+        :param backup:      keep the previous snapshot as ``root_bak_<time>.dfr``
+        """
+        tmp_path = self.snapshot_path + '.tmp'
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+        token = uuid4().hex
+        dataframe.to_hdf(tmp_path, key=SNAPSHOT_KEY, mode='w')
+        pd.Series([token]).to_hdf(tmp_path, key=TOKEN_KEY, mode='a')
+
+        if backup and os.path.isfile(self.snapshot_path):
+            self.backup_snapshot()
+
+        os.replace(tmp_path, self.snapshot_path)
+        self.token = token
+
+        # if this is interrupted the old journal is recognized as stale by its token
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+
+        self.n_records = 0
+
+    def backup_snapshot(self):
+        """Keep the current snapshot as ``root_bak_<time>.dfr`` and delete the oldest backups beyond ``max_backups``"""
+        bak_path = os.path.join(self.dataframes_dir, f'root_bak_{time()}.dfr')
+        try:
+            # the snapshot is always replaced, never modified in place, so a hard link is a safe backup
+            os.link(self.snapshot_path, bak_path)
+        except OSError:
+            copy2(self.snapshot_path, bak_path)
+
+        self.prune_backups()
+
+    def prune_backups(self):
+        """Delete the oldest snapshot backups so that at most ``max_backups`` remain"""
+        if self.max_backups is None:
+            return
+
+        backups = glob(os.path.join(self.dataframes_dir, 'root_bak_*.dfr'))
+        backups.sort(key=os.path.getmtime)
+
+        n_remove = len(backups) - self.max_backups
+        for path in backups[:max(n_remove, 0)]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                warn(f'Could not remove old project dataframe backup: {path}\n{e}')
+
+
+def read_project_dataframe(proj_path: str) -> pd.DataFrame:
+    """
+    Read the current project dataframe, including any changes that are still in the journal.
+
+    :param proj_path: root directory of the project
+    """
+    return DataFrameJournal(os.path.join(proj_path, 'dataframes')).load()
@@ -150,12 +150,16 @@ class ColumnsPage(QtWidgets.QWidget):
             roi_defs.append(self.ui.listwROIDefs.item(i).text())
         configuration.proj_cfg['ROI_DEFS'] = dict.fromkeys(roi_defs)
 
+        from ..viewer.modules.roi_manager_modules.roi_store import states_to_columns, columns_to_states
+
         images_dir = configuration.proj_path + '/images'
         for new_def in self.new_roi_defs:
             for f in glob(images_dir + '/*.pik'):
                 p = pickle.load(open(f, 'rb'))
-                for s in p['roi_states']['states']:
+                roi_states = columns_to_states(p['roi_states'])
+                for s in roi_states['states']:
                     s['tags'].update({new_def: 'untagged'})
+                p['roi_states'] = states_to_columns(roi_states)
                 pickle.dump(p, open(f, 'wb'))
 
         self.new_roi_defs = []
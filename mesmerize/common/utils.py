@@ -204,23 +204,7 @@ class HdfTools:
         f.create_group('DATAFRAME')
 
         if metadata is not None:
-            mg = f.create_group('META')
-            mg.attrs['method'] = metadata_method
-
-            if metadata_method == 'json':
-                bad_keys = []
-                for k in metadata.keys():
-                    try:
-                        mg.create_dataset(k, data=json.dumps(metadata[k]))
-                    except TypeError as e:
-                        bad_keys.append(k + ': ' + str(e))
-
-                if len(bad_keys) > 0:
-                    bad_keys = '\n'.join(bad_keys)
-                    raise TypeError(f"The following meta data keys are not JSON serializable\n{bad_keys}")
-
-            elif metadata_method == 'recursive':
-                HdfTools._dicts_to_group(h5file=f, path='META/', d=metadata, raise_meta_fail=raise_meta_fail)
+            HdfTools.save_metadata(f, metadata, metadata_method, raise_meta_fail)
 
         f.close()
 
@@ -239,23 +223,61 @@ class HdfTools:
         """
 
         with h5py.File(filepath, 'r') as f:
-            if 'META' in f.keys():
+            metadata = HdfTools.load_metadata(f)
 
-                if f['META'].attrs['method'] == 'json':
-                    ks = f['META'].keys()
-                    metadata = dict.fromkeys(ks)
-                    for k in ks:
-                        metadata[k] = json.loads(f['META'][k][()])
-
-                elif f['META'].attrs['method'] == 'recursive':
-                    metadata = HdfTools._dicts_from_group(f, 'META/')
-
-            else:
-                metadata = None
         df = pd.read_hdf(filepath, key='DATAFRAME', mode='r')
 
         return (df, metadata)
 
+    @staticmethod
+    def save_metadata(h5file: h5py.File, metadata: dict, metadata_method: str = 'json', raise_meta_fail: bool = True):
+        """
+        Save a meta data dict to the 'META' group of an open hdf5 file, see ``HdfTools.save_dataframe``
+
+        :param h5file:          hdf5 file opened for writing
+        :param metadata:        meta data dict
+        :param metadata_method: method for storing the metadata dict, either 'json' or 'recursive'
+        :param raise_meta_fail: raise an exception if recursive metadata saving encounters an unsupported object
+        """
+        mg = h5file.create_group('META')
+        mg.attrs['method'] = metadata_method
+
+        if metadata_method == 'json':
+            bad_keys = []
+            for k in metadata.keys():
+                try:
+                    mg.create_dataset(k, data=json.dumps(metadata[k]))
+                except TypeError as e:
+                    bad_keys.append(k + ': ' + str(e))
+
+            if len(bad_keys) > 0:
+                bad_keys = '\n'.join(bad_keys)
+                raise TypeError(f"The following meta data keys are not JSON serializable\n{bad_keys}")
+
+        elif metadata_method == 'recursive':
+            HdfTools._dicts_to_group(h5file=h5file, path='META/', d=metadata, raise_meta_fail=raise_meta_fail)
+
+    @staticmethod
+    def load_metadata(h5file: h5py.File) -> Union[dict, None]:
+        """
+        Load the meta data dict from the 'META' group of an open hdf5 file
+
+        :return: meta data dict if present else None
+        """
+        if 'META' not in h5file.keys():
+            return None
+
+        if h5file['META'].attrs['method'] == 'json':
+            ks = h5file['META'].keys()
+            metadata = dict.fromkeys(ks)
+            for k in ks:
+                metadata[k] = json.loads(h5file['META'][k][()])
+
+        elif h5file['META'].attrs['method'] == 'recursive':
+            metadata = HdfTools._dicts_from_group(h5file, 'META/')
+
+        return metadata
+
     @staticmethod
     def save_dict(d: dict, filename: str, group: str, raise_type_fail=True):
         """
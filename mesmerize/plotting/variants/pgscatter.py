@@ -9,16 +9,399 @@ Sars International Centre for Marine Molecular Biology
 GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
 """
 
-from ...pyqtgraphCore import ScatterPlotItem, SpotItem, GraphicsLayoutWidget
-from ...pyqtgraphCore.Qt import QtCore, QtGui, QtWidgets
-# from ...pyqtgraphCore.functions import mkBrush
+from ...pyqtgraphCore import ScatterPlotItem, GraphicsLayoutWidget, GraphicsObject
+from ...pyqtgraphCore.Qt import QtCore, QtGui, sip
+from ...pyqtgraphCore import functions as fn
+from ...pyqtgraphCore.graphicsItems.ScatterPlotItem import renderSymbol
+from ...pyqtgraphCore import debug
 import pandas as pd
 from uuid import UUID
 # from collections.abc import Iterable
 import numpy as np
+from scipy.spatial import cKDTree
 from typing import *
 
 
+class _PixmapFragments:
+    """
+    Array of ``QPainter.PixmapFragment`` whose fields are the rows of a numpy array, so that the fragments can be set
+    for millions of points without creating them in python.
+
+    With PyQt5 >= 5.15.7 the fragments are a ``sip.array``, with older versions they are a list of fragments that
+    wrap the memory of the numpy array, which are only made when the array grows.
+    """
+    #: x, y, sourceLeft, sourceTop, width, height, scaleX, scaleY, rotation, opacity
+    N_FIELDS = 10
+
+    #: drawPixmapFragments() takes a sip.array instead of a list
+    USE_SIP_ARRAY = hasattr(sip, 'array') and QtCore.PYQT_VERSION >= 0x50f07
+
+    def __init__(self):
+        self.capacity = 0
+        self.array = np.empty((0, self.N_FIELDS), dtype=np.float64)  #: fields of the fragments, one row each
+        self._fragments = []
+
+    def resize(self, size: int):
+        """Make room for at least ``size`` fragments, the fields are not kept"""
+        if size <= self.capacity:
+            return
+
+        size = max(size, int(self.capacity * 1.5))
+        n_bytes = size * self.N_FIELDS * 8
+
+        if self.USE_SIP_ARRAY:
+            self._fragments = sip.array(QtGui.QPainter.PixmapFragment, size)
+            self.array = np.frombuffer(sip.voidptr(self._fragments, n_bytes), dtype=np.float64)
+        else:
+            self.array = np.empty(size * self.N_FIELDS, dtype=np.float64)
+            address = self.array.ctypes.data
+            self._fragments = [
+                sip.wrapinstance(address + i * self.N_FIELDS * 8, QtGui.QPainter.PixmapFragment) for i in range(size)
+            ]
+
+        self.array = self.array.reshape(size, self.N_FIELDS)
+        self.capacity = size
+
+    def draw(self, p: QtGui.QPainter, start: int, stop: int, pixmap: QtGui.QPixmap):
+        """Draw the fragments ``start:stop`` with one call"""
+        p.drawPixmapFragments(self._fragments[start:stop], pixmap)
+
+
+class ArrayScatterItem(GraphicsObject):
+    """
+    Scatter plot item for very large numbers of points, all point attributes are numpy arrays.
+
+    Colors and symbols are given as palettes with an integer index into the palette for every point. Points are
+    snapped to screen pixels and points that fall onto the same pixel as another point with the same color & symbol
+    are drawn only once, unless the color is translucent. The occupied pixels of each 3x3 pixel block are drawn with
+    a single pixmap that is rendered once for every occupancy pattern, color & symbol, and all the blocks that use a
+    pixmap are drawn with one ``drawPixmapFragments`` call. Clicks are located with a KD-tree.
+
+    Points are drawn grouped by symbol and then by color, in the order of their palette indices, not in the order of
+    the data. Points of a later group are drawn on top of the points of earlier groups where they overlap.
+    """
+    sigClicked = QtCore.pyqtSignal(object, int)  #: Emits (self, row index of the clicked point)
+
+    #: size of the pixel blocks that are drawn with one pixmap
+    BLOCK_SIZE = 3
+    #: the pixmap cache is cleared when it has more entries than this
+    MAX_SPRITES = 50000
+
+    def __init__(self):
+        GraphicsObject.__init__(self)
+
+        self.xs = np.empty(0, dtype=np.float64)
+        self.ys = np.empty(0, dtype=np.float64)
+
+        self.brushes = [fn.mkBrush('r')]
+        self.color_ixs = np.empty(0, dtype=np.intp)
+
+        self.symbols = ['o']
+        self.symbol_ixs = np.empty(0, dtype=np.intp)
+
+        self.size = 10
+        self.pen = fn.mkPen('k')
+
+        self._groups = []  # [(symbol index, color index, row indices), ...]
+        self._sprites = {}  # (symbol index, color index, occupancy pattern): QPixmap
+        self._fragments = _PixmapFragments()
+        self._bounds = [None, None]
+        self._tree = None
+        self._tree_rows = None
+        self._tree_scale = None
+
+    def set_data(self, xs: np.ndarray, ys: np.ndarray,
+                 color_ixs: np.ndarray = None, colors: list = None,
+                 symbol_ixs: np.ndarray = None, symbols: List[str] = None,
+                 size: int = 10, pen: Any = 'k'):
+        """
+        Set the data, replaces any existing data
+
+        :param xs:          array of x values
+        :param ys:          array of y values
+        :param color_ixs:   index into ``colors`` for every point, all points use ``colors[0]`` if None
+        :param colors:      palette of colors that pyqtgraph.fn.mkBrush() can accept
+        :param symbol_ixs:  index into ``symbols`` for every point, all points use ``symbols[0]`` if None
+        :param symbols:     palette of symbols, such as 'o', 's', 't', 'd', '+'
+        :param size:        spot size in pixels
+        :param pen:         spot outline, anything that pyqtgraph.fn.mkPen() can accept
+        """
+        self.prepareGeometryChange()
+
+        self.xs = np.asarray(xs, dtype=np.float64).ravel()
+        self.ys = np.asarray(ys, dtype=np.float64).ravel()
+        n = self.xs.size
+
+        if self.ys.size != n:
+            raise ValueError('xs and ys must be the same size')
+
+        self.brushes = [fn.mkBrush(c) for c in (colors if colors is not None else ['r'])]
+        self.color_ixs = np.zeros(n, dtype=np.intp) if color_ixs is None else np.asarray(color_ixs, dtype=np.intp)
+
+        self.symbols = list(symbols) if symbols is not None else ['o']
+        self.symbol_ixs = np.zeros(n, dtype=np.intp) if symbol_ixs is None else np.asarray(symbol_ixs, dtype=np.intp)
+
+        if self.color_ixs.size != n or self.symbol_ixs.size != n:
+            raise ValueError('color_ixs and symbol_ixs must be the same size as xs and ys')
+
+        # negative indices count from the end of the palette, same as python lists
+        self.color_ixs = np.where(self.color_ixs < 0, self.color_ixs + len(self.brushes), self.color_ixs)
+        self.symbol_ixs = np.where(self.symbol_ixs < 0, self.symbol_ixs + len(self.symbols), self.symbol_ixs)
+
+        self.size = size
+        self.pen = fn.mkPen(pen)
+
+        self._sprites.clear()
+        self._bounds = [None, None]
+        self._tree = None
+
+        # group the points by their sprite
+        codes = self.symbol_ixs * len(self.brushes) + self.color_ixs
+        order = np.argsort(codes, kind='stable')
+        ucodes, starts = np.unique(codes[order], return_index=True)
+        stops = np.append(starts[1:], n)
+
+        self._groups = [
+            (code // len(self.brushes), code % len(self.brushes), order[start:stop])
+            for code, start, stop in zip(ucodes, starts, stops)
+        ]
+
+        self.update()
+
+    def clear(self):
+        """Remove all points"""
+        self.set_data(np.empty(0), np.empty(0))
+
+    def _get_sprite(self, symbol_ix: int, color_ix: int, pattern: int) -> QtGui.QPixmap:
+        """
+        Pixmap of a pixel block with a spot drawn at each pixel in the block's occupancy pattern.
+        Bit ``i`` of the pattern is the pixel at (i % BLOCK_SIZE, i // BLOCK_SIZE) in the block.
+        """
+        key = (symbol_ix, color_ix, pattern)
+        if key in self._sprites:
+            return self._sprites[key]
+
+        if len(self._sprites) > self.MAX_SPRITES:
+            self._sprites.clear()
+
+        spot = renderSymbol(self.symbols[symbol_ix], self.size, self.pen, self.brushes[color_ix])
+
+        b = self.BLOCK_SIZE
+        img = QtGui.QImage(spot.width() + b - 1, spot.height() + b - 1, QtGui.QImage.Format_ARGB32_Premultiplied)
+        img.fill(0)
+
+        painter = QtGui.QPainter(img)
+        try:
+            for i in range(b * b):
+                if pattern & (1 << i):
+                    painter.drawImage(i % b, i // b, spot)
+        finally:
+            painter.end()
+
+        self._sprites[key] = QtGui.QPixmap.fromImage(img)
+        return self._sprites[key]
+
+    def dataBounds(self, ax, frac=1.0, orthoRange=None):
+        d, d2 = (self.xs, self.ys) if ax == 0 else (self.ys, self.xs)
+
+        if orthoRange is not None:
+            mask = (d2 >= orthoRange[0]) & (d2 <= orthoRange[1])
+            d = d[mask]
+
+        elif frac >= 1.0 and self._bounds[ax] is not None:
+            return self._bounds[ax]
+
+        d = d[np.isfinite(d)]
+        if d.size == 0:
+            return (None, None)
+
+        if frac >= 1.0:
+            bounds = (d.min(), d.max())
+        else:
+            bounds = tuple(np.percentile(d, [50 * (1 - frac), 50 * (1 + frac)]))
+
+        if orthoRange is None and frac >= 1.0:
+            self._bounds[ax] = bounds
+
+        return bounds
+
+    def pixelPadding(self):
+        return self.size * 0.7072
+
+    def boundingRect(self):
+        (xmn, xmx) = self.dataBounds(ax=0)
+        (ymn, ymx) = self.dataBounds(ax=1)
+        if xmn is None or ymn is None:
+            return QtCore.QRectF()
+
+        px, py = self.pixelVectors()
+        px = 0 if px is None else px.length() * self.pixelPadding()
+        py = 0 if py is None else py.length() * self.pixelPadding()
+
+        return QtCore.QRectF(xmn - px, ymn - py, (2 * px) + xmx - xmn, (2 * py) + ymx - ymn)
+
+    def viewTransformChanged(self):
+        self.prepareGeometryChange()
+        GraphicsObject.viewTransformChanged(self)
+
+    @debug.warnOnException  ## raising an exception here causes crash
+    def paint(self, p, *args):
+        if self.xs.size == 0:
+            return
+
+        tr = self.deviceTransform()
+        vb = self.getViewBox()
+        if tr is None or vb is None:
+            return
+
+        p.resetTransform()
+
+        pts = fn.transformCoordinates(tr, np.vstack([self.xs, self.ys]))
+
+        view = vb.mapRectToDevice(vb.boundingRect())
+        pad = self.size
+        left, top = int(view.left()) - pad, int(view.top()) - pad
+        width, height = int(view.width()) + 2 * pad, int(view.height()) + 2 * pad
+
+        # integer pixel positions, anything outside the view or nan is culled
+        with np.errstate(invalid='ignore'):
+            ix = np.floor(pts[0] - left)
+            iy = np.floor(pts[1] - top)
+            visible = (ix >= 0) & (ix < width) & (iy >= 0) & (iy < height)
+
+        b = self.BLOCK_SIZE
+        n_block_cols = width // b + 1
+        n_blocks = n_block_cols * (height // b + 1)
+
+        # bit of each pixel in a block's occupancy pattern
+        bits = np.left_shift(1, np.arange(b * b, dtype=np.int64))
+
+        # the spot is centered on the pixel, same offset as renderSymbol
+        spot_offset = int(self.size + max(np.ceil(self.pen.widthF()), 1)) // 2
+
+        # (sprite, x, y of the sprite's top left corner) of each group of blocks that are drawn with the same sprite
+        draws = []
+
+        for symbol_ix, color_ix, rows in self._groups:
+            rows = rows[visible[rows]]
+            if rows.size == 0:
+                continue
+
+            bx, sx = np.divmod(ix[rows].astype(np.int64), b)
+            by, sy = np.divmod(iy[rows].astype(np.int64), b)
+
+            blocks = by * n_block_cols + bx
+            subpixels = sy * b + sx
+
+            if self.brushes[color_ix].color().alpha() == 255:
+                # overlapping opaque spots look the same as a single spot, each occupied pixel is drawn once.
+                # The occupied pixels are marked in an array the size of the view, which is much faster than
+                # sorting the points.
+                occupied = np.zeros((n_blocks, b * b), dtype=bool)
+                occupied[blocks, subpixels] = True
+
+                patterns = occupied.astype(np.int64) @ bits
+                blocks = np.flatnonzero(patterns)
+                patterns = patterns[blocks]
+            else:
+                # translucent spots are blended where they overlap, so every point is drawn
+                patterns = bits[subpixels]
+
+            xs = (blocks % n_block_cols) * b + left - spot_offset
+            ys = (blocks // n_block_cols) * b + top - spot_offset
+
+            # the blocks with the same pattern are drawn together
+            order = np.argsort(patterns, kind='stable')
+            counts = np.bincount(patterns)
+            upatterns = np.flatnonzero(counts)
+
+            for pattern, ixs in zip(upatterns.tolist(), np.split(order, np.cumsum(counts[upatterns])[:-1])):
+                draws.append((self._get_sprite(symbol_ix, color_ix, pattern), xs[ixs], ys[ixs]))
+
+        if len(draws) == 0:
+            return
+
+        self._fragments.resize(sum(x.size for sprite, x, y in draws))
+        fragments = self._fragments.array
+
+        start = 0
+        for sprite, xs, ys in draws:
+            stop = start + xs.size
+            w, h = sprite.width(), sprite.height()
+
+            # fragments are positioned by their center
+            fragments[start:stop] = (0, 0, 0, 0, w, h, 1, 1, 0, 1)
+            fragments[start:stop, 0] = xs + w / 2
+            fragments[start:stop, 1] = ys + h / 2
+
+            self._fragments.draw(p, start, stop, sprite)
+            start = stop
+
+    def _build_tree(self):
+        finite = np.isfinite(self.xs) & np.isfinite(self.ys)
+        self._tree_rows = np.flatnonzero(finite)
+
+        pts = np.column_stack([self.xs[finite], self.ys[finite]])
+
+        # normalize the axes so that the tree's metric roughly matches screen distances
+        scale = np.ptp(pts, axis=0) if pts.size > 0 else np.ones(2)
+        scale[scale == 0] = 1
+        self._tree_scale = scale
+
+        self._tree = cKDTree(pts / scale)
+
+    def point_at(self, pos: QtCore.QPointF) -> Optional[int]:
+        """
+        Get the row index of the point under ``pos``, the point closest to ``pos`` if several points overlap.
+
+        :param pos: position in the item's coordinates
+        :return: row index or None if there is no point under ``pos``
+        """
+        if self.xs.size == 0:
+            return None
+
+        if self._tree is None:
+            self._build_tree()
+
+        # spot radius in data units
+        rx = self.size * 0.5 * self.pixelWidth()
+        ry = self.size * 0.5 * self.pixelHeight()
+        if rx == 0 or ry == 0:
+            return None
+
+        x, y = pos.x(), pos.y()
+
+        # candidates within the bounding box of the spot, then exact test
+        r = max(rx / self._tree_scale[0], ry / self._tree_scale[1])
+        candidates = self._tree.query_ball_point([x / self._tree_scale[0], y / self._tree_scale[1]], r, p=np.inf)
+        if len(candidates) == 0:
+            return None
+
+        rows = self._tree_rows[candidates]
+        dx = (self.xs[rows] - x) / rx
+        dy = (self.ys[rows] - y) / ry
+
+        inside = (np.abs(dx) < 1) & (np.abs(dy) < 1)
+        if not inside.any():
+            return None
+
+        dist = dx[inside] ** 2 + dy[inside] ** 2
+        return int(rows[inside][np.argmin(dist)])
+
+    def mouseClickEvent(self, ev):
+        if ev.button() != QtCore.Qt.LeftButton:
+            ev.ignore()
+            return
+
+        row = self.point_at(ev.pos())
+        if row is None:
+            ev.ignore()
+            return
+
+        ev.accept()
+        self.sigClicked.emit(self, row)
+
+
 class PgScatterPlot(QtCore.QObject):
     signal_spot_clicked = QtCore.pyqtSignal(UUID)  #: Emits the UUID of a spot when it is clicked
 
@@ -30,13 +413,20 @@ class PgScatterPlot(QtCore.QObject):
 
         self.graphics_view = graphics_view
         self.current_datapoint = None
-        self.lastClicked = []
         self.plots = self.graphics_view.addPlot(title='Scatter_Plot')
-        self.plot = ScatterPlotItem(title='Scatter_Plot')
+        self.plot = ArrayScatterItem()
         self.plot.sigClicked.connect(self._clicked)
 
         self.plots.addItem(self.plot)
 
+        # uuid of each point, only looked up when a point is clicked
+        self.uuids = None
+
+        # marks the last clicked point
+        self.highlight = ScatterPlotItem()
+        self.highlight.setZValue(1)
+        self.plots.addItem(self.highlight)
+
         self.legend = self.plots.addLegend()
         self.legend.setParentItem(self.plots)
 
@@ -47,11 +437,33 @@ class PgScatterPlot(QtCore.QObject):
         self.pseudo_plots = []
         # self.legend.addItem(self.plot, 'Legend')
         
+    def set_data(self, xs: np.ndarray, ys: np.ndarray, uuid_series: pd.Series,
+                 color_ixs: np.ndarray = None, colors: list = None,
+                 symbol_ixs: np.ndarray = None, symbols: List[str] = None,
+                 size: int = 10):
+        """
+        Set the plot data, colors and symbols are given as palettes with an index for every point.
+
+        :param xs:          array of x values, indices must correspond to the "ys" array
+        :param ys:          array of y values, indices must correspond to the "xs" array
+        :param uuid_series: series of UUID values, the indices must correspond to the "xs" and "ys" arrays
+        :param color_ixs:   index into ``colors`` for every point
+        :param colors:      palette of colors that pqytgraph.fn.mkBrush() can accept
+        :param symbol_ixs:  index into ``symbols`` for every point
+        :param symbols:     palette of symbols, such as 'o', 's', 't', 'd', '+'
+        :param size:        spot size
+        """
+        self.clear()
+        self.uuids = uuid_series
+        self.plot.set_data(xs, ys, color_ixs=color_ixs, colors=colors, symbol_ixs=symbol_ixs, symbols=symbols,
+                           size=size, pen='k')
+
     def add_data(self, xs: np.ndarray, ys: np.ndarray, uuid_series: pd.Series,
                  color: Union[str, QtGui.QColor, QtGui.QBrush, List[Union[QtGui.QBrush, QtGui.QColor, str]]],
                  size: int = 10, **kwargs):
         """
-        Add data to the plot
+        Add data to the plot, with a color and symbol per point. The points are added to any existing data.
+        Use :meth:`set_data` to replace the data when the colors and symbols are already available as palette indices.
 
         :param xs:          array of x values, indices must correspond to the "ys" array
         :type xs:           np.ndarray
@@ -59,9 +471,7 @@ class PgScatterPlot(QtCore.QObject):
         :param ys:          array of y values, indices must correspond to the "xs" array
         :type ys:           np.ndarray
 
-        :param uuid_series: series of UUID values.
-                            Each SpotItem on the plot is tagged with these UUIDs, therefore
-                            the indices must correspond to the "xs" and "ys" arrays.
+        :param uuid_series: series of UUID values, the indices must correspond to the "xs" and "ys" arrays.
         :type uuid_series:  pd.Series
 
         :param color:       Either a single color or list of colors that pqytgraph.fn.mkBrush() can accept
@@ -70,37 +480,56 @@ class PgScatterPlot(QtCore.QObject):
         :param size:        spot size
         :type size:         int
 
-        :param kwargs:      any additional kwargs that are passed to ScatterPlotItem.addPoints()
+        :param kwargs:      "symbol", either a single symbol or a list of symbols
         """
-        self.plot.addPoints(xs, ys, uuid=uuid_series, pen='k', brush=color, size=size, name='scatter', **kwargs)
-
-    def _clicked(self, plot, points):
-        """Called when the plot is clicked"""
-        for i, p in enumerate(self.lastClicked):
-            assert isinstance(p, SpotItem)
-            p.setPen('k')#p._data['orig_pen'])
-            p.setBrush(p._data['orig_brush'])
-            # p.setSymbol(p._data['orig_symbol'])
-
-        if len(points) == 1:
-            p = points[0]
-            assert isinstance(p, SpotItem)
-            if isinstance(p.uuid, str):
-                u = UUID(p.uuid)
-            elif isinstance(p.uuid, UUID):
-                u = p.uuid
-            else:
-                raise TypeError('spot uuid attribute must be either uuid.UUID or str')
-            self.signal_spot_clicked.emit(u)
+        n = np.asarray(xs).size
+
+        if isinstance(color, (list, tuple, np.ndarray)):
+            rgba = [fn.mkBrush(c).color().rgba() for c in color]
+        else:
+            rgba = [fn.mkBrush(color).color().rgba()] * n
+
+        symbol = kwargs.pop('symbol', 'o')
+        if isinstance(symbol, (list, tuple, np.ndarray)):
+            symbol = np.asarray(symbol, dtype=str)
+        else:
+            symbol = np.full(n, symbol)
+
+        uuids = pd.Series(uuid_series).reset_index(drop=True)
+
+        # existing points as per-point colors & symbols, so that the palettes can be rebuilt for all points
+        if self.plot.xs.size > 0:
+            old_rgba = np.array([b.color().rgba() for b in self.plot.brushes], dtype=np.int64)[self.plot.color_ixs]
+            rgba = np.concatenate([old_rgba, np.asarray(rgba, dtype=np.int64)])
+            symbol = np.concatenate([np.asarray(self.plot.symbols, dtype=str)[self.plot.symbol_ixs], symbol])
+
+            xs = np.concatenate([self.plot.xs, np.asarray(xs, dtype=np.float64).ravel()])
+            ys = np.concatenate([self.plot.ys, np.asarray(ys, dtype=np.float64).ravel()])
+            uuids = pd.concat([self.uuids.reset_index(drop=True), uuids], ignore_index=True)
+
+        colors, color_ixs = np.unique(np.asarray(rgba, dtype=np.int64), return_inverse=True)
+        colors = [QtGui.QColor.fromRgba(int(c)) for c in colors]
+
+        symbols, symbol_ixs = np.unique(symbol, return_inverse=True)
+
+        self.set_data(xs, ys, uuids, color_ixs=color_ixs, colors=colors, symbol_ixs=symbol_ixs,
+                      symbols=[str(s) for s in symbols], size=size)
 
-        for p in points:
-            assert isinstance(p, SpotItem)
-            # p.setSymbol(p._data['orig_symbol'])
-            p.setPen('w')
+    def _clicked(self, plot: ArrayScatterItem, row: int):
+        """Called when a point is clicked"""
+        self.highlight.setData(x=[plot.xs[row]], y=[plot.ys[row]], size=plot.size, pen='w', brush='w',
+                               symbol=plot.symbols[plot.symbol_ixs[row]])
 
-            p.setBrush('w')
+        uuid = self.uuids.iloc[row]
+        if isinstance(uuid, str):
+            u = UUID(uuid)
+        elif isinstance(uuid, UUID):
+            u = uuid
+        else:
+            raise TypeError('uuid values must be either uuid.UUID or str')
 
-        self.lastClicked = points
+        self.current_datapoint = u
+        self.signal_spot_clicked.emit(u)
 
     def set_legend(self, colors: dict, shapes: dict = None):
         """
@@ -147,6 +576,8 @@ class PgScatterPlot(QtCore.QObject):
     def clear(self):
         """Clear the plot"""
         self.plot.clear()
+        self.highlight.clear()
+        self.uuids = None
 
     def export_plot(self, column: str, filetype: str = 'svg', title: str = None, error_bars: str = 'mean',
                     spots_color=None, spots_outline='black', background_color='black', axis_color='white'):
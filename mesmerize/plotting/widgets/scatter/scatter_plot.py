@@ -16,7 +16,7 @@ from .control_widget import Ui_DockWidgetControls
 from ....analysis import Transmission
 from ....common.qdialogs import *
 import numpy as np
-from ....pyqtgraphCore import GraphicsLayoutWidget, mkBrush
+from ....pyqtgraphCore import GraphicsLayoutWidget
 from ....pyqtgraphCore.console import ConsoleWidget
 from ...utils import get_colormap
 from .. import DatapointTracerWidget
@@ -288,11 +288,13 @@ class ScatterPlotWidget(QtWidgets.QMainWindow, BasePlotWidget):
             colors_map = get_colormap(self.transmission.df[self.plot_opts['colors_column']],
                                        self.plot_opts['cmap'], output='pyqt', alpha=self.plot_opts['spot_alpha'])
 
-            colors = list(map(colors_map.get, self.transmission.df[self.plot_opts['colors_column']]))
-            brushes_list = list(map(mkBrush, colors))
+            # palette index for each point, -1 for labels that are missing
+            color_ixs, color_labels = pd.factorize(self.transmission.df[self.plot_opts['colors_column']])
+            colors = [colors_map.get(label) for label in color_labels] + [None]
         else:
             colors_map = None
-            brushes_list = 'r'
+            color_ixs = None
+            colors = ['r']
 
         if self.plot_opts['shapes_column'] != '------------':
             shapes = ['o', 's', 't', 'd', '+']
@@ -301,13 +303,17 @@ class ScatterPlotWidget(QtWidgets.QMainWindow, BasePlotWidget):
                 raise ValueError('Too many labels to set different shapes')
             shapes_map = dict(zip(shapes_labels, shapes))
 
-            shapes_list = list(map(shapes_map.get, self.transmission.df[self.plot_opts['shapes_column']]))
+            symbol_ixs, symbol_labels = pd.factorize(self.transmission.df[self.plot_opts['shapes_column']])
+            symbols = [shapes_map.get(label) for label in symbol_labels] + [None]
         else:
             shapes_map = None
-            shapes_list = 'o'
+            symbol_ixs = None
+            symbols = ['o']
 
-        self.plot_variant.add_data(xs, ys, self.transmission.df[self.plot_opts['uuid_column']], color=brushes_list,
-                                   size=self.plot_opts['spot_size'], symbol=shapes_list)
+        self.plot_variant.set_data(xs, ys, self.transmission.df[self.plot_opts['uuid_column']],
+                                   color_ixs=color_ixs, colors=colors,
+                                   symbol_ixs=symbol_ixs, symbols=symbols,
+                                   size=self.plot_opts['spot_size'])
 
         if colors_map is not None:
             self.plot_variant.set_legend(colors_map, shapes_map)
@@ -19,6 +19,87 @@ from uuid import UUID
 from collections import OrderedDict
 
 
+def get_stimulus_labels(
+        stim_df: pd.DataFrame,
+        n_frames: int,
+        start_offset: int = 0,
+        end_offset: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Integer stimulus label for every frame of a curve, computed once per sample since all ROIs of a
+    sample share the same stimulus maps.
+
+    :param stim_df: stimulus dataframe for one stimulus type
+    :param n_frames: number of frames in the curves
+    :param start_offset: start offset (in frames) for stimulus period extraction
+    :param end_offset: end offset (in frames) for stimulus period extraction
+    :return: (labels, names)
+                labels: int array of shape [n_frames], frame ``i`` is during stimulus ``names[labels[i]]``
+                names: sorted stimulus names present in the curve, "None" for frames without a stimulus
+    """
+    codes = {"None": 0}
+    labels = np.zeros(n_frames, dtype=np.intp)
+
+    # later stimulus periods overwrite earlier ones where they overlap
+    for start, end, name in zip(stim_df['start'].values, stim_df['end'].values, stim_df['name'].values):
+        # stimulus names are compared as str with max length 32 char
+        code = codes.setdefault(str(name)[:32], len(codes))
+        labels[int(start + start_offset):int(end + end_offset)] = code
+
+    all_names = np.array(list(codes.keys()), dtype=np.dtype('<U32'))
+
+    # only keep the stimuli that are present, sorted by name
+    present = np.flatnonzero(np.bincount(labels, minlength=all_names.size))
+    order = np.argsort(all_names[present], kind='stable')
+
+    remap = np.zeros(all_names.size, dtype=np.intp)
+    remap[present[order]] = np.arange(present.size)
+
+    return remap[labels], all_names[present[order]]
+
+
+def reduce_by_label(curves: np.ndarray, labels: np.ndarray, n_labels: int, method: str = 'mean') -> np.ndarray:
+    """
+    Grouped reduction of curves over the frames of each label.
+
+    :param curves: 2D array of curves, shape is [n_curves, n_frames]
+    :param labels: label of each frame, every label in range(n_labels) must be present
+    :param n_labels: number of labels
+    :param method: stats method, such as "mean", "max", "median", etc.
+    :return: 2D array of shape [n_curves, n_labels]
+    """
+    curves = np.asarray(curves, dtype=np.float64)
+
+    # make the frames of each label contiguous
+    order = np.argsort(labels, kind='stable')
+    counts = np.bincount(labels, minlength=n_labels)
+    starts = np.zeros(n_labels, dtype=np.intp)
+    np.cumsum(counts[:-1], out=starts[1:])
+
+    segments = curves[:, order]
+
+    if method == 'mean':
+        return np.add.reduceat(segments, starts, axis=1) / counts
+    elif method == 'max':
+        return np.maximum.reduceat(segments, starts, axis=1)
+    elif method == 'min':
+        return np.minimum.reduceat(segments, starts, axis=1)
+
+    func = getattr(np, method)
+    return np.stack(
+        [func(segments[:, i:i + n], axis=1) for i, n in zip(starts, counts)],
+        axis=1
+    )
+
+
+def _tuning_curve_columns(stim_types: Iterable[str]) -> List[str]:
+    stim_types = list(stim_types)
+    return [f"TUNE_CURVE_{k}_xlabels" for k in stim_types] + \
+           [f"_TUNE_CURVE_{k}_yvals" for k in stim_types] + \
+           [f"TUNE_MAX_{k}" for k in stim_types] + \
+           [f"TUNE_MIN_{k}" for k in stim_types]
+
+
 def get_tuning_curves(
         curve: np.ndarray,
         stim_maps: dict,
@@ -27,12 +108,12 @@ def get_tuning_curves(
         end_offset: int = 0
 ) -> pd.Series:
     """
-    Returns a pandas series with tuning curves for all stimuli for a single curve
+    Returns a pandas series with tuning curves for all stimuli for a single curve.
+    Use :func:`get_tuning_curves_df` to compute the tuning curves for many curves.
 
     :param curve: curve to create tuning curves from
     :param stim_maps: dict of stimulus maps
     :param method: stats method, such as "mean", "max", "median", etc.
-    :param method_assign_stim: assign the "TUNE_<stim_name>" label according to min or max
     :param start_offset: start offset (in frames) for stimulus period extraction
     :param end_offset: end offset (in frames) for stimulus period extraction
     :return: pandas series:
@@ -42,62 +123,82 @@ def get_tuning_curves(
 
     """
     # empty output dict
-    d = OrderedDict.fromkeys(
-        [f"TUNE_CURVE_{k}_xlabels" for k in stim_maps.keys()] +   # used for the tuning curve
-        [f"_TUNE_CURVE_{k}_yvals" for k in stim_maps.keys()] +
-        [f"TUNE_MAX_{k}" for k in stim_maps.keys()] +  # used for stimulus at argmax(tuning_curve)
-        [f"TUNE_MIN_{k}" for k in stim_maps.keys()]    # used for stimulus at argmin(tuning_curve)
-    )
+    d = OrderedDict.fromkeys(_tuning_curve_columns(stim_maps.keys()))
+
+    for stim_type, stim_df in stim_maps.items():
+        labels, xs = get_stimulus_labels(stim_df, curve.size, start_offset, end_offset)
+        ys = reduce_by_label(curve[np.newaxis], labels, xs.size, method)[0]
+
+        # the tuning curve
+        d[f"TUNE_CURVE_{stim_type}_xlabels"] = xs
+        d[f"_TUNE_CURVE_{stim_type}_yvals"] = ys
 
-    # each stimulus datafame
-    for stim_type in stim_maps.keys():
-        stim_df = stim_maps[stim_type]  # get the stimulus dataframe
+        # stimulus name at argmax() and argmin() of tuning curve
+        d[f"TUNE_MAX_{stim_type}"] = xs[np.argmax(ys)]
+        d[f"TUNE_MIN_{stim_type}"] = xs[np.argmin(ys)]
 
-        # stimulus names will be stored as str with max length 32 char
-        stim_array = np.empty(curve.size, dtype=np.dtype('<U32'))
-        stim_array[:] = "None"
+    return pd.Series(d)
 
-        # fill stim_array
-        # stim_array is used for fancy indexing of `curve`
-        # to extract the curve values during the various
-        # stimuli
-        for ix, r in stim_df.iterrows():  # iterate through the stimulus periods
-            # apply any offsets
-            start_ix = r['start'] + start_offset
-            end_ix = r['end'] + end_offset
 
-            # add this stimulus period to the stim_array
-            stim_array[int(start_ix):int(end_ix)] = str(r['name'])  # store stim name as str
+def get_tuning_curves_df(
+        df: pd.DataFrame,
+        data_column: str,
+        stim_types: List[str],
+        method: str = 'mean',
+        start_offset: int = 0,
+        end_offset: int = 0
+) -> pd.DataFrame:
+    """
+    Tuning curves for all curves in a DataFrame, same output as :func:`get_tuning_curves` for each row.
 
-        # instantiate lists for the tuning curves
-        all_stimuli = np.unique(stim_array)  # [stim_array != ''])
-        xs = np.empty(all_stimuli.size, dtype=np.dtype('<U32'))
-        #         xs = []
-        ys = np.empty(all_stimuli.size)
+    The stimulus labels are computed once per sample and the tuning curves of all ROIs
+    in a sample are computed together from the stacked curves.
 
-        # create the tuning curves
-        for i, stimulus in enumerate(all_stimuli):
-            xs[i] = stimulus  # stimulus name
+    :param df: DataFrame with "SampleID" and "stim_maps" columns
+    :param data_column: column containing the curves
+    :param stim_types: stimulus types to create tuning curves for
+    :param method: stats method, such as "mean", "max", "median", etc.
+    :param start_offset: start offset (in frames) for stimulus period extraction
+    :param end_offset: end offset (in frames) for stimulus period extraction
+    :return: DataFrame with the same index as ``df``, columns are in the same order as the
+             entries of the Series returned by :func:`get_tuning_curves`
+    """
+    columns = _tuning_curve_columns(stim_types)
+    out = {c: np.full(df.shape[0], None, dtype=object) for c in columns}
 
-            # get ALL the y values from the curve where
-            # this specific stimulus is present
-            y = curve[stim_array == stimulus]
+    curves = df[data_column].values
+    stim_maps = df['stim_maps'].values
 
-            # get the mean, or max, etc. for the stimulus period
-            ys[i] = getattr(np, method)(y)
+    for sample_id, positions in tqdm(df.groupby('SampleID', sort=False).indices.items()):
+        sample_stim_maps = stim_maps[positions[0]][0][0]
 
-        #         xs.append("None")
-        #         ys.append(curve[np.isnan(stim_array)].mean())
+        # curves of a sample usually all have the same length
+        sizes = np.array([curves[i].size for i in positions])
 
-        # the tuning curve
-        d[f"TUNE_CURVE_{stim_type}_xlabels"] = xs
-        d[f"_TUNE_CURVE_{stim_type}_yvals"] = ys
+        for n_frames in np.unique(sizes):
+            rows = positions[sizes == n_frames]
+            curve_matrix = np.stack([curves[i] for i in rows])
 
-        # stimulus name at argmax() and argmin() of tuning curve
-        d[f"TUNE_MAX_{stim_type}"] = xs[np.argmax(ys)]
-        d[f"TUNE_MIN_{stim_type}"] = xs[np.argmin(ys)]
+            for stim_type in stim_types:
+                if stim_type not in sample_stim_maps.keys():
+                    continue
 
-    return pd.Series(d)
+                labels, xs = get_stimulus_labels(
+                    sample_stim_maps[stim_type], n_frames, start_offset, end_offset
+                )
+                ys = reduce_by_label(curve_matrix, labels, xs.size, method)
+
+                # stimulus names are only looked up at the end
+                maxs = xs[np.argmax(ys, axis=1)]
+                mins = xs[np.argmin(ys, axis=1)]
+
+                for j, i in enumerate(rows):
+                    out[f"TUNE_CURVE_{stim_type}_xlabels"][i] = xs
+                    out[f"_TUNE_CURVE_{stim_type}_yvals"][i] = ys[j]
+                    out[f"TUNE_MAX_{stim_type}"][i] = maxs[j]
+                    out[f"TUNE_MIN_{stim_type}"][i] = mins[j]
+
+    return pd.DataFrame(out, index=df.index, columns=columns)
 
 
 class ControlDock(QtWidgets.QDockWidget):
@@ -305,23 +406,17 @@ class TuningCurvesWidget(QtWidgets.QMainWindow, BasePlotWidget):
         start_offset = params['start_offset']
         end_offset = params['end_offset']
 
-        tqdm().pandas()
-
-        self.transmission.df[
-                    [f"TUNE_CURVE_{s}_xlabels" for s in self.transmission.STIM_DEFS] +
-                    [f"_TUNE_CURVE_{s}_yvals" for s in self.transmission.STIM_DEFS] +
-                    [f"TUNE_MAX_{s}" for s in self.transmission.STIM_DEFS] +
-                    [f"TUNE_MIN_{s}" for s in self.transmission.STIM_DEFS]
-                 ] = \
-            self.transmission.df.progress_apply(
-                lambda r: get_tuning_curves(
-                    curve=r[data_column],
-                    stim_maps=r['stim_maps'][0][0],
-                    method=method,
-                    start_offset=start_offset,
-                    end_offset=end_offset
-                ), axis=1
-            )
+        tuning_curves = get_tuning_curves_df(
+            self.transmission.df,
+            data_column=data_column,
+            stim_types=self.transmission.STIM_DEFS,
+            method=method,
+            start_offset=start_offset,
+            end_offset=end_offset
+        )
+
+        for c in tuning_curves.columns:
+            self.transmission.df[c] = tuning_curves[c]
 
         self.send_output_transmission()
 
@@ -17,11 +17,9 @@ adding rows to the root dataframe, updating child dataframes, and updating the p
 from PyQt5 import QtCore
 from ..common import configuration, project_config_window, start, get_window_manager, is_mesmerize_project
 # from ..common import get_window_manager
+from ..common.dataframe_journal import DataFrameJournal
 import os
 import pandas as pd
-from time import time
-from shutil import move as move_file
-from warnings import warn
 
 
 class ProjectManager(QtCore.QObject):
@@ -33,11 +31,16 @@ class ProjectManager(QtCore.QObject):
         self.root_dir = None
         self.dataframe = pd.DataFrame(data=None)
         self.child_dataframes = None
+        self.journal = None  # type: DataFrameJournal
+
+        # set when the latest change to the dataframe has already been written to the journal
+        self._change_journaled = False
 
     def set(self, project_root_dir: str):
         self.root_dir = project_root_dir
         configuration.proj_path = self.root_dir
         self.dataframe = pd.DataFrame(data=None)
+        self.journal = DataFrameJournal(os.path.join(self.root_dir, 'dataframes'))
         self.signal_dataframe_changed.connect(self.save_dataframe)
         self.child_dataframes = dict()
 
@@ -85,8 +88,9 @@ class ProjectManager(QtCore.QObject):
     def open_project(self):
         is_mesmerize_project(self.root_dir)
 
-        df_path = os.path.join(self.root_dir, 'dataframes', 'root.dfr')
-        self.dataframe = pd.read_hdf(df_path, key='project_dataframe', mode='r')
+        self.dataframe = self.journal.load()
+        if self.journal.needs_compaction():
+            self.journal.write_snapshot(self.dataframe)
 
         self._initialize_config_window()
 
@@ -129,12 +133,16 @@ class ProjectManager(QtCore.QObject):
         self.emit_signal_dataframe_changed()
 
     def save_dataframe(self):
-        df_path = os.path.join(self.root_dir, 'dataframes', 'root.dfr')
-        if os.path.isfile(df_path):
-            warn('root.dfr already exists, renaming file...')
-            self.backup_project_dataframe()
+        """
+        Save the project dataframe. Changes that were already written to the journal only trigger a compaction of
+        the journal when it has grown large, any other change writes a full snapshot.
+        """
+        if self._change_journaled:
+            self._change_journaled = False
+            if not self.journal.needs_compaction():
+                return
 
-        self.dataframe.to_hdf(df_path, key='project_dataframe', mode='w')
+        self.journal.write_snapshot(self.dataframe)
 
     def update_project_config_requested(self, custom_to_add: dict):
         if self.dataframe.empty:
@@ -172,7 +180,6 @@ class ProjectManager(QtCore.QObject):
             columns_changed = True
 
         if columns_changed:
-            self.backup_project_dataframe()
             self.dataframe.drop(columns=columns_to_drop, inplace=True)
             self.save_dataframe()
 
@@ -192,11 +199,14 @@ class ProjectManager(QtCore.QObject):
         widget.children()
 
     def backup_project_dataframe(self):
-        move_file(os.path.join(self.root_dir, 'dataframes', 'root.dfr'), os.path.join(self.root_dir, 'dataframes', f'root_bak_{time()}.dfr'))
+        self.journal.backup_snapshot()
 
     def append_to_dataframe(self, dicts_to_append: list):
-        self.backup_project_dataframe()
-        self.dataframe = self.dataframe.append(pd.DataFrame(dicts_to_append), ignore_index=True)
+        rows = pd.DataFrame(dicts_to_append)
+        self.journal.append_rows(rows)
+        self.dataframe = self.journal.apply(self.dataframe, 'append', rows)
+
+        self._change_journaled = True
         self.emit_signal_dataframe_changed()
 
     def emit_signal_dataframe_changed(self):
@@ -206,15 +216,19 @@ class ProjectManager(QtCore.QObject):
         """
         Remove the rows corresponding to the passed sample_id and replace them with the list of dicts provided
         """
-        # self.backup_project_dataframe()
-        # self.dataframe = self.dataframe[self.dataframe['SampleID'] != sample_id]
-        self.delete_sample_id_rows(sample_id)
-        self.dataframe = self.dataframe.append(pd.DataFrame(dicts_to_append), ignore_index=True)
+        # a single journal record so that the sample is never left with only its old rows removed
+        rows = pd.DataFrame(dicts_to_append)
+        self.journal.replace_sample(sample_id, rows)
+        self.dataframe = self.journal.apply(self.dataframe, 'replace_sample', (sample_id, rows))
+
+        self._change_journaled = True
         self.emit_signal_dataframe_changed()
 
     def delete_sample_id_rows(self, sample_id: str):
-        self.backup_project_dataframe()
-        self.dataframe = self.dataframe[self.dataframe['SampleID'] != sample_id]
+        self.journal.delete_sample(sample_id)
+        self.dataframe = self.journal.apply(self.dataframe, 'delete_sample', sample_id)
+
+        self._change_journaled = True
         self.emit_signal_dataframe_changed()
 
     def get_sample_id_rows(self, sample_id: str) -> pd.DataFrame:
@@ -4,6 +4,7 @@ from .common import *
 from ....analysis.data_types import *
 from ....analysis.stimulus_extraction import StimulusExtraction
 from ....plotting import TuningCurvesWidget
+from ....analysis.math.running_percentile import running_percentile
 
 
 class ExtractStim(CtrlNode):
@@ -115,6 +116,77 @@ class StaticDFoFo(CtrlNode):
         return d
 
 
+class RunningPercentileDFoF(CtrlNode):
+    """
+    Perform (F - Fo / Fo) where Fo is the running percentile of a sliding window.
+    The window is limited to the number of frames of the curves, the output of curves that contain NaNs is NaN.
+    """
+    nodeName = 'RunningPercentileDFoF'
+    uiTemplate = [('data_column', 'combo', {}),
+                  ('percentile', 'doubleSpin', {'min': 0.0, 'max': 100.0, 'step': 1.0, 'value': 8.0}),
+                  ('window', 'intSpin', {'min': 1, 'max': 999999, 'step': 10, 'value': 500}),
+                  ('output', 'combo', {'values': ['dF/Fo', 'F - Fo', 'Fo']}),
+                  ('Apply', 'check', {'checked': False, 'applyBox': True})
+                  ]
+
+    output_columns = {'dF/Fo': '_RUNNING_DF_O_F', 'F - Fo': '_RUNNING_DETREND', 'Fo': '_RUNNING_PERCENTILE'}
+
+    def processData(self, transmission: Transmission):
+        self.t = transmission
+        self.set_data_column_combo_box()
+
+        if not self.ctrls['Apply'].isChecked():
+            return
+
+        self.t = transmission.copy()
+
+        data_column = self.data_column
+        percentile = self.ctrls['percentile'].value()
+        window = self.ctrls['window'].value()
+        output = self.ctrls['output'].currentText()
+        output_column = self.output_columns[output]
+
+        params = {'data_column': data_column,
+                  'percentile': percentile,
+                  'window': window,
+                  'output': output,
+                  'units': self.t.last_unit
+                  }
+
+        curves = self.t.df[data_column].values
+        result = np.empty(len(curves), dtype=object)
+
+        # curves with the same number of frames are filtered together as one 2D array
+        lengths = np.array([c.size for c in curves])
+        for n_frames in np.unique(lengths):
+            ixs = np.flatnonzero(lengths == n_frames)
+            F = np.vstack(curves[ixs]).astype(np.float64)
+
+            # the running percentile is not defined for curves with NaNs
+            finite = ~np.isnan(F).any(axis=1)
+            Fo = np.full(F.shape, np.nan)
+            if finite.any():
+                Fo[finite] = running_percentile(F[finite], percentile, max(min(window, n_frames), 1))
+
+            if output == 'dF/Fo':
+                out = (F - Fo) / Fo
+            elif output == 'F - Fo':
+                out = F - Fo
+            else:
+                out = Fo
+
+            for ix, y in zip(ixs, out):
+                result[ix] = y
+
+        self.t.df[output_column] = result
+
+        self.t.history_trace.add_operation(data_block_id='all', operation='running_percentile_df_o_f',
+                                           parameters=params)
+        self.t.last_output = output_column
+
+        return self.t
+
+
 class ManualDFoF(CtrlNode):
     """Set Fo for dF/Fo using a particular time period. Useful for looking at stimulus responses"""
     nodeName = 'ManualDFoF'
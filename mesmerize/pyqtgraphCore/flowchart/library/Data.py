@@ -4,12 +4,16 @@ from spyder.widgets.variableexplorer.objecteditor import oedit
 from .common import *
 import traceback
 from ....analysis import Transmission
+from ....common.columnar_hdf import ColumnarHdf
+from ....common.utils import HdfTools
 from ....analysis.history_widget import HistoryTreeWidget
 from ....common import get_project_manager
 from ....common.qdialogs import *
 import os
 import pickle
+from copy import deepcopy
 from glob import glob
+import pandas as pd
 from ....common.configuration import HAS_TSLEARN
 if HAS_TSLEARN:
     from tslearn.preprocessing import TimeSeriesScalerMinMax
@@ -77,6 +81,9 @@ class LoadFile(CtrlNode):
     uiTemplate = [('load_trn', 'button', {'text': 'Open .trn File'}),
                   ('proj_trns', 'combo', {}),
                   ('fname', 'label', {'text': ''}),
+                  ('columns', 'list_widget', {'selection_mode': QtWidgets.QAbstractItemView.ExtendedSelection,
+                                              'toolTip': 'Only load the selected columns, loads all columns if\n'
+                                                         'none are selected. Available for version 2 .trn files.'}),
                   ('proj_path', 'button', {'text': 'Project Path'}),
                   ('proj_path_label', 'label', {'text': ''})
                   ]
@@ -85,9 +92,19 @@ class LoadFile(CtrlNode):
         CtrlNode.__init__(self, name, terminals={'Out': {'io': 'out'}})
         self.ctrls['load_trn'].clicked.connect(lambda: self.load_file())
         self.ctrls['proj_path'].clicked.connect(self.dir_dialog_proj_path)
+        self.ctrls['columns'].itemSelectionChanged.connect(self._columns_changed)
 
         self.t = None
         self._loadNode = True
+        self._path = None
+        self._proj_path = None
+
+        # columns are only read from the file when they are needed, and kept once read
+        self._all_columns = []
+        self._column_cache = {}
+        self._index = None
+        self._meta = None
+        self._loaded_columns = None
 
         proj_path = get_project_manager().root_dir
         
@@ -108,25 +125,68 @@ class LoadFile(CtrlNode):
         if not path:
             return
         try:
-            self.t = Transmission.from_hdf5(path)
+            self._open(path)
         except:
             QtWidgets.QMessageBox.warning(None, 'File open Error!', 'Could not open the chosen file.\n' + traceback.format_exc())
             return
 
         self.ctrls['fname'].setText(os.path.basename(path))
 
-        proj_path = get_project_manager().root_dir
+        # print(self.transmission)
+        # self.update()
+        self.changed()
+
+    def _open(self, path: str):
+        """Read the column names, index & meta data of the file. The columns are read in process()."""
+        self._column_cache = {}
+        self._loaded_columns = None
+        self.t = None
+
+        if ColumnarHdf.is_columnar(path):
+            df, self._meta = ColumnarHdf.load_dataframe(path, columns=[])
+            self._all_columns = ColumnarHdf.get_columns(path)
+            self.ctrls['columns'].setItems(self._all_columns)
+        else:
+            # version 1 files can only be read whole
+            df, self._meta = HdfTools.load_dataframe(path)
+            self._all_columns = list(df.columns)
+            self._column_cache = {c: df[c].values for c in df.columns}
+            self.ctrls['columns'].setItems([])
+
+        self._index = df.index
+        self._path = path
+
+    def _load_columns(self):
+        """Create the Transmission with only the selected columns of the DataFrame"""
+        columns = self.ctrls['columns'].getSelectedItems()
+        if len(columns) == 0:
+            columns = self._all_columns
+
+        # only the columns that have not been read before
+        missing = [c for c in columns if c not in self._column_cache.keys()]
+        if len(missing) > 0:
+            df, _ = ColumnarHdf.load_dataframe(self._path, columns=missing, metadata=False)
+            self._column_cache.update({c: df[c].values for c in missing})
+
+        df = pd.DataFrame({c: self._column_cache[c] for c in columns}, index=self._index, columns=columns)
+        self.t = Transmission(df, **deepcopy(self._meta))
+        self._loaded_columns = columns
+
+        proj_path = self._proj_path if self._proj_path is not None else get_project_manager().root_dir
         if proj_path is not None:
             self._set_proj_path(proj_path)
 
-        # print(self.transmission)
-        # self.update()
+    def _columns_changed(self):
+        if self._path is None:
+            return
+
         self.changed()
 
     def _set_proj_path(self, path: str):
         self.ctrls['proj_path_label'].setText(os.path.basename(path))
         self.t.set_proj_path(path)
         self.t.set_proj_config()
+        self._proj_path = path
 
     def dir_dialog_proj_path(self):
         path = QtWidgets.QFileDialog.getExistingDirectory(None, 'Select Project Folder')
@@ -135,13 +195,26 @@ class LoadFile(CtrlNode):
             return
 
         try:
-            self._set_proj_path(path)
+            if self.t is None and self._path is not None:
+                self._load_columns()
+            if self.t is not None:
+                self._set_proj_path(path)
+            else:
+                self._proj_path = path
+                self.ctrls['proj_path_label'].setText(os.path.basename(path))
             self.changed()
         except (FileNotFoundError, NotADirectoryError) as e:
             QtWidgets.QMessageBox.warning(None, 'Invalid Project Folder', 'This is not a valid Mesmerize project\n' + e)
             return
 
     def process(self):
+        if self._path is None:
+            return {'Out': None}
+
+        columns = self.ctrls['columns'].getSelectedItems()
+        if self.t is None or (columns or self._all_columns) != self._loaded_columns:
+            self._load_columns()
+
         return {'Out': self.t}
 
 
@@ -476,9 +549,11 @@ class NormRaw(CtrlNode):
             raw_min_max = roi_state['raw_min_max']
 
         else:
+            from ....viewer.modules.roi_manager_modules.roi_store import columns_to_states
+
             cnmf_idx = roi_state['cnmf_idx']
             img_info_path = os.path.join(self.proj_path, img_info_path)
-            roi_states = pickle.load(open(img_info_path, 'rb'))['roi_states']
+            roi_states = columns_to_states(pickle.load(open(img_info_path, 'rb'))['roi_states'])
 
             idx_components = roi_states['cnmf_output']['idx_components']
 
@@ -13,9 +13,19 @@ import ctypes
 import sys, struct
 from .python2_3 import asUnicode, basestring
 from .Qt import QtGui, QtCore, USE_PYSIDE
-from . import getConfigOption, setConfigOptions
+from . import getConfigOption
 from . import debug
 
+try:
+    from . import functions_numba
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+
+def _numbaAvailable():
+    return HAVE_NUMBA and getConfigOption('useNumba')
+
 
 
 Colors = {
@@ -826,61 +836,26 @@ def rescaleData(data, scale, offset, dtype=None, clip=None):
         dtype = data.dtype
     else:
         dtype = np.dtype(dtype)
+
+    if _numbaAvailable():
+        return functions_numba.rescaleData(data, scale, offset, dtype, clip)
+
+    # a single temporary, the operations below are done in place
+    d2 = data - float(offset)
+    d2 *= scale
     
-    try:
-        if not getConfigOption('useWeave'):
-            raise Exception('Weave is disabled; falling back to slower version.')
-        try:
-            import scipy.weave
-        except ImportError:
-            raise Exception('scipy.weave is not importable; falling back to slower version.')
-        
-        ## require native dtype when using weave
-        if not data.dtype.isnative:
-            data = data.astype(data.dtype.newbyteorder('='))
-        if not dtype.isnative:
-            weaveDtype = dtype.newbyteorder('=')
+    # Clip before converting dtype to avoid overflow
+    if dtype.kind in 'ui':
+        lim = np.iinfo(dtype)
+        if clip is None:
+            # don't let rescale cause integer overflow
+            np.clip(d2, lim.min, lim.max, out=d2)
         else:
-            weaveDtype = dtype
-        
-        newData = np.empty((data.size,), dtype=weaveDtype)
-        flat = np.ascontiguousarray(data).reshape(data.size)
-        size = data.size
-        
-        code = """
-        double sc = (double)scale;
-        double off = (double)offset;
-        for( int i=0; i<size; i++ ) {
-            newData[i] = ((double)flat[i] - off) * sc;
-        }
-        """
-        scipy.weave.inline(code, ['flat', 'newData', 'size', 'offset', 'scale'], compiler='gcc')
-        if dtype != weaveDtype:
-            newData = newData.astype(dtype)
-        data = newData.reshape(data.shape)
-    except:
-        if getConfigOption('useWeave'):
-            if getConfigOption('weaveDebug'):
-                debug.printExc("Error; disabling weave.")
-            setConfigOptions(useWeave=False)
-        
-        #p = np.poly1d([scale, -offset*scale])
-        #d2 = p(data)
-        d2 = data - float(offset)
-        d2 *= scale
-        
-        # Clip before converting dtype to avoid overflow
-        if dtype.kind in 'ui':
-            lim = np.iinfo(dtype)
-            if clip is None:
-                # don't let rescale cause integer overflow
-                d2 = np.clip(d2, lim.min, lim.max)
-            else:
-                d2 = np.clip(d2, max(clip[0], lim.min), min(clip[1], lim.max))
-        else:
-            if clip is not None:
-                d2 = np.clip(d2, *clip)
-        data = d2.astype(dtype)
+            np.clip(d2, max(clip[0], lim.min), min(clip[1], lim.max), out=d2)
+    else:
+        if clip is not None:
+            np.clip(d2, *clip, out=d2)
+    data = d2.astype(dtype)
     return data
     
 def applyLookupTable(data, lut):
@@ -902,7 +877,7 @@ def makeRGBA(*args, **kwds):
     return makeARGB(*args, **kwds)
 
 
-def makeARGB(data, lut=None, levels=None, scale=None, useRGBA=False): 
+def makeARGB(data, lut=None, levels=None, scale=None, useRGBA=False, output=None): 
     """ 
     Convert an array of values into an ARGB array suitable for building QImages,
     OpenGL textures, etc.
@@ -940,7 +915,12 @@ def makeARGB(data, lut=None, levels=None, scale=None, useRGBA=False):
                    The default is False, which returns in ARGB order for use with QImage 
                    (Note that 'ARGB' is a term used by the Qt documentation; the *actual* order 
                    is BGRA).
+    output         Optional C-contiguous ubyte array of shape data.shape[:2] + (4,) that the result is 
+                   written into, so that the same buffer can be reused for every frame.
     ============== ==================================================================================
+
+    If numba is available, 2D data with 1D levels and a ubyte lookup table (or no lookup table) are rescaled, 
+    looked up and written into the output in a single pass without any temporary arrays.
     """
     profile = debug.Profiler()
 
@@ -985,6 +965,31 @@ def makeARGB(data, lut=None, levels=None, scale=None, useRGBA=False):
         else:
             scale = 255.
 
+    if output is None:
+        output = np.empty(data.shape[:2] + (4,), dtype=np.ubyte)
+    elif output.shape != data.shape[:2] + (4,) or output.dtype != np.ubyte or not output.flags['C_CONTIGUOUS']:
+        raise ValueError('output must be a C-contiguous ubyte array of shape data.shape[:2] + (4,)')
+
+    if data.ndim == 2 and levels.ndim == 1 and data.dtype.kind in 'uif' and \
+            (lut is None or (lut.dtype == np.ubyte and (lut.ndim == 1 or lut.shape[1] in (1, 3, 4)))):
+        minVal, maxVal = levels
+        rescale = minVal != 0 or maxVal != scale
+        if minVal == maxVal:
+            maxVal += 1e-16
+
+        if _numbaAvailable() or (not rescale and data.dtype.kind in 'ui'):
+            lut32, alpha = _packLut32(lut, useRGBA)
+            out32 = output.view(np.uint32).reshape(data.shape)
+
+            if _numbaAvailable():
+                functions_numba.makeARGB(data, lut32, rescale, minVal, scale/(maxVal-minVal), output)
+            else:
+                # the data are already lookup table indices, a single gather without temporaries
+                np.take(lut32, data, axis=0, mode='clip', out=out32)
+
+            profile()
+            return output, alpha
+
     # Decide on the dtype we want after scaling
     if lut is None:
         dtype = np.ubyte
@@ -1025,7 +1030,7 @@ def makeARGB(data, lut=None, levels=None, scale=None, useRGBA=False):
     profile()
 
     # this will be the final image array
-    imgData = np.empty(data.shape[:2]+(4,), dtype=np.ubyte)
+    imgData = output
 
     profile()
 
@@ -1062,6 +1067,32 @@ def makeARGB(data, lut=None, levels=None, scale=None, useRGBA=False):
     return imgData, alpha
 
 
+def _packLut32(lut, useRGBA):
+    """
+    Pack a ubyte lookup table of shape (N,), (N, 1), (N, 3) or (N, 4), or None for a grayscale 0 - 255 ramp, into a
+    uint32 table where each entry holds the 4 output bytes of one color in the final channel order.
+    Returns (lut32, alpha).
+    """
+    if lut is None:
+        lut = np.arange(256, dtype=np.ubyte)
+    if lut.ndim == 2 and lut.shape[1] == 1:
+        lut = lut[:, 0]
+
+    lut4 = np.empty((lut.shape[0], 4), dtype=np.ubyte)
+    lut4[:, 3] = 255
+
+    if lut.ndim == 1:
+        lut4[:, :3] = lut[:, np.newaxis]
+        alpha = False
+    else:
+        order = [0, 1, 2, 3] if useRGBA else [2, 1, 0, 3]
+        for i in range(lut.shape[1]):
+            lut4[:, i] = lut[:, order[i]]
+        alpha = lut.shape[1] == 4
+
+    return lut4.view(np.uint32).reshape(lut.shape[0]), alpha
+
+
 def makeQImage(imgData, alpha=None, copy=True, transpose=True):
     """
     Turn an ARGB array into QImage.
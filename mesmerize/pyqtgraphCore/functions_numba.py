@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+functions_numba.py -  numba kernels for the image rendering functions in functions.py
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+Importing this module raises ImportError if numba is not available, functions.py then uses its numpy implementations.
+"""
+
+import numpy as np
+import numba
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def _rescale(flat, out, offset, scale, lo, hi, do_clip):
+    for i in range(flat.size):
+        v = (np.float64(flat[i]) - offset) * scale
+        if do_clip:
+            if v < lo:
+                v = lo
+            elif v > hi:
+                v = hi
+        out[i] = v
+
+
+def rescaleData(data, scale, offset, dtype, clip):
+    """
+    Same as the numpy implementation of :func:`rescaleData <pyqtgraph.rescaleData>`, but without temporary arrays.
+    *dtype* must be a numpy dtype and *clip* a (min, max) tuple or None.
+    """
+    out = np.empty(data.shape, dtype=dtype.newbyteorder('='))
+    flat = np.ascontiguousarray(data).reshape(-1)
+    if not flat.dtype.isnative:
+        flat = flat.astype(flat.dtype.newbyteorder('='))
+
+    if dtype.kind in 'ui':
+        lim = np.iinfo(dtype)
+        if clip is None:
+            lo, hi = lim.min, lim.max
+        else:
+            lo, hi = max(clip[0], lim.min), min(clip[1], lim.max)
+        do_clip = True
+    elif clip is not None:
+        lo, hi = clip
+        do_clip = True
+    else:
+        lo, hi = 0., 0.
+        do_clip = False
+
+    _rescale(flat, out.reshape(-1), float(offset), float(scale), float(lo), float(hi), do_clip)
+
+    if out.dtype != dtype:
+        out = out.astype(dtype)
+    return out
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def _lookup_index(v, rescale, offset, scale, n):
+    if rescale:
+        x = (v - offset) * scale
+    else:
+        x = np.float64(v)
+
+    if not (x > 0.):
+        # also catches nan
+        return 0
+    if x >= n - 1:
+        return n - 1
+    return int(x)
+
+
+@numba.jit(nopython=True, nogil=True, parallel=True, cache=True)
+def _lookup32(data, out, rescale, offset, scale, lut):
+    n = lut.shape[0]
+    for i in numba.prange(data.shape[0]):
+        for j in range(data.shape[1]):
+            out[i, j] = lut[_lookup_index(data[i, j], rescale, offset, scale, n)]
+
+
+def makeARGB(data, lut32, rescale, offset, scale, output):
+    """
+    Fused rescale + lookup for 2D data, see :func:`makeARGB <pyqtgraph.makeARGB>`.
+
+    *lut32* is the lookup table with each (b, g, r, a) color packed into a uint32, as made by
+    ``functions._packLut32``, so that every pixel is a single 4 byte write into *output*.
+    *output* must be a C-contiguous ubyte array of shape data.shape + (4,).
+    """
+    if not data.dtype.isnative:
+        data = data.astype(data.dtype.newbyteorder('='))
+
+    if data.dtype == np.float32:
+        # same float32 arithmetic as the numpy implementation
+        offset, scale = np.float32(offset), np.float32(scale)
+    else:
+        offset, scale = float(offset), float(scale)
+
+    out32 = output.view(np.uint32).reshape(data.shape)
+    _lookup32(data, out32, rescale, offset, scale, lut32)
+    return output
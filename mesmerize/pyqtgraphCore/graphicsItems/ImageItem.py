@@ -3,6 +3,7 @@ from __future__ import division
 from ..Qt import QtGui, QtCore
 import numpy as np
 import collections
+import sys
 from .. import functions as fn
 from .. import debug as debug
 from .GraphicsObject import GraphicsObject
@@ -53,6 +54,7 @@ class ImageItem(GraphicsObject):
         # In some cases, we use a modified lookup table to handle both rescaling
         # and LUT more efficiently
         self._effectiveLut = None
+        self._argbBuffer = None  ## reused by render() for every frame of the same shape
         
         self.drawKernel = None
         self.border = None
@@ -400,8 +402,19 @@ class ImageItem(GraphicsObject):
         if self.axisOrder == 'col-major':
             image = image.transpose((1, 0, 2)[:image.ndim])
         
-        argb, alpha = fn.makeARGB(image, lut=lut, levels=levels)
-        self.qimage = fn.makeQImage(argb, alpha, transpose=False)
+        shape = image.shape[:2] + (4,)
+
+        # drop the previous QImage before its buffer is written
+        self.qimage = None
+
+        # The QImage points into the buffer without copying it and keeps a reference to it. The buffer is only reused
+        # if no QImage from a previous render() is still held elsewhere, otherwise a new buffer is used so that the
+        # image that is held doesn't change. getrefcount() counts self._argbBuffer and its own argument.
+        if self._argbBuffer is None or self._argbBuffer.shape != shape or sys.getrefcount(self._argbBuffer) > 2:
+            self._argbBuffer = np.empty(shape, dtype=np.ubyte)
+
+        argb, alpha = fn.makeARGB(image, lut=lut, levels=levels, output=self._argbBuffer)
+        self.qimage = fn.makeQImage(argb, alpha, copy=False, transpose=False)
 
     def paint(self, p, *args):
         profile = debug.Profiler()
@@ -252,7 +252,7 @@ class ImageView(QtWidgets.QWidget):
 
         if self.export_gui.comboBoxFormat.currentText() == 'tiff':
             try:
-                export.Exporter(self.workEnv.imgdata, path + '.tiff')
+                export.Exporter(self.workEnv.imgdata, path + '.tiff', **self.export_gui.get_export_kwargs())
             except Exception as e:
                 QtWidgets.QMessageBox.warning(self, 'Export Error', 'The following error occured while exporting the work '
                                                                 'environment: \n' + str(e))
@@ -277,7 +277,8 @@ class ImageView(QtWidgets.QWidget):
             imgdata_to_export = self.workEnv.imgdata.seq
 
         try:
-            export.Exporter(imgdata_to_export, path + ex, levels=histLevels, fps=f)
+            export.Exporter(imgdata_to_export, path + ex, levels=histLevels, fps=f,
+                            **self.export_gui.get_export_kwargs())
         except Exception as e:
             QtWidgets.QMessageBox.warning(self, 'Export Error', 'The following error occured while exporting the work '
                                                             'environment: \n' + str(e))
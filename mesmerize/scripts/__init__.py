@@ -1,4 +1,6 @@
 __all__ = \
 [
-    'create_lite_project'
+    'create_lite_project',
+    'project_dfof',
+    'bulk_import'
 ]
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Import many tiff files, with their meta data and ROIs, into a project without the viewer.
+
+The files are listed in a manifest, a CSV file or a JSON file with a list of objects, with one entry per file:
+
+=============   ========================================================================================================
+Key             Description
+=============   ========================================================================================================
+tiff_path       path to the tiff file, required
+animal_id       AnimalID of the sample, required
+trial_id        TrialID of the sample, required. The SampleID is ``<animal_id>-_-<trial_id>``
+meta_path       path to the meta data file
+meta_format     function in ``viewer.core.organize_metadata`` that reads the meta data file, such as ``json_minimal``
+fps             sampling rate, if there is no meta data file or meta_format
+date            date as "YYYYMMDD_HHMMSS", if there is no meta data file
+axes_order      axes order of the tiff file, same as for the Tiff File module, such as "txy"
+roi_source      'suite2p' or 'npz', required
+roi_path        Suite2p output dir, or ``.npz`` file with the arrays ``curves`` [n_rois, n_frames], ``roi_xs`` and
+                ``roi_ys`` (coordinates of each ROI)
+Fneu_sub        fraction of the Suite2p neuropil that is subtracted, default is 0.7
+use_iscell      only import ROIs that Suite2p classified as cells, default is True
+comments        comments for the sample
+=============   ========================================================================================================
+
+Any other keys that are custom columns in the project config are set as the values of those columns.
+Relative paths are relative to the manifest's dir.
+
+Files are processed in a process pool, each worker writes the image sequence, the max & std projections, the
+pickle and the curves of a sample into the project, same as "Add to project" in the viewer. The rows of each sample
+are added to the project dataframe as a single journal record as soon as its files are written, so the dataframe
+never has the rows of only part of a sample. The tiff path of each sample is kept in the ``misc`` of its rows, so if
+an import is interrupted it continues from where it stopped when it's run again with the same manifest. Files of
+samples that were written when the import was interrupted, but whose rows were not added, are removed first.
+
+The project should not be open in Mesmerize while this runs, since saving the project dataframe from Mesmerize would
+overwrite the imported rows.
+
+Usage::
+
+    mesmerize import <proj_dir> <manifest> [n_processes]
+"""
+
+import os
+import re
+import json
+from shutil import rmtree
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import time
+from typing import *
+import numpy as np
+import pandas as pd
+from ..common import get_proj_config
+from ..common.configuration import get_sys_config
+from ..common.dataframe_journal import DataFrameJournal
+from ..viewer.core.viewer_work_environment import ViewerWorkEnv
+
+
+#: Key in the ``misc`` of the imported rows with the path of the tiff file
+SOURCE_KEY = 'bulk_import_source'
+
+#: Keys of a manifest entry that are not custom columns
+MANIFEST_KEYS = ['tiff_path', 'animal_id', 'trial_id', 'meta_path', 'meta_format', 'fps', 'date', 'axes_order',
+                 'roi_source', 'roi_path', 'Fneu_sub', 'use_iscell', 'comments']
+
+
+class _ROIStates:
+    """Stands in for the ROI Manager of the work environment, gives the ROI states that were read from a ROI source"""
+    def __init__(self, states: dict):
+        self.states = states
+
+    def is_empty(self) -> bool:
+        return len(self.states['states']) == 0
+
+    def get_all_states(self) -> dict:
+        # to_pandas() changes the tags of the states
+        return {**self.states, 'states': [{**s, 'tags': dict(s['tags'])} for s in self.states['states']]}
+
+
+def read_manifest(path: str) -> List[dict]:
+    """
+    Read a CSV or JSON manifest, relative paths are made absolute
+
+    :param path: path to the manifest
+    :return:     list of entries
+    """
+    if path.endswith('.json'):
+        with open(path, 'r') as f:
+            entries = json.load(f)
+    else:
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        entries = [{k: v for k, v in r.items() if v != ''} for r in df.to_dict('records')]
+
+    manifest_dir = os.path.dirname(os.path.abspath(path))
+
+    for entry in entries:
+        for k in ['tiff_path', 'meta_path', 'roi_path']:
+            if entry.get(k, None) is not None:
+                entry[k] = os.path.abspath(os.path.join(manifest_dir, entry[k]))
+
+        missing = [k for k in ['tiff_path', 'animal_id', 'trial_id', 'roi_source'] if k not in entry.keys()]
+        if len(missing) > 0:
+            raise KeyError(f'Manifest entry is missing: {missing}\n{entry}')
+
+    return entries
+
+
+def _to_bool(v) -> bool:
+    if isinstance(v, str):
+        return v.strip().lower() in ('1', 'true', 'yes')
+    return bool(v)
+
+
+def _blank_state(roi_xs: np.ndarray, roi_ys: np.ndarray, curve: np.ndarray, roi_defs: List[str]) -> dict:
+    """State of a ScatterROI, same as ``ScatterROI.to_state()``"""
+    return {
+        'roi_xs':       np.asarray(roi_xs).astype(int),
+        'roi_ys':       np.asarray(roi_ys).astype(int),
+        'curve_data':   [np.arange(curve.size), curve],
+        'spike_data':   None,
+        'dfof_data':    None,
+        'tags':         dict.fromkeys(roi_defs, ''),
+        'roi_type':     'ScatterROI'
+    }
+
+
+def read_suite2p_rois(path: str, roi_defs: List[str], fneu_sub: float = 0.7,
+                      use_iscell: bool = True) -> Tuple[dict, dict]:
+    """
+    ROI states from Suite2p output, same as the Suite2p importer module
+
+    :param path:        Suite2p output dir
+    :param roi_defs:    ROI_DEFS of the project
+    :param fneu_sub:    fraction of the neuropil that is subtracted
+    :param use_iscell:  only ROIs that Suite2p classified as cells
+    :return:            ROI Manager states, history trace entry
+    """
+    from ..viewer.modules.suite2p import Suite2pData, get_all_vertices
+
+    data = Suite2pData()
+    data.set_dir(path)
+
+    F, Fneu, stat, iscell = data.F, data.Fneu, data.stat, data.iscell
+
+    if use_iscell:
+        mask = iscell[:, 0] == 1
+        F, Fneu, stat, iscell = F[mask], Fneu[mask], stat[mask], iscell[mask]
+
+    Fc = F - (fneu_sub * Fneu)
+    xs, ys = get_all_vertices(stat)
+
+    states = [_blank_state(x, y, curve, roi_defs) for x, y, curve in zip(xs, ys, Fc)]
+
+    if 's2p_iscell' in roi_defs:
+        for state, (is_cell, probability) in zip(states, iscell):
+            state['tags']['s2p_iscell'] = f"{int(is_cell)} | {probability}"
+
+    rois = {'roi_type': 'ScatterROI', 'states': states, 'metadata': list(stat)}
+    log = {'suite_2p_import': {'Fneu_subtraction': fneu_sub, 'ops': data.ops}}
+
+    return rois, log
+
+
+def read_npz_rois(path: str, roi_defs: List[str]) -> Tuple[dict, dict]:
+    """
+    ROI states from an ``.npz`` file with the arrays ``curves``, ``roi_xs`` and ``roi_ys``
+
+    :param path:        path to the npz file
+    :param roi_defs:    ROI_DEFS of the project
+    :return:            ROI Manager states, history trace entry
+    """
+    npz = np.load(path, allow_pickle=True)
+
+    curves = np.atleast_2d(npz['curves'])
+    roi_xs, roi_ys = npz['roi_xs'], npz['roi_ys']
+
+    if not len(curves) == len(roi_xs) == len(roi_ys):
+        raise ValueError(f'curves, roi_xs and roi_ys must have the same number of ROIs: {path}')
+
+    states = [_blank_state(x, y, curve, roi_defs) for x, y, curve in zip(roi_xs, roi_ys, curves)]
+
+    rois = {'roi_type': 'ScatterROI', 'states': states, 'metadata': None}
+    log = {'npz_roi_import': {'path': path}}
+
+    return rois, log
+
+
+def import_sample(proj_path: str, entry: dict) -> List[dict]:
+    """
+    Write the files of one sample into the project, run in a worker process
+
+    :param proj_path:   project dir
+    :param entry:       manifest entry
+    :return:            rows for the project dataframe, same as ``ViewerWorkEnv.to_pandas()``
+    """
+    proj_cfg = get_proj_config(proj_path)
+    roi_defs = proj_cfg.options('ROI_DEFS')
+    custom_columns = proj_cfg.options('CUSTOM_COLUMNS')
+
+    work_env = ViewerWorkEnv.from_tiff(
+        entry['tiff_path'],
+        method='imread',
+        meta_path=entry.get('meta_path', None),
+        axes_order=entry.get('axes_order', None),
+        meta_format=entry.get('meta_format', None)
+    )
+
+    # from_tiff() only reads the meta data if both are given
+    if entry.get('meta_path', None) is None or entry.get('meta_format', None) is None:
+        if entry.get('fps', None) is None:
+            raise KeyError('Manifest entry must have a meta_path and meta_format, or an fps')
+
+        work_env.imgdata.meta = {
+            'origin': 'bulk_import',
+            'fps': float(entry['fps']),
+            'date': entry.get('date', 'unknown'),
+            'orig_meta': None
+        }
+
+    if entry['roi_source'] == 'suite2p':
+        rois, log = read_suite2p_rois(
+            entry['roi_path'],
+            roi_defs,
+            fneu_sub=float(entry.get('Fneu_sub', 0.7)),
+            use_iscell=_to_bool(entry.get('use_iscell', True))
+        )
+    elif entry['roi_source'] == 'npz':
+        rois, log = read_npz_rois(entry['roi_path'], roi_defs)
+    else:
+        raise ValueError(f"Invalid roi_source: {entry['roi_source']}, must be one of 'suite2p' or 'npz'")
+
+    if len(rois['states']) == 0:
+        raise ValueError(f"No ROIs found in: {entry['roi_path']}")
+
+    work_env.sample_id = f"{entry['animal_id']}-_-{entry['trial_id']}"
+    work_env.roi_manager = _ROIStates(rois)
+    work_env.history_trace.append(log)
+    work_env.comments = entry.get('comments', '')
+    work_env.custom_cols = {k: v for k, v in entry.items() if k in custom_columns}
+    work_env.misc = {SOURCE_KEY: entry['tiff_path']}
+
+    return work_env.to_pandas(proj_path)
+
+
+def get_imported(dataframe: pd.DataFrame) -> Set[str]:
+    """Tiff paths of the samples in the project dataframe that were added by a bulk import"""
+    if 'misc' not in dataframe.columns:
+        return set()
+
+    return {m[SOURCE_KEY] for m in dataframe['misc'] if isinstance(m, dict) and SOURCE_KEY in m.keys()}
+
+
+def remove_incomplete(proj_path: str, sample_ids: Iterable[str]) -> List[str]:
+    """
+    Remove the files of samples that are not in the project dataframe, left by an import that was interrupted after
+    they were written and before their rows were added.
+
+    :param proj_path:   project dir
+    :param sample_ids:  SampleIDs that are not in the project dataframe
+    :return:            paths of the removed files and dirs
+    """
+    # files & dirs are named <SampleID>-_-<UUID>, with an extension or suffix for the files
+    patterns = [re.compile(re.escape(sample_id) + r'-_-[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}(\W|_|$)')
+                for sample_id in sample_ids]
+
+    removed = []
+    for d in ['images', 'curves']:
+        dir_path = os.path.join(proj_path, d)
+        if not os.path.isdir(dir_path):
+            continue
+
+        for name in os.listdir(dir_path):
+            if not any(p.match(name) for p in patterns):
+                continue
+
+            path = os.path.join(dir_path, name)
+            if os.path.isdir(path):
+                rmtree(path)
+            else:
+                os.remove(path)
+            removed.append(path)
+
+    return removed
+
+
+def bulk_import(proj_path: str, manifest_path: str, n_processes: Optional[int] = None) -> Dict[str, Exception]:
+    """
+    Import the files of a manifest into a project, files that have already been imported are skipped.
+
+    :param proj_path:       project dir
+    :param manifest_path:   path to a CSV or JSON manifest, see the module docstring
+    :param n_processes:     number of worker processes, default is the number of threads from the system config
+    :return:                tiff paths of the entries that failed and their exceptions
+    """
+    proj_path = os.path.abspath(proj_path)
+
+    if n_processes is None:
+        n_processes = get_sys_config()['_MESMERIZE_N_THREADS']
+
+    custom_columns = get_proj_config(proj_path).options('CUSTOM_COLUMNS')
+
+    entries = read_manifest(manifest_path)
+
+    for k in set().union(*[e.keys() for e in entries]).difference(MANIFEST_KEYS + custom_columns):
+        print(f'Ignoring manifest column that is not a custom column in the project config: {k}')
+
+    journal = DataFrameJournal(os.path.join(proj_path, 'dataframes'))
+    dataframe = journal.load()
+
+    imported = get_imported(dataframe)
+    sample_ids = set(dataframe['SampleID']) if 'SampleID' in dataframe.columns else set()
+
+    todo = [e for e in entries if e['tiff_path'] not in imported]
+    print(f'{len(entries) - len(todo)} of {len(entries)} files have already been imported')
+
+    failed = {}
+    for e in todo:
+        sample_id = f"{e['animal_id']}-_-{e['trial_id']}"
+        if sample_id in sample_ids:
+            failed[e['tiff_path']] = ValueError(f'SampleID already exists in the project: {sample_id}')
+        sample_ids.add(sample_id)
+
+    todo = [e for e in todo if e['tiff_path'] not in failed.keys()]
+
+    removed = remove_incomplete(proj_path, [f"{e['animal_id']}-_-{e['trial_id']}" for e in todo])
+    if len(removed) > 0:
+        print(f'Removed {len(removed)} files of samples from an import that was interrupted')
+
+    n_done = 0
+    t0 = time()
+
+    with ProcessPoolExecutor(max_workers=max(int(n_processes), 1)) as pool:
+        futures = {pool.submit(import_sample, proj_path, e): e['tiff_path'] for e in todo}
+
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                rows = future.result()
+            except Exception as e:
+                print(f'Could not import: {path}\n{e}')
+                failed[path] = e
+                continue
+
+            journal.append_rows(pd.DataFrame(rows))
+            n_done += 1
+
+            if n_done % 10 == 0:
+                print(f'{n_done} / {len(todo)} files imported')
+
+    if journal.needs_compaction():
+        journal.write_snapshot(journal.load())
+
+    print(f'Done in {time() - t0:.1f} seconds, {n_done} files imported, {len(failed)} failed')
+
+    return failed
+
+
+def main(proj_dir: str, manifest_path: str, n_processes: Optional[int] = None):
+    bulk_import(proj_dir, manifest_path, n_processes=n_processes)
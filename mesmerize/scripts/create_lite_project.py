@@ -8,14 +8,176 @@ Sars International Centre for Marine Molecular Biology
 
 GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
 
-A back-end module for managing most project related functions, such as the root dataframe and all children,
-adding rows to the root dataframe, updating child dataframes, and updating the project configuration.
+Create a lite copy of a project, without the raw image sequences, that can be used for analysis.
+
+The lite project has the project config, the dataframes, the curves, the ImgInfoPath pickles and the max & std
+projections of the image sequences, along with the flowcharts, transmissions and plots. The image sequences and the
+batches are not copied. Files are copied in a thread pool. The curves and the projections, which Mesmerize never
+modifies in place, are hard linked instead when the destination is on the same file system, other files such as the
+dataframes, the config and the pickles are always copied so that using the lite project never writes into the
+project. Running it again on the same destination only copies the files that have changed since.
+
+Usage::
+
+    mesmerize lighten <proj_dir> <dest_dir> [n_workers]
 """
 
+import os
 from shutil import copy2
 from glob import glob
+from fnmatch import fnmatch
 from os import makedirs
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import time
+from typing import *
+
+
+#: Project subdirectories that are copied with all their contents
+FULL_DIRS = ['dataframes', 'curves', 'flowcharts', 'trns', 'plots']
+
+#: Patterns of the files in the images dir that are copied, relative to the images dir
+IMAGE_PATTERNS = ['*.pik', '*_max_proj*.tiff', '*_std_proj*.tiff']
+
+#: Project subdirectories that are created empty
+EMPTY_DIRS = ['images', 'batches']
+
+#: Patterns of the files that are never modified in place, relative to the project dir. Only these are hard linked.
+LINK_PATTERNS = [
+    os.path.join('curves', '*.npz'),
+    os.path.join('images', '*_max_proj*.tiff'),
+    os.path.join('images', '*_std_proj*.tiff')
+]
+
+#: Number of threads that copy files
+N_WORKERS = 8
+
+
+def get_lite_files(proj_dir: str) -> List[str]:
+    """
+    Paths of the files that belong in the lite project, relative to the project dir
+
+    :param proj_dir: project dir
+    """
+    paths = []
+
+    if os.path.isfile(os.path.join(proj_dir, 'config.cfg')):
+        paths.append('config.cfg')
+
+    for d in FULL_DIRS:
+        for root, dirs, files in os.walk(os.path.join(proj_dir, d)):
+            paths += [os.path.relpath(os.path.join(root, f), proj_dir) for f in files]
+
+    images_dir = os.path.join(proj_dir, 'images')
+    for pattern in IMAGE_PATTERNS:
+        paths += [os.path.relpath(p, proj_dir) for p in glob(os.path.join(images_dir, pattern))]
+
+    return sorted(set(paths))
+
+
+def can_link(path: str) -> bool:
+    """If a file can be hard linked since it is never modified in place, ``path`` is relative to the project dir"""
+    return any(fnmatch(path, pattern) for pattern in LINK_PATTERNS)
+
+
+def is_up_to_date(src: str, dst: str, link: bool = True) -> bool:
+    """
+    If ``dst`` is a hard link to ``src``, or a copy with the same size and modification time
+
+    :param link:    if a hard link is up to date, a hard link to a file that must be copied is not
+    """
+    try:
+        d = os.stat(dst)
+    except FileNotFoundError:
+        return False
+
+    s = os.stat(src)
+
+    if (s.st_dev, s.st_ino) == (d.st_dev, d.st_ino):
+        return link
+
+    # whole seconds since some file systems store the mtime with less precision
+    return s.st_size == d.st_size and int(s.st_mtime) == int(d.st_mtime)
+
+
+def sync_file(src: str, dst: str, link: bool = False) -> Tuple[str, int]:
+    """
+    Hard link or copy a file if the destination is not up to date
+
+    :param src:     file in the project
+    :param dst:     file in the lite project
+    :param link:    hard link the file if possible, only for files that are never modified in place
+    :return:        one of 'skipped', 'linked' or 'copied', and the number of bytes that were copied
+    """
+    if is_up_to_date(src, dst, link):
+        return 'skipped', 0
+
+    if os.path.lexists(dst):
+        # remove first, writing to dst could otherwise write through a stale hard link into the project
+        os.remove(dst)
+
+    if link:
+        try:
+            os.link(src, dst)
+            return 'linked', 0
+        except OSError:
+            pass
+
+    # copy2 keeps the mtime, used to find changed files the next time
+    copy2(src, dst)
+    return 'copied', os.path.getsize(dst)
+
+
+def main(proj_dir: str, dest_dir: str, n_workers: int = N_WORKERS):
+    """
+    Create or update a lite copy of a project
+
+    :param proj_dir:    project dir
+    :param dest_dir:    dir of the lite project, created if it doesn't exist
+    :param n_workers:   number of threads that copy files
+    """
+    proj_dir = os.path.abspath(proj_dir)
+    dest_dir = os.path.abspath(dest_dir)
+    n_workers = int(n_workers)
+
+    if not os.path.isdir(os.path.join(proj_dir, 'dataframes')):
+        raise ValueError(f'Not a Mesmerize project: {proj_dir}')
+
+    if os.path.commonpath([proj_dir, dest_dir]) == proj_dir:
+        raise ValueError('The lite project cannot be inside the project')
+
+    paths = get_lite_files(proj_dir)
+
+    for d in FULL_DIRS + EMPTY_DIRS:
+        makedirs(os.path.join(dest_dir, d), exist_ok=True)
+
+    for d in {os.path.dirname(p) for p in paths}:
+        makedirs(os.path.join(dest_dir, d), exist_ok=True)
+
+    print(f'Syncing {len(paths)} files to lite project: {dest_dir}')
+
+    counts = {'skipped': 0, 'linked': 0, 'copied': 0}
+    n_bytes = 0
+    t0 = time()
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        futures = {
+            pool.submit(sync_file, os.path.join(proj_dir, p), os.path.join(dest_dir, p), can_link(p)): p
+            for p in paths
+        }
+
+        for i, future in enumerate(as_completed(futures)):
+            try:
+                result, n = future.result()
+            except OSError as e:
+                raise IOError(f'Could not copy file: {futures[future]}') from e
+
+            counts[result] += 1
+            n_bytes += n
 
+            if (i + 1) % 1000 == 0:
+                print(f'{i + 1} / {len(paths)} files')
 
-def main(proj_dir: str, dest_dir: str):
-    print(proj_dir, dest_dir)
+    print(
+        f'Done in {time() - t0:.1f} seconds: {counts["copied"]} copied ({n_bytes / 1e9:.2f} GB), '
+        f'{counts["linked"]} hard linked, {counts["skipped"]} already up to date'
+    )
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Compute ΔF/F for all the samples of a project without opening them in the viewer.
+
+Samples are processed in a process pool. The baseline of all the curves of a sample is computed at once with
+``analysis.math.dfof``. The ΔF/F of each curve is written to the ``dfof_data`` of its ROI_State, both in the project
+dataframe and in the sample's ImgInfoPath pickle, and the parameters are added to the sample's history trace.
+The changes to the project dataframe are written to its journal as a single record.
+
+The project should not be open in Mesmerize while this runs, since saving the project dataframe from Mesmerize would
+overwrite the new ΔF/F.
+
+Usage::
+
+    mesmerize dfof <proj_dir> [quantile] [frames_window] [n_processes]
+"""
+
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import time
+from typing import *
+import numpy as np
+from ..analysis.math.dfof import dfof
+from ..common.configuration import get_sys_config
+from ..common.dataframe_journal import DataFrameJournal
+from ..viewer.modules.roi_manager_modules.roi_store import states_to_columns, columns_to_states
+
+
+#: Key of the history trace entry with the ΔF/F parameters
+HISTORY_KEY = 'dfof_percentile_baseline'
+
+
+def _update_history(history_trace: list, params: dict):
+    try:
+        next(d for d in history_trace if HISTORY_KEY in d)[HISTORY_KEY] = params
+    except StopIteration:
+        history_trace.append({HISTORY_KEY: params})
+
+
+def _update_pickle(path: str, dfof_data: Dict[int, list], params: dict):
+    """Set the ``dfof_data`` of the ROIs in a sample's pickle and add the parameters to its history trace"""
+    with open(path, 'rb') as f:
+        d = pickle.load(f)
+
+    if 'roi_states' not in d.keys():
+        raise KeyError(f'Sample pickle has no ROIs: {path}')
+
+    was_columns = 'columns' in d['roi_states'].keys()
+    rois = columns_to_states(d['roi_states'])
+
+    for ix, data in dfof_data.items():
+        rois['states'][ix]['dfof_data'] = data
+
+    d['roi_states'] = states_to_columns(rois) if was_columns else rois
+
+    if d.get('history_trace', None) is None:
+        d['history_trace'] = []
+    _update_history(d['history_trace'], params)
+
+    # the pickle is only replaced once it's completely written
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(d, f, protocol=4)
+    os.replace(tmp_path, path)
+
+
+def _sample_dfof(proj_path: str, img_info_path: str, rois: List[Tuple[int, str, np.ndarray]],
+                 params: dict) -> Dict[str, dict]:
+    """
+    Compute the ΔF/F of all ROIs of one sample, run in a worker process
+
+    :param proj_path:       project dir
+    :param img_info_path:   ImgInfoPath of the sample, relative to the project dir
+    :param rois:            (ROI index, uuid_curve, curve) of each ROI
+    :param params:          kwargs for ``dfof()``
+    :return:                ROI_State updates, ``{uuid_curve: {'dfof_data': [xs, dfof]}}``
+    """
+    updates = {}
+    dfof_data = {}
+
+    # all curves of a sample usually have the same number of frames, but be safe
+    lengths = np.array([curve.size for ix, u, curve in rois])
+    for n_frames in np.unique(lengths):
+        group = [rois[i] for i in np.flatnonzero(lengths == n_frames)]
+        result = dfof(np.vstack([curve for ix, u, curve in group]), **params)
+
+        xs = np.arange(n_frames)
+        for (ix, u, curve), y in zip(group, result):
+            dfof_data[ix] = [xs, y]
+            updates[u] = {'dfof_data': [xs, y]}
+
+    _update_pickle(os.path.join(proj_path, img_info_path), dfof_data, params)
+
+    return updates
+
+
+def compute_project_dfof(proj_path: str, sample_ids: Optional[List[str]] = None, quantile: float = 8,
+                         frames_window: int = 500, detrend_only: bool = False,
+                         n_processes: Optional[int] = None) -> List[str]:
+    """
+    Compute ΔF/F for samples of a project from their raw curves and save it in the project
+
+    :param proj_path:       project dir
+    :param sample_ids:      SampleIDs to process, all samples if None
+    :param quantile:        percentile of each window that is used as the baseline, 0 - 100
+    :param frames_window:   number of frames in each window
+    :param detrend_only:    only subtract the baseline, see ``analysis.math.dfof.dfof()``
+    :param n_processes:     number of worker processes, default is the number of threads from the system config
+    :return:                SampleIDs that failed
+    """
+    if n_processes is None:
+        n_processes = get_sys_config()['_MESMERIZE_N_THREADS']
+
+    params = {'quantile': float(quantile), 'frames_window': int(frames_window), 'detrend_only': bool(detrend_only)}
+
+    journal = DataFrameJournal(os.path.join(proj_path, 'dataframes'))
+    dataframe = journal.load()
+
+    if sample_ids is not None:
+        dataframe = dataframe[dataframe['SampleID'].isin(sample_ids)]
+
+    updates = {}
+    failed = []
+    t0 = time()
+
+    with ProcessPoolExecutor(max_workers=max(int(n_processes), 1)) as pool:
+        futures = {}
+
+        for sample_id, rows in dataframe.groupby('SampleID'):
+            rois = [
+                (int(os.path.splitext(os.path.basename(r['CurvePath']))[0]), r['uuid_curve'],
+                 np.asarray(r['ROI_State']['curve_data'][1]))
+                for i, r in rows.iterrows() if r['ROI_State'].get('curve_data', None) is not None
+            ]
+
+            if len(rois) == 0:
+                continue
+
+            future = pool.submit(_sample_dfof, proj_path, rows['ImgInfoPath'].iloc[0], rois, params)
+            futures[future] = sample_id
+
+        for i, future in enumerate(as_completed(futures)):
+            sample_id = futures[future]
+            try:
+                updates.update(future.result())
+            except Exception as e:
+                print(f'Could not compute ΔF/F for sample: {sample_id}\n{e}')
+                failed.append(sample_id)
+
+            print(f'{i + 1} / {len(futures)} samples')
+
+    if len(updates) > 0:
+        journal.update_roi_states(updates)
+
+        if journal.needs_compaction():
+            journal.write_snapshot(journal.load())
+
+    print(f'Done in {time() - t0:.1f} seconds, ΔF/F of {len(updates)} curves, {len(failed)} samples failed')
+
+    return failed
+
+
+def main(proj_dir: str, quantile: float = 8, frames_window: int = 500, n_processes: Optional[int] = None):
+    compute_project_dfof(proj_dir, quantile=quantile, frames_window=frames_window, n_processes=n_processes)
@@ -15,10 +15,67 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 from .add_to_project_dialog_pytemplate import Ui_Form
 from ...common import configuration, get_project_manager
 from .viewer_work_environment import ViewerWorkEnv
+from .sample_export import SampleExport
 from numpy import int64, float64
 import traceback
 
 
+class Signals(QtCore.QObject):
+    progress = QtCore.pyqtSignal(int)
+    finished = QtCore.pyqtSignal(object)
+    error = QtCore.pyqtSignal(str)
+
+
+class SampleExportRunner(QtCore.QRunnable):
+    def __init__(self, export: SampleExport, work_environment: ViewerWorkEnv, replace: bool):
+        """
+        Writes the files of a Sample in the background, the rows are added to the project dataframe from the GUI
+        thread once all files have been written.
+
+        :param export:              snapshot of the work environment
+        :param work_environment:    work environment that is marked as not saved if writing fails
+        :param replace:             replace the existing rows of the SampleID
+        """
+        super(SampleExportRunner, self).__init__()
+        self.signals = Signals()
+        self.export = export
+        self.work_environment = work_environment
+        self.replace = replace
+
+        self.signals.finished.connect(self._commit)
+        self.signals.error.connect(self._show_error)
+
+    def run(self):
+        try:
+            self.export.write(progress_callback=self.signals.progress.emit)
+        except:
+            self.signals.error.emit(traceback.format_exc())
+        else:
+            self.signals.finished.emit(self.export)
+
+    def _commit(self, export: SampleExport):
+        # a single journal record, so the dataframe never has only part of the rows of the Sample
+        try:
+            if self.replace:
+                get_project_manager().change_sample_rows(export.sample_id, export.rows)
+            else:
+                get_project_manager().append_to_dataframe(export.rows)
+        finally:
+            pending_exports.pop(export.sample_id, None)
+
+    def _show_error(self, error_msg: str):
+        pending_exports.pop(self.export.sample_id, None)
+        self.work_environment.saved = False
+
+        QtWidgets.QMessageBox.warning(None, 'Error adding to project',
+                                      f'The following error occured while writing the files of Sample '
+                                      f'"{self.export.sample_id}", it was not added to the project:\n' + error_msg)
+
+
+#: Samples whose files are being written in the background, by SampleID
+pending_exports = {}
+
+
 class AddToProjectDialog(QtWidgets.QWidget):
     signal_finished = QtCore.pyqtSignal()
 
@@ -111,6 +168,9 @@ class AddToProjectDialog(QtWidgets.QWidget):
 
         self.ui.btnProceed.clicked.connect(self.slot_proceed)
 
+        #: export that is running and connected to the progress bar of this dialog
+        self.runner = None
+
     def _disable_sample_id_text_entry(self):
         if self.ui.radioButtonSaveChanges.isChecked() and self.ui.checkBoxSaveChanges.isChecked():
             animal_id = self.work_environment.sample_id.split('-_-')[0]
@@ -167,6 +227,12 @@ class AddToProjectDialog(QtWidgets.QWidget):
         trial_id = self.ui.lineEditTrialID.text()
         sample_id = animal_id + '-_-' + trial_id
 
+        if sample_id in pending_exports.keys():
+            QtWidgets.QMessageBox.warning(self, 'SampleID is being saved',
+                                          'This SampleID is still being written to the project, '
+                                          'wait until it has finished.')
+            return
+
         if (sample_id in get_project_manager().dataframe['SampleID'].values) and not self.check_save_changes():
             QtWidgets.QMessageBox.warning(self, 'SampleID exists in project',
                                           'The combination of animal ID and '
@@ -174,11 +240,6 @@ class AddToProjectDialog(QtWidgets.QWidget):
                                           'You must choose a unique combination.')
             return
 
-        self.setDisabled(True)
-        self.label_wait = QtWidgets.QLabel(self)
-        self.label_wait.setText('Please wait...')
-        self.ui.verticalLayout.addWidget(self.label_wait)
-
         self.update_work_environment_dicts()
 
         if self.ui.radioButtonAddToDataFrame.isChecked():
@@ -194,26 +255,80 @@ class AddToProjectDialog(QtWidgets.QWidget):
             return False
 
     def add_to_dataframe(self):
-        dicts_to_append = self.work_environment.to_pandas(configuration.proj_path)
-        get_project_manager().append_to_dataframe(dicts_to_append)
-        self.work_environment.saved = True
-        self.label_wait.setText('FINISHED!')
-        # self.signal_finished.emit()
+        try:
+            export = self.work_environment.prepare_sample_export(configuration.proj_path)
+        except:
+            QtWidgets.QMessageBox.warning(self, 'Error adding to project',
+                                          'The following exception was raised while trying to package the current '
+                                          'work environment: ' + traceback.format_exc())
+            return
+
+        self._start_export(export, replace=False)
 
     def save_changes_to_sample(self):
         try:
             save_tiff = self.ui.checkBoxOverwriteImage.isChecked()
-            dicts_to_append = self.work_environment.to_pandas(configuration.proj_path, modify_options={'overwrite_img_seq': save_tiff})
+            export = self.work_environment.prepare_sample_export(configuration.proj_path, modify_options={'overwrite_img_seq': save_tiff})
         except:
             QtWidgets.QMessageBox.warning(self, 'Exception while trying to overwrite',
                                           'The following exception was raised while trying to package the current'
                                           'work environment to overwrite the SampleID rows: ' + traceback.format_exc())
             return
 
-        get_project_manager().change_sample_rows(self.work_environment.sample_id, dicts_to_append)
+        self._start_export(export, replace=True)
+
+    def _start_export(self, export: SampleExport, replace: bool):
+        """Write the files in the background, the viewer can be used while they're written"""
+        # a failed export can be started again, the previous one is not shown anymore
+        self._disconnect_runner()
+
+        runner = SampleExportRunner(export, self.work_environment, replace)
+        pending_exports[export.sample_id] = runner
+
+        # the snapshot is what gets saved, later changes in the viewer mark the work environment as changed again
         self.work_environment.saved = True
+
+        self.setDisabled(True)
+        self.label_wait = QtWidgets.QLabel(self)
+        self.label_wait.setText('Writing files, you can continue using the viewer...')
+        self.ui.verticalLayout.addWidget(self.label_wait)
+
+        self.progress_bar = QtWidgets.QProgressBar(self)
+        self.ui.verticalLayout.addWidget(self.progress_bar)
+
+        self.runner = runner
+        runner.signals.progress.connect(self.progress_bar.setValue)
+        runner.signals.finished.connect(self._export_finished)
+        runner.signals.error.connect(self._export_failed)
+
+        QtCore.QThreadPool.globalInstance().start(runner)
+
+    def _export_finished(self):
         self.label_wait.setText('FINISHED!')
-        # self.signal_finished.emit()
+
+    def _export_failed(self):
+        self.label_wait.setText('Failed!')
+        self.progress_bar.setValue(0)
+        self.setEnabled(True)
+
+    def _disconnect_runner(self):
+        """The export keeps running after the dialog is closed, it must not update the widgets of the dialog"""
+        if self.runner is None:
+            return
+
+        for signal, slot in [(self.runner.signals.progress, self.progress_bar.setValue),
+                             (self.runner.signals.finished, self._export_finished),
+                             (self.runner.signals.error, self._export_failed)]:
+            try:
+                signal.disconnect(slot)
+            except TypeError:  # already disconnected
+                pass
+
+        self.runner = None
+
+    def closeEvent(self, event: QtGui.QCloseEvent):
+        self._disconnect_runner()
+        super(AddToProjectDialog, self).closeEvent(event)
 
     def close(self):
         self.signal_finished.emit()
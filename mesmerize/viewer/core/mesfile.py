@@ -15,6 +15,10 @@ import numpy as np
 import traceback
 #from common.misc_functions import *
 import scipy.io as spio
+try:
+    from scipy.io.matlab.mio5 import MatFile5Reader
+except ImportError:
+    from scipy.io.matlab._mio5 import MatFile5Reader
 
 
 class MatlabFuncs:
@@ -42,12 +46,72 @@ class MatlabFuncs:
         return d
 
 
+class MatFileIndex:
+    """
+    Index of the variables in a MAT-file (version 5) by their position in the file.
+
+    Only the variable headers are read when the index is built, the data of a variable is decoded when it is loaded.
+    """
+    def __init__(self, filename: str):
+        """
+        :param filename: full path of a MAT-file
+        """
+        self.filename = filename
+        self.positions = {}  # variable name: position of the variable's header in the file
+
+        with open(self.filename, 'rb') as f:
+            reader = self._get_reader(f)
+            reader.initialize_read()
+            reader.read_file_header()
+
+            while not reader.end_of_stream():
+                position = f.tell()
+                hdr, next_position = reader.read_var_header()
+                name = 'None' if hdr.name is None else hdr.name.decode('latin1')
+                # skip the variable's data
+                f.seek(next_position)
+
+                if name == '':
+                    # matlab 7 function workspace
+                    continue
+
+                self.positions[name] = position
+
+    @staticmethod
+    def _get_reader(f) -> MatFile5Reader:
+        return MatFile5Reader(f, struct_as_record=False, squeeze_me=True)
+
+    def keys(self) -> list:
+        return list(self.positions.keys())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.positions
+
+    def load(self, name: str):
+        """
+        Decode a single variable.
+
+        :param name: variable name
+        """
+        with open(self.filename, 'rb') as f:
+            reader = self._get_reader(f)
+            reader.initialize_read()
+            f.seek(self.positions[name])
+            hdr, next_position = reader.read_var_header()
+            var = reader.read_var_array(hdr, process=True)
+
+        return MatlabFuncs._check_keys({name: var})[name]
+
+
 class MES:
     """
     Handles of opening .mes files and organizing the images and meta data.
     The load_img() method returns a 3D array (dims are [time, cols, rows])
     of the image sequence and its associated meta data.
 
+    Only the meta data variables are decoded when the file is opened, each image is read from the file when it is
+    loaded with load_img().
+
     Usage:
     Create a MES instance by passing the path of your mes file, example:
 
@@ -67,12 +131,16 @@ class MES:
         """
         :param filename: full path of a single .mes file
         """
-        self.main_dict = MatlabFuncs.loadmat(filename)
+        self.filename = filename
+        self.mat_index = MatFileIndex(filename)
 
-        self.main_dict_keys = [x for x in self.main_dict.keys()]
+        self.main_dict_keys = self.mat_index.keys()
         self.main_dict_keys.sort()
         self._images = [x for x in self.main_dict_keys if "I" in x]
 
+        # meta data variables, "Dxxxx", are small compared to the images
+        self._meta_vars = {}
+
         self.image_descriptions = {}
 
         self.voltages_lists_dict = {}
@@ -80,11 +148,12 @@ class MES:
 
         for image in self._images:
             try:
-                meta = self.main_dict["D" + image[1:6]].tolist()
+                meta = self._get_meta_var("D" + image[1:6]).tolist()
                 meta = self._todict(meta[int(image[-1]) - 1])
             except Exception:
                 self.errors.append('Error opening an image, There as an error when opening the following image: ' + str(
                     "D" + image[1:6]) + '\n' + traceback.format_exc())
+                continue
 
             # If auxiliary voltage information (which for example contains information
             # about stimulus timings & can be mapped to stimulus definitions).
@@ -122,6 +191,11 @@ class MES:
             for channel in self.voltages_lists_dict.keys():
                 self.voltages_lists_dict[channel] = list(set(self.voltages_lists_dict[channel]))
 
+    def _get_meta_var(self, name: str):
+        if name not in self._meta_vars:
+            self._meta_vars[name] = self.mat_index.load(name)
+        return self._meta_vars[name]
+
     def _loadmat(self, filename):
         data = spio.loadmat(filename, struct_as_record=False, squeeze_me=True)
         return self._check_keys(data)
@@ -157,26 +231,25 @@ class MES:
             raise KeyError('fImage reference: {img_reference} not found.\nCall get_image_references for a '
                            'list of all available references to images that can be loaded.')
 
-        meta = self.main_dict["D" + img_reference[1:6]].tolist()
+        meta = self._get_meta_var("D" + img_reference[1:6]).tolist()
         meta = self._todict(meta[0])
         #        except KeyError:
         #            return False, KeyError
 
         if len(meta["FoldedFrameInfo"]) > 0:
             start = meta["FoldedFrameInfo"]["firstFramePos"]
-            stop = meta["TransversePixNum"]
+            stop = int(meta["TransversePixNum"])
             # print("Images starting at: ",start)
             # print("Frame width = ",stop)
-            im = self.main_dict[img_reference]
+            im = self.mat_index.load(img_reference)
             # Trim the 2D array to start at where img acquisition actually begins
             im = im[:, start:]
             # Figure out where the 2D array stops at end of acquisition
-            im = im[:, :(im.shape[1] - (im.shape[1] % stop))]
-            # Divide the single large 2D array into individual arrays which each
-            # represent a single frame
-            image_sequence = np.hsplit(im, im.shape[1] / stop)
-            # Combine all the frames into one 3D array, 2D + time
-            seq = np.dstack(image_sequence)
+            n_frames = im.shape[1] // stop
+            im = im[:, :n_frames * stop]
+            # Each frame is a block of "stop" columns, with the column major order of MAT-file arrays the
+            # folded 2D array is unfolded into [rows, cols, time] as a view without copying
+            seq = im.reshape((im.shape[0], stop, n_frames), order='F')
 
             return seq, meta
         else:
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Writes the files of a project Sample, used by ``ViewerWorkEnv.to_pandas()`` and "Add to project".
+
+``ViewerWorkEnv.prepare_sample_export()`` takes a snapshot of everything that is saved with the Sample, the image
+sequence and the metadata are copied so that changes made in the viewer while the files are written do not end up in
+the saved Sample. ``SampleExport.write()`` then writes the image sequence,
+the max & std projections, the curves and the pickle in a thread pool, so it can run in the background while the
+viewer is used. Every file is first written to a temporary path and they are all moved into place once all of them
+have been written. The rows for the project dataframe should only be added after ``write()`` returns.
+"""
+
+import os
+import pickle
+from copy import deepcopy
+from shutil import rmtree
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import *
+import numpy as np
+import tifffile
+from ..image_utils.auto_crop import get_projections
+from ...common.configuration import get_sys_config
+
+
+#: Number of curves that are written by each task
+CURVES_PER_TASK = 64
+
+
+def _imsave(path: str, data: np.ndarray, **kwargs):
+    if hasattr(tifffile, 'imwrite'):
+        tifffile.imwrite(path, data, **kwargs)
+    else:
+        tifffile.imsave(path, data, **kwargs)
+
+
+def write_img_seq(path: str, seq: np.ndarray):
+    """
+    Save an image sequence as a tiff file, in the same way as ``ViewerWorkEnv.save_img_seq()``
+
+    :param path:    path of the tiff file
+    :param seq:     image sequence, shape is [x, y, t] or [x, y, t, z]
+    """
+    if seq.ndim == 3:
+        _imsave(path, seq.T, bigtiff=True)
+
+    elif seq.ndim == 4:
+        _imsave(
+            path,
+            np.moveaxis(
+                seq,
+                (2, 3, 0, 1),  # from xytz
+                (0, 1, 2, 3)   # to   tzxy
+            ),
+            bigtiff=True
+        )
+
+
+class SampleExport:
+    def __init__(self, proj_path: str, img_path: str, data: dict, seq: Optional[np.ndarray],
+                 curves_dir: str, curves: List[Tuple[str, list]], rows: List[dict], copy: bool = True):
+        """
+        Snapshot of a work environment that is saved as a project Sample, see
+        ``ViewerWorkEnv.prepare_sample_export()``.
+
+        By default the image sequence, the data, the curves and the rows are copied, so the snapshot is not affected
+        by changes made in the viewer while it is written in the background.
+
+        :param proj_path:   project dir
+        :param img_path:    path of the image files without extension, i.e. ``images/<SampleID>-_-<UUID>``
+        :param data:        dict that is pickled to the ``.pik`` file
+        :param seq:         image sequence, shape is [x, y, t] or [x, y, t, z]. None to keep the existing tiff file.
+        :param curves_dir:  dir of the curves, it is replaced if it already exists
+        :param curves:      file name of each curve in ``curves_dir`` and the curve data, ``[xs, ys]``
+        :param rows:        rows for the project dataframe, one per curve
+        :param copy:        copy the arguments, False if they are not changed until ``write()`` returns
+        """
+        if copy:
+            # a single deepcopy, the curve arrays that are in both the curves and the ROI states are copied once
+            data, curves, rows = deepcopy((data, curves, rows))
+            if seq is not None:
+                seq = seq.copy()
+
+        self.proj_path = proj_path
+        self.img_path = img_path
+        self.data = data
+        self.seq = seq
+        self.curves_dir = curves_dir
+        self.curves = curves
+        self.rows = rows
+
+        self.sample_id = data['sample_id']  #: SampleID
+
+    def _get_projection_tasks(self) -> List[Tuple[np.ndarray, str, str]]:
+        if self.seq.ndim == 3:
+            return [(self.seq, f'{self.img_path}_max_proj.tiff', f'{self.img_path}_std_proj.tiff')]
+
+        # projection for each zlevel
+        return [
+            (self.seq[:, :, :, z], f'{self.img_path}_max_proj-{z}.tiff', f'{self.img_path}_std_proj-{z}.tiff')
+            for z in range(self.seq.shape[3])
+        ]
+
+    @staticmethod
+    def _write_projections(seq: np.ndarray, max_path: str, std_path: str):
+        max_proj, std_proj = get_projections(seq, axis=2)
+        _imsave(max_path + '.tmp', max_proj)
+        _imsave(std_path + '.tmp', std_proj)
+
+    @staticmethod
+    def _write_curves(dir_path: str, curves: List[Tuple[str, list]]):
+        for filename, curve_data in curves:
+            np.savez(os.path.join(dir_path, filename), curve=curve_data)
+
+    def _write_pickle(self):
+        with open(f'{self.img_path}.pik.tmp', 'wb') as f:
+            pickle.dump(self.data, f, protocol=4)
+
+    def _get_paths(self) -> List[str]:
+        """Paths of all files that are written, except the curves"""
+        paths = [f'{self.img_path}.pik']
+
+        if self.seq is not None:
+            paths.append(f'{self.img_path}.tiff')
+            for _, max_path, std_path in self._get_projection_tasks():
+                paths += [max_path, std_path]
+
+        return paths
+
+    def write(self, n_threads: Optional[int] = None, progress_callback: Optional[Callable[[int], None]] = None):
+        """
+        Write all files of the Sample
+
+        :param n_threads:           number of threads, default is the number of threads from the system config
+        :param progress_callback:   called with the percentage of tasks that are done, from the calling thread
+        """
+        if n_threads is None:
+            n_threads = int(get_sys_config()['_MESMERIZE_N_THREADS'])
+
+        curves_tmp = self.curves_dir + '.tmp'
+        if os.path.isdir(curves_tmp):
+            rmtree(curves_tmp)
+        os.makedirs(curves_tmp)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(n_threads, 1)) as pool:
+                futures = [pool.submit(self._write_pickle)]
+
+                if self.seq is not None:
+                    futures.append(pool.submit(write_img_seq, f'{self.img_path}.tiff.tmp', self.seq))
+                    futures += [pool.submit(self._write_projections, *t) for t in self._get_projection_tasks()]
+
+                futures += [
+                    pool.submit(self._write_curves, curves_tmp, self.curves[i:i + CURVES_PER_TASK])
+                    for i in range(0, len(self.curves), CURVES_PER_TASK)
+                ]
+
+                for n_done, future in enumerate(as_completed(futures), start=1):
+                    # raises the exception of a failed task, the remaining tasks are still finished by the pool
+                    future.result()
+
+                    if progress_callback is not None:
+                        progress_callback(int(n_done * 100 / len(futures)))
+
+        except:
+            for path in self._get_paths():
+                if os.path.isfile(path + '.tmp'):
+                    os.remove(path + '.tmp')
+            rmtree(curves_tmp, ignore_errors=True)
+            raise
+
+        for path in self._get_paths():
+            os.replace(path + '.tmp', path)
+
+        if os.path.isdir(self.curves_dir):
+            rmtree(self.curves_dir)
+        os.rename(curves_tmp, self.curves_dir)
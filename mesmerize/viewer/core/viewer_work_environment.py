@@ -15,11 +15,12 @@ GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
 from .mesfile import *
 from .data_types import ImgData
 from . import organize_metadata
+from ..modules.roi_manager_modules.roi_store import states_to_columns
+from .sample_export import SampleExport, write_img_seq
 import numpy as np
 import pickle
 import tifffile
 import os
-from shutil import rmtree
 from ...common import get_sys_config, get_proj_config
 from uuid import uuid4
 from uuid import UUID as UUID_type
@@ -418,7 +419,8 @@ class ViewerWorkEnv:
                         if rois['states'][ix]['tags'][roi_def] == '':
                             rois['states'][ix]['tags'][roi_def] = 'untagged'
 
-                d['roi_states'] = rois
+                # stored as columns of arrays, converted back to a list of states when restored
+                d['roi_states'] = states_to_columns(rois)
 
         return d
 
@@ -443,22 +445,24 @@ class ViewerWorkEnv:
         data = {**work_env, 'UUID': UUID}
 
         if save_img_seq:
-            if self.imgdata.ndim == 3:
-                tifffile.imsave(f'{filename}.tiff', self.imgdata.seq.T, bigtiff=True)
-
-            elif self.imgdata.ndim == 4:
-                tifffile.imsave(
-                    f'{filename}.tiff',
-                    np.moveaxis(
-                        self.imgdata._seq,
-                        (2, 3, 0, 1),  # from xytz
-                        (0, 1, 2, 3)   # to   tzxy
-                    ),
-                    bigtiff=True
-                )
+            self.save_img_seq(f'{filename}.tiff')
 
         return (filename, data)
 
+    def get_img_seq_to_save(self) -> np.ndarray:
+        """The image sequence that is saved by ``save_img_seq``, shape is [x, y, t] or [x, y, t, z]"""
+        if self.imgdata.ndim == 4:
+            return self.imgdata._seq
+        return self.imgdata.seq
+
+    def save_img_seq(self, path: str):
+        """
+        Save the image sequence as a tiff file, in the same way as ``to_pickle``
+
+        :param path: path of the tiff file
+        """
+        write_img_seq(path, self.get_img_seq_to_save())
+
     def to_pickle(self, dir_path: str, filename: Optional[str] = None, save_img_seq=True, UUID=None) -> str:
         """
         Package the current work Env ImgData class object (See MesmerizeCore.DataTypes) and any paramteres such as
@@ -483,6 +487,26 @@ class ViewerWorkEnv:
         :return:    list of dicts that each correspond to a single curve that can be appended
                     as rows to the project dataframe
         """
+        # written right away, nothing can change in the meantime
+        export = self.prepare_sample_export(proj_path, modify_options, copy=False)
+        export.write()
+
+        self.saved = True
+        return export.rows
+
+    def prepare_sample_export(self, proj_path: str, modify_options: Optional[dict] = None,
+                              copy: bool = True) -> SampleExport:
+        """
+        Take a snapshot of the work environment for saving it as a project Sample. The files are written by
+        ``SampleExport.write()``, which can run in a background thread, and the rows in ``SampleExport.rows``
+        should be added to the project dataframe after that.
+
+        :param      proj_path:      Root path of the current project
+        :param      modify_options: {'overwrite_img_seq': bool}, if the Sample is being saved over its existing files
+        :param      copy:           copy the image sequence and metadata, only False if the work environment is not
+                                    changed until the files have been written
+        :return:    snapshot that writes the files of the Sample
+        """
         if self.isEmpty:
             raise ValueError('Work environment is empty')
 
@@ -508,38 +532,13 @@ class ViewerWorkEnv:
         curves_dir = os.path.join(proj_path, 'curves', f'{self.sample_id}-_-{str(UUID)}')
 
         if modify_options is not None:
-            rmtree(curves_dir)
             if modify_options['overwrite_img_seq']:
                 save_img_seq = True
             else:
                 save_img_seq = False
 
-        img_path = self.to_pickle(imgdir, UUID=UUID, save_img_seq=save_img_seq)
-
-        if save_img_seq:
-            if self.imgdata.ndim == 3:
-                max_proj = np.amax(self.imgdata.seq, axis=2)
-                max_proj_path = img_path + '_max_proj.tiff'
-                tifffile.imsave(max_proj_path, max_proj)
-
-                std_proj = self.imgdata.seq.std(axis=2)
-                std_proj_path = img_path + '_std_proj.tiff'
-                tifffile.imsave(std_proj_path, std_proj)
-            # projection for each zlevel
-            elif self.imgdata.ndim == 4:
-                for z in range(self.imgdata.z_max):
-                    self.imgdata.set_zlevel(z)
-
-                    max_proj = np.amax(self.imgdata.seq, axis=2)
-                    max_proj_path = f'{img_path}_max_proj-{z}.tiff'
-                    tifffile.imsave(max_proj_path, max_proj)
-
-                    std_proj = self.imgdata.seq.std(axis=2)
-                    std_proj_path = f'{img_path}_std_proj-{z}.tiff'
-                    tifffile.imsave(std_proj_path, std_proj)
-
-        # Since viewerWorkEnv.to_pickle sets the saved property to True, and we're not done saving the dict yet.
-        self._saved = False
+        # the image sequence & projections are written by SampleExport
+        img_path, data = self._prepare_export(imgdir, UUID=UUID, save_img_seq=False)
 
         # Create a dict that contains all stim definitions as keys that refer to a list of all the stims for that sample
         stimuli_unique_sets = {}
@@ -548,7 +547,7 @@ class ViewerWorkEnv:
         # for this simple task.
         # new_stimuli = []
         if self.stim_maps is None:
-            for stim_def in get_proj_config().options('STIM_DEFS'):
+            for stim_def in get_proj_config(proj_path).options('STIM_DEFS'):
                 stimuli_unique_sets[stim_def] = ['untagged']
         else:
             for stim_def in self.stim_maps.keys():
@@ -582,10 +581,8 @@ class ViewerWorkEnv:
         else:
             comments = self.comments
 
-        if os.path.isdir(curves_dir) is False:
-            os.mkdir(curves_dir)
-
         dicts = []
+        curves = []
 
         rois = self.roi_manager.get_all_states()
 
@@ -599,7 +596,7 @@ class ViewerWorkEnv:
             roi_tags = rois['states'][ix]['tags']
             curve_path = os.path.join(curves_dir, str(ix).zfill(5) + '.npz')
 
-            np.savez(curve_path, curve=curve_data)#, stimMaps=self.imgdata.stimMaps)
+            curves.append((os.path.basename(curve_path), curve_data))
 
             # if rois['states'][ix]['roi_type'] == 'ManualROI':
             #     roi_state = {'type': 'ManualROI',
@@ -661,5 +658,13 @@ class ViewerWorkEnv:
         #                   'comments':   comments
         #                   })
 
-        self.saved = True
-        return dicts
+        return SampleExport(
+            proj_path=proj_path,
+            img_path=img_path,
+            data=data,
+            seq=self.get_img_seq_to_save() if save_img_seq else None,
+            curves_dir=curves_dir,
+            curves=curves,
+            rows=dicts,
+            copy=copy
+        )
@@ -18,14 +18,109 @@ import numpy as np
 import cv2
 import tifffile
 from functools import partial
+from threading import Thread
+from queue import Queue
+from time import time
+from typing import *
 from .exporter_pytemplate import *
 
 
+#: Approximate number of bytes of the image sequence that are read & scaled per chunk of frames
+CHUNK_BYTES = 2 ** 28
+
+#: tiff files with more data than this are written as BigTIFF, same threshold as tifffile uses
+BIGTIFF_BYTES = 2 ** 32 - 2 ** 25
+
+
+class _TiffWriter:
+    def __init__(self, path: str, fps: float):
+        self.path = path
+        self.writer = None
+
+    def open(self, frame_shape: Tuple[int, int], dtype: np.dtype, n_frames: int):
+        # BigTIFF only when needed, since older readers can't open it
+        data_bytes = n_frames * int(np.prod(frame_shape)) * np.dtype(dtype).itemsize
+        self.writer = tifffile.TiffWriter(self.path, bigtiff=data_bytes > BIGTIFF_BYTES)
+
+    def write(self, chunk: np.ndarray):
+        for frame in chunk:
+            # append each frame as a page, same layout as imsave of the whole [t, y, x] array
+            if hasattr(self.writer, 'write'):
+                self.writer.write(frame, contiguous=True)
+            else:
+                self.writer.save(frame, contiguous=True)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class _GifWriter:
+    def __init__(self, path: str, fps: float):
+        self.path = path
+        self.fps = fps
+        self.writer = None
+
+    def open(self, frame_shape: Tuple[int, int], dtype: np.dtype, n_frames: int):
+        import imageio
+        self.writer = imageio.get_writer(self.path, mode='I', fps=self.fps)
+
+    def write(self, chunk: np.ndarray):
+        for frame in chunk:
+            self.writer.append_data(frame)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class _VideoWriter:
+    def __init__(self, path: str, fps: float, codec: str):
+        self.path = path
+        self.fps = fps
+        self.codec = codec
+        self.writer = None
+
+    def open(self, frame_shape: Tuple[int, int], dtype: np.dtype, n_frames: int):
+        fourcc = cv2.VideoWriter_fourcc(*self.codec)
+        # frame_shape is [y, x], VideoWriter wants (width, height)
+        self.writer = cv2.VideoWriter(self.path, fourcc, int(self.fps), (frame_shape[1], frame_shape[0]))
+
+    def write(self, chunk: np.ndarray):
+        # gray to BGR for the whole chunk at once
+        bgr = np.repeat(chunk[..., np.newaxis], 3, axis=-1)
+        for frame in bgr:
+            self.writer.write(frame)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
 # vmin & vmax only has to be supplied for video outputs since videos cannot contain
 # the full range of 16astype(np.int32 bit image depth (OpenCV & 16 bit grayscale is a nightmare to deal with)
 class Exporter:
+    """
+    Export an image sequence to tiff, gif, avi or mp4.
+
+    The image sequence is read, scaled and written in chunks of frames so that memory use is bounded by the chunk
+    size and not the size of the image sequence, which can be a memmap. Chunks are written on a background thread
+    while the next chunk is being read & scaled.
+    """
     def __init__(self, img_data, out_file, **kwargs):
-        if out_file[-4:] != 'tiff' and 'levels' not in kwargs.keys():
+        """
+        :param img_data:    image sequence array of shape [x, y, t], or an ImgData instance
+        :param out_file:    output file path, the format is determined by the extension
+
+        :keyword levels:        (vmin, vmax) for scaling to uint8, required for formats other than tiff
+        :keyword fps:           frame rate of the output, default is the frame rate in ``img_data.meta``
+        :keyword frame_range:   (start, stop) frame indices, export only this subrange of frames
+        :keyword frame_step:    export every nth frame
+        :keyword spatial_step:  export every nth pixel along x and y
+        :keyword chunk_bytes:   approximate number of bytes of the image sequence to read per chunk
+        :keyword progress_callback: called with (frames exported, total frames, frames per second) after every chunk
+        """
+        if out_file[-4:] != 'tiff' and out_file[-4:] != '.tif' and 'levels' not in kwargs.keys():
             raise ValueError('levels must be specified for file formats other than tiff or npz')
 
         if 'fps' in kwargs.keys():
@@ -33,7 +128,8 @@ class Exporter:
         else:
             self.fps = img_data.meta['fps']
 
-        self.img_data = img_data
+        # work with the ImgData's array
+        self.img_data = getattr(img_data, 'seq', img_data)
         self.out_file = out_file
         
         if 'levels' in kwargs.keys():
@@ -41,7 +137,16 @@ class Exporter:
             vmax = kwargs['levels'][1]
             self.vmin = vmin
             self.vmax = vmax
-            
+
+        n_frames = self.img_data.shape[2]
+        start, stop = kwargs.get('frame_range', (0, n_frames))
+        self.frames = range(n_frames)[start:stop:kwargs.get('frame_step', 1)]
+        self.spatial_step = kwargs.get('spatial_step', 1)
+        self.chunk_bytes = kwargs.get('chunk_bytes', CHUNK_BYTES)
+        self.progress_callback = kwargs.get('progress_callback', None)
+
+        self.export_fps = None  #: frames per second of the export, set after the export is complete
+
         outFormat = self.out_file[-4:]
 
         formats = {'.tif': self.tiff,
@@ -55,43 +160,105 @@ class Exporter:
         formats[outFormat]()
 
     def gif(self):
-        scaled = self.scale_levels()
-        with imageio.get_writer(self.out_file, mode='I', fps=self.fps) as writer:
-            for frame in range(0, scaled.shape[2]):
-                writer.append_data(scaled[:, :, frame].T)
+        self.stream(_GifWriter(self.out_file, self.fps), scale=True)
 
     def tiff(self):
-        tifffile.imsave(self.out_file, self.img_data.T)
+        self.stream(_TiffWriter(self.out_file, self.fps), scale=False)
 
     def npz(self):
         print('yay')
 
-    def scale_levels(self):
+    def scale_levels(self, data: np.ndarray = None) -> np.ndarray:
+        """
+        Scale to uint8 using the levels.
+
+        :param data: array to scale, the entire image sequence if None
+        """
+        if data is None:
+            data = self.img_data
 
-        scaled = ((self.img_data - self.vmin) * (255/self.vmax)).clip(min=0, max=255).astype(np.uint8)
-#        scaled = (((self.img_data.seq - self.vmin) * (self.vmax - self.vmin)) * (255.0/self.vmax)).clip(min=0, max=255).astype(np.uint8)#.clip(min=0, max=255).astype(np.uint8)
-#        self.min_substract = (self.img_data - self.vmin).astype(np.uint8)
-        return scaled
+        scaled = np.subtract(data, self.vmin, dtype=np.float32)
+        scaled *= 255 / self.vmax
+        np.clip(scaled, 0, 255, out=scaled)
+        return scaled.astype(np.uint8)
 
     def vidWrite(self, codec):
-        fourcc = cv2.VideoWriter_fourcc(*codec)
-        print('YAY CODEC IS ' + codec)
-        out = cv2.VideoWriter(self.out_file, fourcc, int(self.fps),
-                        (self.img_data.shape[0],
-                         self.img_data.shape[1]))
-        scaled = self.scale_levels()
-        # if (self.vmin and self.vmax) == None:
-        #     self.vmin = self.img_data.vmin
-        #     self.vmax = self.img_data.vmax
-        # self.min_substract = self.img_data.seq.astype(np.int32) - self.vmin
-        # self.scaled = ((self.img_data.seq.astype(np.int32) - self.vmin)
-        #                 * (255/self.vmax)).clip(min=0, max=255).astype(np.uint8)
-#        self.no_neg = self.min_substract.clip(min=0)
-#        self.scaled = np.array((self.no_neg * (255/self.vmax)), dtype=np.uint8)
-        for frame in range(0, scaled.shape[2]):
-            #print('entered write loop, frame# ' + str(frame))
-            out.write(cv2.cvtColor(scaled[:, :, frame].T, cv2.COLOR_GRAY2BGR))
-        out.release()
+        self.stream(_VideoWriter(self.out_file, self.fps, codec), scale=True)
+
+    def iter_chunks(self, scale: bool) -> Iterator[np.ndarray]:
+        """
+        Yield chunks of frames in the order they are written, shape [t, y, x]
+
+        :param scale: scale to uint8 using the levels
+        """
+        s = self.spatial_step
+        frame_bytes = max(int(np.prod(self.img_data[::s, ::s, 0].shape)) * self.img_data.dtype.itemsize, 1)
+        chunk_size = max(1, self.chunk_bytes // frame_bytes)
+
+        for i in range(0, len(self.frames), chunk_size):
+            frames = self.frames[i:i + chunk_size]
+            # a contiguous slice is a view into a memmap, only this chunk is read from disk
+            chunk = self.img_data[::s, ::s, frames.start:frames.stop:frames.step]
+
+            if scale:
+                chunk = self.scale_levels(chunk)
+
+            yield np.ascontiguousarray(chunk.T)
+
+    def stream(self, writer, scale: bool):
+        """
+        Write all chunks with the writer on a background thread
+
+        :param writer:  one of the _<format>Writer classes
+        :param scale:   scale to uint8 using the levels
+        """
+        # at most two chunks wait to be written, this bounds the memory use
+        chunks = Queue(maxsize=2)
+        errors = []
+
+        def write_chunks():
+            try:
+                while True:
+                    chunk = chunks.get()
+                    if chunk is None:
+                        return
+                    writer.write(chunk)
+            except Exception as e:
+                errors.append(e)
+                # keep taking chunks so that the reading thread does not block
+                while chunks.get() is not None:
+                    pass
+
+        n_total = len(self.frames)
+        n_written = 0
+        t0 = time()
+
+        writer_thread = None
+        try:
+            for chunk in self.iter_chunks(scale):
+                if writer_thread is None:
+                    writer.open(chunk.shape[1:], chunk.dtype, n_total)
+                    writer_thread = Thread(target=write_chunks)
+                    writer_thread.start()
+
+                if errors:
+                    break
+
+                chunks.put(chunk)
+
+                n_written += chunk.shape[0]
+                if self.progress_callback is not None:
+                    self.progress_callback(n_written, n_total, n_written / max(time() - t0, 1e-9))
+        finally:
+            if writer_thread is not None:
+                chunks.put(None)
+                writer_thread.join()
+            writer.close()
+
+        if errors:
+            raise errors[0]
+
+        self.export_fps = n_total / max(time() - t0, 1e-9)
 
 
 class ExporterGUI(QtWidgets.QWidget, Ui_exporter_template):
@@ -105,6 +272,50 @@ class ExporterGUI(QtWidgets.QWidget, Ui_exporter_template):
         self.sliderFPS_Scaling.valueChanged.connect(lambda v: self.labelSlider.setText(str(v/10)))
         self.comboBoxFormat.currentTextChanged.connect(self._enable_non_tiff)
 
+        # frame range & downsampling, inserted above the path
+        ix = self.verticalLayout_2.indexOf(self.checkBoxPseudocolor) + 1
+
+        self.spinBoxFrameStart = QtWidgets.QSpinBox(self)
+        self.spinBoxFrameStart.setMaximum(2 ** 31 - 1)
+
+        self.spinBoxFrameStop = QtWidgets.QSpinBox(self)
+        self.spinBoxFrameStop.setMaximum(2 ** 31 - 1)
+        self.spinBoxFrameStop.setSpecialValueText('end')
+        self.spinBoxFrameStop.setToolTip('Last frame (exclusive), "end" exports until the last frame')
+
+        self.spinBoxFrameStep = QtWidgets.QSpinBox(self)
+        self.spinBoxFrameStep.setRange(1, 10000)
+        self.spinBoxFrameStep.setToolTip('Export every nth frame')
+
+        self.spinBoxSpatialStep = QtWidgets.QSpinBox(self)
+        self.spinBoxSpatialStep.setRange(1, 100)
+        self.spinBoxSpatialStep.setToolTip('Export every nth pixel along x and y')
+
+        for label, spin_box in [('Frames from:', self.spinBoxFrameStart), ('to:', self.spinBoxFrameStop),
+                                ('Frame step:', self.spinBoxFrameStep), ('Spatial step:', self.spinBoxSpatialStep)]:
+            layout = QtWidgets.QHBoxLayout()
+            layout.addWidget(QtWidgets.QLabel(label, self))
+            layout.addWidget(spin_box)
+            self.verticalLayout_2.insertLayout(ix, layout)
+            ix += 1
+
+        self.progressBar.setValue(0)
+
+    def get_export_kwargs(self) -> dict:
+        """Frame range, downsampling & progress kwargs for ``Exporter`` from the GUI"""
+        stop = self.spinBoxFrameStop.value()
+
+        return {
+            'frame_range':  (self.spinBoxFrameStart.value(), stop if stop > 0 else None),
+            'frame_step':   self.spinBoxFrameStep.value(),
+            'spatial_step': self.spinBoxSpatialStep.value(),
+            'progress_callback': self._set_progress
+        }
+
+    def _set_progress(self, n_frames: int, n_total: int, fps: float):
+        self.progressBar.setValue(int(n_frames * 100 / max(n_total, 1)))
+        QtWidgets.QApplication.processEvents()
+
     def _enable_non_tiff(self, f):
         if f == 'tiff':
             self._enable_non_tiff_ui(False)
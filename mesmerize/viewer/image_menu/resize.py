@@ -11,18 +11,160 @@ Sars International Centre for Marine Molecular Biology
 GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
 """
 
-from ...pyqtgraphCore.Qt import QtCore, QtGui, QtWidgets
-from skimage.transform import rescale
+from ...pyqtgraphCore.Qt import QtCore, QtWidgets
 import numpy as np
+from scipy import sparse
 from ..core.common import ViewerUtils
-from functools import partial
 from multiprocessing.pool import ThreadPool as Pool
 from ...common import get_sys_config
+from typing import *
 import traceback
 
 
+#: Approximate number of bytes of float64 working data per block of frames
+BLOCK_BYTES = 2 ** 27
+
+
+def _mirror(ixs: np.ndarray, n: int) -> np.ndarray:
+    """Map indices outside [0, n) back into the array by mirroring at the edges, i.e. (d c b | a b c d | c b a)"""
+    if n == 1:
+        return np.zeros_like(ixs)
+    period = 2 * (n - 1)
+    ixs = np.abs(ixs) % period
+    return np.where(ixs >= n, period - ixs, ixs)
+
+
+def resize_operator(n_in: int, n_out: int, anti_aliasing: bool = True) -> sparse.csr_matrix:
+    """
+    Sparse linear operator that resizes one axis, shape [n_out, n_in].
+
+    Uses the same pixel center mapping and bilinear interpolation as ``skimage.transform.rescale`` with mode
+    "reflect". When downsampling, a gaussian anti-aliasing filter with sigma = (n_in / n_out - 1) / 2 is applied
+    first, also the same as skimage.
+
+    :param n_in:            size of the axis in the input
+    :param n_out:           size of the axis in the output
+    :param anti_aliasing:   gaussian filter before downsampling
+    """
+    scale = n_in / n_out
+
+    # linear interpolation between the two input pixels around each output pixel center
+    coords = (np.arange(n_out) + 0.5) * scale - 0.5
+    i0 = np.floor(coords).astype(np.int64)
+    w = coords - i0
+
+    rows = np.repeat(np.arange(n_out), 2)
+    cols = _mirror(np.column_stack([i0, i0 + 1]).ravel(), n_in)
+    data = np.column_stack([1 - w, w]).ravel()
+
+    # duplicate entries from mirroring are summed
+    interp = sparse.csr_matrix((data, (rows, cols)), shape=(n_out, n_in))
+
+    if not anti_aliasing or scale <= 1:
+        return interp
+
+    # gaussian kernel truncated at 4 sigma, same as scipy.ndimage.gaussian_filter
+    sigma = (scale - 1) / 2
+    radius = int(4.0 * sigma + 0.5)
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel /= kernel.sum()
+
+    rows = np.repeat(np.arange(n_in), offsets.size)
+    cols = _mirror((np.arange(n_in)[:, np.newaxis] + offsets).ravel(), n_in)
+    data = np.tile(kernel, n_in)
+
+    gaussian = sparse.csr_matrix((data, (rows, cols)), shape=(n_in, n_in))
+
+    return (interp @ gaussian).tocsr()
+
+
+def resize_block(block: np.ndarray, op_x: sparse.csr_matrix, op_y: sparse.csr_matrix) -> np.ndarray:
+    """
+    Resize a block of frames with the separable operators, all frames are resized together.
+
+    :param block:   image sequence block, shape [x, y, t]
+    :param op_x:    operator for the x axis, from :func:`resize_operator`
+    :param op_y:    operator for the y axis, from :func:`resize_operator`
+    :return:        float64 array of shape [op_x.shape[0], op_y.shape[0], t]
+    """
+    x, y, t = block.shape
+    ox, oy = op_x.shape[0], op_y.shape[0]
+
+    # x axis: [x, y * t] -> [ox, y * t]
+    tmp = op_x @ np.asarray(block, dtype=np.float64).reshape(x, y * t)
+
+    # y axis: [y, ox * t] -> [oy, ox * t]
+    tmp = tmp.reshape(ox, y, t).transpose(1, 0, 2).reshape(y, ox * t)
+    tmp = op_y @ tmp
+
+    return tmp.reshape(oy, ox, t).transpose(1, 0, 2)
+
+
+def resize_sequence(seq: np.ndarray, factor: float, out: np.ndarray = None, out_path: str = None,
+                    n_threads: int = 1, block_bytes: int = BLOCK_BYTES,
+                    progress_callback: Callable[[int], None] = None) -> np.ndarray:
+    """
+    Resize every frame of an image sequence by a scaling factor.
+
+    The sequence is processed in blocks of frames that are read from ``seq``, resized with one separable sparse
+    interpolation and written into the preallocated output. ``seq`` can be a memmap, only the blocks that are being
+    processed are in memory. With ``out_path`` the output is a memmap as well, so input and output never have to
+    be in RAM together.
+
+    :param seq:         image sequence, shape [x, y, t]
+    :param factor:      scaling factor, output frame shape is round([x, y] * factor), at least 1 pixel
+    :param out:         preallocated output array, shape [max(round(x * factor), 1), max(round(y * factor), 1), t]
+    :param out_path:    create the output as a memmap .npy file at this path, if ``out`` is not given
+    :param n_threads:   number of blocks processed in parallel
+    :param block_bytes: approximate number of bytes of float64 working data per block
+    :param progress_callback: called with the number of frames after every block is written
+
+    :return: the resized image sequence, same dtype as ``seq``
+    """
+    x, y, n_frames = seq.shape
+    ox, oy = max(int(np.round(x * factor)), 1), max(int(np.round(y * factor)), 1)
+
+    if out is None:
+        if out_path is not None:
+            out = np.lib.format.open_memmap(out_path, mode='w+', dtype=seq.dtype, shape=(ox, oy, n_frames))
+        else:
+            out = np.empty((ox, oy, n_frames), dtype=seq.dtype)
+
+    elif out.shape != (ox, oy, n_frames):
+        raise ValueError(f'out must have shape {(ox, oy, n_frames)}, got {out.shape}')
+
+    op_x = resize_operator(x, ox)
+    op_y = resize_operator(y, oy)
+
+    frame_bytes = max(x * y, ox * oy, 1) * 8
+    block_frames = max(1, block_bytes // frame_bytes)
+    blocks = [slice(start, min(start + block_frames, n_frames)) for start in range(0, n_frames, block_frames)]
+
+    if np.issubdtype(out.dtype, np.integer):
+        lim = np.iinfo(out.dtype)
+    else:
+        lim = None
+
+    def process(s: slice) -> int:
+        r = resize_block(seq[:, :, s], op_x, op_y)
+        if lim is not None:
+            r = np.clip(np.rint(r), lim.min, lim.max)
+        out[:, :, s] = r
+        return s.stop - s.start
+
+    with Pool(max(1, n_threads)) as pool:
+        for n in pool.imap_unordered(process, blocks):
+            if progress_callback is not None:
+                progress_callback(n)
+
+    if isinstance(out, np.memmap):
+        out.flush()
+
+    return out
+
+
 class ResizeDialogBox(QtWidgets.QWidget):
-    sig_increase_progressBar = QtCore.pyqtSignal()
 
     def __init__(self, viewer_interface):
         QtWidgets.QWidget.__init__(self)
@@ -51,7 +193,7 @@ class ResizeDialogBox(QtWidgets.QWidget):
         self.status_label = QtWidgets.QLabel()
         self.status_label.setText('')
         layout.addWidget(self.status_label)
-        self.btn.clicked.connect(partial(self.resize_img_seq, self.spinBox.value() / 100))
+        self.btn.clicked.connect(lambda: self.resize_img_seq(self.spinBox.value() / 100))
         self.setLayout(layout)
         self.setWindowTitle('Resize')
         self.frames_processed = 0
@@ -70,7 +212,7 @@ class ResizeDialogBox(QtWidgets.QWidget):
 
         resizer = ResizeObject(seq, factor, n_processes)
 
-        resizer.signals.frame_processed.connect(self.increase_progress_bar)
+        resizer.signals.frames_processed.connect(self.increase_progress_bar)
         resizer.signals.result.connect(self.set_resized_array)
         resizer.signals.error.connect(self.show_error_message)
         resizer.signals.finished.connect(lambda: self.vi.viewer.status_bar_label.showMessage('Resize completed!'))
@@ -78,12 +220,11 @@ class ResizeDialogBox(QtWidgets.QWidget):
         resizer.signals.finished.connect(lambda: self.progressBar.setValue(0))
 
         self.thread_pool = QtCore.QThreadPool()
-        self.thread_pool.setMaxThreadCount(n_processes)
         self.thread_pool.start(resizer)
 
-    @QtCore.pyqtSlot()
-    def increase_progress_bar(self):
-        self.frames_processed += 1
+    @QtCore.pyqtSlot(int)
+    def increase_progress_bar(self, n_frames: int):
+        self.frames_processed += n_frames
         self.progressBar.setValue(int(self.frames_processed * 100 / self.num_frames_to_process))
 
     @QtCore.pyqtSlot(np.ndarray)
@@ -98,42 +239,36 @@ class ResizeDialogBox(QtWidgets.QWidget):
 
 
 class Signals(QtCore.QObject):
-    frame_processed = QtCore.pyqtSignal()
+    frames_processed = QtCore.pyqtSignal(int)
     result = QtCore.pyqtSignal(np.ndarray)
     finished = QtCore.pyqtSignal()
     error = QtCore.pyqtSignal(str)
 
 
 class ResizeObject(QtCore.QRunnable):
-    def __init__(self, seq, factor, n_processes):
+    def __init__(self, seq, factor, n_processes, out_path: str = None):
+        """
+        :param seq:         image sequence, shape [x, y, t]
+        :param factor:      scaling factor
+        :param n_processes: number of threads
+        :param out_path:    stream the output to a memmap .npy file at this path instead of keeping it in RAM
+        """
         super(ResizeObject, self).__init__()
         self.signals = Signals()
         self.seq = seq
         self.factor = factor
         self.n_processes = n_processes
-
-    def resize_split(self, template_factor, img):
-        tmpl = template_factor[0]
-        factor = template_factor[1]
-        r = np.zeros((tmpl.shape[0], tmpl.shape[1], img.shape[2]), dtype=img.dtype)
-
-        for i in range(0, img.shape[2]):
-            r[:, :, i] = rescale(img[:, :, i], factor, preserve_range=True)
-            self.signals.frame_processed.emit()
-
-        return r
+        self.out_path = out_path
 
     def run(self):
         try:
-            tmpl = rescale(self.seq[:, :, :2], self.factor)
-
-            template_factor = [tmpl, self.factor]
-
-            pool = Pool(self.n_processes)
-            splits_resized = pool.map(partial(self.resize_split, template_factor),
-                                      np.array_split(self.seq, self.n_processes, axis=2))
-
-            resized_array = np.concatenate(splits_resized, axis=2)
+            resized_array = resize_sequence(
+                self.seq,
+                self.factor,
+                out_path=self.out_path,
+                n_threads=self.n_processes,
+                progress_callback=self.signals.frames_processed.emit
+            )
         except:
             self.signals.error.emit(str(traceback.format_exc()))
         else:
@@ -1,36 +1,134 @@
+import os
 import cv2
 import numpy as np
+import tifffile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
 from .common import BitDepthConverter
-from typing import Tuple, Union, Any, List
+from ...common.configuration import get_sys_config
+from typing import Tuple, Union, Any, List, Optional, Dict
 
 
-def get_rect(seq: np.ndarray,
-              projection: str,
-              method: str,
-              denoise: str = 'blur',
-              denoise_params: tuple = (16, 16),
-              thresh: tuple = (50, 255),
-              padding: int = 30) -> Tuple[bool, List[Tuple[Union[object, Any], Union[object, Any]]]]:
+#: Approximate number of bytes of the image sequence, as float64, that are processed at a time
+CHUNK_BYTES = 2 ** 28
+
+#: Suffixes of the cached max & std projections of an image sequence file, same as for the images of project samples
+PROJECTION_SUFFIXES = ('_max_proj.tiff', '_std_proj.tiff')
+
+
+def _iter_chunks(seq, axis: int, chunk_bytes: int = CHUNK_BYTES, ix: tuple = None):
+    """
+    Yield consecutive chunks of frames along ``axis`` as arrays. Only the chunk is read from memmaps or lazily read
+    stacks.
+
+    :param seq:         image sequence, numpy array or any array-like with ``shape`` that can be sliced
+    :param axis:        time axis
+    :param chunk_bytes: approximate size of each chunk as float64
+    :param ix:          slices of the other axes that are applied to each chunk, for example to crop
+    """
+    ndim = len(seq.shape)
+    n_frames = seq.shape[axis]
+
+    frame_bytes = max(int(np.prod(seq.shape)) // max(n_frames, 1) * 8, 1)
+    chunk_size = max(1, chunk_bytes // frame_bytes)
+
+    if ix is None:
+        ix = (slice(None),) * (ndim - 1)
+    ix = list(ix)
+
+    for start in range(0, n_frames, chunk_size):
+        yield np.asarray(seq[tuple(ix[:axis] + [slice(start, start + chunk_size)] + ix[axis:])])
+
+
+def get_projections(seq, axis: int = 2, chunk_bytes: int = CHUNK_BYTES) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Max and standard deviation projections of an image sequence, computed in a single pass over chunks of frames.
+    Works with memmaps and lazily read stacks, see ``open_tiff()``, without loading the whole sequence.
+
+    :param seq:         image sequence
+    :param axis:        time axis
+    :param chunk_bytes: approximate size of the chunks, as float64
+    :return:            max projection, std projection
     """
+    max_proj = None
+    n, mean, m2 = 0, None, None
+
+    for chunk in _iter_chunks(seq, axis, chunk_bytes):
+        c_max = chunk.max(axis=axis)
+
+        c = chunk.astype(np.float64)
+        c_n = chunk.shape[axis]
+        c_mean = c.mean(axis=axis)
+        c_m2 = ((c - np.expand_dims(c_mean, axis)) ** 2).sum(axis=axis)
+
+        if max_proj is None:
+            max_proj, n, mean, m2 = c_max, c_n, c_mean, c_m2
+            continue
+
+        np.maximum(max_proj, c_max, out=max_proj)
+
+        # combine the mean & sum of squared differences of the chunk with those of the previous chunks
+        delta = c_mean - mean
+        total = n + c_n
+        mean += delta * (c_n / total)
+        m2 += c_m2 + delta ** 2 * (n * c_n / total)
+        n = total
 
-    :param seq:             image sequence
+    if max_proj is None:
+        raise ValueError('Image sequence has no frames')
+
+    return max_proj, np.sqrt(m2 / n)
+
+
+def get_projection(seq, projection: str, projections: Tuple[np.ndarray, np.ndarray] = None,
+                   chunk_bytes: int = CHUNK_BYTES) -> np.ndarray:
+    """
+    :param seq:         image sequence, time is the last axis
+    :param projection:  'max', 'std', or 'max+std'
+    :param projections: max & std projections if they have already been computed, ``seq`` is then not used
+    :param chunk_bytes: approximate size of the chunks of ``seq`` that are read at a time
+    :return:            projection image
+    """
+    if projection not in ('max', 'std', 'max+std'):
+        raise ValueError('Invalid projection argument: ' + str(projection))
+
+    if projections is None:
+        projections = get_projections(seq, axis=2, chunk_bytes=chunk_bytes)
+
+    max_proj, std_proj = projections
+
+    if projection == 'max':
+        return max_proj
+    elif projection == 'std':
+        return std_proj
+    else:
+        return max_proj + std_proj
+
+
+def get_rect(seq,
+             projection: str,
+             method: str,
+             denoise: str = 'blur',
+             denoise_params: tuple = (16, 16),
+             thresh: tuple = (50, 255),
+             padding: int = 30,
+             projections: Tuple[np.ndarray, np.ndarray] = None,
+             chunk_bytes: int = CHUNK_BYTES) -> Tuple[bool, List[Tuple[Union[object, Any], Union[object, Any]]]]:
+    """
+
+    :param seq:             image sequence, can be a memmap or lazily read stack
     :param projection:      'max', 'std', or 'max+std'
     :param method:          'threshold', 'spectral_saliency', or 'fine_grained_saliency'
     :param denoise:         'blur', 'NlMeans', or 'none'
     :param denoise_params:  params passed to cv2.blur or cv2.fastNlMeansDenoising
     :param thresh:          thresholds for binary image from which to get contours and rect
     :param padding:         number of pixels by which to increase boundaries of returned rectangle
+    :param projections:     max & std projections of ``seq`` if they have already been computed, such as cached ones
+    :param chunk_bytes:     approximate size of the chunks of ``seq`` that are read at a time
     :return:                [(x1, y1), (x2, y2)]
     """
 
-    if projection == 'max':
-        img = seq.max(axis=2)
-    elif projection == 'std':
-        img = seq.std(axis=2)
-    elif projection == 'max+std':
-        img = seq.max(axis=2) + seq.std(axis=2)
-    else:
-        raise ValueError('Invalid projection argument: ' + str(projection))
+    img = get_projection(seq, projection, projections, chunk_bytes)
 
     if img.dtype != np.uint8:
         img = img.astype('uint16')
@@ -59,7 +157,8 @@ def get_rect(seq: np.ndarray,
 
     rval, th_img = cv2.threshold(img.astype('uint8'), *thresh, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
 
-    im2, contours, hierarchy = cv2.findContours(th_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # OpenCV 3 also returns the image
+    contours, hierarchy = cv2.findContours(th_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2:]
 
     try:
         hierarchy = hierarchy[0]
@@ -79,10 +178,10 @@ def get_rect(seq: np.ndarray,
         # cv2.rectangle(th_img, (x,y), (x+w,y+h), (255, 0, 0), 2)
 
     x1 = max(0, min_x - padding)
-    x2 = min(img.shape[0], max_x + padding)
+    x2 = min(width, max_x + padding)
 
     y1 = max(0, min_y - padding)
-    y2 = min(img.shape[1], max_y + padding)
+    y2 = min(height, max_y + padding)
 
     if max_x - min_x > 0 and max_y - min_y > 0:
 
@@ -96,7 +195,7 @@ def crop(seq: np.ndarray, params: dict) -> np.ndarray:
     """
     :param seq:     image sequence
     :param params:  params, passed to get_rect()
-    :return:        cropped image sequence
+    :return:        cropped image sequence, a view of ``seq``
     """
     r, rect = get_rect(seq, **params)
     if r is False:
@@ -109,3 +208,188 @@ def crop(seq: np.ndarray, params: dict) -> np.ndarray:
     y2 = rect[1][1]
 
     return seq[y1:y2, x1:x2, :]
+
+
+class _TiffPages:
+    """Frames of a tiff file that can't be memory mapped, such as a compressed file, read when they are sliced"""
+    def __init__(self, path: str):
+        self.tif = tifffile.TiffFile(path)
+        page = self.tif.pages[0]
+        self.shape = (len(self.tif.pages), *page.shape)
+        self.dtype = page.dtype
+
+    def __getitem__(self, ix):
+        """Only the frames in the slice of the first axis are read"""
+        if not isinstance(ix, tuple):
+            ix = (ix,)
+
+        frames = self.tif.asarray(key=range(*ix[0].indices(self.shape[0])))
+        frames = frames.reshape(-1, *self.shape[1:])
+
+        return frames[(slice(None),) + ix[1:]]
+
+    def close(self):
+        self.tif.close()
+
+
+def open_tiff(path: str):
+    """
+    Open a tiff file of a 2D image sequence without reading it. It is memory mapped if possible, otherwise frames are
+    read when the stack is sliced. The axes are as they are in the file, [t, y, x], i.e. the transpose of the
+    sequences in the viewer.
+
+    :param path: path to the tiff file
+    :return:     memmap or lazily read stack
+    """
+    try:
+        stack = tifffile.memmap(path, mode='r')
+    except ValueError:
+        stack = _TiffPages(path)
+
+    if len(stack.shape) != 3:
+        raise ValueError(f'Can only auto-crop 2D image sequences, shape of tiff file is: {stack.shape}')
+
+    return stack
+
+
+def get_projection_paths(path: str) -> Tuple[str, str]:
+    """Paths of the cached max & std projections of a tiff file, ``<name>_max_proj.tiff`` & ``<name>_std_proj.tiff``"""
+    stem = os.path.splitext(path)[0]
+    return tuple(stem + suffix for suffix in PROJECTION_SUFFIXES)
+
+
+def load_cached_projections(path: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Cached max & std projections of a tiff file, None if they don't exist or are older than the file"""
+    proj_paths = get_projection_paths(path)
+
+    if not all(os.path.isfile(p) for p in proj_paths):
+        return None
+
+    if any(os.path.getmtime(p) < os.path.getmtime(path) for p in proj_paths):
+        return None
+
+    return tuple(tifffile.imread(p) for p in proj_paths)
+
+
+def get_file_projections(path: str, stack=None, cache: bool = True,
+                         chunk_bytes: int = CHUNK_BYTES) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Max & std projections of a tiff file in the same orientation as the viewer, the cached ones are used if they
+    exist. Otherwise they are computed in a single pass over the file.
+
+    :param path:        path to the tiff file
+    :param stack:       stack from ``open_tiff()`` if it's already open
+    :param cache:       save the projections next to the tiff file if they were computed
+    :param chunk_bytes: approximate size of the chunks that are read at a time
+    :return:            max projection, std projection
+    """
+    projections = load_cached_projections(path)
+    if projections is not None:
+        return projections
+
+    if stack is None:
+        stack = open_tiff(path)
+
+    max_proj, std_proj = get_projections(stack, axis=0, chunk_bytes=chunk_bytes)
+    projections = (max_proj.T, std_proj.T)
+
+    if cache:
+        imwrite = tifffile.imwrite if hasattr(tifffile, 'imwrite') else tifffile.imsave
+        try:
+            for p, proj in zip(get_projection_paths(path), projections):
+                imwrite(p, proj)
+        except OSError as e:
+            print(f'Could not cache projections of: {path}\n{e}')
+
+    return projections
+
+
+def crop_file(path: str, out_path: str, params: dict, cache_projections: bool = True,
+              chunk_bytes: int = CHUNK_BYTES) -> List[Tuple[int, int]]:
+    """
+    Auto-crop a tiff file and write the cropped sequence straight to a new tiff file, one chunk of frames at a time.
+    The file is only read once if its projections are cached.
+
+    :param path:                path to the tiff file
+    :param out_path:            path of the cropped tiff file
+    :param params:              params passed to ``get_rect()``
+    :param cache_projections:   save the projections next to the tiff file if they had to be computed
+    :param chunk_bytes:         approximate size of the chunks that are read at a time
+    :return:                    [(x1, y1), (x2, y2)], same as ``get_rect()``
+    """
+    if os.path.abspath(path) == os.path.abspath(out_path):
+        raise ValueError('Output path must be different from the input path')
+
+    stack = open_tiff(path)
+
+    try:
+        projections = get_file_projections(path, stack, cache_projections, chunk_bytes)
+
+        r, rect = get_rect(None, projections=projections, **params)
+        if r is False:
+            raise ValueError('Cannot crop image sequence, try different parameters\n' + str(rect))
+
+        (x1, y1), (x2, y2) = rect
+
+        # seq[y1:y2, x1:x2, :] in the viewer's orientation
+        ix = (slice(x1, x2), slice(y1, y2))
+
+        # no shape description, so that the pages written by all the chunks are read as a single series
+        with tifffile.TiffWriter(out_path, bigtiff=True) as tif:
+            for chunk in _iter_chunks(stack, 0, chunk_bytes, ix):
+                chunk = np.ascontiguousarray(chunk)
+                if hasattr(tif, 'write'):
+                    tif.write(chunk, photometric='minisblack', metadata=None)
+                else:
+                    tif.save(chunk, photometric='minisblack', metadata=None)
+    finally:
+        if isinstance(stack, _TiffPages):
+            stack.close()
+
+    return rect
+
+
+def crop_dir(src_dir: str, dst_dir: str, params: dict, pattern: str = '*.tif*', n_processes: int = None,
+             cache_projections: bool = True) -> Dict[str, Union[List[Tuple[int, int]], Exception]]:
+    """
+    Auto-crop all tiff files in a directory in parallel, the cropped files have the same names in ``dst_dir``.
+    Cached projection files are not cropped.
+
+    :param src_dir:             directory with the tiff files
+    :param dst_dir:             directory for the cropped files, created if it doesn't exist
+    :param params:              params passed to ``get_rect()``
+    :param pattern:             glob pattern of the files in ``src_dir``
+    :param n_processes:         number of processes, default is the number of threads from the system config
+    :param cache_projections:   save the projections next to the tiff files if they had to be computed
+    :return:                    rect of each file, or the exception if it could not be cropped
+    """
+    if os.path.abspath(src_dir) == os.path.abspath(dst_dir):
+        raise ValueError('Output directory must be different from the input directory')
+
+    os.makedirs(dst_dir, exist_ok=True)
+
+    if n_processes is None:
+        n_processes = get_sys_config()['_MESMERIZE_N_THREADS']
+
+    paths = sorted(p for p in glob(os.path.join(src_dir, pattern)) if not p.endswith(PROJECTION_SUFFIXES))
+
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=max(int(n_processes), 1)) as pool:
+        futures = {
+            pool.submit(
+                crop_file, p, os.path.join(dst_dir, os.path.basename(p)), params, cache_projections
+            ): p for p in paths
+        }
+
+        for i, future in enumerate(as_completed(futures)):
+            path = futures[future]
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                print(f'Could not crop: {path}\n{e}')
+                results[path] = e
+
+            print(f'{i + 1} / {len(paths)} files')
+
+    return results
@@ -23,15 +23,19 @@ from .pytemplates.batch_manager_pytemplate import *
 import json
 import pandas
 from .batch_run_modules import * # DO NOT REMOVE THIS LINE
+from .batch_run_modules.batch_db import BatchDB, COLUMNS
+from .batch_run_modules.input_store import InputStore, array_hash, link
+from .batch_run_modules.staging import Stager
+from .batch_output_inspector import OutputInspector
 import uuid
 import numpy as np
 # from .common import BatchRunInterface
 import pickle
 import tifffile
 import os
-from stat import S_IEXEC
 # from multiprocessing import Queue
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from collections import deque
 import psutil
 import traceback
@@ -53,6 +57,10 @@ class ModuleGUI(QtWidgets.QWidget):
     """GUI for the Batch Manager"""
     listwchanged = QtCore.pyqtSignal()
 
+    # emitted from the staging threads, (UUID, Future)
+    sig_staged_in = QtCore.pyqtSignal(object, object)
+    sig_staged_out = QtCore.pyqtSignal(object, object)
+
     def __init__(self, parent, run_batch: list = None, testing: bool = False):
         print('starting batch mananger')
         QtWidgets.QWidget.__init__(self, parent)
@@ -111,12 +119,24 @@ class ModuleGUI(QtWidgets.QWidget):
         self.ui.listwBatch.itemClicked.connect(self.show_item_info)
 
         self.output_widgets = []
-        self.df = pandas.DataFrame() #: pandas.DataFrame that stores a "database" of information on the batch
+        self._df = None
+        self.db = None  #: BatchDB of the currently open batch
+
+        self.process = None
+        self._staging_future = None
+        self.stager = None  #: Stager that copies files between the batch dir and the work dir during a batch run
+        self.sig_staged_in.connect(self._start_batch_item)
+        self.sig_staged_out.connect(self._staged_out)
 
-        self.move_processes = []
+        self.staging_timer = QtCore.QTimer(self)
+        self.staging_timer.timeout.connect(self.update_staging_label)
+        self.staging_timer.start(1000)
 
         self.ui.btnExportShScripts.clicked.connect(self.export_submission_scripts)
 
+        self.output_inspector = None
+        self.ui.btnInspectOutputs.clicked.connect(self.show_output_inspector)
+
         self.lwd = None
 
         self.ui.lineEditFindItem.textEdited.connect(self.higlight_items)
@@ -148,8 +168,7 @@ class ModuleGUI(QtWidgets.QWidget):
                 path = run_batch[0]
                 print('Opening batch: ' + path)
 
-            dfpath = os.path.join(path, 'dataframe.batch')
-            if os.path.isfile(dfpath):
+            if BatchDB.is_batch_dir(path):
                 self.open_batch_dir(path)
 
             else:
@@ -211,22 +230,30 @@ class ModuleGUI(QtWidgets.QWidget):
         os.makedirs(self.batch_path)
         self.ui.listwBatch.clear()
 
-        self.df = pandas.DataFrame(
-            columns=[
-                'module',
-                'input_params',
-                'output',
-                'info',
-                'uuid',
-                'save_temp_files'
-            ]
-        )
-        self.df.to_pickle(os.path.join(self.batch_path, 'dataframe.batch'))
+        self._set_db(BatchDB(self.batch_path))
 
         self.setWindowTitle('Batch Manager: ' + os.path.basename(self.batch_path))
         self.ui.labelBatchPath.setText(self.batch_path)
         self.show()
 
+    def _set_db(self, db: BatchDB):
+        if self.db is not None:
+            self.db.close()
+        self.db = db
+        self._df = None
+
+    @property
+    def df(self) -> pandas.DataFrame:
+        """
+        pandas.DataFrame of the items in the batch. It is derived from the batch database, which is the only record
+        of the items, and is read again after the items are changed.
+        """
+        if self._df is None:
+            if self.db is None:
+                return pandas.DataFrame(columns=COLUMNS)
+            self._df = self.db.to_dataframe()
+        return self._df
+
     def btn_view_input_slot(self):
         s = self.ui.listwBatch.currentItem()
         UUID = s.data(3)
@@ -433,6 +460,12 @@ class ModuleGUI(QtWidgets.QWidget):
         self.ui.scrollAreaStdOut.show()
         self.ui.scrollAreaOutputInfo.show()
         self.current_std_out = deque(maxlen=100)
+
+        if self._use_workdir and not IS_WINDOWS:
+            self.stager = Stager(self.batch_path, self.working_dir)
+        else:
+            self.stager = None
+
         self.run_batch_item()
 
     def set_list_widget_item_color(self, ix: int, color: str):
@@ -459,26 +492,26 @@ class ModuleGUI(QtWidgets.QWidget):
             # Deal with the previous batch item if it aborted and perform workdir cleanup
             if output is None:
                 self.set_list_widget_item_color(ix=self.current_batch_item_index, color='orange')
-                if self._use_workdir:
+                if self.stager is not None:
                     # cleanup workdir
-                    self.move_files([], UUID)
+                    self.stage_out([f'{UUID}.out'], UUID, self.current_batch_item_index)
 
             # Deal with the previous batch item that just finished
             elif output['status']:
-                if 'output_files' in output.keys() and self._use_workdir:# and os.path.isdir(self.working_dir):
-                    output_files_list = output['output_files']
+                if 'output_files' in output.keys() and self.stager is not None:
+                    output_files_list = output['output_files'] + [f'{UUID}.out']
 
-                    mp = self.move_files(output_files_list, UUID)
+                    # turns green once the outputs are in the batch dir
                     self.set_list_widget_item_color(ix=self.current_batch_item_index, color='blue')
-                    mp.finished.connect(partial(self.set_list_widget_item_color, self.current_batch_item_index, 'green'))
+                    self.stage_out(output_files_list, UUID, self.current_batch_item_index, color='green')
 
                 else:
                     self.set_list_widget_item_color(ix=self.current_batch_item_index, color='green')
             else:
                 self.set_list_widget_item_color(ix=self.current_batch_item_index, color='red')
-                if self._use_workdir:
+                if self.stager is not None:
                     # cleanup workdir
-                    self.move_files([f'{UUID}.out'], UUID)
+                    self.stage_out([f'{UUID}.out'], UUID, self.current_batch_item_index)
 
         self.current_batch_item_index += 1
         self.ui.progressBar.setValue(int(self.current_batch_item_index / len(self.df.index) * 100))
@@ -489,6 +522,71 @@ class ModuleGUI(QtWidgets.QWidget):
 
         r = self.df.iloc[self.current_batch_item_index]
 
+        # clear the output of any previous run of this item
+        self.db.set_output(r['uuid'], None)
+
+        self.ui.listwBatch.item(self.current_batch_item_index).setBackground(QtGui.QBrush(QtGui.QColor('yellow')))
+
+        if self.stager is None:
+            self._start_batch_item(r['uuid'])
+            return
+
+        # copy the files of this item to the work dir, and of the next few items while this one is being processed
+        for ix in range(self.current_batch_item_index,
+                        min(self.current_batch_item_index + self.stager.n_prefetch + 1, len(self.df.index))):
+            self.stage_in(self.df.iloc[ix]['uuid'])
+
+        self._staging_future = self.stage_in(r['uuid'])
+        self._staging_future.add_done_callback(partial(self.sig_staged_in.emit, r['uuid']))
+
+    def stage_in(self, UUID: uuid.UUID):
+        """Copy the files of a batch item to the work dir in the background, returns a Future"""
+        input_hash = self.db.get_input_hash(UUID)
+
+        if input_hash is None:
+            input_path = None
+        else:
+            input_path = InputStore(self.batch_path).get_path(input_hash)
+
+        return self.stager.stage_in(str(UUID), input_hash, input_path)
+
+    def stage_out(self, files: list, UUID: uuid.UUID, ix: int, color: Optional[str] = None):
+        """
+        Move the output files of a batch item to the batch dir in the background, and cleanup the work dir
+
+        :param files:   output file names
+        :param UUID:    UUID of the batch item
+        :param ix:      index of the batch item in the list widget
+        :param color:   color of the list widget item once the outputs are in the batch dir
+        """
+        future = self.stager.stage_out(str(UUID), files)
+        future.add_done_callback(partial(self.sig_staged_out.emit, (ix, color)))
+
+    @QtCore.pyqtSlot(object, object)
+    def _staged_out(self, ix_color: Tuple[int, Optional[str]], future):
+        ix, color = ix_color
+        if ix >= self.ui.listwBatch.count():
+            return
+
+        if future.exception() is not None:
+            self.ui.textBrowserStdOut.append(f'Could not move outputs to the batch dir:\n{future.exception()}')
+            self.set_list_widget_item_color(ix, 'red')
+
+        elif color is not None:
+            self.set_list_widget_item_color(ix, color)
+
+    @QtCore.pyqtSlot(object, object)
+    def _start_batch_item(self, UUID: uuid.UUID, future=None):
+        if future is not None and (future is not self._staging_future or not self.ui.btnAbort_batch.isEnabled()):
+            # batch was aborted while the files were being staged
+            return
+
+        if future is not None and future.exception() is not None:
+            # the item will fail without its files and the batch will continue
+            self.ui.textBrowserStdOut.append(f'Could not copy files to the work dir:\n{future.exception()}')
+
+        r = self.df.iloc[self.current_batch_item_index]
+
         self.process = QtCore.QProcess()
         self.process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
         # self.process.readyReadStandardError.connect(partial(self.print_qprocess_std_err, self.process))
@@ -496,7 +594,8 @@ class ModuleGUI(QtWidgets.QWidget):
 
         self.process.finished.connect(self.run_batch_item)
 
-        sh_file = self.create_runscript(r, cp=True, mv=False, use_subdir=False)
+        # files are already in the work dir if they were staged
+        sh_file = self.create_runscript(r, cp=True, mv=False, use_subdir=False, staged=self.stager is not None)
 
         self.process.setWorkingDirectory(self.working_dir)
 
@@ -504,37 +603,22 @@ class ModuleGUI(QtWidgets.QWidget):
             self.process.start('powershell.exe', [sh_file])
         else:
             self.process.start(sh_file)
-        self.ui.listwBatch.item(self.current_batch_item_index).setBackground(QtGui.QBrush(QtGui.QColor('yellow')))
-
-    def move_files(self, files: list, UUID) -> QtCore.QProcess:
-        shell_str = '#!/bin/bash\n'
-
-        files += [f'{UUID}.out']
-
-        for f in files:
-            src = os.path.join(self.working_dir, f)
-            dst = os.path.join(self.batch_path, f)
-            shell_str += f'mv {src} {dst}\n'
-        u = f'*{UUID}*'
-        shell_str += f'rm {os.path.join(self.working_dir, u)}'
-        move_file = os.path.join(self.working_dir, 'move.sh')
-
-        with(open(move_file, 'w')) as sh_mv_f:
-            sh_mv_f.write(shell_str)
-
-        mv_st = os.stat(move_file)
-        os.chmod(move_file, mv_st.st_mode | S_IEXEC)
 
-        move_process = QtCore.QProcess()
-        move_process.setWorkingDirectory(self.working_dir)
-        move_process.start(move_file)
-        self.move_processes.append(move_process)
-        move_process.finished.connect(partial(self.move_processes.remove, move_process))
+    def update_staging_label(self):
+        """Show the number of items being copied to or from the work dir, and the transfer rate"""
+        if self.stager is None:
+            self.ui.labelStaging.clear()
+            return
 
-        return move_process
+        self.ui.labelStaging.setText(
+            f'Staging queue: {self.stager.queue_depth}    {self.stager.throughput():.1f} MB/s'
+        )
 
     def batch_finished(self):
         self.ui.progressBar.setValue(100)
+        if self.stager is not None:
+            # outputs that are still being moved to the batch dir are moved in the background
+            self.stager.shutdown()
         self.disable_ui_buttons(False)
         self.ui.checkBoxUseWorkDir.setEnabled(True)
         QtWidgets.QMessageBox.information(self, 'Batch is done!', 'Yay, your batch has finished processing!')
@@ -562,7 +646,7 @@ class ModuleGUI(QtWidgets.QWidget):
             self.working_dir = self.batch_path
             self._use_workdir = False
 
-    def create_runscript(self, r, cp: bool, mv: bool, use_subdir: bool = True) -> str:
+    def create_runscript(self, r, cp: bool, mv: bool, use_subdir: bool = True, staged: bool = False) -> str:
         m = globals()[r['module']]
         module_path = os.path.abspath(m.__file__)
         u = r['uuid']
@@ -572,9 +656,29 @@ class ModuleGUI(QtWidgets.QWidget):
             cp = False
             mv = False
 
-        if cp:
+        if cp and staged:
+            # files were copied to the work dir by the Stager
+            cp_str = f'export CURR_BATCH_DIR={self.batch_path}'
+
+        elif cp:
             files = os.path.join(self.batch_path, f"*{u}*")
-            cp_str = f'cp {files} {self.working_dir}\nexport CURR_BATCH_DIR={self.batch_path}'
+            input_hash = self.db.get_input_hash(u)
+
+            if input_hash is None:
+                cp_str = f'cp {files} {self.working_dir}\nexport CURR_BATCH_DIR={self.batch_path}'
+            else:
+                # link the stored input instead of copying it, a symlink if the work dir is on another file system
+                input_path = InputStore(self.batch_path).get_path(input_hash)
+                work_input_path = os.path.join(self.working_dir, f'{u}_input.tiff')
+                batch_input_path = os.path.join(self.batch_path, f'{u}_input.tiff')
+
+                cp_str = '\n'.join(
+                    [
+                        f'for f in {files}; do [ "$f" = "{batch_input_path}" ] || cp "$f" {self.working_dir}; done',
+                        f'ln -f {input_path} {work_input_path} 2>/dev/null || ln -sf {input_path} {work_input_path}',
+                        f'export CURR_BATCH_DIR={self.batch_path}'
+                    ]
+                )
         else:
             cp_str = None
 
@@ -604,6 +708,19 @@ class ModuleGUI(QtWidgets.QWidget):
                             pre_run=cp_str,
                             post_run=mv_str)
 
+    def show_output_inspector(self):
+        """Show the summary of the CNMF, CNMFE & CNMF 3D outputs, without loading them into a viewer"""
+        if self.db is None:
+            return
+
+        if self.output_inspector is None:
+            self.output_inspector = OutputInspector(self)
+        else:
+            self.output_inspector.refresh()
+
+        self.output_inspector.show()
+        self.output_inspector.raise_()
+
     def export_submission_scripts(self):
         to_copy = self.ui.checkBoxUseWorkDir.isChecked()
         to_move = to_copy
@@ -615,21 +732,66 @@ class ModuleGUI(QtWidgets.QWidget):
                                           'have been exported to a jobs dir in your batch dir')
 
     def get_batch_item_output(self, UUID: uuid.UUID):
+        """
+        Output of a batch item from the batch database. The item's ``.out`` file is read instead if the output has
+        not been recorded in the database, or if the ``.out`` file is newer than the recorded output, such as for
+        items that were run again using exported submission scripts. The output is then recorded in the database.
+
+        :param UUID: UUID of the batch item
+        :return:     output dict, None if the item does not have an output
+        """
+        output, mtime = self.db.get_output(UUID)
+
+        out_file = self._get_out_file(UUID)
+        if out_file is None:
+            return output
+
+        out_mtime = os.path.getmtime(out_file)
+        if output is not None and mtime is not None and out_mtime <= mtime:
+            return output
+
+        output = json.load(open(out_file, 'r'))
+        self.db.set_output(UUID, output, mtime=out_mtime)
+
+        return output
+
+    def _get_out_file(self, UUID: uuid.UUID) -> Optional[str]:
+        """Path of the item's ``.out`` file in the work dir or the batch dir, None if it doesn't exist"""
         if self.working_dir is not None:
             out_file = os.path.join(self.working_dir, f'{UUID}.out')
             if os.path.isfile(out_file):
-                output = json.load(open(out_file, 'r'))
-                return output
+                return out_file
 
         out_file = os.path.join(self.batch_path, f'{UUID}.out')
 
         if os.path.isfile(out_file):
-            output = json.load(open(out_file, 'r'))
-            return output
+            return out_file
         else:
             return None
 
+    def get_batch_item_statuses(self) -> List[Optional[int]]:
+        """
+        Status of all items in the batch in order, 1 for finished, 0 for failed and None for items without an output.
+        Read from the batch database with one query, ``.out`` files are only read for items without a status or
+        whose ``.out`` file is newer than the recorded output.
+        """
+        statuses = []
+        for u, status, mtime in self.db.get_statuses():
+            out_file = self._get_out_file(u)
+
+            if out_file is not None and (status is None or mtime is None or os.path.getmtime(out_file) > mtime):
+                output = self.get_batch_item_output(u)
+                if output is not None:
+                    status = int(output['status'])
+
+            statuses.append(status)
+
+        return statuses
+
     def _terminate_qprocess(self):
+        if self.process is None or self.process.state() == QtCore.QProcess.NotRunning:
+            return
+
         try:
             py_proc = psutil.Process(self.process.pid()).children()[0].pid
         except psutil.NoSuchProcess:
@@ -660,12 +822,19 @@ class ModuleGUI(QtWidgets.QWidget):
         ) == QtWidgets.QMessageBox.No:
             return
 
-        self.process.finished.disconnect()  # stops it from going to the next item
-
         self.set_list_widget_item_color(ix=self.current_batch_item_index, color='orange')
 
-        self._terminate_qprocess()  # terminate the qproess for current batch item
+        # the current item has not started if its files are still being staged
+        if self.process is not None and self.process.state() != QtCore.QProcess.NotRunning:
+            self.process.finished.disconnect()  # stops it from going to the next item
+            self._terminate_qprocess()  # terminate the qproess for current batch item
+
         self.disable_ui_buttons(False)
+
+        if self.stager is not None:
+            # remove the files of the items that were copied in advance
+            self.stager.cancel(exclude=[self.df.iloc[self.current_batch_item_index]['uuid']])
+            self.stager.shutdown()
         self.ui.checkBoxUseWorkDir.setEnabled(True)
 
     def print_qprocess_std_out(self, proc):
@@ -697,27 +866,21 @@ class ModuleGUI(QtWidgets.QWidget):
         input_workEnv.to_pickle(
             self.batch_path,
             filename=filename,
-            save_img_seq=True,
+            save_img_seq=False,
             UUID=UUID
         )
 
+        # the image sequence is only written if it isn't already in the batch
+        input_hash = self._hash_input(input_workEnv.get_img_seq_to_save())
+        input_path = InputStore(self.batch_path).add(input_hash, input_workEnv.save_img_seq)
+        link(input_path, f'{filename}.tiff')
+
         pickle.dump(input_params, open(os.path.join(self.batch_path, str(UUID) + '.params'), 'wb'), protocol=4)
 
         input_params = np.array(input_params, dtype=object)
 
-        self.df = self.df.append(
-            {
-                'module':           module,
-                'name':             name,
-                'input_item':       None,
-                'input_params':     input_params,
-                'info':             info,
-                'uuid':             UUID,
-                'output':           None,
-                'save_temp_files':  0
-            },
-            ignore_index=True
-        )
+        self.db.add_item(UUID, module=module, name=name, input_params=input_params, info=info, input_hash=input_hash)
+        self._df = None
 
         self.ui.listwBatch.addItem(module + ': ' + name)
         n = self.ui.listwBatch.count()
@@ -726,9 +889,37 @@ class ModuleGUI(QtWidgets.QWidget):
         item.setData(3, UUID)
         self.set_line_numbers()
 
-        self.df.to_pickle(os.path.join(self.batch_path, 'dataframe.batch'))
         return UUID
 
+    def _hash_input(self, seq: np.ndarray) -> str:
+        """Hash the input image sequence in a worker thread, events are processed while waiting for it"""
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+
+        try:
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                future = pool.submit(array_hash, seq)
+
+                loop = QtCore.QEventLoop()
+                # quit is queued to the GUI thread, so it is also received if the hash is done before exec_()
+                future.add_done_callback(
+                    lambda f: QtCore.QMetaObject.invokeMethod(loop, 'quit', QtCore.Qt.QueuedConnection)
+                )
+                loop.exec_(QtCore.QEventLoop.ExcludeUserInputEvents)
+
+                return future.result()
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+    def set_save_temp_files(self, UUID: uuid.UUID, save_temp_files: int = 1):
+        """
+        Set whether the temp files of a batch item, such as memmaps, are kept after it is run
+
+        :param UUID:            UUID of the batch item
+        :param save_temp_files: 1 to keep the temp files, 0 to remove them
+        """
+        self.db.update_item(UUID, save_temp_files=save_temp_files)
+        self._df = None
+
     def del_item(self):
         """Delete the currently selected item from the batch and any corresponding dependents of the item's output"""
         if QtWidgets.QMessageBox.question(self, 'Confirm deletion',
@@ -738,12 +929,11 @@ class ModuleGUI(QtWidgets.QWidget):
                                           QtWidgets.QMessageBox.No) == QtWidgets.QMessageBox.No:
             return
         items = self.ui.listwBatch.selectedItems()
+        deleted = []
 
         for s in items:
             UUID = s.data(3)
-
-            self.df = self.df[self.df['uuid'] != UUID]
-            self.df.reset_index(drop=True, inplace=True)
+            deleted.append(UUID)
 
             ix = self.ui.listwBatch.indexFromItem(s).row()
             self.ui.listwBatch.takeItem(ix)
@@ -752,7 +942,11 @@ class ModuleGUI(QtWidgets.QWidget):
             for file in glob(self.batch_path + '/*' + str(UUID) + '*'):
                 os.remove(file)
 
-        self.df.to_pickle(self.batch_path + '/dataframe.batch')
+        self.db.delete_items(deleted)
+        self._df = None
+
+        # inputs that are no longer used by any item
+        InputStore(self.batch_path).collect_garbage(self.db.get_input_hashes())
 
     def set_line_numbers(self):
         self.ui.listWidgetItemNumbers.clear()
@@ -794,32 +988,28 @@ class ModuleGUI(QtWidgets.QWidget):
         self.open_batch_dir(path)
 
     def open_batch_dir(self, path: str):
-        dfpath = path + '/dataframe.batch'
-        if not os.path.isfile(dfpath):
+        if not BatchDB.is_batch_dir(path):
             QtWidgets.QMessageBox.warning(self, 'Invalid batch dir',
                                           'The selected directory does not appear to be a valid  batch directory '
-                                          'since it does not contain a "dataframe.batch" file')
+                                          'since it does not contain a "batch.db" or "dataframe.batch" file')
             return
         try:
-            df = pandas.read_pickle(dfpath)
-            self.df = df
+            self._set_db(BatchDB.open(path))
             self.batch_path = path
             self.setWindowTitle('Batch Manager: ' + os.path.basename(self.batch_path))
             self.ui.labelBatchPath.setText(self.batch_path)
 
             self.ui.listwBatch.clear()
 
-            for ix, r in self.df.iterrows():
+            for (ix, r), status in zip(self.df.iterrows(), self.get_batch_item_statuses()):
                 self.ui.listwBatch.addItem(r['module'] + ': ' + r['name'])
                 n = self.ui.listwBatch.count()
                 item = self.ui.listwBatch.item(n - 1)
                 item.setData(3, r['uuid'])
 
-                output = self.get_batch_item_output(r['uuid'])
-
-                if output is None:
+                if status is None:
                     continue
-                elif output['status']:
+                elif status:
                     self.ui.listwBatch.item(n - 1).setBackground(
                         QtGui.QBrush(QtGui.QColor('#77dd77'))) # green
                 else:
@@ -836,14 +1026,12 @@ class ModuleGUI(QtWidgets.QWidget):
         self.disable_ui_buttons(False)
 
     def reset_list_widget_colors(self):
-        for ix, r in self.df.iterrows():
+        for ix, status in enumerate(self.get_batch_item_statuses()):
             item = self.ui.listwBatch.item(ix)
 
-            output = self.get_batch_item_output(r['uuid'])
-
-            if output is None:
+            if status is None:
                 item.setBackground(QtGui.QBrush(QtGui.QColor('#FFFFFF')))
-            elif output['status']:
+            elif status:
                 item.setBackground(QtGui.QBrush(QtGui.QColor('#77dd77')))  # green
             else:
                 item.setBackground(QtGui.QBrush(QtGui.QColor('#fe0d00')))  # red
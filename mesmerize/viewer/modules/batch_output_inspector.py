@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Panel for inspecting the outputs of CNMF, CNMFE & CNMF 3D batch items without loading them into a viewer.
+"""
+
+from PyQt5 import QtCore, QtWidgets
+from ...pyqtgraphCore import PlotWidget, mkPen, intColor
+from .batch_run_modules.cnmf_results import get_results
+import numpy as np
+import os
+import traceback
+from uuid import UUID
+
+
+#: batch modules that save a ``<UUID>_results.hdf5`` file
+MODULES = ['CNMF', 'CNMFE', 'CNMF_3D']
+
+_COLUMNS = ['Item', 'Module', 'Components', 'Good', 'Bad', 'SNR median', 'r median', 'Time (min)']
+
+
+class OutputInspector(QtWidgets.QWidget):
+    def __init__(self, batch_manager, parent=None):
+        """
+        Table with the summary of the results of all finished CNMF, CNMFE & CNMF 3D items in the batch.
+        The traces of a few components of the selected item are plotted, only those traces are read from the file.
+
+        :param batch_manager: the Batch Manager
+        """
+        QtWidgets.QWidget.__init__(self, parent)
+        self.setWindowTitle('Inspect outputs')
+        self.batch_manager = batch_manager
+
+        layout = QtWidgets.QVBoxLayout(self)
+
+        self.table = QtWidgets.QTableWidget(self)
+        self.table.setColumnCount(len(_COLUMNS))
+        self.table.setHorizontalHeaderLabels(_COLUMNS)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.setSortingEnabled(True)
+        self.table.itemSelectionChanged.connect(self.plot_selected)
+        layout.addWidget(self.table)
+
+        hlayout = QtWidgets.QHBoxLayout()
+
+        hlayout.addWidget(QtWidgets.QLabel('Traces:', self))
+        self.combo_trace = QtWidgets.QComboBox(self)
+        self.combo_trace.addItems(['C', 'YrA'])
+        self.combo_trace.currentIndexChanged.connect(self.plot_selected)
+        hlayout.addWidget(self.combo_trace)
+
+        hlayout.addWidget(QtWidgets.QLabel('Number of good components to plot:', self))
+        self.spinbox_n_traces = QtWidgets.QSpinBox(self)
+        self.spinbox_n_traces.setRange(1, 100)
+        self.spinbox_n_traces.setValue(10)
+        self.spinbox_n_traces.valueChanged.connect(self.plot_selected)
+        hlayout.addWidget(self.spinbox_n_traces)
+
+        self.btn_refresh = QtWidgets.QPushButton('Refresh', self)
+        self.btn_refresh.clicked.connect(self.refresh)
+        hlayout.addWidget(self.btn_refresh)
+
+        layout.addLayout(hlayout)
+
+        self.plot_widget = PlotWidget(self)
+        layout.addWidget(self.plot_widget)
+
+        self.resize(900, 700)
+
+        self.refresh()
+
+    def _results_path(self, u: UUID) -> str:
+        return os.path.join(self.batch_manager.batch_path, f'{u}_results.hdf5')
+
+    def refresh(self):
+        """Read the summaries of all finished CNMF, CNMFE & CNMF 3D items"""
+        self.table.setSortingEnabled(False)
+        self.table.setRowCount(0)
+
+        df = self.batch_manager.df
+        db = self.batch_manager.db
+
+        names = dict(zip(df['uuid'], df['name']))
+        finished = [(u, m) for m in MODULES for u in db.get_uuids(module=m, status=1)]
+
+        for u, module in finished:
+            path = self._results_path(u)
+            if not os.path.isfile(path):
+                continue
+
+            try:
+                summary = get_results(path).summary
+            except Exception:
+                print(f'Could not read results of item {u}\n{traceback.format_exc()}')
+                continue
+
+            output = self.batch_manager.get_batch_item_output(u) or {}
+
+            values = [
+                names.get(u, ''),
+                module,
+                summary['n_components'],
+                summary['n_good'],
+                summary['n_bad'],
+                round(summary['SNR_comp']['median'], 2),
+                round(summary['r_values']['median'], 3),
+                round(output.get('processing_time', np.nan), 2)
+            ]
+
+            row = self.table.rowCount()
+            self.table.insertRow(row)
+
+            for col, v in enumerate(values):
+                item = QtWidgets.QTableWidgetItem()
+                item.setData(QtCore.Qt.DisplayRole, v)
+                # keep the UUID with the row so that it can be found after sorting
+                item.setData(QtCore.Qt.UserRole, u)
+                self.table.setItem(row, col, item)
+
+        self.table.setSortingEnabled(True)
+        self.table.resizeColumnsToContents()
+
+    def plot_selected(self):
+        """Plot the first few good components of the selected item"""
+        self.plot_widget.clear()
+
+        items = self.table.selectedItems()
+        if len(items) == 0:
+            return
+
+        u = items[0].data(QtCore.Qt.UserRole)
+        results = get_results(self._results_path(u))
+
+        ixs = results.good_components[:self.spinbox_n_traces.value()]
+        n = ixs.size
+        if n == 0:
+            return
+
+        try:
+            traces = results.get_traces(ixs, key=self.combo_trace.currentText())
+        except KeyError:
+            return
+
+        # stack the traces so that they don't overlap
+        offset = 0.
+        for i, trace in enumerate(traces):
+            trace = trace - np.nanmin(trace)
+            self.plot_widget.plot(trace + offset, pen=mkPen(intColor(i, hues=n)))
+            offset += np.nanmax(trace) * 1.1
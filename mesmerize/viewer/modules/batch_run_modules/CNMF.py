@@ -15,7 +15,6 @@ Adapted from @agiovann and @epnev
 from __future__ import division
 import sys
 import cv2
-from glob import glob
 try:
     cv2.setNumThreads(1)
 except:
@@ -30,6 +29,12 @@ import pickle
 import traceback
 import json
 import logging
+try:
+    from .memmap_cache import MemmapCache
+    from .batch_db import BatchDB
+except ImportError:  # when run as a script by the batch manager
+    from memmap_cache import MemmapCache
+    from batch_db import BatchDB
 
 
 if not sys.argv[0] == __file__:
@@ -37,11 +42,13 @@ if not sys.argv[0] == __file__:
     from ...core import ViewerUtils, ViewerWorkEnv
 
 
-def run(batch_dir: str, UUID: str):
+def run(batch_dir: str, UUID: str, save_temp_files: str):
     logging.basicConfig(stream=sys.stdout, level=logging.DEBUG,
                         format="%(relativeCreated)12d [%(filename)s:%(funcName)20s():%(lineno)s] [%(process)d] %(message)s")
     start_time = time()
 
+    save_temp_files = bool(int(save_temp_files))
+
     output = {'status': 0, 'output_info': ''}
     n_processes = os.environ['_MESMERIZE_N_THREADS']
     n_processes = int(n_processes)
@@ -55,15 +62,20 @@ def run(batch_dir: str, UUID: str):
         backend='local', n_processes=n_processes, single_thread=False, ignore_preexisting=True
     )
 
+    # batch_dir is the work dir if one is set, so the memmaps are on local scratch
+    memmap_cache = MemmapCache(batch_dir)
+    memmap_key = None
+
     try:
         print('Creating memmap')
 
-        memmap_fname = cm.save_memmap(
-            filename,
-            base_name='memmap-',
+        memmap_key, memmap_fname = memmap_cache.acquire(
+            filename[0],
+            owner=UUID,
             order='C',
             border_to_0=input_params['border_pix'],
-            dview=dview
+            dview=dview,
+            input_hash=BatchDB.read_input_hash(os.environ.get('CURR_BATCH_DIR', batch_dir), UUID)
         )
 
         Yr, dims, T = cm.load_memmap(memmap_fname)
@@ -108,11 +120,9 @@ def run(batch_dir: str, UUID: str):
 
     dview.terminate()
 
-    for mf in glob(batch_dir + '/memmap-*'):
-        try:
-            os.remove(mf)
-        except:
-            pass
+    if memmap_key is not None:
+        # the memmap is a temp file, it is only kept in the cache if it is saved
+        memmap_cache.release(memmap_key, owner=UUID, keep=save_temp_files)
 
     end_time = time()
     proc_time = (end_time - start_time) / 60
@@ -120,6 +130,7 @@ def run(batch_dir: str, UUID: str):
     output.update({'processing_time': proc_time})
 
     json.dump(output, open(file_path + '.out', 'w'))
+    BatchDB.record_output(os.environ.get('CURR_BATCH_DIR', batch_dir), UUID, output, file_path + '.out')
 
 
 class Output:
@@ -161,4 +172,4 @@ class Output:
 
 #if sys.argv[0] == __file__:
 if __name__ == '__main__':
-    run(sys.argv[1], sys.argv[2])
+    run(*sys.argv[1:])
@@ -23,7 +23,6 @@ from caiman.utils import visualization
 
 import os
 import pickle
-from glob import glob
 from functools import partial
 import traceback
 from time import time, sleep
@@ -38,6 +37,13 @@ try:
 except:
     pass
 
+try:
+    from .memmap_cache import MemmapCache
+    from .batch_db import BatchDB
+except ImportError:  # when run as a script by the batch manager
+    from memmap_cache import MemmapCache
+    from batch_db import BatchDB
+
 
 if not sys.argv[0] == __file__:
     from ..roi_manager import ModuleGUI
@@ -45,12 +51,14 @@ if not sys.argv[0] == __file__:
     from ....pyqtgraphCore.widgets.MatplotlibWidget import MatplotlibWidget
 
 
-def run(batch_dir: str, UUID: str):
+def run(batch_dir: str, UUID: str, save_temp_files: str):
     logging.basicConfig(stream=sys.stdout, level=logging.DEBUG,
                         format="%(relativeCreated)12d [%(filename)s:%(funcName)20s():%(lineno)s] [%(process)d] %(message)s")
 
     start_time = time()
 
+    save_temp_files = bool(int(save_temp_files))
+
     output = {'status': 0, 'output_info': ''}
     n_processes = os.environ['_MESMERIZE_N_THREADS']
     n_processes = int(n_processes)
@@ -94,6 +102,10 @@ def run(batch_dir: str, UUID: str):
         #ignore_preexisting=True
     )
 
+    # batch_dir is the work dir if one is set, so the memmaps are on local scratch
+    memmap_cache = MemmapCache(batch_dir)
+    memmap_key = None
+
     try:
         print('Creating memmap')
 
@@ -109,9 +121,9 @@ def run(batch_dir: str, UUID: str):
         # Y = Yr.T.reshape((T,) + dims, order='F')
 
 
-        memmap_path = cm.save_memmap(
-            filename, base_name=f'memmap-', order='C', dview=dview, border_to_0=input_params['border_pix'],
-
+        memmap_key, memmap_path = memmap_cache.acquire(
+            filename[0], owner=UUID, order='C', dview=dview, border_to_0=input_params['border_pix'],
+            input_hash=BatchDB.read_input_hash(os.environ.get('CURR_BATCH_DIR', batch_dir), UUID)
         )
 
         Yr, dims, T = cm.load_memmap(memmap_path)
@@ -147,14 +159,14 @@ def run(batch_dir: str, UUID: str):
 
             dview.terminate()
 
-            for mf in glob(batch_dir + '/memmap-*'):
-                os.remove(mf)
+            memmap_cache.release(memmap_key, owner=UUID, keep=save_temp_files)
 
             end_time = time()
             processing_time = (end_time - start_time) / 60
             output.update({'processing_time': processing_time})
 
             json.dump(output, open(file_path + '.out', 'w'))
+            BatchDB.record_output(os.environ.get('CURR_BATCH_DIR', batch_dir), UUID, output, file_path + '.out')
 
             return
 
@@ -206,17 +218,16 @@ def run(batch_dir: str, UUID: str):
 
     dview.terminate()
 
-    for mf in glob(batch_dir + '/memmap-*'):
-        try:
-            os.remove(mf)
-        except: # Windows doesn't like removing the memmaps
-            pass
+    if memmap_key is not None:
+        # the memmap is a temp file, it is only kept in the cache if it is saved
+        memmap_cache.release(memmap_key, owner=UUID, keep=save_temp_files)
 
     end_time = time()
     processing_time = (end_time - start_time) / 60
     output.update({'processing_time': processing_time})
 
     json.dump(output, open(file_path + '.out', 'w'))
+    BatchDB.record_output(os.environ.get('CURR_BATCH_DIR', batch_dir), UUID, output, file_path + '.out')
 
 
 class Output(QtWidgets.QWidget):
@@ -364,4 +375,4 @@ class Output(QtWidgets.QWidget):
 
 #if sys.argv[0] == __file__:
 if __name__ == '__main__':
-    run(sys.argv[1], sys.argv[2])
+    run(*sys.argv[1:])
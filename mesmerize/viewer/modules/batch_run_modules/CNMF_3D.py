@@ -31,6 +31,13 @@ from glob import glob
 import json
 import shutil
 
+try:
+    from .memmap_cache import MemmapCache
+    from .batch_db import BatchDB
+except ImportError:  # when run as a script by the batch manager
+    from memmap_cache import MemmapCache
+    from batch_db import BatchDB
+
 
 if not sys.argv[0] == __file__:
     from ...core import ViewerUtils, ViewerWorkEnv
@@ -58,34 +65,33 @@ def run(work_dir: str, UUID: str, save_temp_files: str):
         backend='local', n_processes=n_processes, single_thread=False, ignore_preexisting=True
     )
 
+    memmap_cache = MemmapCache(work_dir)
+    memmap_key = None
+
     try:
+        memmap_batchdir = []
         if input_params['use_memmap']:
             memmap_uuid = input_params['memmap_uuid']
 
+            # memmaps kept by batch items from before the memmap cache
             memmap_batchdir = glob(os.path.join(batch_dir, f'memmap-{memmap_uuid}*.mmap'))
 
-            # Check batch dir
-            if len(memmap_batchdir) > 0:
-                memmap_path = memmap_batchdir[0]
-                print(f'********** Found existing memmap in batch dir: {memmap_path} ********** ')
+        # Check batch dir
+        if len(memmap_batchdir) > 0:
+            memmap_path = memmap_batchdir[0]
+            print(f'********** Found existing memmap in batch dir: {memmap_path} ********** ')
 
-                # copy to work dir
-                if not os.path.samefile(batch_dir, work_dir):
-                    print('**** Copying memmap to work dir ****')
-                    shutil.copy(memmap_path, work_dir)
-                    memmap_path = glob(os.path.join(work_dir, f'memmap-{memmap_uuid}*.mmap'))[0]
-
-            else:
-                # remake the memmap with the same UUID so that future batch items can rely on it
-                print('********** Memmap not found, re-making memmap with the same UUID **********')
-                memmap_path = cm.save_memmap(
-                    [imgpath], base_name=f'memmap-{memmap_uuid}', is_3D=True, order='C', dview=dview
-                )
+            # copy to work dir
+            if not os.path.samefile(batch_dir, work_dir):
+                print('**** Copying memmap to work dir ****')
+                shutil.copy(memmap_path, work_dir)
+                memmap_path = glob(os.path.join(work_dir, f'memmap-{memmap_uuid}*.mmap'))[0]
 
         else:
-            print('********** Making memmap **********')
-            memmap_path = cm.save_memmap(
-                [imgpath], base_name=f'memmap-{UUID}', is_3D=True, order='C', dview=dview
+            # memmaps of the same input are shared by all batch items through the memmap cache
+            memmap_key, memmap_path = memmap_cache.acquire(
+                imgpath, owner=UUID, is_3D=True, order='C', dview=dview,
+                input_hash=BatchDB.read_input_hash(batch_dir, UUID)
             )
 
         print(f'Using memmap:\n{memmap_path}')
@@ -135,17 +141,14 @@ def run(work_dir: str, UUID: str, save_temp_files: str):
 
         output_files = [out_filename]
 
-        # Save the memmap
-        if save_temp_files:
+        # Keep the memmap in the batch dir so that future batch items can use it through its memmap UUID
+        if save_temp_files and memmap_key is not None:
             print("***** Keeping memmap file *****")
+            memmap_name = os.path.basename(memmap_path).replace(f'memmap-{memmap_key}', f'memmap-{UUID}', 1)
+            shutil.copy(memmap_path, os.path.join(batch_dir, memmap_name))
 
-            # copy to batch dir if batch_dir != work_dir
-            if not os.path.samefile(batch_dir, work_dir):
-                print("***** Copying memmap file to batch dir *****")
-                shutil.copy(memmap_path, batch_dir)
-
-        # Delete the memmap from the work dir
-        if not os.path.samefile(batch_dir, work_dir):
+        # Delete a memmap that was copied to the work dir
+        if memmap_key is None and not os.path.samefile(batch_dir, work_dir):
             print("***** Deleting memmap files from work dir *****")
             try:
                 os.remove(memmap_path)
@@ -166,11 +169,16 @@ def run(work_dir: str, UUID: str, save_temp_files: str):
 
     cm.stop_server(dview=dview)
 
+    if memmap_key is not None:
+        # the memmap is a temp file, it is only kept in the cache if it is saved
+        memmap_cache.release(memmap_key, owner=UUID, keep=save_temp_files)
+
     end_time = time()
     processing_time = (end_time - start_time) / 60
     output.update({'processing_time': processing_time})
 
     json.dump(output, open(filepath + '.out', 'w'))
+    BatchDB.record_output(batch_dir, UUID, output, filepath + '.out')
 
 
 class Output:
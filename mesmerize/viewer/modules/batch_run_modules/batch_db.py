@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+SQLite database of the items in a batch, kept in the batch directory as ``batch.db``.
+
+Items are added, modified and deleted one at a time in their own transactions, the database is never rewritten.
+The output of an item, the contents of its ``.out`` file, is stored along with its status so that the status of
+all items can be read with one query. The modification time of the ``.out`` file is stored with the output, so that
+an ``.out`` file written by a later run that could not record its output, such as one run using an exported
+submission script, is used instead of the stale output in the database.
+
+The default rollback journal is used, not WAL, since batch directories are often on network file systems on which
+WAL is not supported.
+
+Batches that were made with older versions of Mesmerize only have a ``dataframe.batch`` pickle, it is imported
+into a new database the first time the batch is opened.
+"""
+
+import os
+import json
+import pickle
+import sqlite3
+from uuid import UUID
+from typing import *
+import pandas as pd
+
+
+DB_FILENAME = 'batch.db'
+
+#: pickled DataFrame used for batches before the database
+LEGACY_FILENAME = 'dataframe.batch'
+
+#: seconds to wait for another process to release its lock on the database
+TIMEOUT = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    uuid            TEXT PRIMARY KEY,
+    position        INTEGER NOT NULL,
+    module          TEXT NOT NULL,
+    name            TEXT NOT NULL DEFAULT '',
+    input_item      TEXT,
+    input_params    BLOB,
+    info            BLOB,
+    save_temp_files INTEGER NOT NULL DEFAULT 0,
+    status          INTEGER,
+    output          TEXT,
+    input_hash      TEXT,
+    output_mtime    REAL
+);
+CREATE INDEX IF NOT EXISTS items_position ON items (position);
+CREATE INDEX IF NOT EXISTS items_module ON items (module);
+CREATE INDEX IF NOT EXISTS items_status ON items (status);
+"""
+
+#: columns of the batch DataFrame, in order
+COLUMNS = ['module', 'name', 'input_item', 'input_params', 'info', 'uuid', 'output', 'save_temp_files']
+
+_EDITABLE = {'module', 'name', 'input_item', 'input_params', 'info', 'save_temp_files'}
+_PICKLED = {'input_params', 'info'}
+
+
+def _dumps(obj: Any) -> bytes:
+    return sqlite3.Binary(pickle.dumps(obj, protocol=4))
+
+
+def _loads(blob: Optional[bytes]) -> Any:
+    if blob is None:
+        return None
+    return pickle.loads(blob)
+
+
+class BatchDB:
+    def __init__(self, batch_dir: str):
+        """
+        Open the database of a batch, it is created if it doesn't exist.
+
+        :param batch_dir: batch directory
+        """
+        self.batch_dir = batch_dir
+        self.path = os.path.join(batch_dir, DB_FILENAME)
+
+        self.conn = sqlite3.connect(self.path, timeout=TIMEOUT)
+        # WAL mode is persistent, databases that were made in WAL mode are changed back to the rollback journal
+        self.conn.execute('PRAGMA journal_mode=DELETE')
+        self.conn.executescript(_SCHEMA)
+
+        columns = [r[1] for r in self.conn.execute('PRAGMA table_info(items)')]
+        if 'input_hash' not in columns:
+            # databases made before inputs were stored by their hash
+            with self.conn:
+                self.conn.execute('ALTER TABLE items ADD COLUMN input_hash TEXT')
+
+        if 'output_mtime' not in columns:
+            # databases made before the modification time of outputs was stored
+            with self.conn:
+                self.conn.execute('ALTER TABLE items ADD COLUMN output_mtime REAL')
+
+    @staticmethod
+    def is_batch_dir(path: str) -> bool:
+        """If the directory has a batch database or a legacy ``dataframe.batch`` file"""
+        return any(os.path.isfile(os.path.join(path, f)) for f in (DB_FILENAME, LEGACY_FILENAME))
+
+    @classmethod
+    def open(cls, batch_dir: str):
+        """
+        Open the database of an existing batch. Batches with only a legacy ``dataframe.batch`` file are imported
+        into a new database, the ``dataframe.batch`` file is left as it is.
+        """
+        if os.path.isfile(os.path.join(batch_dir, DB_FILENAME)):
+            return cls(batch_dir)
+
+        legacy_path = os.path.join(batch_dir, LEGACY_FILENAME)
+        if not os.path.isfile(legacy_path):
+            raise FileNotFoundError(f'Not a batch directory: {batch_dir}')
+
+        df = pd.read_pickle(legacy_path)
+
+        db = cls(batch_dir)
+        try:
+            db.import_dataframe(df)
+        except:
+            db.close()
+            os.remove(db.path)
+            raise
+
+        return db
+
+    def close(self):
+        self.conn.close()
+
+    def import_dataframe(self, df: pd.DataFrame):
+        """Add all the items of a batch DataFrame from a legacy ``dataframe.batch`` file, in one transaction"""
+        rows = []
+        for position, (ix, r) in enumerate(df.iterrows()):
+            rows.append(
+                (
+                    str(r['uuid']),
+                    position,
+                    r['module'],
+                    r.get('name', ''),
+                    None if r.get('input_item', None) is None else str(r['input_item']),
+                    _dumps(r.get('input_params', None)),
+                    _dumps(r.get('info', None)),
+                    int(r.get('save_temp_files', 0)),
+                )
+            )
+
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO items (uuid, position, module, name, input_item, input_params, info, save_temp_files) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def add_item(self, u: Union[UUID, str], module: str, name: str = '', input_params: Any = None,
+                 info: Any = None, input_item: Optional[str] = None, save_temp_files: int = 0,
+                 input_hash: Optional[str] = None):
+        """
+        Add an item at the end of the batch
+
+        :param u:               UUID of the item
+        :param module:          module from batch_run_modules that runs the item
+        :param name:            name of the item
+        :param input_params:    input params of the item, pickled
+        :param info:            info of the item, pickled
+        :param input_item:      UUID of the item whose output is the input for this item, if any
+        :param save_temp_files: 1 to keep the temp files of the item, such as memmaps
+        :param input_hash:      hash of the input image sequence if it is in the batch's ``InputStore``
+        """
+        with self.conn:
+            self.conn.execute(
+                'INSERT INTO items '
+                '(uuid, position, module, name, input_item, input_params, info, save_temp_files, input_hash) '
+                'VALUES (?, (SELECT COALESCE(MAX(position) + 1, 0) FROM items), ?, ?, ?, ?, ?, ?, ?)',
+                (str(u), module, name, input_item, _dumps(input_params), _dumps(info), int(save_temp_files),
+                 input_hash)
+            )
+
+    def delete_items(self, uuids: Iterable[Union[UUID, str]]):
+        """Delete items from the batch"""
+        with self.conn:
+            self.conn.executemany('DELETE FROM items WHERE uuid = ?', [(str(u),) for u in uuids])
+
+    def update_item(self, u: Union[UUID, str], **fields):
+        """
+        Change fields of an item, such as ``save_temp_files``
+
+        :param u:       UUID of the item
+        :param fields:  any of 'module', 'name', 'input_item', 'input_params', 'info', 'save_temp_files'
+        """
+        invalid = set(fields.keys()) - _EDITABLE
+        if invalid:
+            raise KeyError(f'Cannot update fields: {invalid}')
+
+        values = [_dumps(v) if k in _PICKLED else v for k, v in fields.items()]
+        assignments = ', '.join(f'{k} = ?' for k in fields.keys())
+
+        with self.conn:
+            self.conn.execute(f'UPDATE items SET {assignments} WHERE uuid = ?', values + [str(u)])
+
+    def set_output(self, u: Union[UUID, str], output: Optional[dict], mtime: Optional[float] = None):
+        """
+        Record the output of an item, i.e. the contents of its ``.out`` file.
+
+        :param u:       UUID of the item
+        :param output:  output dict with a 'status' key, None to clear the output before the item is run again
+        :param mtime:   modification time of the ``.out`` file that has this output
+        """
+        if output is None:
+            status, output, mtime = None, None, None
+        else:
+            status, output = int(output['status']), json.dumps(output)
+
+        with self.conn:
+            self.conn.execute(
+                'UPDATE items SET status = ?, output = ?, output_mtime = ? WHERE uuid = ?',
+                (status, output, mtime, str(u))
+            )
+
+    def get_output(self, u: Union[UUID, str]) -> Tuple[Optional[dict], Optional[float]]:
+        """
+        Output of an item and the modification time of its ``.out`` file
+
+        :return: (output, mtime), output is None if it has not been recorded. mtime is None if it is not known.
+        """
+        row = self.conn.execute('SELECT output, output_mtime FROM items WHERE uuid = ?', (str(u),)).fetchone()
+
+        if row is None or row[0] is None:
+            return None, None
+
+        return json.loads(row[0]), row[1]
+
+    def get_statuses(self) -> List[Tuple[UUID, Optional[int], Optional[float]]]:
+        """
+        (UUID, status, mtime) of all items in order. status is None for items whose output has not been recorded,
+        mtime is the modification time of the ``.out`` file of the recorded output.
+        """
+        rows = self.conn.execute('SELECT uuid, status, output_mtime FROM items ORDER BY position')
+        return [(UUID(u), status, mtime) for u, status, mtime in rows]
+
+    def get_input_hash(self, u: Union[UUID, str]) -> Optional[str]:
+        """Hash of the item's input in the batch's ``InputStore``, None for items with their own input file"""
+        row = self.conn.execute('SELECT input_hash FROM items WHERE uuid = ?', (str(u),)).fetchone()
+        return None if row is None else row[0]
+
+    def get_input_hashes(self) -> Set[str]:
+        """Hashes of all the inputs that are used by items in the batch"""
+        rows = self.conn.execute('SELECT DISTINCT input_hash FROM items WHERE input_hash IS NOT NULL')
+        return {r[0] for r in rows}
+
+    def get_uuids(self, module: Optional[str] = None, status: Optional[int] = None) -> List[UUID]:
+        """
+        UUIDs of the items in order, filtered by module and status
+
+        :param module:  only items of this module
+        :param status:  only items with this status, 1 for finished, 0 for failed, -1 for items without an output
+        """
+        conditions, values = [], []
+
+        if module is not None:
+            conditions.append('module = ?')
+            values.append(module)
+
+        if status == -1:
+            conditions.append('status IS NULL')
+        elif status is not None:
+            conditions.append('status = ?')
+            values.append(int(status))
+
+        where = f'WHERE {" AND ".join(conditions)} ' if conditions else ''
+
+        rows = self.conn.execute(f'SELECT uuid FROM items {where}ORDER BY position', values)
+        return [UUID(r[0]) for r in rows]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Batch DataFrame of all items in order, same as the DataFrame of legacy ``dataframe.batch`` files"""
+        rows = self.conn.execute(
+            'SELECT module, name, input_item, input_params, info, uuid, save_temp_files FROM items ORDER BY position'
+        ).fetchall()
+
+        data = [
+            {
+                'module':           module,
+                'name':             name,
+                'input_item':       None if input_item is None else UUID(input_item),
+                'input_params':     _loads(input_params),
+                'info':             _loads(info),
+                'uuid':             UUID(u),
+                'output':           None,
+                'save_temp_files':  save_temp_files
+            }
+            for module, name, input_item, input_params, info, u, save_temp_files in rows
+        ]
+
+        return pd.DataFrame(data, columns=COLUMNS)
+
+    @staticmethod
+    def read_input_hash(batch_dir: str, u: Union[UUID, str]) -> Optional[str]:
+        """
+        Hash of the item's input in the batch's ``InputStore``, from the process that runs the item.
+
+        :param batch_dir:   batch directory
+        :param u:           UUID of the item
+
+        :return: None if the item has its own input file or if the database is not reachable
+        """
+        if not os.path.isfile(os.path.join(batch_dir, DB_FILENAME)):
+            return None
+
+        try:
+            db = BatchDB(batch_dir)
+        except sqlite3.Error:
+            return None
+
+        try:
+            return db.get_input_hash(u)
+        except sqlite3.Error:
+            return None
+        finally:
+            db.close()
+
+    @staticmethod
+    def record_output(batch_dir: str, u: Union[UUID, str], output: dict, out_path: str):
+        """
+        Record the output of an item from the process that ran it, after it has been written to the ``.out`` file.
+        The ``.out`` file remains the output that is used if the database is not reachable, for example from a
+        compute node, or if the output is newer than the one in the database.
+
+        Errors from the database are raised, the ``.out`` file has already been written so the output is not lost.
+
+        :param batch_dir:   batch directory
+        :param u:           UUID of the item
+        :param output:      output dict
+        :param out_path:    path of the ``.out`` file that the output was written to
+        """
+        if not os.path.isfile(os.path.join(batch_dir, DB_FILENAME)):
+            return
+
+        db = BatchDB(batch_dir)
+        try:
+            db.set_output(u, output, mtime=os.path.getmtime(out_path))
+        finally:
+            db.close()
@@ -33,11 +33,85 @@ from glob import glob
 from time import time
 import logging
 
+try:
+    from .batch_db import BatchDB
+except ImportError:  # when run as a script by the batch manager
+    from batch_db import BatchDB
+
 if not sys.argv[0] == __file__:
     from ...core.common import ViewerUtils
     from ...core.viewer_work_environment import ViewerWorkEnv
 
 
+#: Approximate number of bytes of the motion corrected movie that are read from the memmap at a time
+CHUNK_BYTES = 2 ** 28
+
+
+def _iter_frame_chunks(images: np.ndarray, chunk_bytes: int):
+    """Yield float32 copies of consecutive chunks of frames from the memmapped movie"""
+    frame_bytes = max(int(np.prod(images.shape[1:])) * 4, 1)
+    chunk_size = max(1, chunk_bytes // frame_bytes)
+
+    for start in range(0, images.shape[0], chunk_size):
+        yield np.array(images[start:start + chunk_size], dtype=np.float32)
+
+
+def write_mc_output(mmap_path: str, out_path: str, output_bit_depth: str, chunk_bytes: int = CHUNK_BYTES):
+    """
+    Write the motion corrected movie from the caiman memmap to a compressed tiff file, one chunk of frames at a time.
+    The global minimum is found in a first pass over the memmap, ignoring NaNs, the frames are then offset by the
+    minimum, converted to the output bit depth and written in a second pass. The memmap is removed afterwards.
+
+    :param mmap_path:           path to the caiman memmap of the motion corrected movie
+    :param out_path:            path of the output tiff file
+    :param output_bit_depth:    one of 'Do not convert', '8' or '16'
+    :param chunk_bytes:         approximate size of the chunks that are read from the memmap
+    """
+    Yr, dims, T = cm.load_memmap(mmap_path)
+    # same frame order as cm.load, this is a view of the memmap
+    images = np.reshape(Yr.T, [T] + list(dims), order='F')
+
+    movie_min = np.float32(np.inf)
+    with np.errstate(invalid='ignore'):
+        for chunk in _iter_frame_chunks(images, chunk_bytes):
+            if np.isnan(chunk).all():
+                continue
+            movie_min = np.fmin(movie_min, np.nanmin(chunk))
+
+    # all NaN movie
+    if not np.isfinite(movie_min):
+        movie_min = np.float32(0)
+
+    if output_bit_depth == '8':
+        dtype = np.uint8
+    elif output_bit_depth == '16':
+        dtype = np.uint16
+    else:
+        dtype = None
+
+    # No shape description, so that the pages written by all the chunks are read as a single series.
+    # ImageJ metadata is not written since it would only describe the frames of one chunk.
+    # Photometric must be explicit, otherwise chunks of 3 or 4 frames would be written as RGB(A) pages.
+    with tifffile.TiffWriter(out_path, bigtiff=True) as tif:
+        for chunk in _iter_frame_chunks(images, chunk_bytes):
+            chunk -= movie_min
+
+            if dtype is not None:
+                chunk = chunk.astype(dtype)
+
+            if hasattr(tif, 'write'):
+                tif.write(chunk, photometric='minisblack', compression='zlib', metadata=None)
+            else:
+                tif.save(chunk, photometric='minisblack', compress=1, metadata=None)
+
+    del images, Yr
+
+    try:
+        os.remove(mmap_path)
+    except OSError:  # Windows doesn't like removing memmaps that are open
+        pass
+
+
 def run(batch_dir: str, UUID: str):
     logging.basicConfig(stream=sys.stdout, level=logging.DEBUG,
                         format="%(relativeCreated)12d [%(filename)s:%(funcName)20s():%(lineno)s] [%(process)d] %(message)s")
@@ -81,21 +155,11 @@ def run(batch_dir: str, UUID: str):
         )
 
         mc.motion_correct_pwrigid(save_movie=True)
-        m_els = cm.load(mc.fname_tot_els)
         bord_px_els = np.ceil(np.maximum(np.max(np.abs(mc.x_shifts_els)),
                                          np.max(np.abs(mc.y_shifts_els)))).astype(np.int)
 
-        m_els -= np.nanmin(m_els)
-
-        if input_params['output_bit_depth'] == 'Do not convert':
-            pass
-        elif input_params['output_bit_depth'] == '8':
-            m_els = m_els.astype(np.uint8, copy=False)
-        elif input_params['output_bit_depth'] == '16':
-            m_els = m_els.astype(np.uint16)
-
         img_out_path = os.path.join(batch_dir, f'{UUID}_mc.tiff')
-        tifffile.imsave(img_out_path, m_els, bigtiff=True, imagej=True, compress=1)
+        write_mc_output(mc.fname_tot_els, img_out_path, input_params['output_bit_depth'])
 
         output.update({'status': 1, 'bord_px': int(bord_px_els)})
 
@@ -119,6 +183,7 @@ def run(batch_dir: str, UUID: str):
                    'output_files': output_files_list})
 
     json.dump(output, open(file_path + '.out', 'w'))
+    BatchDB.record_output(os.environ.get('CURR_BATCH_DIR', batch_dir), UUID, output, file_path + '.out')
 
 
 class Output:
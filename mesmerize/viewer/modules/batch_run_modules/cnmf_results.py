@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Lazy access to the ``<UUID>_results.hdf5`` files that CNMF, CNMFE & CNMF 3D batch items save with ``cnm.save()``.
+
+The summary of an item, such as the number of components and their SNR, is read from the small datasets in the file
+without reading the spatial & temporal components. Large arrays such as ``A``, ``C`` and ``YrA`` are only read when
+they are requested, and are cached for the most recently used items.
+"""
+
+import os
+from collections import OrderedDict
+from typing import *
+import numpy as np
+import h5py
+from scipy import sparse
+
+
+#: Number of items for which large arrays are kept in memory
+MAX_CACHED_ITEMS = 8
+
+_results_cache = OrderedDict()
+
+
+def _read(group: h5py.Group, key: str) -> Optional[np.ndarray]:
+    """Read a small dataset, None if it doesn't exist or if it was None when it was saved by caiman"""
+    if key not in group:
+        return None
+
+    obj = group[key]
+    if not isinstance(obj, h5py.Dataset):
+        return None
+
+    # caiman saves None as the string 'NoneType'
+    if obj.dtype.kind in 'SOU':
+        return None
+
+    return obj[()]
+
+
+def _stats(a: Optional[np.ndarray]) -> Dict[str, float]:
+    if a is None or a.size == 0:
+        return {'min': np.nan, 'median': np.nan, 'mean': np.nan, 'max': np.nan}
+
+    a = np.asarray(a, dtype=np.float64).ravel()
+    return {
+        'min': float(np.nanmin(a)),
+        'median': float(np.nanmedian(a)),
+        'mean': float(np.nanmean(a)),
+        'max': float(np.nanmax(a))
+    }
+
+
+class CNMFResults:
+    def __init__(self, path: str):
+        """
+        :param path: path to a ``<UUID>_results.hdf5`` file
+        """
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+
+        self._summary = None
+        self._good = None
+        self._arrays = {}
+        self._rows = {}
+
+    @property
+    def summary(self) -> dict:
+        """
+        Summary of the results, read without reading the spatial & temporal components.
+
+        keys:
+            | n_components:     number of components
+            | n_good:           number of components in ``idx_components``, all components if they were selected
+            | n_bad:            number of components in ``idx_components_bad``
+            | n_frames:         number of frames
+            | dims:             dims of the movie
+            | SNR_comp:         min, median, mean & max SNR of the good components
+            | r_values:         min, median, mean & max spatial correlation of the good components
+            | cnn_preds:        min, median, mean & max CNN classifier predictions of the good components
+        """
+        if self._summary is None:
+            self._summary = self._read_summary()
+        return self._summary
+
+    def _read_summary(self) -> dict:
+        with h5py.File(self.path, 'r') as f:
+            est = f['estimates']
+
+            n_components, n_frames = self._shape(est, 'C')
+
+            idx_components = _read(est, 'idx_components')
+            idx_components_bad = _read(est, 'idx_components_bad')
+
+            if idx_components is None:
+                # components were already selected, or were never evaluated
+                good = np.arange(n_components)
+            else:
+                good = np.asarray(idx_components, dtype=np.int64).ravel()
+
+            self._good = good
+
+            summary = {
+                'n_components': n_components,
+                'n_good': good.size,
+                'n_bad': 0 if idx_components_bad is None else np.asarray(idx_components_bad).size,
+                'n_frames': n_frames,
+                'dims': None if _read(est, 'dims') is None else tuple(_read(est, 'dims').tolist()),
+            }
+
+            for key in ['SNR_comp', 'r_values', 'cnn_preds']:
+                values = _read(est, key)
+                if values is not None and values.size == n_components:
+                    values = values[good]
+                summary[key] = _stats(values)
+
+        return summary
+
+    @property
+    def good_components(self) -> np.ndarray:
+        """Indices of the good components"""
+        if self._good is None:
+            self._summary = self._read_summary()
+        return self._good
+
+    @staticmethod
+    def _shape(est: h5py.Group, key: str) -> Tuple[int, int]:
+        if key not in est or not isinstance(est[key], h5py.Dataset) or est[key].dtype.kind in 'SOU':
+            return 0, 0
+        shape = est[key].shape
+        if len(shape) == 1:
+            return 1, shape[0]
+        return shape[0], shape[1]
+
+    def get_array(self, key: str) -> Optional[Union[np.ndarray, sparse.csc_matrix]]:
+        """
+        Get an array from the estimates, such as 'A', 'C', 'YrA', 'S', 'b' or 'f'. It is read from the file the first
+        time it is requested and then cached. Sparse arrays, such as 'A', are returned as a ``csc_matrix``.
+        """
+        if key not in self._arrays:
+            with h5py.File(self.path, 'r') as f:
+                est = f['estimates']
+                if key not in est:
+                    raise KeyError(f'No "{key}" in estimates of: {self.path}')
+
+                obj = est[key]
+
+                if isinstance(obj, h5py.Group):
+                    # caiman saves sparse matrices as their csc data, indices, indptr and shape
+                    a = sparse.csc_matrix(
+                        (obj['data'][()], obj['indices'][()], obj['indptr'][()]),
+                        shape=tuple(obj['shape'][()])
+                    )
+                else:
+                    a = _read(est, key)
+
+            self._arrays[key] = a
+
+        return self._arrays[key]
+
+    def get_traces(self, ixs: Iterable[int], key: str = 'C') -> np.ndarray:
+        """
+        Get the temporal traces of some of the components, only those rows are read from the file.
+
+        :param ixs: component indices
+        :param key: one of 'C', 'YrA', 'S' or 'F_dff'
+        :return:    2D array, [component, frame]
+        """
+        ixs = np.asarray(list(ixs), dtype=np.int64)
+
+        if key in self._arrays:
+            # caiman saves the traces of a single component as a 1D array
+            return np.atleast_2d(self._arrays[key])[ixs]
+
+        rows = self._rows.setdefault(key, {})
+        to_read = np.unique([i for i in ixs.tolist() if i not in rows])
+
+        with h5py.File(self.path, 'r') as f:
+            est = f['estimates']
+            if self._shape(est, key) == (0, 0):
+                raise KeyError(f'No "{key}" in estimates of: {self.path}')
+
+            if ixs.size == 0:
+                return np.empty((0, self._shape(est, key)[1]), dtype=est[key].dtype)
+
+            n_rows = self._shape(est, key)[0]
+            if to_read.size > 0 and (to_read.min() < 0 or to_read.max() >= n_rows):
+                raise IndexError(f'Component indices out of range for "{key}" with {n_rows} components')
+
+            if to_read.size > 0 and est[key].ndim == 1:
+                # caiman saves the traces of a single component as a 1D array
+                rows[0] = est[key][()]
+
+            elif to_read.size > 0:
+                # h5py needs increasing indices
+                for i, row in zip(to_read.tolist(), est[key][to_read.tolist()]):
+                    rows[i] = row
+
+        return np.vstack([rows[i] for i in ixs.tolist()])
+
+    @property
+    def has_arrays(self) -> bool:
+        return len(self._arrays) > 0 or len(self._rows) > 0
+
+    def clear_arrays(self):
+        """Free the cached arrays, the summary is kept"""
+        self._arrays.clear()
+        self._rows.clear()
+
+
+def get_results(path: str) -> CNMFResults:
+    """
+    Get the results of a batch item. The same object is returned for the same file so that what has been read
+    is cached. The large arrays of all but the ``MAX_CACHED_ITEMS`` most recently used items are freed.
+
+    :param path: path to a ``<UUID>_results.hdf5`` file
+    """
+    results = _results_cache.pop(path, None)
+
+    if results is None or results.mtime != os.path.getmtime(path):
+        results = CNMFResults(path)
+
+    _results_cache[path] = results
+
+    n = 0
+    for r in reversed(_results_cache.values()):
+        if not r.has_arrays:
+            continue
+        n += 1
+        if n > MAX_CACHED_ITEMS:
+            r.clear_arrays()
+
+    return results
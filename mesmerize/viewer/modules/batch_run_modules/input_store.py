@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Content addressed storage of the input image sequences of batch items.
+
+Each distinct image sequence is written once to the ``inputs`` directory of the batch, named by the hash of its
+contents. The ``<UUID>_input.tiff`` file of every batch item that uses it is a hard link to it, or a symlink if the
+file system does not support hard links, so batch items that are added from the same work environment, such as
+parameter sweeps, don't each write a copy of the image sequence.
+"""
+
+import os
+import hashlib
+from glob import glob
+from shutil import copyfile
+from typing import *
+import numpy as np
+import psutil
+
+
+def array_hash(a: np.ndarray, chunk_bytes: int = 2 ** 26) -> str:
+    """Hash of the shape, dtype & contents of an image sequence, hashed in chunks along the third axis"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'{a.shape}{a.dtype.str}'.encode())
+
+    if a.ndim < 3:
+        h.update(np.ascontiguousarray(a.T))
+        return h.hexdigest()
+
+    frame_bytes = max(int(np.prod(a.shape)) // max(a.shape[2], 1) * a.itemsize, 1)
+    chunk_size = max(1, chunk_bytes // frame_bytes)
+
+    for i in range(0, a.shape[2], chunk_size):
+        # sequences are usually fortran ordered, the transpose is then contiguous and doesn't need a copy
+        h.update(np.ascontiguousarray(a[:, :, i:i + chunk_size].T))
+
+    return h.hexdigest()
+
+
+def link(src: str, dst: str) -> str:
+    """
+    Link ``dst`` to ``src``, a hard link if possible, else a symlink, else a copy.
+
+    :return: one of 'hardlink', 'symlink' or 'copy'
+    """
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        pass
+
+    try:
+        os.symlink(os.path.abspath(src), dst)
+        return 'symlink'
+    except OSError:
+        pass
+
+    copyfile(src, dst)
+    return 'copy'
+
+
+class InputStore:
+    def __init__(self, batch_dir: str):
+        """
+        :param batch_dir: batch directory, the inputs are stored in its ``inputs`` directory
+        """
+        self.store_dir = os.path.join(batch_dir, 'inputs')
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def get_path(self, key: str) -> str:
+        """Path of the stored input with this hash"""
+        return os.path.join(self.store_dir, f'{key}.tiff')
+
+    def add(self, key: str, write: Callable[[str], None]) -> str:
+        """
+        Store an input if it isn't already stored.
+
+        :param key:     hash of the input, from ``array_hash``
+        :param write:   function that writes the input to the path that is passed to it
+        :return:        path of the stored input
+        """
+        path = self.get_path(key)
+
+        if os.path.isfile(path):
+            return path
+
+        # written to a temp file first so that a partly written input is never used
+        tmp_path = os.path.join(self.store_dir, f'tmp-{key}-{os.getpid()}.tiff')
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+        return path
+
+    def collect_garbage(self, referenced: Iterable[str]) -> List[str]:
+        """
+        Remove stored inputs that are not used by any batch item, and left over temp files.
+
+        :param referenced:  hashes of the inputs that are used by the batch items
+        :return:            paths of the removed inputs
+        """
+        referenced = {self.get_path(key) for key in referenced}
+
+        removed = []
+        for path in glob(os.path.join(self.store_dir, '*.tiff')):
+            if path in referenced:
+                continue
+
+            if os.path.basename(path).startswith('tmp-'):
+                pid = os.path.basename(path).split('-')[2].split('.')[0]
+                if pid.isdigit() and psutil.pid_exists(int(pid)):
+                    # still being written
+                    continue
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            removed.append(path)
+
+        return removed
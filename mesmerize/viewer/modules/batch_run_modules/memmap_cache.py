@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Cache of caiman memmaps that is shared by all the batch items of a batch.
+
+Memmaps are kept in the ``memmap_cache`` directory of the dir in which the batch items are processed, i.e. the work
+dir if one is set, otherwise the batch dir. They are keyed on the hash of the input and the memmap parameters, so batch
+items that run different parameters on the same input reuse one memmap. The hash of the input in the batch's
+``InputStore`` is used, the input file is only hashed for batch items whose input is not in the ``InputStore``.
+
+Each batch item that uses a memmap holds a reference to it, a reference file with the host name and process ID of
+the batch item.
+Memmaps that are not referenced by any running process are evicted, least recently used first, when the cache
+grows beyond its maximum size. Creating a memmap and evicting are guarded by lock files so that several batch items
+can use the cache at the same time.
+"""
+
+import os
+import re
+import json
+import socket
+import hashlib
+from glob import glob
+from time import time, sleep
+from contextlib import contextmanager
+from typing import *
+import psutil
+
+
+#: Default maximum total size of the memmaps in the cache
+MAX_CACHE_BYTES = 64 * 2 ** 30
+
+#: Lock files without a process ID which are older than this (seconds) were left by a process that was killed
+STALE_LOCK_TIMEOUT = 60
+
+#: Lock files of processes on other hosts which are older than this (seconds) were left by a process that was killed,
+#: since it cannot be checked if the process is still running
+REMOTE_STALE_LOCK_TIMEOUT = 6 * 60 * 60
+
+#: Host name of this machine, without characters that are used to separate the parts of file names
+HOST = re.sub(r'[^A-Za-z0-9.]', '', socket.gethostname())
+
+
+def file_hash(path: str, chunk_bytes: int = 2 ** 24) -> str:
+    """Content hash of a file, read in chunks"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _read_owner(path: str) -> Optional[Tuple[str, int]]:
+    """Host name & process ID that are written in a lock or reference file"""
+    try:
+        with open(path, 'r') as f:
+            host, pid = f.read().rsplit(':', 1)
+            return host, int(pid)
+    except (OSError, ValueError):
+        return None
+
+
+def _get_age(path: str) -> float:
+    try:
+        return time() - os.path.getmtime(path)
+    except OSError:
+        return 0.
+
+
+def _is_running(host: str, pid: int) -> bool:
+    """If the process is still running. Processes on other hosts can't be checked and are assumed to be running."""
+    if host != HOST:
+        return True
+    return psutil.pid_exists(pid)
+
+
+def _is_stale(path: str, remote_timeout: Optional[float] = None) -> bool:
+    """
+    If the process that created a lock or reference file is no longer running
+
+    :param path:            path of the lock or reference file
+    :param remote_timeout:  files of processes on other hosts are stale once they are older than this,
+                            they are never stale if None
+    """
+    owner = _read_owner(path)
+
+    if owner is None:
+        # the owner may not be written yet
+        return _get_age(path) > STALE_LOCK_TIMEOUT
+
+    host, pid = owner
+
+    if host != HOST:
+        return remote_timeout is not None and _get_age(path) > remote_timeout
+
+    return not _is_running(host, pid)
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+    except OSError:  # Windows doesn't like removing memmaps that are open
+        return False
+    return True
+
+
+class MemmapCache:
+    def __init__(self, work_dir: str, max_bytes: int = MAX_CACHE_BYTES):
+        """
+        :param work_dir:  dir in which the batch items are processed, the memmaps are kept in its ``memmap_cache``
+                          directory. This is the batch dir if no work dir is set.
+        :param max_bytes: maximum total size of the memmaps in the cache
+        """
+        self.cache_dir = os.path.join(work_dir, 'memmap_cache')
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def get_key(input_path: str, order: str = 'C', border_to_0: int = 0, is_3D: bool = False,
+                input_hash: Optional[str] = None) -> str:
+        """
+        Cache key for a memmap, from the hash of the input and the memmap parameters.
+
+        :param input_path:  path to the input image file
+        :param order:       memmap order
+        :param border_to_0: number of border pixels that are set to 0
+        :param is_3D:       if the input is a 3D image sequence
+        :param input_hash:  hash of the input in the batch's ``InputStore``, the input file is hashed if None
+        """
+        if input_hash is not None:
+            source = f'input:{input_hash}'
+        else:
+            source = f'file:{file_hash(input_path)}'
+
+        params = json.dumps({'order': order, 'border_to_0': int(border_to_0), 'is_3D': bool(is_3D)}, sort_keys=True)
+        return hashlib.blake2b(f'{source}{params}'.encode(), digest_size=16).hexdigest()
+
+    def acquire(self, input_path: str, owner: str, order: str = 'C', border_to_0: int = 0, is_3D: bool = False,
+                dview=None, input_hash: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Get a memmap of the input file, it is only made if it isn't already in the cache.
+        The memmap is not evicted until it is released by the owner or the owner's process exits.
+
+        :param input_path:  path to the input image file
+        :param owner:       ID of the batch item that uses the memmap, usually its UUID
+        :param order:       memmap order, passed to ``caiman.save_memmap``
+        :param border_to_0: number of border pixels that are set to 0, passed to ``caiman.save_memmap``
+        :param is_3D:       if the input is a 3D image sequence, passed to ``caiman.save_memmap``
+        :param dview:       passed to ``caiman.save_memmap``
+        :param input_hash:  hash of the input in the batch's ``InputStore``, from ``BatchDB.read_input_hash``.
+                            The input file is hashed if None, which reads the whole file.
+
+        :return: (cache key, memmap path)
+        """
+        key = self.get_key(input_path, order=order, border_to_0=border_to_0, is_3D=is_3D, input_hash=input_hash)
+
+        # hold the reference before looking for the memmap so that it can't be evicted in between
+        with self._lock('cache'):
+            self._add_ref(key, owner)
+            path = self._find(key)
+
+        if path is None:
+            with self._lock(key):
+                path = self._find(key)
+
+                if path is None:
+                    print('********** Memmap not in cache, making memmap **********')
+                    path = self._make(key, input_path, order, border_to_0, is_3D, dview)
+        else:
+            print(f'********** Found memmap in cache: {path} **********')
+
+        # for least recently used eviction
+        os.utime(path)
+
+        self.evict()
+
+        return key, path
+
+    def release(self, key: str, owner: str, keep: bool = True):
+        """
+        Release the owner's reference to a memmap, evicts memmaps if the cache is too large
+
+        :param key:     cache key of the memmap
+        :param owner:   ID of the batch item that used the memmap
+        :param keep:    keep the memmap in the cache until it is evicted, if False it is removed right away if no
+                        other batch item uses it
+        """
+        _remove(self._ref_path(key, owner))
+
+        if not keep:
+            with self._lock('cache'):
+                path = self._find(key)
+                if path is not None and self._n_refs(key) == 0 and _remove(path):
+                    print(f'********** Removed memmap from cache: {path} **********')
+                    try:
+                        os.rmdir(os.path.join(self.cache_dir, f'{key}.refs'))
+                    except OSError:
+                        pass
+
+        self.evict()
+
+    def _find(self, key: str) -> Optional[str]:
+        paths = glob(os.path.join(self.cache_dir, f'memmap-{key}_*.mmap'))
+        if len(paths) == 0:
+            return None
+        return paths[0]
+
+    def _make(self, key: str, input_path: str, order: str, border_to_0: int, is_3D: bool, dview) -> str:
+        import caiman as cm
+
+        # caiman appends the dims and number of frames to the base name
+        tmp_base = f'tmp-{key}-{HOST}-{os.getpid()}'
+
+        tmp_path = cm.save_memmap(
+            [input_path], base_name=os.path.join(self.cache_dir, tmp_base), order=order,
+            border_to_0=border_to_0, is_3D=is_3D, dview=dview
+        )
+
+        path = os.path.join(self.cache_dir, os.path.basename(tmp_path).replace(tmp_base, f'memmap-{key}', 1))
+        os.replace(tmp_path, path)
+
+        return path
+
+    def _ref_path(self, key: str, owner: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.refs', owner)
+
+    def _add_ref(self, key: str, owner: str):
+        path = self._ref_path(key, owner)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, 'w') as f:
+            f.write(f'{HOST}:{os.getpid()}')
+
+    def _n_refs(self, key: str) -> int:
+        """Number of references held by running processes, stale references are removed"""
+        n = 0
+        for ref in glob(os.path.join(self.cache_dir, f'{key}.refs', '*')):
+            if _is_stale(ref):
+                _remove(ref)
+            else:
+                n += 1
+        return n
+
+    @contextmanager
+    def _lock(self, name: str):
+        """
+        Lock file with the host name and process ID of the holder, locks of processes that no longer exist are broken
+        """
+        path = os.path.join(self.cache_dir, f'{name}.lock')
+
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if _is_stale(path, remote_timeout=REMOTE_STALE_LOCK_TIMEOUT):
+                    _remove(path)
+                else:
+                    sleep(0.1)
+                continue
+
+            with os.fdopen(fd, 'w') as f:
+                f.write(f'{HOST}:{os.getpid()}')
+            break
+
+        try:
+            yield
+        finally:
+            _remove(path)
+
+    def evict(self):
+        """Remove the least recently used memmaps that are not referenced until the cache is within ``max_bytes``"""
+        with self._lock('cache'):
+            # memmaps that were being made by processes which were killed
+            for tmp in glob(os.path.join(self.cache_dir, 'tmp-*')):
+                parts = os.path.basename(tmp).split('-')
+                if len(parts) < 4:
+                    continue
+                host, pid = parts[2], parts[3].split('_')[0]
+                if pid.isdigit() and not _is_running(host, int(pid)):
+                    _remove(tmp)
+
+            memmaps = glob(os.path.join(self.cache_dir, 'memmap-*.mmap'))
+            memmaps.sort(key=os.path.getmtime)
+
+            total = sum(os.path.getsize(p) for p in memmaps)
+
+            for path in memmaps:
+                if total <= self.max_bytes:
+                    break
+
+                key = os.path.basename(path)[len('memmap-'):].split('_')[0]
+                if self._n_refs(key) > 0:
+                    continue
+
+                size = os.path.getsize(path)
+                if _remove(path):
+                    print(f'********** Evicted memmap from cache: {path} **********')
+                    total -= size
+
+                    try:
+                        os.rmdir(os.path.join(self.cache_dir, f'{key}.refs'))
+                    except OSError:
+                        pass
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Staging of batch item files between the batch dir and the work dir, in background threads.
+
+The files of the next few batch items are copied to the work dir while the current item is being processed,
+and the outputs of finished items are moved back to the batch dir while the next item is being processed.
+Outputs that are copied between file systems are verified with a checksum before the originals are removed.
+Transient I/O errors, which are common with network storage, are retried.
+"""
+
+import os
+import errno
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
+from glob import glob
+from shutil import rmtree
+from time import time, sleep
+from typing import *
+
+
+#: Number of items after the current item whose files are copied to the work dir in advance
+N_PREFETCH = 2
+
+#: Number of threads that copy files
+N_WORKERS = 2
+
+#: Number of times a file operation is retried after a transient I/O error
+RETRIES = 3
+
+#: Seconds to wait before the first retry, doubled after each retry
+RETRY_DELAY = 1.0
+
+CHUNK_BYTES = 2 ** 24
+
+#: errno of I/O errors that are worth retrying
+TRANSIENT_ERRNOS = {
+    getattr(errno, name) for name in
+    ['EIO', 'EAGAIN', 'EBUSY', 'EINTR', 'ETIMEDOUT', 'ESTALE', 'ENETDOWN', 'ENETRESET', 'ECONNRESET', 'EREMOTEIO']
+    if hasattr(errno, name)
+}
+
+
+def retry(func: Callable, *args, retries: int = RETRIES, delay: float = RETRY_DELAY):
+    """Call a function, retrying if it raises a transient I/O error"""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args)
+        except OSError as e:
+            if e.errno not in TRANSIENT_ERRNOS or attempt == retries:
+                raise
+            print(f'I/O error, retrying in {delay * 2 ** attempt} seconds: {e}')
+            sleep(delay * 2 ** attempt)
+
+
+def checksum(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Stager:
+    def __init__(self, batch_dir: str, work_dir: str, n_prefetch: int = N_PREFETCH, n_workers: int = N_WORKERS):
+        """
+        :param batch_dir:   batch directory
+        :param work_dir:    work directory in which the batch items are processed
+        :param n_prefetch:  number of items after the current item whose files are copied in advance
+        :param n_workers:   number of threads that copy files
+        """
+        self.batch_dir = batch_dir
+        self.work_dir = work_dir
+        self.n_prefetch = n_prefetch
+
+        # stored inputs that are copied to the work dir, used by items that have the same input
+        self.local_inputs_dir = os.path.join(work_dir, 'inputs')
+
+        self._pool = ThreadPoolExecutor(max_workers=n_workers)
+        self._lock = threading.Lock()
+
+        self._staged_in = {}  # UUID str: Future
+        self._input_locks = {}  # input hash: Lock
+        self._input_users = {}  # input hash: set of UUID str
+
+        self._n_pending = 0
+        self._transferred = deque()  # (time, n_bytes)
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of items that are waiting to be, or are being, copied to or from the work dir"""
+        return self._n_pending
+
+    def throughput(self, window: float = 5.0) -> float:
+        """Rate at which files were copied in the last ``window`` seconds, in MB/s"""
+        now = time()
+        with self._lock:
+            while len(self._transferred) > 0 and self._transferred[0][0] < now - window:
+                self._transferred.popleft()
+            n_bytes = sum(n for t, n in self._transferred)
+
+        return n_bytes / window / 1e6
+
+    def _submit(self, func: Callable, *args) -> Future:
+        with self._lock:
+            self._n_pending += 1
+
+        future = self._pool.submit(func, *args)
+        future.add_done_callback(self._done)
+
+        return future
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._n_pending -= 1
+
+    def _copy(self, src: str, dst: str) -> str:
+        """Copy in chunks, the checksum of the source is computed while it is read"""
+        h = hashlib.blake2b(digest_size=16)
+
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            for chunk in iter(lambda: fsrc.read(CHUNK_BYTES), b''):
+                fdst.write(chunk)
+                h.update(chunk)
+
+                with self._lock:
+                    self._transferred.append((time(), len(chunk)))
+
+        return h.hexdigest()
+
+    def _copy_verified(self, src: str, dst: str):
+        """Copy to a temp file which is only renamed to ``dst`` once its checksum matches the source"""
+        tmp = f'{dst}.staging-{os.getpid()}'
+        try:
+            src_checksum = retry(self._copy, src, tmp)
+
+            if retry(checksum, tmp) != src_checksum:
+                raise IOError(f'Checksum of copy does not match source: {src}')
+
+            os.replace(tmp, dst)
+        finally:
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+
+    def stage_in(self, u: str, input_hash: Optional[str] = None, input_path: Optional[str] = None) -> Future:
+        """
+        Copy the files of a batch item to the work dir, if they are not already being copied.
+
+        :param u:           UUID of the batch item
+        :param input_hash:  hash of the item's input if it is in the batch's ``InputStore``
+        :param input_path:  path of the stored input
+        :return:            Future that is done once the files are in the work dir
+        """
+        u = str(u)
+        with self._lock:
+            if u in self._staged_in:
+                return self._staged_in[u]
+
+            if input_hash is not None:
+                self._input_users.setdefault(input_hash, set()).add(u)
+                self._input_locks.setdefault(input_hash, threading.Lock())
+
+        future = self._submit(self._stage_in, u, input_hash, input_path)
+
+        with self._lock:
+            self._staged_in[u] = future
+
+        return future
+
+    def _stage_in(self, u: str, input_hash: Optional[str], input_path: Optional[str]):
+        batch_input = os.path.join(self.batch_dir, f'{u}_input.tiff')
+
+        for src in glob(os.path.join(self.batch_dir, f'*{u}*')):
+            if not os.path.isfile(src):
+                continue
+
+            if input_hash is not None and src == batch_input:
+                continue
+
+            self._copy_verified(src, os.path.join(self.work_dir, os.path.basename(src)))
+
+        if input_hash is not None:
+            self._link_input(u, input_hash, input_path)
+
+    def _link_input(self, u: str, input_hash: str, input_path: str):
+        """Hard link the stored input into the work dir, it's copied to the work dir once if that isn't possible"""
+        dst = os.path.join(self.work_dir, f'{u}_input.tiff')
+
+        # left in the work dir by an earlier run of the item, replaced like ``ln -f`` does
+        try:
+            os.remove(dst)
+        except FileNotFoundError:
+            pass
+
+        try:
+            os.link(input_path, dst)
+            return
+        except OSError:
+            pass
+
+        local_input = os.path.join(self.local_inputs_dir, os.path.basename(input_path))
+
+        with self._input_locks[input_hash]:
+            if not os.path.isfile(local_input):
+                os.makedirs(self.local_inputs_dir, exist_ok=True)
+                self._copy_verified(input_path, local_input)
+
+        os.link(local_input, dst)
+
+    def stage_out(self, u: str, files: List[str]) -> Future:
+        """
+        Move the outputs of a batch item from the work dir to the batch dir, and remove the item's files from the
+        work dir.
+
+        :param u:       UUID of the batch item
+        :param files:   file names of the outputs
+        :return:        Future that is done once the outputs are in the batch dir
+        """
+        u = str(u)
+        with self._lock:
+            # so that cancel() doesn't remove the outputs before they are moved
+            self._staged_in.pop(u, None)
+
+        return self._submit(self._stage_out, u, list(files))
+
+    def _stage_out(self, u: str, files: List[str]):
+        for f in files:
+            src = os.path.join(self.work_dir, f)
+            dst = os.path.join(self.batch_dir, f)
+
+            if not os.path.isfile(src):
+                continue
+
+            try:
+                os.rename(src, dst)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # different file systems
+                self._copy_verified(src, dst)
+
+        self._remove_work_files(u)
+
+    def _remove_work_files(self, u: str):
+        for path in glob(os.path.join(self.work_dir, f'*{u}*')):
+            if os.path.isfile(path) or os.path.islink(path):
+                os.remove(path)
+
+        with self._lock:
+            self._staged_in.pop(u, None)
+
+            unused = []
+            for input_hash, users in self._input_users.items():
+                users.discard(u)
+                if len(users) == 0:
+                    unused.append(input_hash)
+
+            for input_hash in unused:
+                self._input_users.pop(input_hash)
+
+        # inputs that were copied to the work dir and are not used by any of the staged items
+        for input_hash in unused:
+            with self._input_locks[input_hash]:
+                for path in glob(os.path.join(self.local_inputs_dir, f'{input_hash}*')):
+                    os.remove(path)
+
+    def cancel(self, exclude: Iterable[str] = ()):
+        """
+        Cancel the copying of files to the work dir, and remove the files of the items that were copied in advance.
+        Outputs that are being moved to the batch dir are not cancelled.
+
+        :param exclude: UUIDs of the items whose files are left in the work dir, such as the item being processed
+        """
+        exclude = set(map(str, exclude))
+
+        with self._lock:
+            staged = [(u, f) for u, f in self._staged_in.items() if u not in exclude]
+
+        for u, future in staged:
+            future.cancel()
+            future.add_done_callback(lambda f, u=u: self._remove_work_files(u))
+
+    def shutdown(self):
+        """Let the queued copies finish in the background, then remove the inputs that were copied to the work dir"""
+        self._pool.submit(rmtree, self.local_inputs_dir, True)
+        self._pool.shutdown(wait=False)
@@ -164,7 +164,7 @@ class ModuleGUI(QtWidgets.QDockWidget):
             if memmap_uuid not in bm.df['uuid'].values:
                 raise ValueError("The entered memmap UUID isn't present in this batch")
 
-            bm.df.loc[bm.df['uuid'] == memmap_uuid, 'save_temp_files'] = 1
+            bm.set_save_temp_files(memmap_uuid, 1)
 
         u = bm.add_item(
             module='CNMF_3D',
@@ -179,7 +179,7 @@ class ModuleGUI(QtWidgets.QDockWidget):
             return
 
         if d['keep_memmap']:
-            bm.df.loc[bm.df['uuid'] == u, 'save_temp_files'] = 1
+            bm.set_save_temp_files(u, 1)
 
         self.vi.viewer.status_bar_label.showMessage(f'Finished adding CNMF 3D item: "{name}" to batch')
         self.ui.lineEdit_name.clear()
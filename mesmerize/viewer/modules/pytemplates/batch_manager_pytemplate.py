@@ -116,6 +116,15 @@ class Ui_Form(object):
         self.btnExportShScripts.setMaximumSize(QtCore.QSize(16777215, 50))
         self.btnExportShScripts.setObjectName("btnExportShScripts")
         self.horizontalLayout_4.addWidget(self.btnExportShScripts)
+        self.btnInspectOutputs = QtWidgets.QPushButton(self.layoutWidget)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.MinimumExpanding, QtWidgets.QSizePolicy.MinimumExpanding)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.btnInspectOutputs.sizePolicy().hasHeightForWidth())
+        self.btnInspectOutputs.setSizePolicy(sizePolicy)
+        self.btnInspectOutputs.setMaximumSize(QtCore.QSize(16777215, 50))
+        self.btnInspectOutputs.setObjectName("btnInspectOutputs")
+        self.horizontalLayout_4.addWidget(self.btnInspectOutputs)
         self.verticalLayout.addLayout(self.horizontalLayout_4)
         self.horizontalLayout_3 = QtWidgets.QHBoxLayout()
         self.horizontalLayout_3.setObjectName("horizontalLayout_3")
@@ -191,6 +200,9 @@ class Ui_Form(object):
         self.progressBar.setTextDirection(QtWidgets.QProgressBar.TopToBottom)
         self.progressBar.setObjectName("progressBar")
         self.verticalLayout_5.addWidget(self.progressBar)
+        self.labelStaging = QtWidgets.QLabel(self.layoutWidget)
+        self.labelStaging.setObjectName("labelStaging")
+        self.verticalLayout_5.addWidget(self.labelStaging)
         self.scrollArea = QtWidgets.QScrollArea(self.splitter)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
         sizePolicy.setHorizontalStretch(0)
@@ -256,7 +268,8 @@ class Ui_Form(object):
         Form.setTabOrder(self.btnStart, self.btnStartAtSelection)
         Form.setTabOrder(self.btnStartAtSelection, self.btnDelete)
         Form.setTabOrder(self.btnDelete, self.btnExportShScripts)
-        Form.setTabOrder(self.btnExportShScripts, self.btnAbort)
+        Form.setTabOrder(self.btnExportShScripts, self.btnInspectOutputs)
+        Form.setTabOrder(self.btnInspectOutputs, self.btnAbort)
         Form.setTabOrder(self.btnAbort, self.btnAbort_batch)
         Form.setTabOrder(self.btnAbort_batch, self.btnNew)
         Form.setTabOrder(self.btnNew, self.btnOpen)
@@ -277,6 +290,8 @@ class Ui_Form(object):
         self.btnStartAtSelection.setText(_translate("Form", "Start at selection"))
         self.btnDelete.setText(_translate("Form", "Delete selection"))
         self.btnExportShScripts.setText(_translate("Form", "Export shell scripts"))
+        self.btnInspectOutputs.setToolTip(_translate("Form", "Summary of the CNMF, CNMFE & CNMF 3D outputs of the batch"))
+        self.btnInspectOutputs.setText(_translate("Form", "Inspect outputs"))
         self.btnAbort.setText(_translate("Form", "Abort current item"))
         self.btnAbort_batch.setText(_translate("Form", "Abort batch"))
         self.btnNew.setText(_translate("Form", "New Batch"))
@@ -15,6 +15,7 @@ from ..core.common import ViewerUtils
 from .pytemplates.roi_manager_pytemplate import *
 from .roi_manager_modules import managers
 from .roi_manager_modules.roi_types import *
+from .roi_manager_modules.roi_store import columns_to_states
 from functools import partial
 import traceback
 
@@ -217,6 +218,9 @@ class ModuleGUI(QtWidgets.QDockWidget):
         if 'roi_type' not in states.keys():
             raise TypeError('`roi_type` not specified in states dict')
 
+        # states saved with a sample are stored as columns
+        states = columns_to_states(states)
+
         roi_class = states["roi_type"]
 
         if roi_class not in globals().keys():
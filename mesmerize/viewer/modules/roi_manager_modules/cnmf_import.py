@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Vectorized helpers for importing CNMF(E) components into the ROI Manager
+"""
+
+import numpy as np
+from scipy import sparse
+from typing import *
+
+
+def _segment_top_n_means(values: np.ndarray, indptr: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Means of the largest n values within each segment, for all the raw min & max options.
+
+    :param values: values sorted in ascending order within each segment
+    :param indptr: segment boundaries, segment i is values[indptr[i]:indptr[i + 1]]
+    """
+    sizes = np.diff(indptr)
+    ends = indptr[1:]
+
+    csum = np.zeros(values.size + 1, dtype=np.float64)
+    np.cumsum(values, out=csum[1:])
+
+    p5 = (sizes * 0.05).astype(np.int64)
+
+    ns = {
+        'top_5': np.minimum(5, sizes),
+        'top_10': np.minimum(10, sizes),
+        'top_5p': p5,
+        'top_10p': p5 * 2,
+        'top_25p': p5 * 5
+    }
+
+    out = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for k, n in ns.items():
+            # np.partition(a, -0)[-0:] is the whole array, keep that behaviour for small components
+            n = np.where(n == 0, sizes, n)
+            out[k] = (csum[ends] - csum[ends - n]) / n
+
+        out['full_mean'] = (csum[ends] - csum[indptr[:-1]]) / sizes
+
+    return out
+
+
+def _gather_at_frames(img: np.ndarray, pixels: np.ndarray, frames: np.ndarray,
+                      dims: Tuple[int, int]) -> np.ndarray:
+    """
+    Get ``img[frames[i]][pixel i]`` for all i, reading each distinct frame only once.
+
+    :param img:     image sequence, shape [n_frames, *dims]
+    :param pixels:  pixel indices in the Fortran order used by the CNMF ``A`` matrix
+    :param frames:  frame index for each pixel
+    :param dims:    dims of the CNMF output
+    """
+    rows, cols = np.unravel_index(pixels, dims, order='F')
+    values = np.empty(pixels.size, dtype=np.float64)
+
+    order = np.argsort(frames, kind='stable')
+    uframes, starts = np.unique(frames[order], return_index=True)
+    stops = np.append(starts[1:], order.size)
+
+    for f, start, stop in zip(uframes, starts, stops):
+        sel = order[start:stop]
+        values[sel] = img[f][rows[sel], cols[sel]]
+
+    return values
+
+
+def raw_min_max_all(A: sparse.spmatrix, C: np.ndarray, img: np.ndarray, dims: Tuple[int, int]) -> List[dict]:
+    """
+    Raw min & max of all components from the pixel values of the raw image at the frames where each component's
+    temporal trace is at its minimum and maximum. Gives the same output as ``ManagerCNMFROI.get_raw_min_max`` for
+    each component, but computed for all components together straight from the sparse spatial components.
+
+    :param A:       spatial components, shape [n_pixels, n_components]
+    :param C:       temporal components, shape [n_components, n_frames]
+    :param img:     raw image sequence, shape [n_frames, *dims]
+    :param dims:    dims of the CNMF output
+
+    :return: list of raw min max dicts, one for each component
+    """
+    A = sparse.csc_matrix(A, copy=True)
+    # only pixels where A > 0 are part of the mask
+    A.data[A.data < 0] = 0
+    A.eliminate_zeros()
+
+    indptr = A.indptr
+    pixels = A.indices
+    component = np.repeat(np.arange(A.shape[1]), np.diff(indptr))
+
+    out = {}
+    for r, ixs in (('raw_max', C.argmax(axis=1)), ('raw_min', C.argmin(axis=1))):
+        values = _gather_at_frames(img, pixels, ixs[component], dims)
+
+        # sort within each component
+        values = values[np.lexsort((values, component))]
+
+        out[r] = _segment_top_n_means(values, indptr)
+
+    n_components = A.shape[1]
+    return [{r: {k: out[r][k][i] for k in out[r].keys()} for r in ('raw_max', 'raw_min')}
+            for i in range(n_components)]
@@ -17,7 +17,11 @@ from ...core.common import ViewerUtils
 from .... import pyqtgraphCore as pg
 from copy import deepcopy
 from .read_imagej import read_roi_zip as read_imagej
+from .cnmf_import import raw_min_max_all
+from .roi_layer import ROIOutlineLayer
 from ....common.configuration import HAS_CAIMAN
+from functools import partial
+from scipy import sparse
 
 if HAS_CAIMAN:
     from caiman.utils.visualization import get_contours as caiman_get_contours
@@ -84,6 +88,25 @@ class AbstractBaseManager(metaclass=abc.ABCMeta):
         """Get the viewer plot item that is associated to these ROIs"""
         return self.vi.viewer.ui.roiPlot.plot()
 
+    def _restore_scatter_rois(self, roi_class: type, roi_states: list):
+        """
+        Restore ScatterROIs from their states in bulk. Their outlines are shown in a single ``ROIOutlineLayer`` and
+        each ROI only creates its own scatter plot when it is selected.
+        """
+        if len(roi_states) == 0:
+            return
+
+        view_box = self.vi.viewer.getView()
+
+        layer = ROIOutlineLayer(view_box, [s['roi_xs'] for s in roi_states], [s['roi_ys'] for s in roi_states])
+
+        rois = [
+            roi_class.from_state(self.get_plot_item(), view_box, state, outline_layer=layer, layer_ix=ix)
+            for ix, state in enumerate(roi_states)
+        ]
+
+        self.roi_list.extend(rois)
+
     def clear(self):
         """Cleanup of all ROIs in the list"""
         if not hasattr(self, 'roi_list'):
@@ -154,8 +177,10 @@ class ManagerManual(AbstractBaseManager):
             'metadata': self.metadata
         }
 
+        # compute the curves of all ROIs in one pass through the image sequence
+        self.roi_list.plot_manual_roi_regions()
+
         for ix in range(len(self.roi_list)):
-            self.roi_list.set_pg_roi_plot(ix)
             state = self.roi_list[ix].to_state()
             states['states'].append(state)
         self.vi.viewer.status_bar_label.showMessage('Finished saving ROIs!')
@@ -225,6 +250,44 @@ class ManagerScatterROI(AbstractBaseManager):
 
         return roi
 
+    def add_rois(self, curves: np.ndarray, xs: List[np.ndarray], ys: List[np.ndarray],
+                 metadata: list = None) -> List[ScatterROI]:
+        """
+        Add many ROIs at once. Their outlines are shown in a single ``ROIOutlineLayer`` and each ROI only creates
+        its own scatter plot when it is selected, so thousands of ROIs can be added in seconds.
+
+        :param curves:      curve data, 2-D array, [roi, frame]
+        :param xs:          x-values of each ROI's outline, list of 1-D arrays
+        :param ys:          y-values of each ROI's outline, list of 1-D arrays
+        :param metadata:    metadata for each ROI
+        :return:            list of ScatterROI objects
+        """
+        if not hasattr(self, 'roi_list'):
+            self.create_roi_list()
+
+        if metadata is None:
+            metadata = [None] * len(xs)
+
+        layer = ROIOutlineLayer(self.vi.viewer.getView(), xs, ys)
+
+        rois = [
+            ScatterROI(
+                curve_plot_item=self.get_plot_item(),
+                view_box=self.vi.viewer.getView(),
+                curve_data=curves[ix],
+                xs=xs[ix],
+                ys=ys[ix],
+                metadata=metadata[ix],
+                outline_layer=layer,
+                layer_ix=ix
+            )
+            for ix in range(len(xs))
+        ]
+
+        self.roi_list.extend(rois)
+
+        return rois
+
     def restore_from_states(self, states: dict):
         """Restore from states, such as when these ROIs are saved with a Project Sample"""
         super(ManagerScatterROI, self).restore_from_states(states)
@@ -232,11 +295,7 @@ class ManagerScatterROI(AbstractBaseManager):
         if not hasattr(self, 'roi_list'):
             self.create_roi_list()
 
-        for state in states['states']:
-            roi = ScatterROI.from_state(self.get_plot_item(), self.vi.viewer.getView(), state)
-            self.roi_list.append(roi)
-
-        self.roi_list.reindex_colormap()
+        self._restore_scatter_rois(ScatterROI, states['states'])
 
     def create_roi_list(self):
         """Create empty ROI List"""
@@ -245,8 +304,9 @@ class ManagerScatterROI(AbstractBaseManager):
     def set_spot_size(self, size: int):
         """Set the spot size for the scatter plot which illustrates the ROI"""
         for roi in self.roi_list:
-            roi.get_roi_graphics_object().setSize(size)
             roi.spot_size = size
+            if roi.is_drawn:
+                roi.get_roi_graphics_object().setSize(size)
 
 
 class ManagerVolROI(ManagerScatterROI):
@@ -473,64 +533,48 @@ class ManagerCNMFROI(AbstractBaseManager):
         self.orig_idx_components = deepcopy(self.idx_components)
         self.input_params_dict = input_params_dict
 
-        # spatial components
-        contours = caiman_get_contours(self.cnmA[:, self.idx_components], self.dims)
-        # if dfof:
-        #     temporal_components = cnmC
-        # else:
-        #     temporal_components = cnmC[idx_components]
-        self.input_params_dict = self.input_params_dict
         num_components = len(self.cnmC)
 
+        self.vi.viewer.status_bar_label.showMessage(f'Please wait, adding {num_components} components...')
+
+        # spatial components
+        cnmA = self.cnmA[:, self.idx_components]
+        if not isinstance(cnmA, sparse.csc_matrix):
+            cnmA = sparse.csc_matrix(cnmA)
+
         if calc_raw_min_max:
+            # computed for all components together, reading each frame only once
             img = self.vi.viewer.workEnv.imgdata.seq.T
+            raw_min_max = raw_min_max_all(cnmA, self.cnmC, img, self.dims)
+            del img
+        else:
+            raw_min_max = [None] * num_components
 
         self.ui.radioButton_curve_data.setChecked(True)
 
+        rois = []
         for ix in range(num_components):
-            self.vi.viewer.status_bar_label.showMessage('Please wait, adding component #: '
-                                                        + str(ix) + ' / ' + str(num_components))
-
-            curve_data = self.cnmC[ix]
-            contour = contours[ix]
-
-            if calc_raw_min_max:
-                # Get a binary mask
-                mask = self.cnmA[:, self.idx_components[ix]].toarray().reshape(self.dims, order='F') > 0
-                # mask3d = np.array((mask,) * curve_data.shape[0])
-
-                max_ix = curve_data.argmax()
-                min_ix = curve_data.argmin()
-
-                array_at_max = img[max_ix, :, :].copy()
-                array_at_max = array_at_max[mask]
-
-                array_at_min = img[min_ix, :, :].copy()
-                array_at_min = array_at_min[mask]
-
-                raw_min_max = self.get_raw_min_max(array_at_max=array_at_max,
-                                                   array_at_min=array_at_min)
-
-            else:
-                raw_min_max = None
+            # contours are only computed when an ROI is first shown
+            contour_getter = partial(self._get_contour, cnmA, ix)
 
             roi = CNMFROI(curve_plot_item=self.get_plot_item(),
                           view_box=self.vi.viewer.getView(),
                           cnmf_idx=self.idx_components[ix],
-                          curve_data=curve_data,
-                          contour=contour,
-                          raw_min_max=raw_min_max,
+                          curve_data=self.cnmC[ix],
+                          contour_getter=contour_getter,
+                          raw_min_max=raw_min_max[ix],
                           dfof_data=self.cnm_dfof[ix] if (self.cnm_dfof is not None) else None,
                           spike_data=self.cnmS[ix])
 
-            self.roi_list.append(roi)
+            rois.append(roi)
 
-        if calc_raw_min_max:
-            del img
-
-        self.roi_list.reindex_colormap()
+        self.roi_list.extend(rois)
         self.vi.viewer.status_bar_label.showMessage('Finished adding all components!')
 
+    def _get_contour(self, cnmA: sparse.csc_matrix, ix: int) -> dict:
+        """Contour of a single component, same as the corresponding element of get_contours() for all components"""
+        return caiman_get_contours(cnmA[:, [ix]], self.dims)[0]
+
     def get_raw_min_max(self, array_at_max, array_at_min):
         a_size = array_at_max.size
         p5 = int(a_size * 0.05)
@@ -567,9 +611,8 @@ class ManagerCNMFROI(AbstractBaseManager):
         else:
             self.cnmf_data_dict = None
 
-        for state in states['states']:
-            roi = CNMFROI.from_state(self.get_plot_item(), self.vi.viewer.getView(), state)
-            self.roi_list.append(roi)
+        self._restore_scatter_rois(CNMFROI, states['states'])
+
         self.input_params_dict = states['input_params_cnmfe']
         self.cnmA = states['cnmf_output']['cnmA']
         self.cnmb = states['cnmf_output']['cnmb']
@@ -578,7 +621,6 @@ class ManagerCNMFROI(AbstractBaseManager):
         self.cnmYrA = states['cnmf_output']['cnmYrA']
         self.idx_components = states['cnmf_output']['idx_components']
         self.orig_idx_components = states['cnmf_output']['orig_idx_components']
-        self.roi_list.reindex_colormap()
 
     def get_all_states(self) -> dict:
         """Get all states so that they can be restored"""
@@ -614,5 +656,6 @@ class ManagerCNMFROI(AbstractBaseManager):
 
     def set_spot_size(self, size: int):
         for roi in self.roi_list:
-            roi.get_roi_graphics_object().setSize(size)
             roi.spot_size = size
+            if roi.is_drawn:
+                roi.get_roi_graphics_object().setSize(size)
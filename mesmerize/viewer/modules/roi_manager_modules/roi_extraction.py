@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Batch extraction of intensity traces for ManualROIs.
+
+Every ROI is rasterized once into a row of a sparse (n_rois x n_pixels) weight matrix. The traces of all ROIs are then
+computed with one sparse-dense product per chunk of frames, so memory-mapped image sequences are streamed through
+instead of being copied for every ROI.
+"""
+
+import numpy as np
+from scipy import sparse
+from typing import *
+from .... import pyqtgraphCore as pg
+
+
+#: Approximate number of bytes of image data that is read per chunk of frames
+CHUNK_BYTES = 2 ** 26
+
+
+def rasterize_roi(pg_roi: pg.ROI, image_item: pg.ImageItem, frame_shape: Tuple[int, int],
+                  _index_image: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the pixels covered by a pyqtgraph ROI and the weight of each pixel.
+
+    The weights are the values of the ROI's shape mask divided by the number of pixels in the mask, so the dot
+    product of the weights with a frame is the mean intensity that ``getArrayRegion`` would give for that frame.
+    Pixels are sampled with nearest neighbour interpolation.
+
+    :param pg_roi:      pyqtgraph ROI, the graphics object of a ManualROI
+    :param image_item:  ImageItem that the ROI is drawn on
+    :param frame_shape: shape of one frame of the image sequence, in the same axis order as the ImageItem's data
+
+    :return: (flat pixel indices, weights)
+    """
+    if _index_image is None:
+        _index_image = _make_index_image(frame_shape)
+
+    # indices are offset by 1 so that 0 means outside the ROI
+    region = pg_roi.getArrayRegion(_index_image, image_item, axes=(0, 1), order=0)
+    mask = pg_roi.getArrayRegion(np.ones(frame_shape, dtype=np.float64), image_item, axes=(0, 1), order=0)
+
+    if region is None or mask is None:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+
+    inside = (mask > 0) & (region > 0)
+    n = np.count_nonzero(inside)
+    if n == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+
+    # the shape masks of PolyLineROI etc. scale the sampled values, undo that to get the pixel indices back
+    pixels = np.rint(region[inside] / mask[inside]).astype(np.intp) - 1
+    weights = mask[inside] / n
+
+    # the same pixel can be sampled more than once
+    pixels, inverse = np.unique(pixels, return_inverse=True)
+    weights = np.bincount(inverse.ravel(), weights=weights)
+
+    return pixels, weights
+
+
+def _make_index_image(frame_shape: Tuple[int, int]) -> np.ndarray:
+    return np.arange(1, int(np.prod(frame_shape)) + 1, dtype=np.float64).reshape(frame_shape)
+
+
+def _iter_chunks(image: np.ndarray, chunk_bytes: int) -> Iterator[Tuple[slice, np.ndarray]]:
+    """Yield (slice, frames reshaped to [n_frames, n_pixels]) over the first axis of the image"""
+    n_frames = image.shape[0]
+    frame_bytes = max(int(np.prod(image.shape[1:])) * image.dtype.itemsize, 1)
+    chunk_size = max(1, chunk_bytes // frame_bytes)
+
+    for start in range(0, n_frames, chunk_size):
+        s = slice(start, min(start + chunk_size, n_frames))
+        yield s, np.asarray(image[s]).reshape(s.stop - s.start, -1)
+
+
+def extract_traces(weights: sparse.csr_matrix, image: np.ndarray, chunk_bytes: int = CHUNK_BYTES) -> np.ndarray:
+    """
+    Compute the traces of all ROIs.
+
+    :param weights:     sparse weight matrix of shape [n_rois, n_pixels]
+    :param image:       image sequence of shape [n_frames, x, y], or a single frame of shape [x, y].
+                        Can be a memmap, it is only read one chunk of frames at a time.
+    :param chunk_bytes: approximate number of bytes of image data to read per chunk
+
+    :return: traces, shape [n_rois, n_frames]
+    """
+    if image.ndim == 2:
+        image = image[np.newaxis]
+
+    traces = np.empty((weights.shape[0], image.shape[0]), dtype=np.float64)
+
+    for s, frames in _iter_chunks(image, chunk_bytes):
+        traces[:, s] = weights.dot(frames.T)
+
+    return traces
+
+
+def extract_trace(pixels: np.ndarray, weights: np.ndarray, image: np.ndarray,
+                  chunk_bytes: int = CHUNK_BYTES) -> np.ndarray:
+    """
+    Compute the trace of a single ROI, only the pixels that the ROI covers are used.
+
+    :param pixels:      flat pixel indices, from ``rasterize_roi``
+    :param weights:     pixel weights, from ``rasterize_roi``
+    :param image:       image sequence of shape [n_frames, x, y], or a single frame of shape [x, y]
+    :param chunk_bytes: approximate number of bytes of image data to read per chunk
+
+    :return: trace, shape [n_frames]
+    """
+    if image.ndim == 2:
+        image = image[np.newaxis]
+
+    trace = np.empty(image.shape[0], dtype=np.float64)
+
+    for s, frames in _iter_chunks(image, chunk_bytes):
+        trace[s] = frames[:, pixels].dot(weights)
+
+    return trace
+
+
+class ManualROIExtractor:
+    """
+    Keeps the rasterized masks of ManualROIs so that only ROIs which have changed are rasterized again.
+    """
+    def __init__(self):
+        self._masks = dict()  # ManualROI: (pixels, weights)
+        self._frame_shape = None
+        self._index_image = None
+
+    def _set_frame_shape(self, frame_shape: Tuple[int, int]):
+        if frame_shape == self._frame_shape:
+            return
+
+        self._frame_shape = frame_shape
+        self._index_image = _make_index_image(frame_shape)
+        self._masks.clear()
+
+    def invalidate(self, roi):
+        """Call when the region of an ROI has changed"""
+        self._masks.pop(roi, None)
+
+    def remove(self, roi):
+        """Call when an ROI is removed"""
+        self._masks.pop(roi, None)
+
+    def clear(self):
+        self._masks.clear()
+
+    def get_mask(self, roi, image_item: pg.ImageItem, frame_shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the (pixels, weights) for an ROI, rasterizing it only if it has changed since it was last used.
+
+        :param roi:         ManualROI instance
+        :param image_item:  ImageItem that the ROI is drawn on
+        :param frame_shape: shape of one frame of the image sequence
+        """
+        self._set_frame_shape(tuple(frame_shape))
+
+        if roi not in self._masks:
+            self._masks[roi] = rasterize_roi(roi.get_roi_graphics_object(), image_item, self._frame_shape,
+                                             _index_image=self._index_image)
+
+        return self._masks[roi]
+
+    def weight_matrix(self, rois: Sequence, image_item: pg.ImageItem,
+                      frame_shape: Tuple[int, int]) -> sparse.csr_matrix:
+        """
+        Sparse weight matrix for the ROIs, one row per ROI in the order they are passed.
+
+        :return: csr_matrix of shape [n_rois, n_pixels]
+        """
+        masks = [self.get_mask(roi, image_item, frame_shape) for roi in rois]
+
+        indptr = np.zeros(len(masks) + 1, dtype=np.intp)
+        indptr[1:] = np.cumsum([m[0].size for m in masks])
+
+        if len(masks) > 0:
+            indices = np.concatenate([m[0] for m in masks])
+            data = np.concatenate([m[1] for m in masks])
+        else:
+            indices = np.empty(0, dtype=np.intp)
+            data = np.empty(0, dtype=np.float64)
+
+        n_pixels = int(np.prod(frame_shape))
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(masks), n_pixels))
+
+    def extract(self, rois: Sequence, image: np.ndarray, image_item: pg.ImageItem) -> np.ndarray:
+        """
+        Traces of all the passed ROIs from one pass over the image sequence.
+
+        :param rois:        ManualROI instances
+        :param image:       image sequence of shape [n_frames, x, y], or a single frame of shape [x, y]
+        :param image_item:  ImageItem that the ROIs are drawn on
+
+        :return: traces, shape [n_rois, n_frames]
+        """
+        frame_shape = image.shape[-2:]
+        weights = self.weight_matrix(rois, image_item, frame_shape)
+        return extract_traces(weights, image)
+
+    def extract_one(self, roi, image: np.ndarray, image_item: pg.ImageItem) -> np.ndarray:
+        """
+        Trace of a single ROI, the other ROIs are not rasterized or computed.
+
+        :return: trace, shape [n_frames]
+        """
+        pixels, weights = self.get_mask(roi, image_item, image.shape[-2:])
+        return extract_trace(pixels, weights, image)
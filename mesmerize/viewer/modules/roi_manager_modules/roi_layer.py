@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+A single image overlay that shows the outlines of many ScatterROIs, used when thousands of ROIs are imported at once.
+"""
+
+import numpy as np
+from PyQt5 import QtCore
+from .... import pyqtgraphCore as pg
+from typing import *
+
+
+class ROIOutlineLayer:
+    """
+    Outlines of many ROIs kept in flat arrays and drawn as one RGBA ImageItem, instead of a ScatterPlotItem for each
+    ROI. ROIs in the layer are drawn with their own graphics object only when they're selected, see ``ScatterROI``.
+    """
+    def __init__(self, view_box: pg.ViewBox, xs: List[np.ndarray], ys: List[np.ndarray]):
+        """
+        :param view_box:    ViewBox containing the image sequence
+        :param xs:          x coordinates of each ROI's outline
+        :param ys:          y coordinates of each ROI's outline
+        """
+        self.view_box = view_box
+
+        sizes = np.array([x.size for x in xs], dtype=np.int64)
+
+        self.roi_ix = np.repeat(np.arange(sizes.size), sizes)  #: ROI index of each point
+        self.xs = np.concatenate(xs).astype(np.int64) if sizes.size > 0 else np.empty(0, dtype=np.int64)
+        self.ys = np.concatenate(ys).astype(np.int64) if sizes.size > 0 else np.empty(0, dtype=np.int64)
+
+        self.colors = np.zeros((sizes.size, 4), dtype=np.uint8)  #: RGBA color of each ROI
+        self.visible = np.ones(sizes.size, dtype=bool)  #: if each ROI is shown in the layer
+        self.removed = np.zeros(sizes.size, dtype=bool)  #: ROIs that have been removed from the viewer
+
+        # the image only covers the ROIs
+        shape = (self.ys.max() + 1, self.xs.max() + 1) if self.xs.size > 0 else (1, 1)
+        self._image = np.zeros((*shape, 4), dtype=np.uint8)
+
+        self.image_item = pg.ImageItem()
+        # pixel centers on the integer coordinates, same as the square spots of a ScatterPlotItem
+        self.image_item.setPos(-0.5, -0.5)
+        self.view_box.addItem(self.image_item)
+
+        self._update_pending = False
+        self.update()
+
+    def set_color(self, ix: int, color: Union[np.ndarray, str]):
+        self.colors[ix] = pg.mkColor(color).getRgb()
+        self.update()
+
+    def set_visible(self, ix: int, b: bool):
+        self.visible[ix] = b
+        self.update()
+
+    def remove(self, ix: int):
+        """Remove an ROI from the layer, the layer is removed from the viewer when all its ROIs are removed"""
+        self.removed[ix] = True
+        self.visible[ix] = False
+
+        if self.removed.all():
+            self.view_box.removeItem(self.image_item)
+            return
+
+        self.update()
+
+    def update(self):
+        """Redraw the layer once control returns to the event loop, so that many changes are drawn only once"""
+        if self._update_pending:
+            return
+
+        self._update_pending = True
+        QtCore.QTimer.singleShot(0, self._render)
+
+    def _render(self):
+        self._update_pending = False
+
+        if self.removed.all():
+            return
+
+        self._image[:] = 0
+
+        mask = self.visible[self.roi_ix]
+        self._image[self.ys[mask], self.xs[mask]] = self.colors[self.roi_ix[mask]]
+
+        self.image_item.setImage(self._image, autoLevels=False)
@@ -7,6 +7,7 @@ from matplotlib import cm as matplotlib_color_map
 from .... import pyqtgraphCore as pg
 from ....viewer.core.common import ViewerUtils
 from ....viewer.modules.roi_manager_modules.roi_types import ManualROI, ScatterROI
+from ....viewer.modules.roi_manager_modules.roi_extraction import ManualROIExtractor
 from ....common import configuration, get_project_manager
 from typing import Union
 
@@ -27,6 +28,9 @@ class ROIList(list):
         assert isinstance(ui.listWidgetROIs, QtWidgets.QListWidget)
         self.list_widget = ui.listWidgetROIs  #: ROI list widget
         self.list_widget.clear()
+        # only lay out the visible items, for lists of many thousands of ROIs
+        self.list_widget.setUniformItemSizes(True)
+        self.list_widget.setLayoutMode(QtWidgets.QListView.Batched)
         self.list_widget.currentRowChanged.connect(self.set_current_index)
 
         # self.action_delete_roi = QtWidgets.QWidgetAction(ui.dockWidgetContents)
@@ -54,8 +58,10 @@ class ROIList(list):
         self.live_plot_checkbox.setChecked(False)
         if issubclass(self.roi_types, ManualROI):
             self.live_plot_checkbox.setEnabled(True)
+            self.extractor = ManualROIExtractor()  #: Cached ROI masks for computing curves of ManualROIs
         else:
             self.live_plot_checkbox.setEnabled(False)
+            self.extractor = None
 
         assert isinstance(ui.checkBoxShowAll, QtWidgets.QCheckBox)
         self.show_all_checkbox = ui.checkBoxShowAll
@@ -97,6 +103,26 @@ class ROIList(list):
         self.list_widget.addItem(str(self.__len__()))
         super(ROIList, self).append(roi)
 
+    def extend(self, rois: list):
+        """
+        Add many ROI instances to the list at once. The list widget, colors and the viewer are updated only once
+        at the end. ROIs that are drawn lazily, such as CNMFROIs created with a ``contour_getter``, only create
+        their graphics objects when they are shown. ScatterROIs in an outline layer only create them when selected.
+        """
+        n = self.__len__()
+
+        for roi in rois:
+            roi.add_to_viewer()
+
+        super(ROIList, self).extend(rois)
+        self.list_widget.addItems([str(i) for i in range(n, self.__len__())])
+
+        self.vi.workEnv_changed('ROI Added')
+        self.reindex_colormap()
+
+        if self.show_all_checkbox.isChecked():
+            self._show_all_graphics_objects()
+
     # def clear_all(self):
     #     self.list_widget.clear()
     #     self.list_widget_tags.clear()
@@ -117,9 +143,19 @@ class ROIList(list):
         self.list_widget.clear()
         self.list_widget_tags.clear()
         self.disconnect_all()
-        for i in range(self.__len__()):
-            self.vi.viewer.status_bar_label.showMessage('Removing ROIs #:' + str(i))
-            self.__delitem__(0)
+
+        if self.__len__() > 0:
+            self.vi.workEnv_changed('ROI Removed')
+
+        # remove all at once instead of reindexing the list & colors after each ROI
+        self.vi.viewer.status_bar_label.showMessage(f'Removing {self.__len__()} ROIs')
+        for roi in self:
+            roi.remove_from_viewer()
+            if self.extractor is not None:
+                self.extractor.remove(roi)
+
+        super(ROIList, self).clear()
+        self.vi.viewer.status_bar_label.clearMessage()
 
     def __delitem__(self, key):
         """Delete an ROI from the list and cleanup from the viewer, reindex the colors etc."""
@@ -132,6 +168,8 @@ class ROIList(list):
         self.vi.workEnv_changed('ROI Removed')
         roi = self.__getitem__(key)
         roi.remove_from_viewer()
+        if self.extractor is not None:
+            self.extractor.remove(roi)
         super(ROIList, self).__delitem__(key)
         if self.__len__() == 0:
             self.list_widget.clear()
@@ -176,20 +214,16 @@ class ROIList(list):
         cm._init()
         lut = (cm._lut * 255).view(np.ndarray)
 
-        cm_ixs = np.linspace(0, 210, self.__len__(), dtype=int)
+        # colors of all ROIs
+        colors = lut[np.linspace(0, 210, self.__len__(), dtype=int)]
 
-        for ix in range(self.__len__()):
-            c = lut[cm_ixs[ix]]
-            try:
-                roi = self.__getitem__(ix)
-            except IndexError:
-                return
+        for ix, (roi, c) in enumerate(zip(self, colors)):
             item = self.list_widget.item(ix)
             if item is not None:
                 item.setBackground(QtGui.QBrush(pg.mkBrush(c)))
 
+            # also sets the current color
             roi.set_original_color(c)
-            roi.set_color(c)
 
     def __getitem__(self, item) -> Union[ManualROI, ScatterROI]:
         """Get an item (ROI) from the list"""
@@ -246,27 +280,40 @@ class ROIList(list):
             ix = self.list_widget.currentRow()
             self._show_graphics_object(ix)
 
-    def _show_graphics_object(self, ix: int):
-        """Show the ROI at the passed index in the viewer overlay visualization"""
+    def _show_graphics_object(self, ix: int, draw: bool = True):
+        """
+        Show the ROI at the passed index in the viewer overlay visualization
+
+        :param ix:      index of the ROI
+        :param draw:    create the ROI's own graphics object if it is shown in an outline layer
+        """
         try:
             roi = self.__getitem__(ix)
         except IndexError:
             return
-        roi_graphics_object = roi.get_roi_graphics_object()
-        roi_graphics_object.show()
+
+        if not draw and getattr(roi, 'outline_layer', None) is not None and not roi.is_drawn:
+            roi.outline_layer.set_visible(roi.layer_ix, True)
+        else:
+            roi_graphics_object = roi.get_roi_graphics_object()
+            roi_graphics_object.show()
         roi.curve_plot_item.show()
 
     def _hide_graphics_object(self, ix: int):
         """Hide the ROI at the passed index in the viewer overlay visualization"""
         roi = self.__getitem__(ix)
-        roi_graphics_object = roi.get_roi_graphics_object()
-        roi_graphics_object.hide()
+        if getattr(roi, 'outline_layer', None) is not None:
+            roi.outline_layer.set_visible(roi.layer_ix, False)
+        # don't create graphics objects of lazily drawn ROIs just to hide them
+        if getattr(roi, 'is_drawn', True):
+            roi.get_roi_graphics_object().hide()
         roi.curve_plot_item.hide()
 
     def _show_all_graphics_objects(self):
         """Show all ROIs in the viewer overlay visualization"""
         for ix in range(self.__len__()):
-            self._show_graphics_object(ix)
+            # ROIs in an outline layer are shown in the layer instead of creating all their graphics objects
+            self._show_graphics_object(ix, draw=False)
 
     def _hide_all_graphics_objects(self):
         """Hide all ROIs in the viewer overlay visualization"""
@@ -279,6 +326,7 @@ class ROIList(list):
             raise TypeError('Can only live update Manually drawn ROIs when they are moved')
 
         self.vi.workEnv_changed('ROI Region')
+        self.extractor.invalidate(roi)
 
         if not self.live_plot_checkbox.isChecked():
             return
@@ -287,11 +335,25 @@ class ROIList(list):
 
     def plot_manual_roi_regions(self):
         """Plot the ROI curves from the regions of all ManualROI instances in the list"""
+        if self.extractor is None or self.__len__() == 0:
+            return
+
+        image = self.vi.viewer.getProcessedImage()
+        if image.ndim not in (2, 3):
+            return
+
+        self.vi.viewer.status_bar_label.showMessage('Please wait, calculating intensity values for all ROIs')
+
+        # all curves from a single pass through the image sequence
+        ys = self.extractor.extract(list(self), image.view(np.ndarray), self.vi.viewer.imageItem)
+
         for ix in range(self.__len__()):
             roi = self.__getitem__(ix)
-            pg_roi = roi.get_roi_graphics_object()
-            self.set_pg_roi_plot(ix)
+            self._set_roi_curve(roi, ys[ix])
             roi.reset_color()
+
+        self.vi.viewer.status_bar_label.clearMessage()
+
         if not self.show_all_checkbox.isChecked():
             self._hide_all_graphics_objects()
             self._show_graphics_object(self.current_index)
@@ -300,36 +362,21 @@ class ROIList(list):
         """Plot the ROI curve from the region of the ManualROI instance at the passed index"""
         image = self.vi.viewer.getProcessedImage()
 
-        if image.ndim == 2:
-            axes = (0, 1)
-        elif image.ndim == 3:
-            axes = (1, 2)
-        else:
+        if image.ndim not in (2, 3):
             return
         self.vi.viewer.status_bar_label.showMessage('Please wait, calculating intensity values for ROI: ' + str(ix))
 
-        # Get the ROI region
-        pg_roi = self.__getitem__(ix).get_roi_graphics_object()
-        data = pg_roi.getArrayRegion((image.view(np.ndarray)), self.vi.viewer.imageItem, axes)
-
-        if data is not None:
-            data[data == 0] = np.nan
-
-            if data.ndim == 2:
-            # while data.ndim > 1:
-                # data = data.mean(axis=1)
-                y = np.nanmean(data)
-
-            elif image.ndim == 3:
-                # Set the curve
-                y = np.nanmean(data, axis=(1, 2))
+        roi = self.__getitem__(ix)
+        y = self.extractor.extract_one(roi, image.view(np.ndarray), self.vi.viewer.imageItem)
 
-            roi = self.__getitem__(ix)
-            roi.curve_plot_item.setData(y=y, x=self.vi.viewer.tVals)
-            roi.set_color('w', width=2)
-            roi.curve_plot_item.show()
+        self._set_roi_curve(roi, y)
+        roi.set_color('w', width=2)
         self.vi.viewer.status_bar_label.clearMessage()
 
+    def _set_roi_curve(self, roi: ManualROI, y: np.ndarray):
+        roi.curve_plot_item.setData(y=y, x=self.vi.viewer.tVals)
+        roi.curve_plot_item.show()
+
     def slot_btn_set_tag(self):
         ix = self.current_index
         try:
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+@author: kushal
+
+Chatzigeorgiou Group
+Sars International Centre for Marine Molecular Biology
+
+GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+
+Columnar storage of ROI states.
+
+The ROI Managers give a list with a state dict for each ROI. When they're saved with a sample the list is stored as
+columns instead, one for each key of the state dicts. Columns of 1-D arrays, such as the coordinates and curves of
+ScatterROIs, are concatenated into a single array with the offsets of each ROI, so that thousands of ROIs are
+pickled as a few large arrays instead of thousands of small ones.
+
+The columns are stored with a ``columns_version`` key. States that were saved as a list of state dicts, by versions
+of Mesmerize before the columns, have no version and are read as they are.
+"""
+
+import numpy as np
+
+
+#: Version of the columns format, states with a newer version cannot be read
+COLUMNS_VERSION = 1
+
+
+def _is_1d_array(v) -> bool:
+    return isinstance(v, np.ndarray) and v.ndim == 1 and v.dtype.kind in 'biuf'
+
+
+def encode_column(values: list) -> dict:
+    """
+    Encode the values of one key of all ROI states
+
+    :param values:  value for each ROI
+    :return:        dict with a 'kind' key and the encoded data
+    """
+    if all(v is None for v in values):
+        return {'kind': 'none', 'n': len(values)}
+
+    if len(values) > 0 and all(_is_1d_array(v) for v in values) and len({v.dtype for v in values}) == 1:
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum([v.size for v in values], out=offsets[1:])
+
+        return {'kind': 'ragged', 'data': np.concatenate(values), 'offsets': offsets}
+
+    if len(values) > 0 and all(isinstance(v, (list, tuple)) for v in values) and len({len(v) for v in values}) == 1:
+        # such as curve_data, which is [xs, ys]
+        return {
+            'kind': 'tuple',
+            'type': 'list' if isinstance(values[0], list) else 'tuple',
+            'items': [encode_column([v[i] for v in values]) for i in range(len(values[0]))]
+        }
+
+    return {'kind': 'object', 'data': list(values)}
+
+
+def decode_column(column: dict) -> list:
+    """Inverse of ``encode_column()``, 1-D arrays are views of the concatenated array"""
+    kind = column['kind']
+
+    if kind == 'none':
+        return [None] * column['n']
+
+    elif kind == 'ragged':
+        return np.split(column['data'], column['offsets'][1:-1])
+
+    elif kind == 'tuple':
+        items = [decode_column(c) for c in column['items']]
+        cast = list if column['type'] == 'list' else tuple
+        return [cast(v) for v in zip(*items)]
+
+    elif kind == 'object':
+        return list(column['data'])
+
+    raise ValueError(f'Unknown column kind: {kind}')
+
+
+def states_to_columns(states: dict) -> dict:
+    """
+    Convert the states from ``get_all_states()`` of an ROI Manager to columns
+
+    :param states:  dict with a 'states' key that is a list of ROI state dicts
+    :return:        same dict with the 'states' list replaced by 'columns'
+    """
+    roi_states = states['states']
+
+    keys = []
+    for state in roi_states:
+        keys += [k for k in state.keys() if k not in keys]
+
+    columns = {k: encode_column([state.get(k, None) for state in roi_states]) for k in keys}
+
+    # keys that are missing from some states are not restored for those states
+    present = {k: np.array([k in state for state in roi_states], dtype=bool) for k in keys}
+
+    d = {k: v for k, v in states.items() if k != 'states'}
+    d['columns_version'] = COLUMNS_VERSION
+    d['columns'] = columns
+    d['columns_present'] = present
+    d['n_rois'] = len(roi_states)
+
+    return d
+
+
+def columns_to_states(states: dict) -> dict:
+    """
+    Convert states stored as columns back to a dict with a list of ROI state dicts, states that are already
+    a list are returned as they are.
+    """
+    if 'columns' not in states.keys():
+        return states
+
+    if states.get('columns_version', 0) > COLUMNS_VERSION:
+        raise ValueError(f'ROI states columns version {states["columns_version"]} is newer than the supported '
+                         f'version {COLUMNS_VERSION}, update Mesmerize to open this sample.')
+
+    n = states['n_rois']
+    roi_states = [{} for i in range(n)]
+
+    for k, column in states['columns'].items():
+        present = states['columns_present'][k]
+        for i, v in enumerate(decode_column(column)):
+            if present[i]:
+                roi_states[i][k] = v
+
+    d = {k: v for k, v in states.items() if k not in ('columns_version', 'columns', 'columns_present', 'n_rois')}
+    d['states'] = roi_states
+
+    return d
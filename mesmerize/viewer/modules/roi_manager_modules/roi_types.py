@@ -17,7 +17,7 @@ from .... import pyqtgraphCore as pg
 from ....common import get_proj_config, NoProjectOpen, InheritDocs
 from warnings import warn
 from copy import deepcopy
-from typing import Union, List
+from typing import Union, List, Callable
 
 
 class _AbstractBaseROI(metaclass=InheritDocs):
@@ -392,13 +392,16 @@ class ScatterROI(BaseROI):
     def __init__(self, curve_plot_item: pg.PlotDataItem, view_box: pg.ViewBox, state: Union[dict, None] = None,
                  curve_data: np.ndarray = None, xs: np.ndarray = None, ys: np.ndarray = None, metadata: dict = None,
                  spike_data: np.ndarray = None, dfof_data: np.ndarray = None,
-                 **kwargs):
+                 outline_layer=None, layer_ix: int = None, **kwargs):
         """
 
         :param curve_plot_item:
         :param view_box:
         :param state:
-        :param curve_data: 1D numpy array of y values
+        :param curve_data:      1D numpy array of y values
+        :param outline_layer:   ROIOutlineLayer in which this ROI is shown until it is selected, the ROI's own graphics
+                                object is only created when it is selected.
+        :param layer_ix:        index of this ROI in the ``outline_layer``
         :param kwargs:
         """
         self.spot_size = 1
@@ -407,10 +410,17 @@ class ScatterROI(BaseROI):
         self.spike_data = None
         self.dfof_data = None
 
+        self.outline_layer = outline_layer
+        self.layer_ix = layer_ix
+
         super(ScatterROI, self).__init__(curve_plot_item, view_box, state, metadata=metadata)
 
         if (xs is not None) and (ys is not None):
-            self.set_roi_graphics_object(xs, ys)
+            if self.outline_layer is not None:
+                self.roi_xs = xs.astype(int)
+                self.roi_ys = ys.astype(int)
+            else:
+                self.set_roi_graphics_object(xs, ys)
 
         if state is None:
             self.set_curve_data(curve_data)
@@ -467,7 +477,9 @@ class ScatterROI(BaseROI):
         self.roi_xs = state['roi_xs']
         self.roi_ys = state['roi_ys']
 
-        self._draw()
+        # ROIs in an outline layer are drawn when they're selected
+        if self.outline_layer is None:
+            self._draw()
 
     def to_state(self) -> dict:
         state = {'roi_xs':      self.roi_xs,
@@ -486,9 +498,28 @@ class ScatterROI(BaseROI):
 
         self._draw()
 
+    @property
+    def is_drawn(self) -> bool:
+        """False if the graphics object has not been created yet, such as for ROIs in an outline layer"""
+        return self.roi_graphics_object is not None
+
+    def _draw_lazy(self):
+        """Create the graphics object and add it to the viewer"""
+        self._draw()
+        self.view_box.addItem(self.roi_graphics_object)
+
+        if self.outline_layer is not None:
+            # shown with its own graphics object from now on
+            self.outline_layer.set_visible(self.layer_ix, False)
+
+        if self._color is not None:
+            self.set_color(self._color)
+
     def get_roi_graphics_object(self) -> pg.ScatterPlotItem:
-        if self.roi_graphics_object is None:
-            raise AttributeError('Must call set_roi_graphics_object() first')
+        if not self.is_drawn:
+            if not hasattr(self, 'roi_xs'):
+                raise AttributeError('Must call set_roi_graphics_object() first')
+            self._draw_lazy()
 
         return self.roi_graphics_object
 
@@ -496,6 +527,33 @@ class ScatterROI(BaseROI):
         """Create the scatter plot that is used for visualization of the spatial localization"""
         self.roi_graphics_object = pg.ScatterPlotItem(self.roi_xs, self.roi_ys, symbol='s', size=self.spot_size)
 
+    def add_to_viewer(self):
+        # lazily drawn ROIs are added to the viewer when they're first shown
+        if self.is_drawn:
+            super(ScatterROI, self).add_to_viewer()
+
+    def remove_from_viewer(self):
+        if self.outline_layer is not None:
+            self.outline_layer.remove(self.layer_ix)
+
+        if self.is_drawn:
+            super(ScatterROI, self).remove_from_viewer()
+        else:
+            self.curve_plot_item.clear()
+            del self.curve_plot_item
+
+    def set_color(self, color: Union[np.ndarray, str], *args, **kwargs):
+        if self.is_drawn:
+            return super(ScatterROI, self).set_color(color, *args, **kwargs)
+
+        # the graphics object gets this color when it's drawn
+        self.curve_plot_item.setPen(pg.mkPen(color, *args, **kwargs))
+
+        if self.outline_layer is not None:
+            self.outline_layer.set_color(self.layer_ix, color)
+
+        self._color = color
+
     @classmethod
     def from_state(cls, curve_plot_item: pg.PlotDataItem, view_box: pg.ViewBox, state: dict, **kwargs):
         return cls(curve_plot_item=curve_plot_item, view_box=view_box, state=state, **kwargs)
@@ -599,19 +657,23 @@ class CNMFROI(ScatterROI):
     def __init__(self, curve_plot_item: pg.PlotDataItem, view_box: pg.ViewBox, cnmf_idx: int = None,
                  curve_data: np.ndarray = None, contour: dict = None, state: Union[dict, None] = None,
                  spike_data: np.ndarray = None, dfof_data: np.ndarray = None, metadata: dict = None,
-                 **kwargs):
+                 contour_getter: Callable[[], dict] = None, outline_layer=None, layer_ix: int = None, **kwargs):
         """
         Instantiate attributes.
 
-        :type: curve_data:  np.ndarray
-        :param curve_data:  1D numpy array of y values
-        :type  contour:     np.ndarray
-        :type  state:       dict
-        :param cnmf_idx:    original index of the ROI from cnmf idx_components
+        :type: curve_data:      np.ndarray
+        :param curve_data:      1D numpy array of y values
+        :type  contour:         np.ndarray
+        :type  state:           dict
+        :param cnmf_idx:        original index of the ROI from cnmf idx_components
+        :param contour_getter:  Pass instead of ``contour`` to compute the contour and create the graphics object
+                                only when the ROI is first shown.
         """
+        self._contour_getter = None
+
         super(CNMFROI, self).__init__(curve_plot_item, view_box, state, curve_data,
                                       spike_data=spike_data, dfof_data=dfof_data,
-                                      metadata=metadata)
+                                      metadata=metadata, outline_layer=outline_layer, layer_ix=layer_ix)
 
         self.roi_xs = np.empty(0)  #: numpy array of the x values of the ROI's spatial coordinates
         self.roi_ys = np.empty(0)  #: numpy array of the y values of the ROI's spatial coordinates
@@ -622,14 +684,10 @@ class CNMFROI(ScatterROI):
             self.raw_min_max = None
 
         if state is None:
-            # get the outline from the cnmf output
-            cors = contour['coordinates']
-            cors = cors[~np.isnan(cors).any(axis=1)]
-
-            xs = cors[:, 0].flatten()
-            ys = cors[:, 1].flatten()
-
-            self.set_roi_graphics_object(xs, ys)
+            if contour is not None:
+                self._set_contour(contour)
+            else:
+                self._contour_getter = contour_getter
 
             self.set_curve_data(curve_data)
             self.cnmf_idx = cnmf_idx  #: original index of the ROI from cnmf idx_components
@@ -638,6 +696,31 @@ class CNMFROI(ScatterROI):
 
         # self.spot_size = 1
 
+    @staticmethod
+    def _get_contour_xys(contour: dict) -> tuple:
+        """Get the outline from the cnmf contour"""
+        cors = contour['coordinates']
+        cors = cors[~np.isnan(cors).any(axis=1)]
+
+        xs = cors[:, 0].flatten()
+        ys = cors[:, 1].flatten()
+
+        return xs, ys
+
+    def _set_contour(self, contour: dict):
+        self.set_roi_graphics_object(*self._get_contour_xys(contour))
+
+    def _draw_lazy(self):
+        """Compute the contour and add the graphics object to the viewer"""
+        if self._contour_getter is not None:
+            xs, ys = self._get_contour_xys(self._contour_getter())
+            self._contour_getter = None
+
+            self.roi_xs = xs.astype(int)
+            self.roi_ys = ys.astype(int)
+
+        super(CNMFROI, self)._draw_lazy()
+
     def restore_state(self, state):
         super(CNMFROI, self).restore_state(state)
         # self.curve_data = state['curve_data']
@@ -651,6 +734,15 @@ class CNMFROI(ScatterROI):
             self.raw_max = None
 
     def to_state(self) -> dict:
+        if not self.is_drawn and self._contour_getter is not None:
+            # only the coordinates are needed, the graphics object is still created when the ROI is first shown.
+            # ROIs that were restored from a state already have their coordinates.
+            contour = self._contour_getter()
+            self._contour_getter = lambda: contour
+            xs, ys = self._get_contour_xys(contour)
+            self.roi_xs = xs.astype(int)
+            self.roi_ys = ys.astype(int)
+
         state = super(CNMFROI, self).to_state()
 
         state = {**state,
@@ -18,7 +18,6 @@ import numpy as np
 from pathlib import Path
 from scipy.spatial import cKDTree
 from .roi_manager_modules.managers import ManagerScatterROI
-from tqdm import tqdm
 from typing import *
 
 
@@ -78,6 +77,42 @@ def get_vertices(s: np.ndarray):
     return vs
 
 
+def get_all_vertices(stat: np.ndarray) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """
+    Edge points of all ROIs in the stat array, the same points as ``get_vertices()`` but computed for all ROIs
+    together. A point is on the edge if any of its 4 neighbours is not part of the same ROI.
+
+    :param stat:    Suite2p stat array
+    :return:        (xs, ys), lists of the x & y coordinates of the edge points of each ROI
+    """
+    sizes = np.array([s['xpix'].size for s in stat], dtype=np.int64)
+
+    if sizes.sum() == 0:
+        return [np.empty(0, dtype=np.int64)] * len(stat), [np.empty(0, dtype=np.int64)] * len(stat)
+
+    xs = np.concatenate([s['xpix'] for s in stat]).astype(np.int64)
+    ys = np.concatenate([s['ypix'] for s in stat]).astype(np.int64)
+    roi_ix = np.repeat(np.arange(sizes.size), sizes)
+
+    # one key for each (roi, y, x), padded by 1 so that neighbours outside the image still have unique keys
+    w = xs.max() + 3
+    h = ys.max() + 3
+    keys = (roi_ix * h + ys + 1) * w + xs + 1
+    sorted_keys = np.sort(keys)
+
+    n_neighbours = np.zeros(keys.size, dtype=np.int64)
+    for offset in (1, -1, w, -w):
+        neighbours = keys + offset
+        ixs = np.minimum(np.searchsorted(sorted_keys, neighbours), sorted_keys.size - 1)
+        n_neighbours += sorted_keys[ixs] == neighbours
+
+    edge = n_neighbours < 4
+
+    splits = np.cumsum(np.bincount(roi_ix[edge], minlength=sizes.size))[:-1]
+
+    return np.split(xs[edge], splits), np.split(ys[edge], splits)
+
+
 class ModuleGUI(QtWidgets.QDockWidget):
     def __init__(self, parent, viewer_reference):
         self.vi = ViewerUtils(viewer_reference)
@@ -114,14 +149,6 @@ class ModuleGUI(QtWidgets.QDockWidget):
         else:
             self.has_iscell_column = True
 
-        if (len(self.data.stat) > 100) and (not self.ui.checkBox_use_iscell.isChecked()):
-            if QMessageBox.warning(self, 'Large Import Warning!',
-                                      f'This will import {len(self.data.stat)} ROIs which may take a few minutes.\n'
-                                      f'You may want to consider importing only ROIs classified as cells '
-                                      f'by the suite2p classifier.\n\n'
-                                      f'Continue anyways?', QMessageBox.Yes, QMessageBox.No) == QMessageBox.No:
-                return
-
         if len(self.vi.viewer.workEnv.roi_manager.roi_list) > 0:
             if QMessageBox.warning(self, 'Clear ROI Manager?',
                                              'Importing Suite2p ROIs will clear the ROI Manager, proceed anyway?',
@@ -151,34 +178,25 @@ class ModuleGUI(QtWidgets.QDockWidget):
             stat = stat[mask]
             iscell = iscell[mask]
 
+        self.vi.viewer.status_bar_label.showMessage(f'Importing {len(stat)} ROIs from Suite2p output data...')
+
         # substract neuropil contribution
         Fc = F - (self.data.Fneu_sub * Fneu)
 
-        for ix in tqdm(range(len(stat))):
-            self.vi.viewer.status_bar_label.showMessage(f'Importing ROIs from Suite2p output data. {ix} / {len(stat)}')
-
-            pos = get_vertices(stat[ix])
-            xs = pos[:, 0]
-            ys = pos[:, 1]
-
-            y = Fc[ix]
-
-            roi = roi_manager.add_roi(
-                curve=y,
-                xs=xs,
-                ys=ys,
-                metadata=stat[ix]
-            )
-
-            # x = np.arange(y.size + 1, dtype=np.float64)[1:]
-            #
-            # # set curve data
-            # roi.curve_data = (x, y)
+        # outlines of all ROIs
+        xs, ys = get_all_vertices(stat)
 
+        rois = roi_manager.add_rois(
+            curves=Fc,
+            xs=xs,
+            ys=ys,
+            metadata=list(stat)
+        )
 
-            # set is_cell data
-            if self.has_iscell_column:
-                roi.set_tag('s2p_iscell', f"{int(iscell[ix][0])} | {iscell[ix][1]}")
+        # set is_cell data
+        if self.has_iscell_column:
+            for roi, (is_cell, probability) in zip(rois, iscell):
+                roi.set_tag('s2p_iscell', f"{int(is_cell)} | {probability}")
 
         log = {'Fneu_subtraction': self.data.Fneu_sub,
                'ops': self.data.ops}
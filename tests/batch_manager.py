@@ -30,7 +30,7 @@ class CreateNewBatch(BaseBatchManager):
         bm.create_new_batch(self.batch_path)
         self.assertIsInstance(bm, BatchManagerGUI)
 
-        self.assertTrue(os.path.isfile(os.path.join(self.batch_path, 'dataframe.batch')))
+        self.assertTrue(os.path.isfile(os.path.join(self.batch_path, 'batch.db')))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,72 @@
+"""
+Frame rate benchmark for ImageView playback of uint16 image sequences, with and without the numba rendering kernels.
+
+Run with: python -m tests.benchmarks.image_rendering
+"""
+
+from PyQt5 import QtWidgets
+import numpy as np
+from time import perf_counter
+from mesmerize import pyqtgraphCore as pg
+from mesmerize.pyqtgraphCore import functions as fn
+
+
+SHAPES = [(512, 512), (1024, 1024)]
+N_FRAMES = 300
+
+
+def make_stack(shape: tuple, n_frames: int = N_FRAMES) -> np.ndarray:
+    rng = np.random.RandomState(0)
+    return rng.randint(0, 2 ** 12, size=(n_frames,) + shape).astype(np.uint16)
+
+
+def bench_makeARGB(stack: np.ndarray, use_numba: bool) -> float:
+    """frames per second for makeARGB alone, using the same levels + lut that ImageItem.render uses"""
+    pg.setConfigOptions(useNumba=use_numba)
+    lut = np.random.RandomState(1).randint(0, 256, size=(256, 4)).astype(np.ubyte)
+    out = np.empty(stack.shape[1:] + (4,), dtype=np.ubyte)
+
+    # warm up jit
+    fn.makeARGB(stack[0], lut=lut, levels=[100, 3000], output=out)
+
+    t0 = perf_counter()
+    for frame in stack:
+        fn.makeARGB(frame, lut=lut, levels=[100, 3000], output=out)
+    return stack.shape[0] / (perf_counter() - t0)
+
+
+def bench_play(app: QtWidgets.QApplication, stack: np.ndarray, use_numba: bool) -> float:
+    """frames per second for stepping through all frames of an ImageView, as ImageView.play does"""
+    pg.setConfigOptions(useNumba=use_numba)
+    imv = pg.ImageView()
+    imv.show()
+    imv.setImage(stack)
+    app.processEvents()
+
+    imv.setCurrentIndex(1)
+    app.processEvents()
+
+    t0 = perf_counter()
+    for ix in range(stack.shape[0]):
+        imv.setCurrentIndex(ix)
+        app.processEvents()
+    fps = stack.shape[0] / (perf_counter() - t0)
+
+    imv.close()
+    return fps
+
+
+def run():
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    print(f'numba available: {fn.HAVE_NUMBA}')
+
+    for shape in SHAPES:
+        stack = make_stack(shape)
+        for use_numba in ([True, False] if fn.HAVE_NUMBA else [False]):
+            print(f'{shape[0]}x{shape[1]} uint16, numba={use_numba}:\t'
+                  f'makeARGB {bench_makeARGB(stack, use_numba):.1f} fps\t'
+                  f'ImageView.play {bench_play(app, stack, use_numba):.1f} fps')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,54 @@
+"""
+Benchmark of the running percentile filter against scipy.ndimage.percentile_filter, for long curves and large windows.
+
+Run with: python -m tests.benchmarks.running_percentile
+"""
+
+import numpy as np
+from time import perf_counter
+from scipy.ndimage import percentile_filter
+from mesmerize.analysis.math import running_percentile as rp
+
+
+N_CURVES = 20
+N_FRAMES = 100000
+WINDOWS = [100, 500, 2000]
+PERCENTILE = 8
+
+
+def make_curves(n_curves: int = N_CURVES, n_frames: int = N_FRAMES) -> np.ndarray:
+    rng = np.random.RandomState(0)
+    drift = np.linspace(0, 5, n_frames)
+    return rng.standard_normal((n_curves, n_frames)) + drift + 100
+
+
+def bench(func, *args) -> float:
+    """seconds for one call"""
+    t0 = perf_counter()
+    func(*args)
+    return perf_counter() - t0
+
+
+def run():
+    curves = make_curves()
+    print(f'numba available: {rp.HAVE_NUMBA}')
+    print(f'{N_CURVES} curves x {N_FRAMES} frames, percentile {PERCENTILE}')
+
+    # warm up jit
+    rp.running_percentile(curves[:1, :1000], PERCENTILE, 10)
+
+    for w in WINDOWS:
+        t_rp = bench(rp.running_percentile, curves, PERCENTILE, w)
+        t_scipy = bench(lambda: percentile_filter(curves, PERCENTILE, size=(1, w), mode='reflect'))
+
+        same = np.array_equal(
+            rp.running_percentile(curves[:2], PERCENTILE, w),
+            percentile_filter(curves[:2], PERCENTILE, size=(1, w), mode='reflect')
+        )
+
+        print(f'window {w}:\trunning_percentile {t_rp:.2f} s\tscipy percentile_filter {t_scipy:.2f} s\t'
+              f'same output: {same}')
+
+
+if __name__ == '__main__':
+    run()
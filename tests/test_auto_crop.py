@@ -0,0 +1,141 @@
+import os
+import numpy as np
+import tifffile
+import pytest
+from mesmerize.viewer.image_utils import auto_crop
+from mesmerize.viewer.image_utils.auto_crop import get_projections, get_file_projections, crop_file, open_tiff
+
+PARAMS = {'projection': 'max+std', 'method': 'threshold', 'denoise': 'none', 'padding': 2}
+
+
+def _seq(n_frames: int = 37, seed: int = 0) -> np.ndarray:
+    """[x, y, t] sequence with a bright rectangle, in the orientation of the viewer"""
+    rng = np.random.default_rng(seed)
+    seq = rng.integers(0, 100, (40, 30, n_frames)).astype(np.uint16)
+    seq[10:25, 8:20] += rng.integers(2000, 4000, (15, 12, n_frames)).astype(np.uint16)
+    return seq
+
+
+def _frame_bytes(seq: np.ndarray, axis: int) -> int:
+    return seq.size // seq.shape[axis] * 8
+
+
+def _write_tiff(path: str, seq: np.ndarray, **kwargs):
+    # [t, y, x] in the file
+    imwrite = tifffile.imwrite if hasattr(tifffile, 'imwrite') else tifffile.imsave
+    imwrite(path, np.ascontiguousarray(seq.T), **kwargs)
+
+
+@pytest.mark.parametrize('chunk_frames', [1, 2, 5, 36, 37, 1000])
+@pytest.mark.parametrize('axis', [0, 2])
+def test_projections_same_as_numpy(chunk_frames, axis):
+    seq = _seq()
+    if axis == 0:
+        seq = np.ascontiguousarray(seq.T)
+
+    max_proj, std_proj = get_projections(seq, axis=axis, chunk_bytes=chunk_frames * _frame_bytes(seq, axis))
+
+    np.testing.assert_array_equal(max_proj, seq.max(axis=axis))
+    assert max_proj.dtype == seq.dtype
+    np.testing.assert_allclose(std_proj, seq.std(axis=axis), rtol=1e-10)
+
+
+def test_projections_float_and_offset():
+    # a large offset, the std must not lose precision from the sums of squares
+    seq = 1e6 + np.random.default_rng(0).normal(size=(8, 9, 50))
+
+    max_proj, std_proj = get_projections(seq, chunk_bytes=3 * _frame_bytes(seq, 2))
+
+    np.testing.assert_array_equal(max_proj, seq.max(axis=2))
+    np.testing.assert_allclose(std_proj, seq.std(axis=2), rtol=1e-6)
+
+
+def test_projections_no_frames():
+    with pytest.raises(ValueError):
+        get_projections(np.zeros((4, 4, 0)))
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_file_projections(tmp_path, compress):
+    seq = _seq()
+    path = str(tmp_path / 'a.tiff')
+    # compressed files can't be memory mapped and are read a few pages at a time
+    _write_tiff(path, seq, **({'compression': 'zlib'} if compress else {}))
+
+    stack = open_tiff(path)
+    assert isinstance(stack, auto_crop._TiffPages) == compress
+
+    max_proj, std_proj = get_file_projections(path, stack, cache=False, chunk_bytes=4 * _frame_bytes(seq, 2))
+
+    np.testing.assert_array_equal(max_proj, seq.max(axis=2))
+    np.testing.assert_allclose(std_proj, seq.std(axis=2), rtol=1e-10)
+    assert not any(os.path.isfile(p) for p in auto_crop.get_projection_paths(path))
+
+
+def test_crop_file(tmp_path):
+    seq = _seq()
+    path, out_path = str(tmp_path / 'a.tiff'), str(tmp_path / 'a_cropped.tiff')
+    _write_tiff(path, seq)
+
+    # several chunks of frames are written
+    rect = crop_file(path, out_path, PARAMS, chunk_bytes=5 * _frame_bytes(seq, 2))
+    (x1, y1), (x2, y2) = rect
+
+    # the rectangle with the padding
+    assert (x1, y1, x2, y2) == (8 - 2, 10 - 2, 20 + 2, 25 + 2)
+
+    cropped = tifffile.imread(out_path).T
+    np.testing.assert_array_equal(cropped, seq[y1:y2, x1:x2, :])
+
+    with pytest.raises(ValueError):
+        crop_file(path, path, PARAMS)
+
+
+def test_crop_file_projection_cache(tmp_path, monkeypatch):
+    seq = _seq()
+    path = str(tmp_path / 'a.tiff')
+    _write_tiff(path, seq)
+
+    max_path, std_path = auto_crop.get_projection_paths(path)
+    assert (max_path, std_path) == (str(tmp_path / 'a_max_proj.tiff'), str(tmp_path / 'a_std_proj.tiff'))
+
+    rect = crop_file(path, str(tmp_path / 'out_1.tiff'), PARAMS)
+
+    # the projections are cached next to the file
+    np.testing.assert_array_equal(tifffile.imread(max_path), seq.max(axis=2))
+    np.testing.assert_allclose(tifffile.imread(std_path), seq.std(axis=2), rtol=1e-10)
+
+    n_computed = []
+    _get_projections = auto_crop.get_projections
+
+    def get_projections(*args, **kwargs):
+        n_computed.append(1)
+        return _get_projections(*args, **kwargs)
+
+    monkeypatch.setattr(auto_crop, 'get_projections', get_projections)
+
+    # the cached projections are used
+    assert crop_file(path, str(tmp_path / 'out_2.tiff'), PARAMS) == rect
+    assert len(n_computed) == 0
+
+    # the file changed after the projections were cached
+    new_seq = _seq(seed=1)
+    _write_tiff(path, new_seq)
+    t = os.path.getmtime(path) - 10
+    for p in [max_path, std_path]:
+        os.utime(p, (t, t))
+
+    assert auto_crop.load_cached_projections(path) is None
+
+    crop_file(path, str(tmp_path / 'out_3.tiff'), PARAMS)
+    assert len(n_computed) == 1
+
+    np.testing.assert_array_equal(tifffile.imread(max_path), new_seq.max(axis=2))
+    assert os.path.getmtime(max_path) >= os.path.getmtime(path)
+
+    # not cached
+    os.remove(std_path)
+    assert auto_crop.load_cached_projections(path) is None
+    crop_file(path, str(tmp_path / 'out_4.tiff'), PARAMS, cache_projections=False)
+    assert len(n_computed) == 2
+    assert not os.path.isfile(std_path)
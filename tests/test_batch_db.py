@@ -0,0 +1,166 @@
+import os
+import sqlite3
+from uuid import uuid4
+import pandas as pd
+import pytest
+from mesmerize.viewer.modules.batch_run_modules.batch_db import BatchDB, COLUMNS, LEGACY_FILENAME, DB_FILENAME
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = BatchDB(str(tmp_path))
+    yield db
+    db.close()
+
+
+def _add(db: BatchDB, module: str = 'CNMF', **kwargs):
+    u = uuid4()
+    db.add_item(u, module, name=f'item {u}', input_params={'k': [1, 2]}, info={'fps': 10}, **kwargs)
+    return u
+
+
+def test_add_update_delete(db):
+    uuids = [_add(db) for i in range(3)]
+    u_mc = _add(db, 'caiman_motion_correction', input_hash='abc')
+
+    df = db.to_dataframe()
+    assert list(df.columns) == COLUMNS
+    assert list(df['uuid']) == uuids + [u_mc]
+    assert df['input_params'].iloc[0] == {'k': [1, 2]}
+
+    db.update_item(uuids[1], name='renamed', save_temp_files=1, input_params={'k': [3]})
+    df = db.to_dataframe()
+    assert df['name'].iloc[1] == 'renamed'
+    assert df['save_temp_files'].iloc[1] == 1
+    assert df['input_params'].iloc[1] == {'k': [3]}
+
+    with pytest.raises(KeyError):
+        db.update_item(uuids[1], output='x')
+
+    db.delete_items([uuids[0]])
+    assert db.get_uuids() == uuids[1:] + [u_mc]
+
+    # new items are added after the last one, even after deletions
+    u_new = _add(db)
+    assert db.get_uuids()[-1] == u_new
+
+    assert db.get_uuids(module='caiman_motion_correction') == [u_mc]
+    assert db.get_input_hash(u_mc) == 'abc'
+    assert db.get_input_hashes() == {'abc'}
+
+
+def test_outputs(db):
+    u0, u1, u2 = _add(db), _add(db), _add(db)
+
+    db.set_output(u0, {'status': 1, 'output': 'x'}, mtime=123.)
+    db.set_output(u1, {'status': 0, 'output_info': 'error'})
+
+    assert db.get_output(u0) == ({'status': 1, 'output': 'x'}, 123.)
+    assert db.get_output(u1) == ({'status': 0, 'output_info': 'error'}, None)
+    assert db.get_output(u2) == (None, None)
+
+    assert db.get_statuses() == [(u0, 1, 123.), (u1, 0, None), (u2, None, None)]
+    assert db.get_uuids(status=1) == [u0]
+    assert db.get_uuids(status=-1) == [u2]
+
+    # cleared before the item is run again
+    db.set_output(u0, None)
+    assert db.get_output(u0) == (None, None)
+
+
+def test_record_output(tmp_path, db):
+    u = _add(db)
+    out_path = str(tmp_path / f'{u}.out')
+    with open(out_path, 'w') as f:
+        f.write('{}')
+
+    BatchDB.record_output(str(tmp_path), u, {'status': 1}, out_path)
+
+    assert db.get_output(u) == ({'status': 1}, os.path.getmtime(out_path))
+
+    # nothing is recorded for batches without a database
+    no_db = tmp_path / 'no_db'
+    no_db.mkdir()
+    BatchDB.record_output(str(no_db), u, {'status': 1}, out_path)
+    assert not os.path.isfile(no_db / DB_FILENAME)
+
+
+def test_read_input_hash(tmp_path, db):
+    u = _add(db, input_hash='abc')
+    u_own_input = _add(db)
+
+    assert BatchDB.read_input_hash(str(tmp_path), u) == 'abc'
+    assert BatchDB.read_input_hash(str(tmp_path), str(u)) == 'abc'
+    assert BatchDB.read_input_hash(str(tmp_path), u_own_input) is None
+
+    # batches without a database, such as when the database is not reachable
+    no_db = tmp_path / 'no_db'
+    no_db.mkdir()
+    assert BatchDB.read_input_hash(str(no_db), u) is None
+    assert not os.path.isfile(no_db / DB_FILENAME)
+
+
+def test_import_legacy_batch(tmp_path):
+    uuids = [uuid4() for i in range(3)]
+    df = pd.DataFrame(
+        {
+            'module': ['CNMF', 'CNMFE', 'CNMF'],
+            'name': ['a', 'b', 'c'],
+            'input_item': [None, uuids[0], None],
+            'input_params': [{'p': i} for i in range(3)],
+            'info': [{} for i in range(3)],
+            'uuid': uuids,
+            'output': [None] * 3,
+            'save_temp_files': [0, 1, 0],
+        }
+    )
+    df.to_pickle(str(tmp_path / LEGACY_FILENAME))
+
+    assert BatchDB.is_batch_dir(str(tmp_path))
+
+    db = BatchDB.open(str(tmp_path))
+    imported = db.to_dataframe()
+    db.close()
+
+    assert list(imported['uuid']) == uuids
+    assert list(imported['name']) == ['a', 'b', 'c']
+    assert imported['input_item'].iloc[1] == uuids[0]
+    assert list(imported['input_params']) == [{'p': i} for i in range(3)]
+    assert list(imported['save_temp_files']) == [0, 1, 0]
+
+    # opened from the database the next time
+    os.remove(str(tmp_path / LEGACY_FILENAME))
+    db = BatchDB.open(str(tmp_path))
+    assert db.get_uuids() == uuids
+    db.close()
+
+
+def test_open_not_a_batch(tmp_path):
+    assert not BatchDB.is_batch_dir(str(tmp_path))
+
+    with pytest.raises(FileNotFoundError):
+        BatchDB.open(str(tmp_path))
+
+
+def test_old_databases_are_migrated(tmp_path):
+    # database in WAL mode from before the input hash and output mtime were stored
+    path = str(tmp_path / DB_FILENAME)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(
+        'CREATE TABLE items (uuid TEXT PRIMARY KEY, position INTEGER NOT NULL, module TEXT NOT NULL, '
+        "name TEXT NOT NULL DEFAULT '', input_item TEXT, input_params BLOB, info BLOB, "
+        'save_temp_files INTEGER NOT NULL DEFAULT 0, status INTEGER, output TEXT)'
+    )
+    u = uuid4()
+    with conn:
+        conn.execute("INSERT INTO items (uuid, position, module) VALUES (?, 0, 'CNMF')", (str(u),))
+    conn.close()
+
+    db = BatchDB(str(tmp_path))
+    assert db.conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+
+    db.set_output(u, {'status': 1}, mtime=1.)
+    assert db.get_statuses() == [(u, 1, 1.)]
+    assert db.get_input_hash(u) is None
+    db.close()
@@ -0,0 +1,72 @@
+import os
+import json
+from uuid import uuid4
+import pandas as pd
+import pytest
+from mesmerize.scripts.bulk_import import read_manifest, get_imported, remove_incomplete, SOURCE_KEY
+
+
+def test_read_csv_manifest(tmp_path):
+    with open(tmp_path / 'manifest.csv', 'w') as f:
+        f.write('tiff_path,animal_id,trial_id,roi_source,roi_path,fps,comments\n')
+        f.write('data/a.tiff,a,1,npz,data/a.npz,10,\n')
+        f.write('/abs/b.tiff,b,1,suite2p,/abs/suite2p,,some comment\n')
+
+    entries = read_manifest(str(tmp_path / 'manifest.csv'))
+
+    # relative paths are relative to the manifest's dir, empty values are left out
+    assert entries[0] == {'tiff_path': str(tmp_path / 'data' / 'a.tiff'), 'animal_id': 'a', 'trial_id': '1',
+                          'roi_source': 'npz', 'roi_path': str(tmp_path / 'data' / 'a.npz'), 'fps': '10'}
+    assert entries[1]['tiff_path'] == '/abs/b.tiff'
+    assert entries[1]['comments'] == 'some comment'
+    assert 'fps' not in entries[1].keys()
+
+
+def test_read_json_manifest(tmp_path):
+    entries = [{'tiff_path': 'a.tiff', 'animal_id': 'a', 'trial_id': 1, 'roi_source': 'npz', 'fps': 10.5}]
+    with open(tmp_path / 'manifest.json', 'w') as f:
+        json.dump(entries, f)
+
+    assert read_manifest(str(tmp_path / 'manifest.json')) == [{**entries[0], 'tiff_path': str(tmp_path / 'a.tiff')}]
+
+
+def test_manifest_missing_keys(tmp_path):
+    with open(tmp_path / 'manifest.json', 'w') as f:
+        json.dump([{'tiff_path': 'a.tiff', 'animal_id': 'a', 'roi_source': 'npz'}], f)
+
+    with pytest.raises(KeyError):
+        read_manifest(str(tmp_path / 'manifest.json'))
+
+
+def test_get_imported():
+    df = pd.DataFrame({'misc': [{SOURCE_KEY: '/a.tiff'}, {SOURCE_KEY: '/a.tiff'}, None, {'other': 1}]})
+
+    assert get_imported(df) == {'/a.tiff'}
+    assert get_imported(pd.DataFrame()) == set()
+
+
+def test_remove_incomplete(tmp_path):
+    for d in ['images', 'curves']:
+        os.makedirs(tmp_path / d)
+
+    def make_sample(sample_id: str) -> list:
+        name = f'{sample_id}-_-{uuid4()}'
+        paths = [tmp_path / 'images' / f'{name}{ext}' for ext in ['.tiff', '.pik', '_max_proj.tiff']]
+        for path in paths:
+            path.touch()
+
+        curves = tmp_path / 'curves' / name
+        curves.mkdir()
+        (curves / '00000.npz').touch()
+
+        return [str(p) for p in paths + [curves]]
+
+    incomplete = make_sample('a-_-1')
+    # SampleIDs that start with the same characters
+    others = make_sample('a-_-10') + make_sample('b-_-1')
+
+    removed = remove_incomplete(str(tmp_path), ['a-_-1'])
+
+    assert sorted(removed) == sorted(incomplete)
+    assert not any(os.path.exists(p) for p in incomplete)
+    assert all(os.path.exists(p) for p in others)
@@ -0,0 +1,224 @@
+import json
+import numpy as np
+import pandas as pd
+import h5py
+import pytest
+from mesmerize.common import columnar_hdf
+from mesmerize.common.columnar_hdf import ColumnarHdf
+from mesmerize.analysis.data_types import Transmission, HistoryTrace
+
+
+def _dataframe(n: int = 6) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+
+    roi_states = [
+        {
+            'roi_type': 'CNMFROI',
+            'roi_xs': rng.integers(0, 100, 10 + i),
+            'roi_ys': rng.integers(0, 100, 10 + i),
+            'curve_data': [np.arange(20), rng.random(20)],
+            'tags': {'cell_type': f'type_{i % 2}'},
+            'cnmf_idx': i
+        }
+        for i in range(n)
+    ]
+    # an ROI without some of the keys, and a row without an ROI
+    roi_states[1] = {'roi_type': 'ManualROI', 'roi_xs': np.arange(3), 'tags': {}}
+    roi_states[2] = None
+
+    spikes = [rng.random(30) for i in range(n)]
+    spikes[3] = None
+
+    df = pd.DataFrame(
+        {
+            'SampleID': [f'animal_{i // 2}-_-{i}' for i in range(n)],
+            'uuid_curve': [f'{i:05}' for i in range(n)],
+            '_RAW_CURVE': [rng.random(30) for i in range(n)],
+            '_SPIKES': spikes,
+            '_RFFT': [rng.random(10 + i).astype(np.float32) for i in range(n)],
+            'ROI_State': roi_states,
+            'stim_maps': [[{'odor': pd.DataFrame({'name': ['a'], 'start': [0]})}] for i in range(n)],
+            'meta': [{'fps': 10.0, 'date': '20200101'} for i in range(n)],
+            'n_frames': np.arange(n) * 100,
+            'fps': np.full(n, 10.5),
+            'category': pd.Categorical(['a', 'b'] * (n // 2)),
+            'date': pd.date_range('2020-01-01', periods=n),
+            '_BLOCK_': 'block',
+        },
+        index=pd.Index(np.arange(n) * 2, name='ix')
+    )
+
+    # newer pandas infers a string dtype
+    return df.astype({'SampleID': object, 'uuid_curve': object, '_BLOCK_': object})
+
+
+def _assert_equal(a, b):
+    if isinstance(a, np.ndarray):
+        assert isinstance(b, np.ndarray)
+        assert a.dtype == b.dtype
+        np.testing.assert_array_equal(a, b)
+    elif isinstance(a, dict):
+        assert isinstance(b, dict)
+        assert list(a.keys()) == list(b.keys())
+        for k in a.keys():
+            _assert_equal(a[k], b[k])
+    elif isinstance(a, (list, tuple)):
+        assert type(a) == type(b) and len(a) == len(b)
+        for x, y in zip(a, b):
+            _assert_equal(x, y)
+    elif isinstance(a, pd.DataFrame):
+        pd.testing.assert_frame_equal(a, b)
+    else:
+        assert a == b
+
+
+def _assert_frame_equal(df: pd.DataFrame, expected: pd.DataFrame, object_dtype: bool = True):
+    assert list(df.columns) == list(expected.columns)
+    pd.testing.assert_index_equal(df.index, expected.index)
+
+    for c in expected.columns:
+        if expected[c].dtype == object:
+            if object_dtype:
+                assert df[c].dtype == object
+            for a, b in zip(expected[c], df[c]):
+                _assert_equal(a, b)
+        else:
+            pd.testing.assert_series_equal(df[c], expected[c])
+
+
+def _history_trace(df: pd.DataFrame) -> HistoryTrace:
+    h = HistoryTrace()
+    df, block_id = h.create_data_block(df)
+    h.add_operation('all', 'rfft', {'data_column': '_RAW_CURVE', 'frequencies': np.linspace(0, 5, 100).tolist()})
+    h.add_operation('all', 'normalize', {'data_column': '_RFFT', 'units': 'time'})
+    return df, h
+
+
+def test_round_trip(tmp_path):
+    df = _dataframe()
+    path = str(tmp_path / 'df.h5')
+
+    ColumnarHdf.save_dataframe(path, df, metadata={'a': [1, 2]})
+
+    assert ColumnarHdf.is_columnar(path)
+    assert ColumnarHdf.get_columns(path) == list(df.columns)
+
+    loaded, meta = ColumnarHdf.load_dataframe(path)
+
+    _assert_frame_equal(loaded, df)
+    assert meta == {'a': [1, 2]}
+
+    # arrays are stored as datasets, not pickled
+    names = list(df.columns)
+    with h5py.File(path, 'r') as f:
+        kinds = {c: f['COLUMNS'][str(names.index(c))].attrs['kind'] for c in names}
+
+        roi_state = f['COLUMNS'][str(names.index('ROI_State'))]
+        roi_keys = json.loads(roi_state.attrs['keys'])
+        roi_kinds = {k: roi_state[f'k{i}']['column'].attrs['kind'] for i, k in enumerate(roi_keys)}
+
+    assert kinds['_RAW_CURVE'] == 'fixed'
+    # with a None cell
+    assert kinds['_SPIKES'] == 'fixed'
+    assert kinds['_RFFT'] == 'ragged'
+    assert kinds['ROI_State'] == 'dicts'
+    assert kinds['SampleID'] == 'string'
+    assert kinds['n_frames'] == 'scalar'
+    assert kinds['date'] == 'datetime'
+    assert kinds['stim_maps'] == 'pickle'
+
+    assert roi_kinds['roi_xs'] == 'ragged'
+    assert roi_kinds['roi_type'] == 'string'
+    assert roi_kinds['tags'] == 'dicts'
+
+
+def test_empty_dataframe(tmp_path):
+    df = _dataframe().iloc[:0]
+    path = str(tmp_path / 'df.h5')
+
+    ColumnarHdf.save_dataframe(path, df)
+    loaded, meta = ColumnarHdf.load_dataframe(path)
+
+    assert list(loaded.columns) == list(df.columns)
+    assert len(loaded.index) == 0
+    assert meta is None
+
+
+def test_transmission_round_trip(tmp_path):
+    df, h = _history_trace(_dataframe())
+    t = Transmission(df, h, last_output='_RFFT', last_unit='frequency')
+    path = str(tmp_path / 't.trn')
+
+    t.to_hdf5(path)
+    loaded = Transmission.from_hdf5(path)
+
+    _assert_frame_equal(loaded.df, t.df)
+    assert loaded.last_output == '_RFFT'
+    assert loaded.last_unit == 'frequency'
+
+    assert loaded.history_trace.data_blocks == h.data_blocks
+    for db in h.data_blocks:
+        assert loaded.history_trace.get_data_block_history(db) == h.get_data_block_history(db)
+
+
+def test_read_columns(tmp_path, monkeypatch):
+    df, h = _history_trace(_dataframe())
+    path = str(tmp_path / 't.trn')
+    Transmission(df, h, last_output='_RAW_CURVE').to_hdf5(path)
+
+    read = []
+    _read_values = columnar_hdf._read_values
+
+    def read_values(group):
+        read.append(group.name)
+        return _read_values(group)
+
+    monkeypatch.setattr(columnar_hdf, '_read_values', read_values)
+
+    columns = ['ROI_State', '_RAW_CURVE', 'SampleID']
+    loaded = Transmission.from_hdf5(path, columns=columns)
+
+    _assert_frame_equal(loaded.df, df[columns])
+    assert loaded.history_trace.data_blocks == h.data_blocks
+
+    # the other columns are not read
+    names = list(df.columns)
+    read_columns = {g.split('/')[2] for g in read if g.startswith('/COLUMNS/')}
+    assert read_columns == {str(names.index(c)) for c in columns}
+
+    with pytest.raises(KeyError):
+        ColumnarHdf.load_dataframe(path, columns=['not_a_column'])
+
+
+def test_read_v1(tmp_path):
+    pytest.importorskip('tables')
+
+    # columns that v1 files, saved with pytables, can store
+    df, h = _history_trace(_dataframe().drop(columns=['category']))
+    t = Transmission(df, h, last_output='_RAW_CURVE', last_unit='time')
+    path = str(tmp_path / 't.trn')
+
+    t.to_hdf5(path, version=1)
+    assert not ColumnarHdf.is_columnar(path)
+
+    loaded = Transmission.from_hdf5(path)
+
+    # pandas >= 3 reads the str columns of v1 files as a string dtype
+    _assert_frame_equal(loaded.df, df, object_dtype=False)
+    assert loaded.last_output == '_RAW_CURVE'
+    for db in h.data_blocks:
+        assert loaded.history_trace.get_data_block_history(db) == h.get_data_block_history(db)
+
+    columns = ['_SPIKES', 'SampleID']
+    _assert_frame_equal(Transmission.from_hdf5(path, columns=columns).df, df[columns], object_dtype=False)
+
+
+def test_newer_version(tmp_path):
+    path = str(tmp_path / 'df.h5')
+    ColumnarHdf.save_dataframe(path, _dataframe())
+
+    with h5py.File(path, 'r+') as f:
+        f.attrs['version'] = columnar_hdf.FORMAT_VERSION + 1
+
+    with pytest.raises(ValueError):
+        ColumnarHdf.load_dataframe(path)
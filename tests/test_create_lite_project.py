@@ -0,0 +1,89 @@
+import os
+import numpy as np
+from mesmerize.scripts.create_lite_project import main
+
+
+def _make_project(proj_dir: str):
+    for d in ['dataframes', 'curves/s1', 'images', 'batches', 'trns']:
+        os.makedirs(os.path.join(proj_dir, d), exist_ok=True)
+
+    with open(os.path.join(proj_dir, 'config.cfg'), 'w') as f:
+        f.write('[ROI_DEFS]\n')
+
+    with open(os.path.join(proj_dir, 'dataframes', 'root.dfr.journal'), 'wb') as f:
+        f.write(b'record 1\n')
+
+    with open(os.path.join(proj_dir, 'images', 's1-_-abc.pik'), 'wb') as f:
+        f.write(b'pickle')
+
+    for name in ['s1-_-abc.tiff', 's1-_-abc_max_proj.tiff', 's1-_-abc_std_proj.tiff']:
+        with open(os.path.join(proj_dir, 'images', name), 'wb') as f:
+            f.write(b'tiff')
+
+    np.savez(os.path.join(proj_dir, 'curves', 's1', 'curve.npz'), curve=np.arange(5))
+
+
+def _same_file(a: str, b: str) -> bool:
+    return os.path.samefile(a, b)
+
+
+def test_lite_project_files(tmp_path):
+    proj, lite = str(tmp_path / 'proj'), str(tmp_path / 'lite')
+    _make_project(proj)
+
+    main(proj, lite, n_workers=2)
+
+    # raw image sequences are not copied
+    assert not os.path.exists(os.path.join(lite, 'images', 's1-_-abc.tiff'))
+
+    # files that are never modified in place are hard linked
+    for p in ['curves/s1/curve.npz', 'images/s1-_-abc_max_proj.tiff', 'images/s1-_-abc_std_proj.tiff']:
+        assert _same_file(os.path.join(proj, p), os.path.join(lite, p))
+
+    # mutable files are copied
+    for p in ['config.cfg', 'dataframes/root.dfr.journal', 'images/s1-_-abc.pik']:
+        assert os.path.isfile(os.path.join(lite, p))
+        assert not _same_file(os.path.join(proj, p), os.path.join(lite, p))
+
+
+def test_lite_project_does_not_write_into_project(tmp_path):
+    proj, lite = str(tmp_path / 'proj'), str(tmp_path / 'lite')
+    _make_project(proj)
+
+    main(proj, lite, n_workers=2)
+
+    # the journal is appended in place
+    with open(os.path.join(lite, 'dataframes', 'root.dfr.journal'), 'ab') as f:
+        f.write(b'record 2\n')
+
+    with open(os.path.join(proj, 'dataframes', 'root.dfr.journal'), 'rb') as f:
+        assert f.read() == b'record 1\n'
+
+
+def test_lite_project_replaces_old_hard_links(tmp_path):
+    proj, lite = str(tmp_path / 'proj'), str(tmp_path / 'lite')
+    _make_project(proj)
+
+    # lite projects made before mutable files were copied
+    journal = os.path.join('dataframes', 'root.dfr.journal')
+    os.makedirs(os.path.join(lite, 'dataframes'))
+    os.link(os.path.join(proj, journal), os.path.join(lite, journal))
+
+    main(proj, lite, n_workers=2)
+
+    assert not _same_file(os.path.join(proj, journal), os.path.join(lite, journal))
+
+
+def test_lite_project_update(tmp_path):
+    proj, lite = str(tmp_path / 'proj'), str(tmp_path / 'lite')
+    _make_project(proj)
+
+    main(proj, lite, n_workers=2)
+
+    with open(os.path.join(proj, 'dataframes', 'root.dfr.journal'), 'ab') as f:
+        f.write(b'record 2 with a different size\n')
+
+    main(proj, lite, n_workers=2)
+
+    with open(os.path.join(lite, 'dataframes', 'root.dfr.journal'), 'rb') as f:
+        assert f.read() == b'record 1\nrecord 2 with a different size\n'
@@ -0,0 +1,132 @@
+import os
+import pandas as pd
+import pytest
+from mesmerize.common.dataframe_journal import DataFrameJournal, read_project_dataframe
+
+
+def _rows(sample_id: str, n: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            'SampleID': [sample_id] * n,
+            'uuid_curve': [f'{sample_id}-{i}' for i in range(n)],
+            'ROI_State': [{'tags': {}, 'i': i} for i in range(n)],
+        }
+    )
+
+
+@pytest.fixture
+def journal(tmp_path):
+    proj = tmp_path / 'proj'
+    (proj / 'dataframes').mkdir(parents=True)
+
+    j = DataFrameJournal(str(proj / 'dataframes'))
+    j.write_snapshot(_rows('a', 2), backup=False)
+    return j
+
+
+def _assert_same(a: pd.DataFrame, b: pd.DataFrame):
+    a, b = a.reset_index(drop=True), b.reset_index(drop=True)
+    assert list(a['SampleID']) == list(b['SampleID'])
+    assert list(a['uuid_curve']) == list(b['uuid_curve'])
+    assert list(a['ROI_State']) == list(b['ROI_State'])
+
+
+def _replay(journal: DataFrameJournal, records: list) -> pd.DataFrame:
+    """Apply the records in memory, the same way as the project manager does"""
+    dataframe = journal.load()
+    for op, payload in records:
+        dataframe = DataFrameJournal.apply(dataframe, op, payload)
+    return dataframe
+
+
+def test_load_replays_records(journal):
+    records = [
+        ('append', _rows('b', 3)),
+        ('append', _rows('c', 1)),
+        ('delete_sample', 'a'),
+        ('replace_sample', ('b', _rows('b', 1))),
+        ('update_roi_states', {'c-0': {'i': 10, 'new': True}}),
+    ]
+    expected = _replay(journal, records)
+
+    for op, payload in records:
+        journal.append_record(op, payload)
+
+    loaded = DataFrameJournal(journal.dataframes_dir).load()
+    _assert_same(loaded, expected)
+
+    # replaced rows are added at the end
+    assert list(loaded['SampleID']) == ['c', 'b']
+    assert loaded['ROI_State'].iloc[0] == {'tags': {}, 'i': 10, 'new': True}
+
+
+def test_snapshot_round_trip(journal):
+    journal.append_rows(_rows('b', 2))
+    journal.delete_sample('a')
+    dataframe = journal.load()
+
+    journal.write_snapshot(dataframe, backup=True)
+    assert not os.path.isfile(journal.journal_path)
+    assert journal.n_records == 0
+
+    _assert_same(read_project_dataframe(os.path.dirname(journal.dataframes_dir)), dataframe)
+
+    # the previous snapshot is kept as a backup
+    backups = [f for f in os.listdir(journal.dataframes_dir) if f.startswith('root_bak_')]
+    assert len(backups) == 1
+
+
+def test_stale_journal_is_ignored(journal):
+    journal.append_rows(_rows('b', 2))
+
+    # compaction that was interrupted after the snapshot was replaced, before the journal was removed
+    stale = open(journal.journal_path, 'rb').read()
+    journal.write_snapshot(_rows('a', 2), backup=False)
+    with open(journal.journal_path, 'wb') as f:
+        f.write(stale)
+
+    with pytest.warns(UserWarning):
+        loaded = DataFrameJournal(journal.dataframes_dir).load()
+
+    _assert_same(loaded, _rows('a', 2))
+    assert not os.path.isfile(journal.journal_path)
+
+
+def test_incomplete_record_is_ignored(journal):
+    journal.append_rows(_rows('b', 2))
+    journal.append_rows(_rows('c', 2))
+
+    # write that was interrupted partway through the last record
+    size = os.path.getsize(journal.journal_path)
+    with open(journal.journal_path, 'r+b') as f:
+        f.truncate(size - 10)
+
+    with pytest.warns(UserWarning):
+        loaded = DataFrameJournal(journal.dataframes_dir).load()
+
+    assert list(loaded['SampleID']) == ['a', 'a', 'b', 'b']
+
+
+def test_needs_compaction(journal):
+    journal.max_records = 3
+    journal.max_ratio = 1000
+
+    journal.load()
+    assert not journal.needs_compaction()
+
+    for s in ['b', 'c']:
+        journal.append_rows(_rows(s, 1))
+    assert not journal.needs_compaction()
+
+    journal.append_rows(_rows('d', 1))
+    assert journal.needs_compaction()
+
+
+def test_prune_backups(journal):
+    journal.max_backups = 2
+
+    for i in range(4):
+        journal.write_snapshot(_rows('a', i + 1), backup=True)
+
+    backups = [f for f in os.listdir(journal.dataframes_dir) if f.startswith('root_bak_')]
+    assert len(backups) == 2
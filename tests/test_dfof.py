@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from scipy.ndimage import percentile_filter
+from mesmerize.analysis.math.dfof import percentile_baseline, dfof
+
+
+def _curves(n_curves: int = 4, n_frames: int = 300) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return 100 + np.cumsum(rng.normal(size=(n_curves, n_frames)), axis=1)
+
+
+def test_baseline_same_as_scipy():
+    curves = _curves()
+    expected = percentile_filter(curves, 8, size=(1, 51), mode='reflect')
+
+    np.testing.assert_allclose(percentile_baseline(curves, 8, 51), expected)
+
+
+@pytest.mark.parametrize('step', [2, 10, 299, 1000])
+def test_baseline_step(step):
+    curves = _curves()
+    exact = percentile_filter(curves, 20, size=(1, 31), mode='reflect')
+
+    baseline = percentile_baseline(curves, 20, 31, step=step)
+
+    # exact at the frames whose percentile is computed, linearly interpolated in between
+    centers = np.append(np.arange(0, 300, step), 299)
+    np.testing.assert_allclose(baseline[:, centers], exact[:, centers])
+
+    expected = np.stack([np.interp(np.arange(300), centers, e[centers]) for e in exact])
+    np.testing.assert_allclose(baseline, expected)
+
+
+def test_window_longer_than_curves():
+    curves = _curves(n_frames=20)
+
+    baseline = percentile_baseline(curves, 50, 500)
+
+    np.testing.assert_allclose(baseline, percentile_filter(curves, 50, size=(1, 20), mode='reflect'))
+
+
+def test_dfof():
+    curves = _curves()
+    baseline = percentile_filter(curves, 8, size=(1, 101), mode='reflect')
+
+    np.testing.assert_allclose(dfof(curves, 8, 101), (curves - baseline) / baseline)
+    np.testing.assert_allclose(dfof(curves, 8, 101, detrend_only=True), curves - baseline)
+
+    # single curve
+    np.testing.assert_allclose(dfof(curves[0], 8, 101), ((curves - baseline) / baseline)[:1])
@@ -0,0 +1,132 @@
+import pickle
+from uuid import uuid4
+import numpy as np
+import pandas as pd
+import pytest
+from mesmerize.analysis.data_types import HistoryTrace, OperationNotFound, BLOB_MIN_LENGTH
+
+
+def _history_trace(n_blocks: int = 3) -> HistoryTrace:
+    h = HistoryTrace()
+    for i in range(n_blocks):
+        h.create_data_block(pd.DataFrame({'a': [i]}))
+
+    freqs = np.linspace(0, 10, BLOB_MIN_LENGTH * 4)
+
+    h.add_operation('all', 'rfft', {'data_column': '_SPLICE_ARRAYS', 'frequencies': freqs, 'nested': {'a': [1, 2]}})
+    h.add_operation(h.data_blocks[0], 'normalize', {'data_column': '_RFFT', 'units': 'time'})
+    h.add_operation('all', 'splice_arrays', {'data_column': '_RAW_CURVE', 'start_ix': 0, 'end_ix': 10})
+
+    return h
+
+
+def _assert_same_history(a: HistoryTrace, b: HistoryTrace):
+    assert a.data_blocks == b.data_blocks
+    for db in a.data_blocks:
+        ha, hb = a.get_data_block_history(db), b.get_data_block_history(db)
+        assert [next(iter(o)) for o in ha] == [next(iter(o)) for o in hb]
+
+        for oa, ob in zip(ha, hb):
+            pa, pb = next(iter(oa.values())), next(iter(ob.values()))
+            assert pa.keys() == pb.keys()
+            for k in pa.keys():
+                if isinstance(pa[k], np.ndarray):
+                    np.testing.assert_array_equal(pa[k], pb[k])
+                else:
+                    assert pa[k] == pb[k]
+
+
+def test_operations_are_stored_once():
+    h = _history_trace()
+
+    assert len(h._operations) == 3
+    assert len(h._blobs) == 1
+
+    assert h.get_operations_list(h.data_blocks[0]) == ['rfft', 'normalize', 'splice_arrays']
+    assert h.get_operations_list(h.data_blocks[1]) == ['rfft', 'splice_arrays']
+
+    assert h.check_operation_exists(h.data_blocks[0], 'normalize')
+    assert not h.check_operation_exists(h.data_blocks[1], 'normalize')
+
+    with pytest.raises(OperationNotFound):
+        h.get_operation_params(h.data_blocks[1], 'normalize')
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_to_dict_from_dict(compact):
+    h = _history_trace()
+
+    # as stored in a pickle or hdf5 file
+    d = pickle.loads(pickle.dumps(h.to_dict(compact=compact)))
+
+    if compact:
+        assert set(d.keys()) == {'operations', 'blobs', 'blocks', 'data_blocks'}
+        # the large parameters are stored once
+        assert len(d['blobs']) == 1
+        assert all(len(ops) == len(h.get_operations_list(db)) for db, ops in d['blocks'].items())
+    else:
+        assert set(d.keys()) == {'history', 'data_blocks'}
+
+    restored = HistoryTrace(**HistoryTrace.from_dict(d))
+
+    _assert_same_history(restored, h)
+
+    # still stored once when the full history is read
+    assert len(restored._operations) == 3
+    assert len(restored._blobs) == 1
+
+
+def test_merge():
+    a, b = _history_trace(2), _history_trace(3)
+    b.add_operation('all', 'fcluster', {'linkage_matrix': np.ones((BLOB_MIN_LENGTH * 2, 4))})
+
+    merged = HistoryTrace.merge([a, b])
+
+    assert merged.data_blocks == a.data_blocks + b.data_blocks
+    for h in [a, b]:
+        for db in h.data_blocks:
+            assert merged.get_operations_list(db) == h.get_operations_list(db)
+
+    # the identical operations of both are stored once
+    assert len(merged._operations) == 4
+    assert len(merged._blobs) == 2
+
+    # adding an operation to the merged HistoryTrace doesn't change the ones that were merged
+    merged.add_operation('all', 'log_transform', {})
+    assert 'log_transform' not in a.get_operations_list(a.data_blocks[0])
+    assert 'log_transform' not in b.get_operations_list(b.data_blocks[0])
+
+
+def test_copy_isolation():
+    h = _history_trace()
+    c = h.copy()
+
+    c.add_operation('all', 'log_transform', {})
+    c._add_data_block(uuid4())
+
+    assert len(c.data_blocks) == len(h.data_blocks) + 1
+    assert all('log_transform' not in h.get_operations_list(db) for db in h.data_blocks)
+    assert 'log_transform' in c.get_operations_list(h.data_blocks[0])
+
+
+def test_returned_params_are_copies():
+    h = _history_trace()
+    db0, db1 = h.data_blocks[:2]
+
+    # modifying the params of one data block would otherwise change all data blocks that share the operation
+    params = h.get_operation_params(db0, 'rfft')
+    params['data_column'] = 'changed'
+    params['nested']['a'].append(3)
+    params['frequencies'][:] = -1
+
+    history = h.get_data_block_history(db0, copy=False)
+    history[0]['rfft']['nested']['a'].append(4)
+    history[0]['rfft']['frequencies'][:] = -2
+
+    h.history[db0][0]['rfft']['nested']['a'].append(5)
+
+    for db in [db0, db1]:
+        params = h.get_operation_params(db, 'rfft')
+        assert params['data_column'] == '_SPLICE_ARRAYS'
+        assert params['nested'] == {'a': [1, 2]}
+        np.testing.assert_array_equal(params['frequencies'], np.linspace(0, 10, BLOB_MIN_LENGTH * 4))
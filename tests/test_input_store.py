@@ -0,0 +1,90 @@
+import os
+import numpy as np
+from mesmerize.viewer.modules.batch_run_modules.input_store import InputStore, array_hash, link
+
+
+def _seq(seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 1000, (20, 16, 30)).astype(np.uint16)
+
+
+def test_array_hash_chunks():
+    seq = _seq()
+
+    # the same hash whatever the chunk size and memory order
+    key = array_hash(seq)
+    assert array_hash(seq, chunk_bytes=1) == key
+    assert array_hash(seq, chunk_bytes=20 * 16 * 2 * 7) == key
+    assert array_hash(np.asfortranarray(seq)) == key
+
+    # contents, dtype and shape
+    changed = seq.copy()
+    changed[3, 4, 29] += 1
+    assert array_hash(changed) != key
+    assert array_hash(seq.astype(np.int16)) != key
+    assert array_hash(seq.reshape(16, 20, 30)) != key
+
+    assert array_hash(seq[:, :, 0]) == array_hash(seq[:, :, 0].copy())
+
+
+def _write(data: bytes, calls: list):
+    def write(path: str):
+        calls.append(path)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return write
+
+
+def test_add_once(tmp_path):
+    store = InputStore(str(tmp_path))
+    calls = []
+
+    path = store.add('abc', _write(b'seq', calls))
+    assert store.add('abc', _write(b'other', calls)) == path
+
+    assert len(calls) == 1
+    assert open(path, 'rb').read() == b'seq'
+    assert os.listdir(store.store_dir) == ['abc.tiff']
+
+
+def test_add_failed_write(tmp_path):
+    store = InputStore(str(tmp_path))
+
+    def write(path: str):
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+        raise IOError
+
+    try:
+        store.add('abc', write)
+    except IOError:
+        pass
+
+    # a partly written input is never used
+    assert os.listdir(store.store_dir) == []
+
+
+def test_link(tmp_path):
+    src = str(tmp_path / 'src.tiff')
+    with open(src, 'wb') as f:
+        f.write(b'seq')
+
+    dst = str(tmp_path / 'dst.tiff')
+    assert link(src, dst) in ('hardlink', 'symlink', 'copy')
+    assert open(dst, 'rb').read() == b'seq'
+
+
+def test_collect_garbage(tmp_path):
+    store = InputStore(str(tmp_path))
+    for key in ['used', 'unused']:
+        store.add(key, _write(key.encode(), []))
+
+    # temp files of a process that is still running, and of one that no longer exists
+    running = os.path.join(store.store_dir, f'tmp-abc-{os.getpid()}.tiff')
+    dead = os.path.join(store.store_dir, 'tmp-abc-999999999.tiff')
+    for path in [running, dead]:
+        open(path, 'wb').close()
+
+    removed = store.collect_garbage(['used'])
+
+    assert sorted(removed) == sorted([store.get_path('unused'), dead])
+    assert sorted(os.listdir(store.store_dir)) == sorted(['used.tiff', os.path.basename(running)])
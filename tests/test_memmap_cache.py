@@ -0,0 +1,181 @@
+import os
+import sys
+import types
+import pytest
+from mesmerize.viewer.modules.batch_run_modules import memmap_cache
+from mesmerize.viewer.modules.batch_run_modules.memmap_cache import MemmapCache, HOST
+
+
+@pytest.fixture
+def caiman(monkeypatch):
+    """caiman with only ``save_memmap``, which writes the input file as the memmap"""
+    calls = []
+
+    def save_memmap(filenames, base_name, order, border_to_0, is_3D, dview):
+        calls.append(filenames[0])
+        path = f'{base_name}_d1_4_d2_3_d3_1_order_{order}_frames_5_.mmap'
+        with open(filenames[0], 'rb') as fsrc, open(path, 'wb') as fdst:
+            fdst.write(fsrc.read())
+        return path
+
+    cm = types.ModuleType('caiman')
+    cm.save_memmap = save_memmap
+    cm.calls = calls
+    monkeypatch.setitem(sys.modules, 'caiman', cm)
+
+    return cm
+
+
+def _input(tmp_path, name: str, data: bytes) -> str:
+    path = str(tmp_path / name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def _memmaps(cache: MemmapCache) -> list:
+    return sorted(f for f in os.listdir(cache.cache_dir) if f.endswith('.mmap'))
+
+
+def test_memmap_is_reused(tmp_path, caiman):
+    cache = MemmapCache(str(tmp_path))
+
+    input_a = _input(tmp_path, 'a_input.tiff', b'a' * 100)
+    # another batch item with the same input
+    input_b = _input(tmp_path, 'b_input.tiff', b'a' * 100)
+
+    key, path = cache.acquire(input_a, 'a')
+    assert os.path.basename(path).startswith(f'memmap-{key}_')
+    assert open(path, 'rb').read() == b'a' * 100
+
+    assert cache.acquire(input_b, 'b') == (key, path)
+    assert len(caiman.calls) == 1
+
+    # different memmap params
+    key_f, path_f = cache.acquire(input_a, 'c', order='F')
+    assert key_f != key
+    assert len(caiman.calls) == 2
+
+    # no temp or lock files are left
+    assert _memmaps(cache) == sorted([os.path.basename(path), os.path.basename(path_f)])
+    assert [f for f in os.listdir(cache.cache_dir) if f.startswith('tmp-') or f.endswith('.lock')] == []
+
+
+def test_stored_input_hash(tmp_path, caiman, monkeypatch):
+    cache = MemmapCache(str(tmp_path))
+
+    input_a = _input(tmp_path, 'a_input.tiff', b'a' * 100)
+    input_b = _input(tmp_path, 'b_input.tiff', b'a' * 100)
+
+    # inputs with a stored hash are not read to get the key
+    def file_hash(path, chunk_bytes=None):
+        raise AssertionError(f'{path} was hashed')
+
+    with monkeypatch.context() as m:
+        m.setattr(memmap_cache, 'file_hash', file_hash)
+
+        key, path = cache.acquire(input_a, 'a', input_hash='abc')
+        assert cache.acquire(input_b, 'b', input_hash='abc') == (key, path)
+        assert len(caiman.calls) == 1
+
+        # another stored input
+        key_c, path_c = cache.acquire(input_a, 'c', input_hash='def')
+        assert key_c != key
+        assert len(caiman.calls) == 2
+
+        assert MemmapCache.get_key(input_a, order='F', input_hash='abc') != key
+
+    # inputs without a stored hash are hashed
+    key_d, path_d = cache.acquire(input_a, 'd')
+    assert key_d not in (key, key_c)
+    assert MemmapCache.get_key(input_b) == key_d
+
+
+def test_release(tmp_path, caiman):
+    cache = MemmapCache(str(tmp_path))
+    input_path = _input(tmp_path, 'input.tiff', b'a' * 100)
+
+    key, path = cache.acquire(input_path, 'a')
+    cache.acquire(input_path, 'b')
+
+    # still used by b
+    cache.release(key, 'a', keep=False)
+    assert os.path.isfile(path)
+
+    cache.release(key, 'b', keep=False)
+    assert not os.path.isfile(path)
+
+
+def test_evict_unreferenced(tmp_path, caiman):
+    cache = MemmapCache(str(tmp_path), max_bytes=150)
+
+    key_a, path_a = cache.acquire(_input(tmp_path, 'a.tiff', b'a' * 100), 'a')
+    key_b, path_b = cache.acquire(_input(tmp_path, 'b.tiff', b'b' * 100), 'b')
+
+    # both are referenced, the cache is allowed to grow
+    assert os.path.isfile(path_a) and os.path.isfile(path_b)
+
+    cache.release(key_a, 'a')
+    assert not os.path.isfile(path_a)
+    assert os.path.isfile(path_b)
+
+
+def test_stale_references(tmp_path, caiman):
+    cache = MemmapCache(str(tmp_path), max_bytes=0)
+    key, path = cache.acquire(_input(tmp_path, 'a.tiff', b'a' * 100), 'a')
+
+    ref = os.path.join(cache.cache_dir, f'{key}.refs', 'a')
+    with open(ref, 'r') as f:
+        assert f.read() == f'{HOST}:{os.getpid()}'
+
+    # reference of a batch item on another host, its process can't be checked
+    with open(ref, 'w') as f:
+        f.write('otherhost:1')
+    cache.evict()
+    assert os.path.isfile(path)
+
+    # reference of a process on this host that no longer exists
+    with open(ref, 'w') as f:
+        f.write(f'{HOST}:999999999')
+    cache.evict()
+    assert not os.path.isfile(path)
+
+
+def test_stale_locks(tmp_path):
+    cache = MemmapCache(str(tmp_path))
+    lock = os.path.join(cache.cache_dir, 'cache.lock')
+
+    # lock of a process on this host that was killed
+    with open(lock, 'w') as f:
+        f.write(f'{HOST}:999999999')
+    cache.evict()
+    assert not os.path.isfile(lock)
+
+    # lock of a process on another host that was killed a long time ago
+    with open(lock, 'w') as f:
+        f.write('otherhost:1')
+    age = memmap_cache.REMOTE_STALE_LOCK_TIMEOUT + 1
+    os.utime(lock, (os.path.getatime(lock) - age, os.path.getmtime(lock) - age))
+    cache.evict()
+    assert not os.path.isfile(lock)
+
+    # a recent lock of another host is held
+    with open(lock, 'w') as f:
+        f.write('otherhost:1')
+    assert not memmap_cache._is_stale(lock, remote_timeout=memmap_cache.REMOTE_STALE_LOCK_TIMEOUT)
+
+
+def test_left_over_temp_memmaps(tmp_path):
+    cache = MemmapCache(str(tmp_path))
+
+    dead = os.path.join(cache.cache_dir, f'tmp-abc-{HOST}-999999999_d1_4_frames_5_.mmap')
+    running = os.path.join(cache.cache_dir, f'tmp-def-{HOST}-{os.getpid()}_d1_4_frames_5_.mmap')
+    remote = os.path.join(cache.cache_dir, 'tmp-ghi-otherhost-1_d1_4_frames_5_.mmap')
+    for path in [dead, running, remote]:
+        open(path, 'wb').close()
+
+    cache.evict()
+
+    assert not os.path.isfile(dead)
+    assert os.path.isfile(running)
+    assert os.path.isfile(remote)
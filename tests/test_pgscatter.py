@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from PyQt5 import QtGui, QtWidgets
+from mesmerize import pyqtgraphCore as pg
+from mesmerize.pyqtgraphCore.graphicsItems.ScatterPlotItem import renderSymbol
+from mesmerize.plotting.variants.pgscatter import ArrayScatterItem, _PixmapFragments
+
+
+@pytest.fixture
+def qapp():
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication([])
+    return app
+
+
+def _to_array(img: QtGui.QImage) -> np.ndarray:
+    return np.frombuffer(img.constBits().asstring(img.byteCount()), dtype=np.uint8).reshape(img.height(), -1).copy()
+
+
+def _blank(w: int = 100, h: int = 80) -> QtGui.QImage:
+    img = QtGui.QImage(w, h, QtGui.QImage.Format_ARGB32_Premultiplied)
+    img.fill(0)
+    return img
+
+
+@pytest.mark.parametrize('sip_array', [True, False])
+def test_pixmap_fragments(qapp, monkeypatch, sip_array):
+    if not sip_array:
+        # older PyQt5
+        monkeypatch.setattr(_PixmapFragments, 'USE_SIP_ARRAY', False)
+    elif not _PixmapFragments.USE_SIP_ARRAY:
+        pytest.skip('sip.array is not available')
+
+    pixmap = QtGui.QPixmap.fromImage(renderSymbol('o', 7, pg.mkPen('k'), pg.mkBrush('r')))
+    xy = np.random.default_rng(0).integers(0, 90, (50, 2))
+
+    fragments = _PixmapFragments()
+    fragments.resize(10)
+    fragments.resize(len(xy))
+    assert fragments.capacity >= len(xy)
+
+    fragments.array[:len(xy)] = (0, 0, 0, 0, pixmap.width(), pixmap.height(), 1, 1, 0, 1)
+    fragments.array[:len(xy), :2] = xy + np.array([pixmap.width(), pixmap.height()]) / 2
+
+    img = _blank()
+    p = QtGui.QPainter(img)
+    fragments.draw(p, 0, 20, pixmap)
+    fragments.draw(p, 20, len(xy), pixmap)
+    p.end()
+
+    expected = _blank()
+    p = QtGui.QPainter(expected)
+    for x, y in xy.tolist():
+        p.drawPixmap(x, y, pixmap)
+    p.end()
+
+    np.testing.assert_array_equal(_to_array(img), _to_array(expected))
+
+
+@pytest.mark.parametrize('alpha', [255, 128])
+def test_same_as_drawing_each_point(qapp, alpha):
+    widget = pg.PlotWidget()
+    widget.resize(300, 200)
+    widget.show()
+
+    item = ArrayScatterItem()
+    widget.addItem(item)
+
+    # spots that don't overlap, so the order in which they're drawn doesn't matter, and some duplicates
+    xs, ys = [a.ravel() for a in np.meshgrid(np.arange(0.05, 1, 0.05), np.arange(0.05, 1, 0.05))]
+    xs, ys = np.concatenate([xs, xs[::3]]), np.concatenate([ys, ys[::3]])
+
+    item.set_data(xs, ys, colors=[(255, 0, 0, alpha)], size=5)
+    widget.getPlotItem().vb.setRange(xRange=(0, 1), yRange=(0, 1), padding=0)
+    qapp.processEvents()
+
+    img = _blank(300, 200)
+    p = QtGui.QPainter(img)
+    item.paint(p)
+    p.end()
+
+    spot = renderSymbol('o', 5, item.pen, item.brushes[0])
+    offset = int(5 + max(np.ceil(item.pen.widthF()), 1)) // 2
+    pts = np.floor(pg.functions.transformCoordinates(item.deviceTransform(), np.vstack([xs, ys]))).astype(int).T
+
+    if alpha == 255:
+        # opaque spots at the same pixel are drawn once
+        pts = np.unique(pts, axis=0)
+
+    expected = _blank(300, 200)
+    p = QtGui.QPainter(expected)
+    for x, y in pts.tolist():
+        p.drawImage(x - offset, y - offset, spot)
+    p.end()
+
+    assert _to_array(img).any()
+    np.testing.assert_array_equal(_to_array(img), _to_array(expected))
@@ -0,0 +1,130 @@
+import pickle
+import numpy as np
+import pytest
+from PyQt5 import QtWidgets
+from mesmerize.viewer.modules.roi_manager_modules import roi_types
+from mesmerize.viewer.modules.roi_manager_modules.roi_layer import ROIOutlineLayer
+from mesmerize.viewer.modules.roi_manager_modules.roi_store import states_to_columns, columns_to_states, \
+    COLUMNS_VERSION
+from mesmerize import pyqtgraphCore as pg
+
+
+def _scatter_states(n: int) -> dict:
+    rng = np.random.default_rng(0)
+    states = []
+    for i in range(n):
+        n_px = rng.integers(5, 30)
+        states.append(
+            {
+                'roi_xs': rng.integers(0, 512, n_px),
+                'roi_ys': rng.integers(0, 512, n_px),
+                'curve_data': [np.arange(100), rng.random(100).astype(np.float32)],
+                'spike_data': None,
+                'dfof_data': [np.arange(100), rng.random(100)] if i % 2 == 0 else None,
+                'tags': {'cell_type': str(i)},
+                'roi_type': 'CNMFROI',
+                'cnmf_idx': i,
+                'raw_min_max': None,
+            }
+        )
+    # key that only some states have
+    states[-1]['extra'] = 1
+
+    return {'roi_type': 'CNMFROI', 'states': states, 'metadata': None, 'cnmf_output': {'idx_components': [1, 2]}}
+
+
+def _assert_states_equal(a: list, b: list):
+    assert len(a) == len(b)
+    for sa, sb in zip(a, b):
+        assert sa.keys() == sb.keys()
+        for k in sa.keys():
+            va, vb = sa[k], sb[k]
+            if isinstance(va, (list, tuple)):
+                assert type(va) is type(vb)
+                for x, y in zip(va, vb):
+                    np.testing.assert_array_equal(x, y)
+                    assert x.dtype == y.dtype
+            elif isinstance(va, np.ndarray):
+                np.testing.assert_array_equal(va, vb)
+                assert va.dtype == vb.dtype
+            else:
+                assert va == vb
+
+
+def test_columns_round_trip():
+    states = _scatter_states(50)
+
+    columns = pickle.loads(pickle.dumps(states_to_columns(states), protocol=4))
+    assert columns['columns_version'] == COLUMNS_VERSION
+    assert 'states' not in columns.keys()
+
+    restored = columns_to_states(columns)
+    _assert_states_equal(states['states'], restored['states'])
+    assert restored['cnmf_output'] == states['cnmf_output']
+    assert restored.keys() == states.keys()
+
+
+def test_columns_round_trip_manual_and_empty():
+    manual = {
+        'roi_type': 'ManualROI',
+        'states': [{'curve_data': (np.arange(3), np.ones(3)), 'shape': 'PolyLineROI',
+                    'roi_graphics_object_state': {'pos': (1, 2)}, 'tags': {}}],
+        'metadata': None
+    }
+    _assert_states_equal(manual['states'], columns_to_states(states_to_columns(manual))['states'])
+
+    empty = {'roi_type': 'ScatterROI', 'states': [], 'metadata': None}
+    assert columns_to_states(states_to_columns(empty)) == empty
+
+
+def test_list_states_are_read_as_they_are():
+    # states saved before the columns format
+    states = _scatter_states(3)
+    assert columns_to_states(states) is states
+
+
+def test_newer_columns_version_raises():
+    columns = states_to_columns(_scatter_states(3))
+    columns['columns_version'] = COLUMNS_VERSION + 1
+
+    with pytest.raises(ValueError):
+        columns_to_states(columns)
+
+
+@pytest.fixture
+def qapp(monkeypatch):
+    def no_project():
+        raise roi_types.NoProjectOpen
+
+    monkeypatch.setattr(roi_types, 'get_proj_config', no_project)
+
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication([])
+    return app
+
+
+def test_cnmfroi_state_round_trip_without_drawing(qapp):
+    view_box = pg.ViewBox()
+    curve_plot_item = pg.PlotDataItem()
+
+    contour = {'coordinates': np.array([[1., 2.], [3., 4.], [np.nan, np.nan], [5., 6.]])}
+
+    roi = roi_types.CNMFROI(curve_plot_item, view_box, cnmf_idx=3, curve_data=np.arange(10.),
+                            contour_getter=lambda: contour)
+    state = roi.to_state()
+
+    np.testing.assert_array_equal(state['roi_xs'], [1, 3, 5])
+    np.testing.assert_array_equal(state['roi_ys'], [2, 4, 6])
+
+    # restored the way the ROI Manager restores a sample, it is only drawn when it is selected
+    layer = ROIOutlineLayer(view_box, [state['roi_xs']], [state['roi_ys']])
+    restored = roi_types.CNMFROI(curve_plot_item, view_box, state=dict(state), outline_layer=layer, layer_ix=0)
+    assert not restored.is_drawn
+
+    restored_state = restored.to_state()
+    assert not restored.is_drawn
+
+    np.testing.assert_array_equal(restored_state['roi_xs'], state['roi_xs'])
+    np.testing.assert_array_equal(restored_state['roi_ys'], state['roi_ys'])
+    assert restored_state['cnmf_idx'] == 3
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from scipy.ndimage import percentile_filter
+from mesmerize.analysis.math.running_percentile import running_percentile, running_median
+
+
+@pytest.mark.parametrize('window', [1, 2, 7, 50, 101, 200])
+@pytest.mark.parametrize('percentile', [0, 8, 50, 100])
+def test_same_as_scipy(window, percentile):
+    rng = np.random.default_rng(window)
+    curves = rng.random((5, 200))
+
+    expected = percentile_filter(curves, percentile, size=(1, window), mode='reflect')
+
+    np.testing.assert_allclose(running_percentile(curves, percentile, window), expected)
+
+
+def test_ties_same_as_scipy():
+    curves = np.random.default_rng(0).integers(0, 4, (3, 300)).astype(np.float64)
+    expected = percentile_filter(curves, 20, size=(1, 31), mode='reflect')
+
+    np.testing.assert_allclose(running_percentile(curves, 20, 31), expected)
+
+
+def test_1d_curve():
+    curve = np.random.default_rng(0).random(100)
+
+    out = running_median(curve, 11)
+
+    assert out.shape == curve.shape
+    np.testing.assert_allclose(out, running_percentile(curve[None], 50, 11)[0])
+
+
+def test_invalid_input():
+    curves = np.random.default_rng(0).random((2, 50))
+
+    with pytest.raises(ValueError):
+        running_percentile(curves, 101, 5)
+
+    with pytest.raises(ValueError):
+        running_percentile(curves, 50, 0)
+
+    curves[1, 10] = np.nan
+    with pytest.raises(ValueError):
+        running_percentile(curves, 50, 5)
@@ -0,0 +1,128 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+import tifffile
+from mesmerize.viewer.core.sample_export import SampleExport
+
+
+@pytest.fixture
+def proj(tmp_path):
+    for d in ['images', 'curves']:
+        os.makedirs(tmp_path / d)
+    return str(tmp_path)
+
+
+def _export(proj: str, seq: np.ndarray, **kwargs):
+    name = 'a-_-1-_-uuid'
+    curve = [np.arange(5), np.arange(5) * 2.]
+    state = {'curve_data': curve, 'tags': {'cell': 'x'}}
+
+    data = {
+        'sample_id': 'a-_-1',
+        'meta': {'fps': 10},
+        'stim_maps': {'odor': pd.DataFrame({'name': ['a'], 'start': [0], 'end': [2]})},
+    }
+
+    export = SampleExport(
+        proj_path=proj,
+        img_path=os.path.join(proj, 'images', name),
+        data=data,
+        seq=seq,
+        curves_dir=os.path.join(proj, 'curves', name),
+        curves=[(f'{i:05}.npz', curve) for i in range(130)],
+        rows=[{'SampleID': 'a-_-1', 'ROI_State': state}],
+        **kwargs
+    )
+    return export, data, curve, state
+
+
+def _files(proj: str) -> list:
+    return sorted(
+        os.path.relpath(os.path.join(root, f), proj) for root, dirs, files in os.walk(proj) for f in files + dirs
+    )
+
+
+def test_write(proj):
+    seq = np.random.default_rng(0).integers(0, 1000, (8, 6, 5)).astype(np.uint16)
+    export, data, curve, state = _export(proj, seq)
+
+    progress = []
+    export.write(n_threads=2, progress_callback=progress.append)
+
+    assert progress[-1] == 100
+
+    images = sorted(os.listdir(os.path.join(proj, 'images')))
+    assert images == ['a-_-1-_-uuid.pik', 'a-_-1-_-uuid.tiff', 'a-_-1-_-uuid_max_proj.tiff',
+                      'a-_-1-_-uuid_std_proj.tiff']
+
+    # no temp files are left
+    assert [f for f in _files(proj) if f.endswith('.tmp')] == []
+
+    np.testing.assert_array_equal(tifffile.imread(os.path.join(proj, 'images', 'a-_-1-_-uuid.tiff')), seq.T)
+
+    curves = sorted(os.listdir(export.curves_dir))
+    assert len(curves) == 130
+    np.testing.assert_array_equal(np.load(os.path.join(export.curves_dir, curves[-1]))['curve'], curve)
+
+    with open(os.path.join(proj, 'images', 'a-_-1-_-uuid.pik'), 'rb') as f:
+        assert pickle.load(f)['meta'] == {'fps': 10}
+
+
+def test_snapshot_is_not_changed(proj):
+    seq = np.ones((8, 6, 5), dtype=np.uint16)
+    export, data, curve, state = _export(proj, seq)
+
+    # changes made in the viewer while the files are written
+    seq[:] = 0
+    data['meta']['fps'] = 1
+    data['stim_maps']['odor'].loc[0, 'name'] = 'b'
+    curve[1][:] = 0
+    state['tags']['cell'] = 'y'
+
+    export.write(n_threads=2)
+
+    assert tifffile.imread(os.path.join(proj, 'images', 'a-_-1-_-uuid.tiff')).min() == 1
+
+    with open(os.path.join(proj, 'images', 'a-_-1-_-uuid.pik'), 'rb') as f:
+        saved = pickle.load(f)
+    assert saved['meta'] == {'fps': 10}
+    assert saved['stim_maps']['odor']['name'].iloc[0] == 'a'
+
+    np.testing.assert_array_equal(np.load(os.path.join(export.curves_dir, '00000.npz'))['curve'][1], np.arange(5) * 2.)
+    assert export.rows[0]['ROI_State']['tags'] == {'cell': 'x'}
+
+
+def test_keep_img_seq_and_replace_curves(proj):
+    seq = np.ones((8, 6, 5), dtype=np.uint16)
+    export, data, curve, state = _export(proj, seq)
+    export.write(n_threads=2)
+
+    old_curve = os.path.join(export.curves_dir, 'old.npz')
+    open(old_curve, 'wb').close()
+
+    # overwriting the Sample without its image sequence
+    export, data, curve, state = _export(proj, None)
+    export.write(n_threads=2)
+
+    assert os.path.isfile(os.path.join(proj, 'images', 'a-_-1-_-uuid.tiff'))
+    assert not os.path.isfile(old_curve)
+    assert len(os.listdir(export.curves_dir)) == 130
+
+
+def test_failed_write_leaves_existing_files(proj):
+    seq = np.ones((8, 6, 5), dtype=np.uint16)
+    export, data, curve, state = _export(proj, seq)
+    export.write(n_threads=2)
+    files = _files(proj)
+
+    export, data, curve, state = _export(proj, seq * 2)
+    # a curve that can't be written
+    export.curves.append(('missing_dir/00000.npz', curve))
+
+    with pytest.raises(OSError):
+        export.write(n_threads=2)
+
+    assert _files(proj) == files
+    assert tifffile.imread(os.path.join(proj, 'images', 'a-_-1-_-uuid.tiff')).max() == 1
@@ -0,0 +1,167 @@
+import os
+import errno
+from uuid import uuid4
+import pytest
+from mesmerize.viewer.modules.batch_run_modules import staging
+from mesmerize.viewer.modules.batch_run_modules.staging import Stager, retry, checksum
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    batch_dir, work_dir = tmp_path / 'batch', tmp_path / 'work'
+    batch_dir.mkdir()
+    work_dir.mkdir()
+    return str(batch_dir), str(work_dir)
+
+
+def _write(path: str, data: bytes):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_stage_in_and_out(dirs):
+    batch_dir, work_dir = dirs
+    u = str(uuid4())
+
+    _write(os.path.join(batch_dir, f'{u}_input.tiff'), os.urandom(2 ** 20))
+    _write(os.path.join(batch_dir, f'{u}.params'), b'params')
+    _write(os.path.join(batch_dir, f'{uuid4()}_input.tiff'), b'other item')
+
+    stager = Stager(batch_dir, work_dir)
+    try:
+        future = stager.stage_in(u)
+        assert stager.stage_in(u) is future
+        future.result()
+
+        assert sorted(os.listdir(work_dir)) == sorted([f'{u}_input.tiff', f'{u}.params'])
+        for f in os.listdir(work_dir):
+            assert checksum(os.path.join(work_dir, f)) == checksum(os.path.join(batch_dir, f))
+
+        _write(os.path.join(work_dir, f'{u}_results.hdf5'), b'results')
+        stager.stage_out(u, [f'{u}_results.hdf5']).result()
+
+        assert open(os.path.join(batch_dir, f'{u}_results.hdf5'), 'rb').read() == b'results'
+        # the files of the item are removed from the work dir
+        assert os.listdir(work_dir) == []
+        assert stager.queue_depth == 0
+    finally:
+        stager.shutdown()
+
+
+@pytest.mark.parametrize('cross_device', [False, True])
+def test_stage_in_stored_input(dirs, monkeypatch, cross_device):
+    batch_dir, work_dir = dirs
+    input_path = os.path.join(batch_dir, 'inputs', 'abc.tiff')
+    os.makedirs(os.path.dirname(input_path))
+    _write(input_path, b'stored input')
+
+    uuids = [str(uuid4()) for i in range(2)]
+    for u in uuids:
+        os.link(input_path, os.path.join(batch_dir, f'{u}_input.tiff'))
+
+    if cross_device:
+        # batch dir and work dir on different file systems, the input is copied to the work dir once
+        os_link = os.link
+
+        def link(src, dst):
+            if src.startswith(batch_dir):
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            os_link(src, dst)
+
+        monkeypatch.setattr(os, 'link', link)
+
+    stager = Stager(batch_dir, work_dir)
+    try:
+        for u in uuids:
+            stager.stage_in(u, input_hash='abc', input_path=input_path).result()
+            assert open(os.path.join(work_dir, f'{u}_input.tiff'), 'rb').read() == b'stored input'
+
+        for u in uuids:
+            stager.stage_out(u, []).result()
+        # inputs that were copied to the work dir are removed once no staged item uses them
+        assert [f for f in os.listdir(work_dir) if f != 'inputs'] == []
+        assert not os.path.isdir(stager.local_inputs_dir) or os.listdir(stager.local_inputs_dir) == []
+    finally:
+        stager.shutdown()
+
+
+@pytest.mark.parametrize('cross_device', [False, True])
+def test_stage_in_replaces_left_over_input(dirs, monkeypatch, cross_device):
+    batch_dir, work_dir = dirs
+    input_path = os.path.join(batch_dir, 'inputs', 'abc.tiff')
+    os.makedirs(os.path.dirname(input_path))
+    _write(input_path, b'stored input')
+
+    u = str(uuid4())
+    # from an earlier run of the item that was cancelled
+    _write(os.path.join(work_dir, f'{u}_input.tiff'), b'left over')
+
+    copies = []
+    _copy_verified = Stager._copy_verified
+
+    def copy_verified(self, src, dst):
+        copies.append(src)
+        _copy_verified(self, src, dst)
+
+    monkeypatch.setattr(Stager, '_copy_verified', copy_verified)
+
+    if cross_device:
+        os_link = os.link
+
+        def link(src, dst):
+            if src.startswith(batch_dir):
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            os_link(src, dst)
+
+        monkeypatch.setattr(os, 'link', link)
+
+    stager = Stager(batch_dir, work_dir)
+    try:
+        stager.stage_in(u, input_hash='abc', input_path=input_path).result()
+
+        assert open(os.path.join(work_dir, f'{u}_input.tiff'), 'rb').read() == b'stored input'
+        # the input is only copied if it can't be linked
+        assert copies == ([input_path] if cross_device else [])
+    finally:
+        stager.shutdown()
+
+
+def test_failed_copy_leaves_nothing(dirs, monkeypatch):
+    batch_dir, work_dir = dirs
+    u = str(uuid4())
+    _write(os.path.join(batch_dir, f'{u}_input.tiff'), b'seq')
+
+    monkeypatch.setattr(staging, 'checksum', lambda path: 'wrong')
+
+    stager = Stager(batch_dir, work_dir)
+    try:
+        with pytest.raises(IOError):
+            stager.stage_in(u).result()
+    finally:
+        stager.shutdown()
+
+    assert not os.path.isfile(os.path.join(work_dir, f'{u}_input.tiff'))
+    assert [f for f in os.listdir(work_dir) if 'staging' in f] == []
+
+
+def test_retry():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise OSError(errno.EIO, 'I/O error')
+        return 'done'
+
+    assert retry(flaky, delay=0) == 'done'
+    assert len(calls) == 3
+
+    def missing():
+        calls.append(1)
+        raise FileNotFoundError(errno.ENOENT, 'missing')
+
+    calls.clear()
+    with pytest.raises(FileNotFoundError):
+        retry(missing, delay=0)
+    # not a transient error
+    assert len(calls) == 1
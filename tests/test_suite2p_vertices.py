@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from mesmerize.viewer.modules.suite2p import get_all_vertices, get_vertices
+
+
+def _roi(xs, ys) -> dict:
+    # Suite2p stores the pixels as int32
+    return {'xpix': np.asarray(xs, dtype=np.int32), 'ypix': np.asarray(ys, dtype=np.int32)}
+
+
+def _random_roi(rng: np.random.Generator, shape: tuple = (64, 48)) -> dict:
+    """Random blob of pixels, unique pixels like Suite2p ROIs"""
+    cx, cy = rng.integers(0, shape[0]), rng.integers(0, shape[1])
+    r = rng.uniform(1, 8)
+
+    xs, ys = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing='ij')
+    mask = ((xs - cx) ** 2 + (ys - cy) ** 2 < r ** 2) & (rng.random(shape) < 0.85)
+
+    # pixels in a random order
+    order = rng.permutation(np.count_nonzero(mask))
+    return _roi(xs[mask][order], ys[mask][order])
+
+
+def _stat(seed: int = 0, n: int = 50) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+
+    rois = [_random_roi(rng) for i in range(n)]
+
+    # single pixels, at the image border and inside of another ROI
+    rois[3] = _roi([0], [0])
+    rois[7] = _roi([rois[8]['xpix'][0]], [rois[8]['ypix'][0]])
+    # a line and a filled rectangle that only has an outline
+    rois[10] = _roi(np.arange(5, 15), np.full(10, 20))
+    xs, ys = np.meshgrid(np.arange(30, 36), np.arange(0, 4), indexing='ij')
+    rois[11] = _roi(xs.ravel(), ys.ravel())
+
+    return np.array(rois, dtype=object)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_same_as_get_vertices(seed):
+    stat = _stat(seed)
+
+    xs, ys = get_all_vertices(stat)
+
+    assert len(xs) == len(ys) == len(stat)
+
+    for s, x, y in zip(stat, xs, ys):
+        expected = get_vertices(s)
+        np.testing.assert_array_equal(np.column_stack([x, y]), expected)
+
+
+def test_outline_of_rectangle():
+    stat = _stat()
+    xs, ys = get_all_vertices(stat)
+
+    # the interior pixels of the rectangle are not vertices
+    inner = {(x, y) for x in range(31, 35) for y in range(1, 3)}
+    assert not inner & set(zip(xs[11].tolist(), ys[11].tolist()))
+    assert len(xs[11]) == 6 * 4 - len(inner)
+
+    # every pixel of a single pixel ROI or a line is a vertex
+    assert (xs[3].tolist(), ys[3].tolist()) == ([0], [0])
+    assert xs[10].tolist() == list(range(5, 15))
+
+
+def test_empty_rois():
+    stat = _stat(n=12)
+    stat[5] = _roi([], [])
+
+    xs, ys = get_all_vertices(stat)
+
+    assert xs[5].size == ys[5].size == 0
+    for i in [4, 6]:
+        np.testing.assert_array_equal(np.column_stack([xs[i], ys[i]]), get_vertices(stat[i]))
+
+    # only empty ROIs
+    xs, ys = get_all_vertices(np.array([_roi([], []), _roi([], [])], dtype=object))
+    assert [x.size for x in xs] == [y.size for y in ys] == [0, 0]